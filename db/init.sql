@@ -20,7 +20,7 @@ CREATE TABLE IF NOT EXISTS users (
     username VARCHAR(80) UNIQUE NOT NULL,
     password_hash VARCHAR(256) NOT NULL,
     phone VARCHAR(20),
-    role VARCHAR(20) NOT NULL CHECK (role IN ('passenger', 'driver')),
+    role VARCHAR(20) NOT NULL CHECK (role IN ('passenger', 'driver', 'admin')),
     
     -- 乘客字段
     payment_method VARCHAR(50),
@@ -30,6 +30,9 @@ CREATE TABLE IF NOT EXISTS users (
     license_number VARCHAR(50),
     vehicle_id INTEGER REFERENCES vehicles(id),
     current_location VARCHAR(100),
+    current_lat FLOAT,
+    current_lng FLOAT,
+    location_updated_at TIMESTAMP,
     is_available BOOLEAN DEFAULT true,
     rating FLOAT DEFAULT 5.0,
     
@@ -50,10 +53,16 @@ CREATE TABLE IF NOT EXISTS rides (
     pickup_lng FLOAT,
     dropoff_lat FLOAT,
     dropoff_lng FLOAT,
+
+    -- 幂等键（同一乘客唯一）、请求体指纹和第一次请求的响应体
+    idempotency_key VARCHAR(255),
+    request_fingerprint VARCHAR(64),
+    idempotency_response TEXT,
     
     -- 状态
     status VARCHAR(20) DEFAULT 'requested' 
         CHECK (status IN ('requested', 'accepted', 'in_progress', 'completed', 'cancelled')),
+    version INTEGER NOT NULL DEFAULT 1,
     
     -- 时间戳
     requested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
@@ -61,6 +70,10 @@ CREATE TABLE IF NOT EXISTS rides (
     started_at TIMESTAMP,
     completed_at TIMESTAMP,
     cancelled_at TIMESTAMP,
+
+    -- 当前派单（等待回应的司机和过期时间）
+    offered_driver_id INTEGER REFERENCES users(id),
+    offer_expires_at TIMESTAMP,
     
     -- 费用
     estimated_fare FLOAT,
@@ -75,14 +88,47 @@ CREATE TABLE IF NOT EXISTS rides (
     driver_comment TEXT
 );
 
+-- 创建行程区域表（上下车点所在的地理围栏区域，每个区域一行）
+CREATE TABLE IF NOT EXISTS ride_zones (
+    ride_id INTEGER NOT NULL REFERENCES rides(id) ON DELETE CASCADE,
+    kind VARCHAR(10) NOT NULL CHECK (kind IN ('pickup', 'dropoff')),
+    zone_id VARCHAR(100) NOT NULL,
+    position INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (ride_id, kind, zone_id)
+);
+
+-- 创建行程轨迹表（简化后的GPS轨迹，差分变长整数编码）
+CREATE TABLE IF NOT EXISTS ride_tracks (
+    ride_id INTEGER PRIMARY KEY REFERENCES rides(id),
+    points BYTEA NOT NULL,
+    point_count INTEGER DEFAULT 0,
+    raw_point_count INTEGER DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
 -- 创建索引
 CREATE INDEX idx_users_role ON users(role);
 CREATE INDEX idx_users_is_available ON users(is_available) WHERE role = 'driver';
+CREATE INDEX idx_users_driver_position ON users(role, is_available, current_lat, current_lng);
 CREATE INDEX idx_rides_status ON rides(status);
 CREATE INDEX idx_rides_passenger ON rides(passenger_id);
 CREATE INDEX idx_rides_driver ON rides(driver_id);
 CREATE INDEX idx_rides_requested ON rides(requested_at DESC);
 
+-- 附近行程查询：状态等值 + 上车点经纬度范围
+CREATE INDEX idx_rides_status_pickup ON rides(status, pickup_lat, pickup_lng);
+
+-- 幂等键：同一乘客的同一个键只能创建一个行程
+CREATE UNIQUE INDEX uq_rides_passenger_idempotency_key ON rides(passenger_id, idempotency_key);
+
+-- 按上车区域排队（如机场）
+CREATE INDEX idx_ride_zones_zone_kind ON ride_zones(zone_id, kind, ride_id);
+
+-- PostGIS空间索引：仅覆盖待接单行程，表达式需与 Ride.pickup_within 保持一致
+CREATE INDEX idx_rides_pickup_geom ON rides
+    USING GIST (ST_SetSRID(ST_MakePoint(pickup_lng, pickup_lat), 4326))
+    WHERE status = 'requested' AND driver_id IS NULL;
+
 -- 创建触发器函数来更新updated_at
 CREATE OR REPLACE FUNCTION update_updated_at_column()
 RETURNS TRIGGER AS $$
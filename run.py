@@ -14,7 +14,7 @@ print(f"📁 Project directory: {current_dir}")
 
 try:
     # 导入并运行应用
-    from src.app import app
+    from src.app import create_server
 
     if __name__ == '__main__':
         # 获取端口，默认为5000
@@ -29,6 +29,7 @@ try:
         print("=" * 50)
 
         # 运行应用
+        app = create_server()
         app.run(host='0.0.0.0', port=port, debug=debug)
 
 except ImportError as e:
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+K近邻索引基准测试
+测量K-D树在1万、10万、100万司机规模下的重建耗时和查询延迟，并与NumPy暴力检索对比
+"""
+
+import sys
+import os
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.services.kdtree import KDTree, to_unit_vectors
+
+# 城市范围（约60公里 x 60公里，以纽约为中心）
+CENTER_LAT, CENTER_LNG = 40.7128, -74.0060
+SPAN_DEG = 0.27
+
+
+def brute_force(points, query, k):
+    """NumPy暴力检索"""
+    diff = points - query
+    dist = np.einsum('ij,ij->i', diff, diff)
+    top = np.argpartition(dist, k - 1)[:k]
+    return top[np.argsort(dist[top])]
+
+
+def run(size, k=10, queries=200, seed=42):
+    """运行单个规模的基准测试"""
+    rng = np.random.default_rng(seed)
+    lats = CENTER_LAT + rng.uniform(-SPAN_DEG, SPAN_DEG, size)
+    lngs = CENTER_LNG + rng.uniform(-SPAN_DEG, SPAN_DEG, size)
+    points = to_unit_vectors(lats, lngs)
+
+    start = time.perf_counter()
+    tree = KDTree(points)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    query_points = to_unit_vectors(
+        CENTER_LAT + rng.uniform(-SPAN_DEG, SPAN_DEG, queries),
+        CENTER_LNG + rng.uniform(-SPAN_DEG, SPAN_DEG, queries)
+    )
+
+    # 正确性校验
+    for query in query_points[:5]:
+        idx, _ = tree.query(query, k)
+        assert list(idx) == list(brute_force(points, query, k))
+
+    latencies = []
+    for query in query_points:
+        start = time.perf_counter()
+        tree.query(query, k)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    brute_queries = query_points[:20]
+    start = time.perf_counter()
+    for query in brute_queries:
+        brute_force(points, query, k)
+    brute_ms = (time.perf_counter() - start) * 1000 / len(brute_queries)
+
+    latencies = np.array(latencies)
+    return build_ms, np.percentile(latencies, 50), np.percentile(latencies, 99), brute_ms
+
+
+def main():
+    """主函数"""
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+
+    print("=" * 70)
+    print("K-D树基准测试 (K=10)")
+    print("=" * 70)
+    print(f"{'司机数量':>10}{'重建(ms)':>12}{'查询P50(ms)':>14}{'查询P99(ms)':>14}{'暴力检索(ms)':>14}")
+    for size in sizes:
+        build_ms, p50, p99, brute_ms = run(size)
+        print(f"{size:>10}{build_ms:>12.1f}{p50:>14.3f}{p99:>14.3f}{brute_ms:>14.3f}")
+
+
+if __name__ == "__main__":
+    main()
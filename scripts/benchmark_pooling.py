@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+拼车插入基准测试
+在数千辆拼车车辆的规模下测量为新请求选择车辆和插入位置的耗时，以及ETA函数的调用次数
+"""
+
+import sys
+import os
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.services.location import LocationService
+from src.services.pooling import PoolingEngine
+
+# 城市范围（约30公里 x 30公里，以纽约为中心）
+CENTER_LAT, CENTER_LNG = 40.7128, -74.0060
+SPAN_DEG = 0.135
+
+# 模拟路网ETA查询的耗时（秒）
+ETA_COST_SECONDS = 0.0005
+
+
+def fast_eta(lat1, lng1, lat2, lng2):
+    """直线距离 x 1.3 绕行系数，30km/h"""
+    return LocationService.calculate_distance(lat1, lng1, lat2, lng2) * 1.3 / 30 * 60
+
+
+def slow_eta(lat1, lng1, lat2, lng2):
+    """模拟代价较高的路网ETA"""
+    time.sleep(ETA_COST_SECONDS)
+    return fast_eta(lat1, lng1, lat2, lng2)
+
+
+def random_point(rng):
+    return CENTER_LAT + rng.uniform(-SPAN_DEG, SPAN_DEG), CENTER_LNG + rng.uniform(-SPAN_DEG, SPAN_DEG)
+
+
+def run(vehicles, requests=200, seed=42):
+    """运行单个规模的基准测试"""
+    rng = np.random.default_rng(seed)
+    engine = PoolingEngine(eta_fn=fast_eta)
+    for vehicle_id in range(vehicles):
+        engine.upsert_vehicle(vehicle_id, *random_point(rng), capacity=4)
+
+    # 预热：先给车辆分配一部分拼车乘客，使停靠序列非空
+    for ride_id in range(vehicles):
+        insertion = engine.find_insertion(*random_point(rng), *random_point(rng))
+        if insertion is not None:
+            engine.commit(insertion, ride_id)
+
+    engine.eta_fn = slow_eta
+    latencies = []
+    eta_calls = []
+    matched = 0
+    for ride_id in range(vehicles, vehicles + requests):
+        pickup = random_point(rng)
+        dropoff = (pickup[0] + rng.uniform(-0.05, 0.05), pickup[1] + rng.uniform(-0.05, 0.05))
+        start = time.perf_counter()
+        insertion = engine.find_insertion(*pickup, *dropoff)
+        latencies.append((time.perf_counter() - start) * 1000)
+        eta_calls.append(engine.last_stats['eta_calls'])
+        if insertion is not None and engine.commit(insertion, ride_id):
+            matched += 1
+
+    stops = sum(len(engine.get_vehicle(v).stops) for v in range(vehicles))
+    latencies = np.array(latencies)
+    return stops / vehicles, np.percentile(latencies, 50), np.percentile(latencies, 99), np.mean(eta_calls), matched
+
+
+def main():
+    """主函数"""
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1000, 5000]
+
+    print("=" * 80)
+    print(f"拼车插入基准测试 (模拟ETA查询 {ETA_COST_SECONDS * 1000:.1f}ms/次)")
+    print("=" * 80)
+    print(f"{'车辆数':>8}{'平均停靠点':>12}{'P50(ms)':>10}{'P99(ms)':>10}{'ETA次数':>10}{'匹配数':>10}")
+    for size in sizes:
+        stops, p50, p99, calls, matched = run(size)
+        print(f"{size:>8}{stops:>12.2f}{p50:>10.2f}{p99:>10.2f}{calls:>10.1f}{matched:>10}")
+
+
+if __name__ == "__main__":
+    main()
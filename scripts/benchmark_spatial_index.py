@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+空间索引基准测试
+对比网格索引与线性扫描在同一批司机上的半径查询和Top-K查询耗时
+"""
+
+import sys
+import os
+import random
+import time
+import heapq
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.services.spatial_index import DriverGridIndex, haversine_km
+
+# 城市范围（约60公里 x 60公里，以纽约为中心）
+CENTER_LAT, CENTER_LNG = 40.7128, -74.0060
+SPAN_DEG = 0.27
+
+
+def generate_fleet(count, seed=42):
+    """生成随机分布的司机位置"""
+    rng = random.Random(seed)
+    return [
+        (driver_id,
+         CENTER_LAT + rng.uniform(-SPAN_DEG, SPAN_DEG),
+         CENTER_LNG + rng.uniform(-SPAN_DEG, SPAN_DEG))
+        for driver_id in range(1, count + 1)
+    ]
+
+
+def linear_radius(fleet, lat, lng, radius_km):
+    """线性扫描：半径查询"""
+    results = []
+    for driver_id, d_lat, d_lng in fleet:
+        distance = haversine_km(lat, lng, d_lat, d_lng)
+        if distance <= radius_km:
+            results.append((driver_id, distance))
+    results.sort(key=lambda item: item[1])
+    return results
+
+
+def linear_nearest(fleet, lat, lng, k):
+    """线性扫描：Top-K查询"""
+    return heapq.nsmallest(
+        k,
+        ((driver_id, haversine_km(lat, lng, d_lat, d_lng)) for driver_id, d_lat, d_lng in fleet),
+        key=lambda item: item[1]
+    )
+
+
+def timed(func, queries, repeat=1):
+    """返回每次查询的平均耗时（毫秒）"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for lat, lng in queries:
+            func(lat, lng)
+    elapsed = time.perf_counter() - start
+    return elapsed / (len(queries) * repeat) * 1000
+
+
+def main():
+    """主函数"""
+    fleet_size = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    radius_km = 1.0
+    k = 10
+
+    print("=" * 50)
+    print("空间索引基准测试")
+    print(f"司机数量: {fleet_size}, 半径: {radius_km} km, K: {k}")
+    print("=" * 50)
+
+    fleet = generate_fleet(fleet_size)
+    rng = random.Random(7)
+    queries = [
+        (CENTER_LAT + rng.uniform(-SPAN_DEG, SPAN_DEG), CENTER_LNG + rng.uniform(-SPAN_DEG, SPAN_DEG))
+        for _ in range(200)
+    ]
+
+    index = DriverGridIndex()
+    start = time.perf_counter()
+    index.bulk_load(fleet)
+    print(f"索引构建: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    # 正确性校验
+    for lat, lng in queries[:5]:
+        assert [d for d, _ in index.query_radius(lat, lng, radius_km)] == \
+               [d for d, _ in linear_radius(fleet, lat, lng, radius_km)]
+        assert [d for d, _ in index.query_nearest(lat, lng, k)] == \
+               [d for d, _ in linear_nearest(fleet, lat, lng, k)]
+
+    grid_radius = timed(lambda lat, lng: index.query_radius(lat, lng, radius_km), queries, repeat=5)
+    grid_knn = timed(lambda lat, lng: index.query_nearest(lat, lng, k), queries, repeat=5)
+    linear_radius_ms = timed(lambda lat, lng: linear_radius(fleet, lat, lng, radius_km), queries[:10])
+    linear_knn_ms = timed(lambda lat, lng: linear_nearest(fleet, lat, lng, k), queries[:10])
+
+    # 增量更新耗时
+    moves = [(driver_id, lat + 0.001, lng - 0.001) for driver_id, lat, lng in fleet[:10000]]
+    start = time.perf_counter()
+    for driver_id, lat, lng in moves:
+        index.upsert(driver_id, lat, lng)
+    update_us = (time.perf_counter() - start) / len(moves) * 1_000_000
+
+    print(f"{'查询':<12}{'网格索引(ms)':>14}{'线性扫描(ms)':>14}{'加速比':>10}")
+    print(f"{'半径查询':<12}{grid_radius:>14.3f}{linear_radius_ms:>14.3f}{linear_radius_ms / grid_radius:>10.1f}")
+    print(f"{'Top-K查询':<12}{grid_knn:>14.3f}{linear_knn_ms:>14.3f}{linear_knn_ms / grid_knn:>10.1f}")
+    print(f"位置更新: {update_us:.2f} us/次")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+路网预处理脚本
+把节点/边CSV（例如从OSM抽取导出）转换为路由服务使用的 .npz 二进制路网，并预计算ALT地标
+
+nodes.csv: id,lat,lng
+edges.csv: from_id,to_id,length_m,speed_kmh[,oneway]
+    oneway 为 1/true 时只生成单向边，否则生成双向边
+
+用法:
+    python scripts/build_road_graph.py nodes.csv edges.csv city_graph.npz --landmarks 16
+然后设置环境变量 ROAD_GRAPH_PATH=city_graph.npz
+"""
+
+import sys
+import os
+import argparse
+import csv
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.services.routing import RoadGraph, DEFAULT_LANDMARK_COUNT
+
+
+def read_nodes(path):
+    """读取节点文件，返回 (原始ID到下标的映射, 纬度数组, 经度数组)"""
+    index = {}
+    lats, lngs = [], []
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            index[row['id']] = len(lats)
+            lats.append(float(row['lat']))
+            lngs.append(float(row['lng']))
+    return index, np.array(lats), np.array(lngs)
+
+
+def read_edges(path, index):
+    """读取边文件，返回 (起点, 终点, 时间秒, 长度米) 数组"""
+    sources, targets, times, lengths = [], [], [], []
+    skipped = 0
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            if row['from_id'] not in index or row['to_id'] not in index:
+                skipped += 1
+                continue
+            source, target = index[row['from_id']], index[row['to_id']]
+            length = float(row['length_m'])
+            speed = float(row['speed_kmh'])
+            if speed <= 0:
+                skipped += 1
+                continue
+            seconds = length / (speed / 3.6)
+            oneway = str(row.get('oneway', '')).lower() in ('1', 'true', 'yes')
+
+            sources.append(source)
+            targets.append(target)
+            times.append(seconds)
+            lengths.append(length)
+            if not oneway:
+                sources.append(target)
+                targets.append(source)
+                times.append(seconds)
+                lengths.append(length)
+
+    if skipped:
+        print(f"  跳过 {skipped} 条无效边")
+    return np.array(sources), np.array(targets), np.array(times), np.array(lengths)
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='构建路由服务使用的二进制路网文件')
+    parser.add_argument('nodes', help='节点CSV文件')
+    parser.add_argument('edges', help='边CSV文件')
+    parser.add_argument('output', help='输出 .npz 文件')
+    parser.add_argument('--landmarks', type=int, default=DEFAULT_LANDMARK_COUNT, help='ALT地标数量')
+    args = parser.parse_args()
+    if args.landmarks < 1:
+        parser.error('路由服务要求路网文件包含预计算的地标，--landmarks 至少为1')
+
+    print("=" * 50)
+    print("构建路网文件")
+    print("=" * 50)
+
+    index, lats, lngs = read_nodes(args.nodes)
+    sources, targets, times, lengths = read_edges(args.edges, index)
+    graph = RoadGraph.from_edges(lats, lngs, sources, targets, times, lengths)
+    print(f"✓ 节点 {graph.node_count}，边 {graph.edge_count}")
+
+    start = time.perf_counter()
+    graph.build_landmarks(args.landmarks)
+    print(f"✓ 预计算 {len(graph.landmarks)} 个地标，耗时 {time.perf_counter() - start:.1f} 秒")
+
+    graph.save(args.output)
+    print(f"✓ 已保存到 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
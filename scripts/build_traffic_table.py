@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+交通系数表构建脚本
+流式读取已完成的行程，按 started_at 到 completed_at 的时长和上下车点距离计算实际速度，
+聚合成"周内小时 x 粗粒度区域"的交通系数表，供 LocationService.estimate_travel_time 查询
+
+用法:
+    python scripts/build_traffic_table.py traffic_table.npz --days 56
+然后设置环境变量 TRAFFIC_TABLE_PATH=traffic_table.npz
+"""
+
+import sys
+import os
+import argparse
+import datetime
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from flask import Flask
+
+from src.services.traffic import build_from_rides, DEFAULT_ZONE_DEG, DEFAULT_MIN_SAMPLES
+
+
+def create_app():
+    """创建 Flask 应用"""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///taxi.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    return app
+
+
+def completed_rides_query(db, days=None):
+    """已完成行程的查询，只取计算需要的列"""
+    from src.models.ride import Ride
+
+    query = db.session.query(
+        Ride.pickup_lat, Ride.pickup_lng, Ride.dropoff_lat, Ride.dropoff_lng,
+        Ride.started_at, Ride.completed_at
+    ).filter(
+        Ride.status == 'completed',
+        Ride.started_at.isnot(None),
+        Ride.completed_at.isnot(None)
+    )
+    if days:
+        since = datetime.datetime.utcnow() - datetime.timedelta(days=days)
+        query = query.filter(Ride.completed_at >= since)
+    return query
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='从历史行程构建交通系数表')
+    parser.add_argument('output', help='输出 .npz 文件')
+    parser.add_argument('--days', type=int, default=None, help='只使用最近N天的行程（默认全部）')
+    parser.add_argument('--zone-deg', type=float, default=DEFAULT_ZONE_DEG, help='区域边长（度）')
+    parser.add_argument('--min-samples', type=int, default=DEFAULT_MIN_SAMPLES, help='每个格子最少样本数')
+    parser.add_argument('--batch-size', type=int, default=1000, help='每批读取的行数')
+    args = parser.parse_args()
+
+    print("=" * 50)
+    print("构建交通系数表")
+    print("=" * 50)
+
+    from src.services.database import db
+
+    app = create_app()
+    db.init_app(app)
+
+    try:
+        with app.app_context():
+            start = time.perf_counter()
+            table = build_from_rides(
+                completed_rides_query(db, args.days),
+                zone_deg=args.zone_deg,
+                min_samples=args.min_samples,
+                batch_size=args.batch_size
+            )
+            print(f"✓ 区域 {table.zone_count}，耗时 {time.perf_counter() - start:.1f} 秒")
+
+        table.save(args.output)
+        print(f"✓ 已保存到 {args.output}")
+
+    except Exception as e:
+        print(f"\n❌ 构建失败: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
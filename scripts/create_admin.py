@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+创建管理员账号
+
+管理员可以调用运营接口（热力图和加价分析、批量行程查询、批量转换行程状态），
+这个角色不能通过注册接口获得，只能由运维用本脚本创建。PostgreSQL 库需要先执行
+scripts/migrate_admin_role.py 放开角色约束。
+
+密码从环境变量 ADMIN_PASSWORD 读取，未设置时交互输入。登录接口尚未实现，
+加 --token 时同时打印一个用于调用管理接口的JWT。
+
+用法:
+    python scripts/create_admin.py ops@example.com ops --token
+"""
+
+import sys
+import os
+import argparse
+import getpass
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from flask import Flask
+
+
+def create_app():
+    """创建 Flask 应用"""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///taxi.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    return app
+
+
+def create_admin(db, email, username, password):
+    """创建管理员用户，邮箱或用户名已存在时返回None"""
+    from src.models.user import User
+    from src.utils.security import hash_password
+
+    existing = User.query.filter(
+        (User.email == email) | (User.username == username)
+    ).first()
+    if existing is not None:
+        return None
+
+    admin = User(
+        email=email,
+        username=username,
+        password_hash=hash_password(password),
+        role='admin'
+    )
+    db.session.add(admin)
+    db.session.commit()
+    return admin
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='创建管理员账号')
+    parser.add_argument('email', help='管理员邮箱')
+    parser.add_argument('username', help='管理员用户名')
+    parser.add_argument('--token', action='store_true', help='打印管理员JWT')
+    parser.add_argument('--expires-hours', type=int, default=24, help='JWT有效期（小时）')
+    args = parser.parse_args()
+
+    from src.services.database import db
+    from src.utils.security import (
+        generate_token, validate_email, validate_password, TOKEN_SECRET_KEY
+    )
+
+    if not validate_email(args.email):
+        print(f"❌ 邮箱格式无效: {args.email}")
+        sys.exit(1)
+    password = os.environ.get('ADMIN_PASSWORD') or getpass.getpass('密码: ')
+    valid, message = validate_password(password)
+    if not valid:
+        print(f"❌ {message}")
+        sys.exit(1)
+
+    app = create_app()
+    db.init_app(app)
+
+    try:
+        with app.app_context():
+            admin = create_admin(db, args.email, args.username, password)
+            if admin is None:
+                print(f"❌ 邮箱 {args.email} 或用户名 {args.username} 已存在")
+                sys.exit(1)
+            print(f"✓ 创建管理员 {admin.username}（ID {admin.id}）")
+
+            if args.token:
+                token = generate_token(
+                    admin.id, admin.email, admin.role, TOKEN_SECRET_KEY,
+                    args.expires_hours
+                )
+                print(f"\nAuthorization: Bearer {token}")
+
+    except Exception as e:
+        print(f"\n❌ 创建管理员失败: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
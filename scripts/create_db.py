@@ -152,6 +152,8 @@ def insert_test_data(db):
             license_number="LIC001",
             vehicle_id=1,
             current_location="40.7128,-74.0060",
+            current_lat=40.7128,
+            current_lng=-74.0060,
             is_available=True,
             rating=4.8
         ),
@@ -165,6 +167,8 @@ def insert_test_data(db):
             license_number="LIC002",
             vehicle_id=2,
             current_location="40.7589,-73.9851",
+            current_lat=40.7589,
+            current_lng=-73.9851,
             is_available=True,
             rating=4.9
         )
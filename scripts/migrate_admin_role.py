@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+用户角色约束在线迁移脚本
+
+把 users 表的角色检查约束从 ('passenger', 'driver') 改为 ('passenger', 'driver', 'admin')，
+之后才能创建管理员账号（scripts/create_admin.py）。PostgreSQL 上先以 NOT VALID 添加新约束，
+再单独校验已有行，校验期间不阻塞读写。
+
+SQLite 开发库由 db.create_all() 按模型建表，不需要迁移。
+
+可重复执行：约束已包含 admin 时跳过。
+"""
+
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from flask import Flask
+from sqlalchemy import text
+
+CONSTRAINT_NAME = 'users_role_check'
+ROLE_CHECK = "CHECK (role IN ('passenger', 'driver', 'admin'))"
+
+
+def create_app():
+    """创建 Flask 应用"""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///taxi.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    return app
+
+
+def role_constraints(conn):
+    """查询 users 表上与角色有关的检查约束 {约束名: 定义}"""
+    rows = conn.execute(text(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE conrelid = 'users'::regclass AND contype = 'c' "
+        "AND pg_get_constraintdef(oid) LIKE '%role%'"
+    ))
+    return dict(rows.all())
+
+
+def replace_constraint(db):
+    """替换角色检查约束"""
+    if db.engine.dialect.name != 'postgresql':
+        print("  非 PostgreSQL 数据库，跳过")
+        return
+
+    with db.engine.begin() as conn:
+        constraints = role_constraints(conn)
+        if any("'admin'" in definition for definition in constraints.values()):
+            print("  角色约束已包含 admin，跳过")
+            return
+        for name in constraints:
+            conn.execute(text(f'ALTER TABLE users DROP CONSTRAINT "{name}"'))
+        conn.execute(text(
+            f"ALTER TABLE users ADD CONSTRAINT {CONSTRAINT_NAME} {ROLE_CHECK} NOT VALID"
+        ))
+    with db.engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE users VALIDATE CONSTRAINT {CONSTRAINT_NAME}"))
+    print(f"  ✓ 约束 {CONSTRAINT_NAME} 已允许 admin 角色")
+
+
+def main():
+    """主函数"""
+    print("=" * 50)
+    print("用户角色约束迁移")
+    print("=" * 50)
+
+    from src.services.database import db
+
+    app = create_app()
+    db.init_app(app)
+
+    try:
+        with app.app_context():
+            print("1. 替换角色约束...")
+            replace_constraint(db)
+
+        print("\n" + "=" * 50)
+        print("迁移完成！")
+        print("=" * 50)
+
+    except Exception as e:
+        print(f"\n❌ 迁移失败: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
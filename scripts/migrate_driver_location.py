@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+"""
+司机位置数值列在线迁移脚本
+
+1. 为 users 表添加 current_lat / current_lng / location_updated_at 列（可空，不锁表重写）
+2. 按主键分批从 current_location 字符串回填数值列，每批单独提交
+3. 创建经纬度复合索引（PostgreSQL 上使用 CONCURRENTLY）
+
+可重复执行：已存在的列和索引会跳过，已回填的行不会再次更新。
+应用代码在迁移期间双写字符串列和数值列，读取时数值列为空会回退解析字符串。
+"""
+
+import sys
+import os
+import argparse
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from flask import Flask
+from sqlalchemy import inspect, text
+
+NEW_COLUMNS = [
+    ('current_lat', 'FLOAT'),
+    ('current_lng', 'FLOAT'),
+    ('location_updated_at', 'TIMESTAMP'),
+]
+
+INDEX_NAME = 'idx_users_driver_position'
+
+
+def create_app():
+    """创建 Flask 应用"""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///taxi.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    return app
+
+
+def add_columns(db):
+    """添加缺失的数值位置列"""
+    existing = {column['name'] for column in inspect(db.engine).get_columns('users')}
+    for name, column_type in NEW_COLUMNS:
+        if name in existing:
+            print(f"  列 {name} 已存在，跳过")
+            continue
+        with db.engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE users ADD COLUMN {name} {column_type}"))
+        print(f"  ✓ 添加列 {name}")
+
+
+def parse_location(location):
+    """解析 "lat,lng" 字符串，无效时返回None"""
+    try:
+        lat_str, lng_str = location.split(',')
+        lat, lng = float(lat_str), float(lng_str)
+    except (ValueError, AttributeError):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return None
+    return lat, lng
+
+
+def backfill(db, batch_size=1000, pause=0.0):
+    """按主键分批回填数值列
+
+    每批只锁定少量行并立即提交，不会长时间阻塞线上写入；
+    条件 current_lat IS NULL 保证不会覆盖应用已经双写的新位置。
+    """
+    last_id = 0
+    updated = 0
+    skipped = 0
+
+    while True:
+        with db.engine.begin() as conn:
+            rows = conn.execute(text(
+                "SELECT id, current_location FROM users "
+                "WHERE id > :last_id AND current_location IS NOT NULL AND current_lat IS NULL "
+                "ORDER BY id LIMIT :limit"
+            ), {'last_id': last_id, 'limit': batch_size}).fetchall()
+
+            if not rows:
+                break
+
+            params = []
+            for user_id, location in rows:
+                parsed = parse_location(location)
+                if parsed is None:
+                    skipped += 1
+                    continue
+                params.append({'id': user_id, 'lat': parsed[0], 'lng': parsed[1]})
+
+            if params:
+                conn.execute(text(
+                    "UPDATE users SET current_lat = :lat, current_lng = :lng "
+                    "WHERE id = :id AND current_lat IS NULL"
+                ), params)
+
+            updated += len(params)
+            last_id = rows[-1][0]
+
+        print(f"  已回填 {updated} 行（当前ID {last_id}）")
+        if pause:
+            time.sleep(pause)
+
+    return updated, skipped
+
+
+def create_index(db):
+    """创建经纬度复合索引"""
+    existing = {index['name'] for index in inspect(db.engine).get_indexes('users')}
+    if INDEX_NAME in existing:
+        print(f"  索引 {INDEX_NAME} 已存在，跳过")
+        return
+
+    columns = "role, is_available, current_lat, current_lng"
+    if db.engine.dialect.name == 'postgresql':
+        # CONCURRENTLY 不能在事务中执行
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {INDEX_NAME} ON users ({columns})"))
+    else:
+        with db.engine.begin() as conn:
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS {INDEX_NAME} ON users ({columns})"))
+    print(f"  ✓ 创建索引 {INDEX_NAME}")
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='司机位置数值列在线迁移')
+    parser.add_argument('--batch-size', type=int, default=1000, help='每批回填的行数')
+    parser.add_argument('--pause', type=float, default=0.0, help='每批之间暂停的秒数')
+    args = parser.parse_args()
+
+    print("=" * 50)
+    print("司机位置数值列迁移")
+    print("=" * 50)
+
+    from src.services.database import db
+
+    app = create_app()
+    db.init_app(app)
+
+    try:
+        with app.app_context():
+            print("1. 添加列...")
+            add_columns(db)
+
+            print("2. 回填数据...")
+            updated, skipped = backfill(db, batch_size=args.batch_size, pause=args.pause)
+            print(f"  ✓ 回填 {updated} 行，跳过 {skipped} 行无效位置")
+
+            print("3. 创建索引...")
+            create_index(db)
+
+        print("\n" + "=" * 50)
+        print("迁移完成！")
+        print("=" * 50)
+
+    except Exception as e:
+        print(f"\n❌ 迁移失败: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+行程幂等键列在线迁移脚本
+
+1. 为 rides 表添加 idempotency_key、request_fingerprint 和 idempotency_response 列
+   （可为空，只修改表定义）
+2. 创建 (passenger_id, idempotency_key) 唯一索引；PostgreSQL 上使用 CONCURRENTLY，不阻塞写入
+
+已有行程的键为空，不受唯一索引限制。之后带 Idempotency-Key 的行程请求在任意工作进程
+重试都由该索引去重。
+
+可重复执行：已存在的列和索引会跳过。
+"""
+
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from flask import Flask
+from sqlalchemy import inspect, text
+
+COLUMNS = (
+    ('idempotency_key', 'VARCHAR(255)'),
+    ('request_fingerprint', 'VARCHAR(64)'),
+    ('idempotency_response', 'TEXT'),
+)
+INDEX_NAME = 'uq_rides_passenger_idempotency_key'
+
+
+def create_app():
+    """创建 Flask 应用"""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///taxi.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    return app
+
+
+def add_columns(db):
+    """添加幂等键列"""
+    existing = {column['name'] for column in inspect(db.engine).get_columns('rides')}
+    for name, definition in COLUMNS:
+        if name in existing:
+            print(f"  列 {name} 已存在，跳过")
+            continue
+        with db.engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE rides ADD COLUMN {name} {definition}"))
+        print(f"  ✓ 添加列 {name}")
+
+
+def create_index(db):
+    """创建唯一索引"""
+    existing = {index['name'] for index in inspect(db.engine).get_indexes('rides')}
+    if INDEX_NAME in existing:
+        print(f"  索引 {INDEX_NAME} 已存在，跳过")
+        return
+
+    columns = "passenger_id, idempotency_key"
+    if db.engine.dialect.name == 'postgresql':
+        # CONCURRENTLY 不能在事务中执行
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.execute(text(f"CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {INDEX_NAME} ON rides ({columns})"))
+    else:
+        with db.engine.begin() as conn:
+            conn.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS {INDEX_NAME} ON rides ({columns})"))
+    print(f"  ✓ 创建索引 {INDEX_NAME}")
+
+
+def main():
+    """主函数"""
+    print("=" * 50)
+    print("行程幂等键列迁移")
+    print("=" * 50)
+
+    from src.services.database import db
+
+    app = create_app()
+    db.init_app(app)
+
+    try:
+        with app.app_context():
+            print("1. 添加列...")
+            add_columns(db)
+
+            print("2. 创建唯一索引...")
+            create_index(db)
+
+        print("\n" + "=" * 50)
+        print("迁移完成！")
+        print("=" * 50)
+
+    except Exception as e:
+        print(f"\n❌ 迁移失败: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
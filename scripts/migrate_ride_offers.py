@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+行程派单列在线迁移脚本
+
+为 rides 表添加 offered_driver_id 和 offer_expires_at 列（可为空，无默认值），
+只修改表定义，不重写已有数据。派单管理器每次派单时写入这两列，
+接单的条件UPDATE和拒单接口在任意工作进程都以它们为准。
+
+可重复执行：列已存在时跳过。
+"""
+
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from flask import Flask
+from sqlalchemy import inspect, text
+
+COLUMNS = (
+    ('offered_driver_id', 'INTEGER REFERENCES users(id)'),
+    ('offer_expires_at', 'TIMESTAMP'),
+)
+
+
+def create_app():
+    """创建 Flask 应用"""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///taxi.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    return app
+
+
+def add_columns(db):
+    """添加派单列"""
+    existing = {column['name'] for column in inspect(db.engine).get_columns('rides')}
+    added = 0
+    for name, definition in COLUMNS:
+        if name in existing:
+            print(f"  列 {name} 已存在，跳过")
+            continue
+        with db.engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE rides ADD COLUMN {name} {definition}"))
+        print(f"  ✓ 添加列 {name}")
+        added += 1
+    return added
+
+
+def main():
+    """主函数"""
+    print("=" * 50)
+    print("行程派单列迁移")
+    print("=" * 50)
+
+    from src.services.database import db
+
+    app = create_app()
+    db.init_app(app)
+
+    try:
+        with app.app_context():
+            print("1. 添加列...")
+            add_columns(db)
+
+        print("\n" + "=" * 50)
+        print("迁移完成！")
+        print("=" * 50)
+
+    except Exception as e:
+        print(f"\n❌ 迁移失败: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+行程版本号列在线迁移脚本
+
+为 rides 表添加 version 列（NOT NULL DEFAULT 1）。PostgreSQL 11+ 和 SQLite 上
+带常量默认值的新列只修改表定义，不重写已有数据，已有行程读出的版本号为1。
+之后每次状态转换由行程状态机把版本号加1，行程详情的ETag和长轮询都依赖它。
+
+可重复执行：列已存在时跳过。
+"""
+
+import sys
+import os
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from flask import Flask
+from sqlalchemy import inspect, text
+
+COLUMN_NAME = 'version'
+COLUMN_DEFINITION = 'INTEGER NOT NULL DEFAULT 1'
+
+
+def create_app():
+    """创建 Flask 应用"""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///taxi.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    return app
+
+
+def add_column(db):
+    """添加版本号列"""
+    existing = {column['name'] for column in inspect(db.engine).get_columns('rides')}
+    if COLUMN_NAME in existing:
+        print(f"  列 {COLUMN_NAME} 已存在，跳过")
+        return False
+    with db.engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE rides ADD COLUMN {COLUMN_NAME} {COLUMN_DEFINITION}"))
+    print(f"  ✓ 添加列 {COLUMN_NAME}")
+    return True
+
+
+def main():
+    """主函数"""
+    print("=" * 50)
+    print("行程版本号列迁移")
+    print("=" * 50)
+
+    from src.services.database import db
+
+    app = create_app()
+    db.init_app(app)
+
+    try:
+        with app.app_context():
+            print("1. 添加列...")
+            add_column(db)
+
+        print("\n" + "=" * 50)
+        print("迁移完成！")
+        print("=" * 50)
+
+    except Exception as e:
+        print(f"\n❌ 迁移失败: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
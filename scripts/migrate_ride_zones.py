@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+行程地理围栏区域表在线迁移脚本
+
+1. 创建 ride_zones 表和 (zone_id, kind, ride_id) 索引
+2. 按主键分批回填已有行程的区域，每批单独提交：
+   rides 表上还有旧的 pickup_zone / dropoff_zone 逗号分隔列时从中拆分，
+   否则用地理围栏（GEOFENCE_PATH）重新解析
+3. 删除旧的 (status, pickup_zone) 索引；指定 --drop-columns 时同时删除旧列
+
+可重复执行：已存在的表和索引会跳过，已有区域行的行程不会再次写入。
+新写入的行程由 Ride 的 before_flush 钩子自动解析区域。
+"""
+
+import sys
+import os
+import argparse
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from flask import Flask
+from sqlalchemy import inspect, text
+
+LEGACY_COLUMNS = ('pickup_zone', 'dropoff_zone')
+LEGACY_INDEX = 'idx_rides_status_pickup_zone'
+
+
+def create_app():
+    """创建 Flask 应用"""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///taxi.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    return app
+
+
+def create_table(db):
+    """创建区域表（连同索引）"""
+    from src.models.ride_zone import RideZone
+
+    if inspect(db.engine).has_table(RideZone.__tablename__):
+        print(f"  表 {RideZone.__tablename__} 已存在，跳过")
+        return False
+    RideZone.__table__.create(db.engine)
+    print(f"  ✓ 创建表 {RideZone.__tablename__}")
+    return True
+
+
+def has_legacy_columns(db):
+    """rides 表上是否还有旧的区域列"""
+    existing = {column['name'] for column in inspect(db.engine).get_columns('rides')}
+    return all(name in existing for name in LEGACY_COLUMNS)
+
+
+def backfill(db, resolve, batch_size=1000, pause=0.0):
+    """按主键分批写入还没有区域行的行程
+
+    Args:
+        db: 数据库
+        resolve: 函数 (行程行) -> [(kind, zone_id, position), ...]
+        batch_size: 每批的行数
+        pause: 每批之间暂停的秒数
+
+    Returns:
+        写入的区域行数
+    """
+    columns = "id, pickup_lat, pickup_lng, dropoff_lat, dropoff_lng"
+    if has_legacy_columns(db):
+        columns += ", pickup_zone, dropoff_zone"
+
+    last_id = 0
+    written = 0
+    while True:
+        with db.engine.begin() as conn:
+            rows = conn.execute(text(
+                f"SELECT {columns} FROM rides "
+                "WHERE id > :last_id AND NOT EXISTS (SELECT 1 FROM ride_zones WHERE ride_zones.ride_id = rides.id) "
+                "ORDER BY id LIMIT :limit"
+            ), {'last_id': last_id, 'limit': batch_size}).fetchall()
+
+            if not rows:
+                break
+
+            params = [
+                {'ride_id': row[0], 'kind': kind, 'zone_id': zone_id, 'position': position}
+                for row in rows
+                for kind, zone_id, position in resolve(row)
+            ]
+            if params:
+                conn.execute(text(
+                    "INSERT INTO ride_zones (ride_id, kind, zone_id, position) "
+                    "VALUES (:ride_id, :kind, :zone_id, :position)"
+                ), params)
+
+            written += len(params)
+            last_id = rows[-1][0]
+
+        print(f"  已写入 {written} 个区域行（当前ID {last_id}）")
+        if pause:
+            time.sleep(pause)
+
+    return written
+
+
+def from_legacy_columns(row):
+    """从旧的逗号分隔列拆分区域"""
+    return [
+        (kind, zone_id, position)
+        for kind, value in (('pickup', row[5]), ('dropoff', row[6]))
+        for position, zone_id in enumerate(zone for zone in (value or '').split(',') if zone)
+    ]
+
+
+def from_geofence(index):
+    """用地理围栏解析区域"""
+    def resolve(row):
+        _, pickup_lat, pickup_lng, dropoff_lat, dropoff_lng = row[:5]
+        return [
+            (kind, zone_id, position)
+            for kind, lat, lng in (('pickup', pickup_lat, pickup_lng), ('dropoff', dropoff_lat, dropoff_lng))
+            if lat is not None and lng is not None
+            for position, zone_id in enumerate(index.lookup_ids(lat, lng))
+        ]
+    return resolve
+
+
+def drop_legacy(db, drop_columns=False):
+    """删除旧的区域索引和（可选）旧的区域列"""
+    existing = {index['name'] for index in inspect(db.engine).get_indexes('rides')}
+    if LEGACY_INDEX in existing:
+        with db.engine.begin() as conn:
+            conn.execute(text(f"DROP INDEX IF EXISTS {LEGACY_INDEX}"))
+        print(f"  ✓ 删除索引 {LEGACY_INDEX}")
+
+    if drop_columns and has_legacy_columns(db):
+        for name in LEGACY_COLUMNS:
+            with db.engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE rides DROP COLUMN {name}"))
+            print(f"  ✓ 删除列 {name}")
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='行程地理围栏区域表迁移')
+    parser.add_argument('--geojson', default=os.environ.get('GEOFENCE_PATH'), help='区域GeoJSON文件')
+    parser.add_argument('--batch-size', type=int, default=1000, help='每批回填的行数')
+    parser.add_argument('--pause', type=float, default=0.0, help='每批之间暂停的秒数')
+    parser.add_argument('--drop-columns', action='store_true', help='回填后删除旧的 pickup_zone/dropoff_zone 列')
+    args = parser.parse_args()
+
+    print("=" * 50)
+    print("行程地理围栏区域表迁移")
+    print("=" * 50)
+
+    from src.services.database import db
+    from src.services.geofence import GeofenceIndex
+
+    app = create_app()
+    db.init_app(app)
+
+    try:
+        with app.app_context():
+            print("1. 创建区域表...")
+            create_table(db)
+
+            print("2. 回填数据...")
+            if has_legacy_columns(db):
+                print("  从旧的区域列拆分")
+                written = backfill(db, from_legacy_columns, batch_size=args.batch_size, pause=args.pause)
+                print(f"  ✓ 写入 {written} 个区域行")
+            elif args.geojson:
+                index = GeofenceIndex.load(args.geojson)
+                print(f"  加载 {len(index)} 个区域")
+                written = backfill(db, from_geofence(index), batch_size=args.batch_size, pause=args.pause)
+                print(f"  ✓ 写入 {written} 个区域行")
+            else:
+                print("  未指定 --geojson 或 GEOFENCE_PATH，跳过回填")
+
+            print("3. 清理旧的区域列...")
+            drop_legacy(db, drop_columns=args.drop_columns)
+
+        print("\n" + "=" * 50)
+        print("迁移完成！")
+        print("=" * 50)
+
+    except Exception as e:
+        print(f"\n❌ 迁移失败: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+城市模拟
+用离散事件模拟生成乘客和司机，驱动派单服务层，报告吞吐、延迟和匹配质量
+
+用法: python scripts/run_simulation.py [司机数] [模拟秒数] [每小时请求数]
+"""
+
+import sys
+import os
+import logging
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
+
+from src.simulator import Simulation
+
+# 无人接单的行程会回到待分配池，模拟中数量很多，不逐条打印
+logging.getLogger('src.services.offers').setLevel(logging.WARNING)
+
+
+def format_percentiles(values, unit):
+    return "  ".join(f"{name.upper()} {value:.2f}{unit}" for name, value in values.items())
+
+
+def main():
+    """主函数"""
+    drivers = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    duration = float(sys.argv[2]) if len(sys.argv) > 2 else 1800.0
+    requests_per_hour = float(sys.argv[3]) if len(sys.argv) > 3 else None
+
+    print("=" * 70)
+    print(f"城市模拟 ({drivers} 名司机, 模拟 {duration:.0f} 秒)")
+    print("=" * 70)
+
+    report = Simulation(drivers=drivers, duration_seconds=duration, requests_per_hour=requests_per_hour).run()
+
+    print("吞吐:")
+    print(f"  真实耗时 {report['wall_seconds']:.2f} 秒, 模拟速度 {report['speedup']}x 实时")
+    print(f"  处理事件 {report['events']} 个 ({report['events_per_second']} 个/秒)")
+    print(f"  完成行程 {report['completed']} 个 ({report['completed_per_hour']} 个/小时)")
+    print("延迟:")
+    print(f"  派单窗口耗时  {format_percentiles(report['dispatch_ms'], 'ms')}")
+    print(f"  乘客等待接单  {format_percentiles(report['accept_wait_seconds'], 's')}")
+    print(f"  乘客等待上车  {format_percentiles(report['pickup_wait_minutes'], 'min')}")
+    print("匹配质量:")
+    print(f"  请求 {report['requests']}  接单 {report['accepted']}  取消 {report['cancelled']}"
+          f"  匹配率 {report['match_rate']:.2%}")
+    print(f"  平均预计接驾 {report['mean_pickup_eta_minutes']:.2f} 分钟, 前向派单 {report['chained']} 个")
+    offers = report['offers']
+    print(f"  派单 {offers['offered']} 次: 接受 {offers['accepted']}  拒绝 {offers['declined']}"
+          f"  超时 {offers['timed_out']}")
+    print(f"  司机利用率 {report['utilization']:.1%}, 总车费 ${report['fares']:.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,8 +8,8 @@ __author__ = 'Your Name'
 __email__ = 'your.email@example.com'
 
 # 导入主要的类和函数，方便直接导入
-# 注意：我们不再有 create_app 函数，只有一个 app 实例
-from .app import app
+# create_app 创建不启动后台线程的应用，create_server 是运行服务的入口（会启动后台线程）
+from .app import create_app, create_server
 
 # 包级别的日志配置
 import logging
@@ -46,7 +46,8 @@ class PaymentError(TaxiServiceError):
 
 # 导出常用的类和函数
 __all__ = [
-    'app',  # 只导出 app，不导出 create_app
+    'create_app',
+    'create_server',
     'TaxiServiceError',
     'AuthenticationError',
     'ValidationError',
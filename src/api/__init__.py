@@ -7,13 +7,17 @@ from .auth import auth_bp
 from .booking import booking_bp
 from .driver import driver_bp
 from .notification import notification_bp
+from .analytics import analytics_bp
+from .ride_watch import ride_watch_bp
 
 # 导出所有蓝图
 __all__ = [
     'auth_bp',
     'booking_bp',
     'driver_bp',
-    'notification_bp'
+    'notification_bp',
+    'analytics_bp',
+    'ride_watch_bp'
 ]
 
 # API版本信息
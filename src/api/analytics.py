@@ -0,0 +1,119 @@
+"""
+分析API - 运营看板的实时需求/供给热力图
+
+所有端点只对管理员开放，管理员账号由 scripts/create_admin.py 创建。
+"""
+from flask import Blueprint, request, jsonify
+from src.utils.security import token_required, role_required
+from src.services.heatmap import demand_heatmap, WINDOWS_MINUTES
+from src.services.surge import surge_engine
+
+analytics_bp = Blueprint("analytics", __name__)
+
+
+def parse_window():
+    """解析窗口参数（分钟），不支持的窗口返回None"""
+    try:
+        window = int(request.args.get("window", 15))
+    except (TypeError, ValueError):
+        return None
+    return window if window in WINDOWS_MINUTES else None
+
+
+@analytics_bp.route("/heatmap", methods=["GET"])
+@token_required
+@role_required("admin")
+def get_heatmap(**kwargs):
+    """获取需求/供给热力图
+
+    查询参数: window（5/15/60分钟），可选 min_lat, max_lat, min_lng, max_lng 限定范围
+    """
+    try:
+        window = parse_window()
+        if window is None:
+            return (
+                jsonify({"error": f"window must be one of {list(WINDOWS_MINUTES)}"}),
+                400,
+            )
+
+        bounds = None
+        bound_names = ("min_lat", "max_lat", "min_lng", "max_lng")
+        if any(name in request.args for name in bound_names):
+            try:
+                bounds = tuple(float(request.args[name]) for name in bound_names)
+            except (KeyError, ValueError):
+                return (
+                    jsonify(
+                        {
+                            "error": "min_lat, max_lat, min_lng and max_lng "
+                            "must all be numbers"
+                        }
+                    ),
+                    400,
+                )
+
+        cells = demand_heatmap.heatmap(window, bounds)
+
+        return (
+            jsonify(
+                {
+                    "window_minutes": window,
+                    "precision": demand_heatmap.precision,
+                    "cells": cells,
+                    "count": len(cells),
+                }
+            ),
+            200,
+        )
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@analytics_bp.route("/heatmap/<cell>", methods=["GET"])
+@token_required
+@role_required("admin")
+def get_heatmap_cell(cell, **kwargs):
+    """获取单个网格的需求/供给"""
+    try:
+        window = parse_window()
+        if window is None:
+            return (
+                jsonify({"error": f"window must be one of {list(WINDOWS_MINUTES)}"}),
+                400,
+            )
+
+        try:
+            data = demand_heatmap.cell(cell, window)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        data["window_minutes"] = window
+        return jsonify(data), 200
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@analytics_bp.route("/surge", methods=["GET"])
+@token_required
+@role_required("admin")
+def get_surge(**kwargs):
+    """获取当前加价的网格及倍数"""
+    try:
+        cells = surge_engine.surging_cells()
+
+        return (
+            jsonify(
+                {
+                    "window_minutes": surge_engine.window_minutes,
+                    "cells": cells,
+                    "count": len(cells),
+                    "last_tick_ms": round(surge_engine.last_tick_ms, 3),
+                }
+            ),
+            200,
+        )
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
@@ -1,48 +1,422 @@
 """
 预订API - 行程管理
 """
-from flask import Blueprint, request, jsonify
+import os
+
+from flask import Blueprint, current_app, request, jsonify, stream_with_context
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+from src.models.ride import Ride
+from src.models.ride_track import RideTrack
+from src.models.user import User
+from src.api.driver import release_drivers, sync_released_drivers
+from src.services.database import db
+from src.services.idempotency import (
+    idempotency_store, request_fingerprint,
+    MAX_KEY_LENGTH, REPLAY, IN_PROGRESS, MISMATCH
+)
+from src.services.location import LocationService
+from src.services.payment import PaymentService
+from src.services.ride_cache import ride_detail_cache
+from src.services.ride_state import ride_state_machine, CANCEL
+from src.services.trajectory import track_store, encode_polyline
+from src.utils.security import token_required, role_required
+from src.utils.validators import validate_address
 
 booking_bp = Blueprint('booking', __name__)
 
+# 单个行程的最大直线/路网距离（公里）
+MAX_RIDE_DISTANCE_KM = float(os.environ.get('MAX_RIDE_DISTANCE_KM', 50))
+
+# 批量查询单次最多的行程数
+MAX_BATCH_RIDES = int(os.environ.get('MAX_BATCH_RIDES', 500))
+
 
 @booking_bp.route('/ride/request', methods=['POST'])
-def request_ride():
-    """请求行程"""
+@token_required
+@role_required('passenger')
+def request_ride(**kwargs):
+    """请求行程
+
+    请求头可带 Idempotency-Key：同一乘客用同一个键重试时直接返回第一次的响应，
+    不会重复创建行程和派单。同一个键用于不同的请求体时返回422，
+    第一次请求尚未处理完时返回409。服务端错误（5xx）不缓存，客户端可以用同一个键重试。
+
+    本进程的幂等存储是前置缓存，命中时不访问数据库；重试落在其他工作进程时
+    由 rides 表上 (passenger_id, idempotency_key) 的唯一索引去重，返回与行程一起保存的
+    第一次响应。
+    """
+    data = request.get_json(silent=True) or {}
+    passenger_id = kwargs['user_id']
+
+    key = request.headers.get('Idempotency-Key')
+    if key is None:
+        body, status = create_ride(passenger_id, data)
+        return jsonify(body), status
+
+    key = key.strip()
+    if not key or len(key) > MAX_KEY_LENGTH:
+        return jsonify({
+            "success": False,
+            "message": f"Idempotency-Key 长度必须在1到{MAX_KEY_LENGTH}个字符之间"
+        }), 400
+
+    fingerprint = request_fingerprint(data)
+    state, cached = idempotency_store.begin(passenger_id, key, fingerprint)
+    if state == REPLAY:
+        response = current_app.response_class(
+            cached[0], status=cached[1], mimetype='application/json'
+        )
+        response.headers['Idempotent-Replayed'] = 'true'
+        return response
+    if state == IN_PROGRESS:
+        return jsonify({"success": False, "message": "相同 Idempotency-Key 的请求正在处理"}), 409
+    if state == MISMATCH:
+        return jsonify({"success": False, "message": "Idempotency-Key 已用于不同的请求"}), 422
+
+    try:
+        result = replay_ride_request(passenger_id, key, fingerprint)
+        replayed = result is not None
+        if not replayed:
+            result = create_ride(passenger_id, data, key, fingerprint)
+            if result is None:
+                # 另一个进程用同一个键并发创建了行程
+                result = replay_ride_request(passenger_id, key, fingerprint)
+                replayed = result is not None
+                if not replayed:
+                    # 冲突的不是幂等键的唯一索引
+                    result = {"success": False, "message": "请求行程失败: 数据冲突"}, 500
+        body, status = result
+    except Exception:
+        idempotency_store.release(passenger_id, key)
+        raise
+
+    response = jsonify(body)
+    response.status_code = status
+    if replayed and status < 400:
+        response.headers['Idempotent-Replayed'] = 'true'
+    if status < 500:
+        idempotency_store.complete(
+            passenger_id, key, fingerprint, response.get_data(), status
+        )
+    else:
+        idempotency_store.release(passenger_id, key)
+    return response
+
+
+def parse_coordinates(data, prefix):
+    """读取并校验 <prefix>_lat / <prefix>_lng，无效时返回None"""
+    try:
+        lat = float(data[f'{prefix}_lat'])
+        lng = float(data[f'{prefix}_lng'])
+    except (KeyError, TypeError, ValueError):
+        return None
+    if not LocationService.validate_coordinates(lat, lng):
+        return None
+    return lat, lng
+
+
+def replay_ride_request(passenger_id, key, fingerprint):
+    """按幂等键查找已创建的行程（可能由其他工作进程创建）
+
+    Returns:
+        (响应字典, 状态码)，没有该键的行程时返回None
+    """
+    ride = Ride.query.filter_by(passenger_id=passenger_id, idempotency_key=key).first()
+    if ride is None:
+        return None
+    if ride.request_fingerprint != fingerprint:
+        return {"success": False, "message": "Idempotency-Key 已用于不同的请求"}, 422
+    if ride.idempotency_response is not None:
+        return current_app.json.loads(ride.idempotency_response), 201
+    # 迁移前创建的行程没有保存响应体，只能按行程重建
+    return {
+        "success": True,
+        "message": "行程请求成功",
+        "ride_id": ride.id,
+        "ride": ride.to_dict(),
+        "estimated_fare": ride.estimated_fare
+    }, 201
+
+
+def create_ride(passenger_id, data, idempotency_key=None, fingerprint=None):
+    """校验请求、估算车费并创建行程
+
+    Returns:
+        (响应字典, 状态码)；带幂等键写入时违反约束（通常是同一乘客的同一个键
+        已有行程）返回None，由调用方按键查找
+    """
+    for field in ('pickup_address', 'dropoff_address'):
+        valid, message = validate_address(data.get(field))
+        if not valid:
+            return {"success": False, "message": f"{field}: {message}"}, 400
+
+    pickup = parse_coordinates(data, 'pickup')
+    dropoff = parse_coordinates(data, 'dropoff')
+    if pickup is None or dropoff is None:
+        return {"success": False, "message": "上下车点坐标缺失或无效"}, 400
+
+    route = LocationService.estimate_route(pickup[0], pickup[1], dropoff[0], dropoff[1])
+    if route['distance_km'] > MAX_RIDE_DISTANCE_KM:
+        return {"success": False, "message": f"行程距离不能超过{MAX_RIDE_DISTANCE_KM:g}公里"}, 400
+
+    surge_multiplier = PaymentService.get_surge_multiplier(pickup[0], pickup[1])
+    estimated_fare = round(
+        PaymentService.calculate_fare(
+            route['distance_km'], surge_multiplier=surge_multiplier
+        ),
+        2
+    )
+
+    # 行程由批量派单器在下一个窗口分配，这里只估计最近司机的到达时间
+    nearest = LocationService.find_nearest_drivers(pickup[0], pickup[1], k=1)
+
+    try:
+        ride = Ride(
+            passenger_id=passenger_id,
+            pickup_address=data['pickup_address'],
+            dropoff_address=data['dropoff_address'],
+            pickup_lat=pickup[0],
+            pickup_lng=pickup[1],
+            dropoff_lat=dropoff[0],
+            dropoff_lng=dropoff[1],
+            estimated_fare=estimated_fare,
+            idempotency_key=idempotency_key,
+            request_fingerprint=fingerprint
+        )
+        db.session.add(ride)
+        # 先写入取得行程ID，唯一索引冲突在这里抛出
+        db.session.flush()
+        body = {
+            "success": True,
+            "message": "行程请求成功",
+            "ride_id": ride.id,
+            "ride": ride.to_dict(),
+            "distance_km": round(route['distance_km'], 2),
+            "estimated_time_minutes": round(route['duration_minutes'], 1),
+            "estimated_fare": estimated_fare,
+            "surge_multiplier": surge_multiplier,
+            "estimated_wait_minutes": nearest[0]['eta_minutes'] if nearest else None
+        }
+        if idempotency_key is not None:
+            ride.idempotency_response = current_app.json.dumps(body)
+        db.session.commit()
+    except IntegrityError as e:
+        db.session.rollback()
+        if idempotency_key is None:
+            return {"success": False, "message": f"请求行程失败: {str(e)}"}, 500
+        return None
+    except Exception as e:
+        db.session.rollback()
+        return {"success": False, "message": f"请求行程失败: {str(e)}"}, 500
+
+    return body, 201
+
+
+def serialize_ride(ride_id):
+    """从数据库读取行程并序列化详情响应
+
+    Returns:
+        (版本号, 响应体bytes, 乘客ID, 司机ID)，行程不存在时为None
+    """
+    ride = db.session.get(Ride, ride_id)
+    if ride is None:
+        return None
+    body = current_app.json.dumps({
+        "success": True,
+        "ride_id": ride.id,
+        "status": ride.status,
+        "version": ride.version,
+        "ride": ride.to_dict()
+    })
+    return ride.version, body.encode('utf-8'), ride.passenger_id, ride.driver_id
+
+
+@booking_bp.route('/ride/<int:ride_id>', methods=['GET'])
+@token_required
+def get_ride(ride_id, **kwargs):
+    """获取行程详情
+
+    响应来自行程详情缓存，带基于版本号的ETag；请求头 If-None-Match 与当前版本相同时
+    返回304，不访问数据库也不重新序列化。行程状态转换后缓存失效，版本号加1。
+    只有行程的乘客、司机和管理员可以查看，权限按缓存条目中的乘客和司机校验。
+    """
+    try:
+        entry = ride_detail_cache.load(ride_id, serialize_ride)
+    except Exception as e:
+        return jsonify({"success": False, "message": f"获取行程详情失败: {str(e)}"}), 500
+    if entry is None:
+        return jsonify({"success": False, "message": "行程不存在"}), 404
+    if not can_view_ride(
+        entry.passenger_id, entry.driver_id, kwargs['user_id'], kwargs['user_role']
+    ):
+        return jsonify({"success": False, "message": "无权查看该行程"}), 403
+
+    return ride_response(entry, request.if_none_match.contains(entry.etag))
+
+
+def ride_response(entry, not_modified=False):
+    """由缓存条目构造行程详情响应（304时不带响应体）"""
+    if not_modified:
+        response = current_app.response_class(status=304)
+    else:
+        response = current_app.response_class(entry.body, mimetype='application/json')
+    response.set_etag(entry.etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@booking_bp.route('/rides/batch', methods=['POST'])
+@token_required
+@role_required('admin')
+def get_rides_batch(**kwargs):
+    """批量获取行程详情
+
+    请求体: {"ride_ids": [1, 2, ...]}，最多 MAX_BATCH_RIDES 个。
+    一条 IN 查询读取全部行程，乘客、司机和司机车辆用 JOIN 在同一次查询中加载；
+    响应为按请求顺序排列的行程数组，逐条序列化后流式返回。不存在的行程不出现在数组中，
+    其数量见响应头 X-Missing-Rides。
+    """
+    data = request.get_json(silent=True) or {}
+    ride_ids = data.get('ride_ids')
+    if not isinstance(ride_ids, list) or not ride_ids:
+        return jsonify({"success": False, "message": "ride_ids 必须是非空列表"}), 400
+    if len(ride_ids) > MAX_BATCH_RIDES:
+        return jsonify({
+            "success": False,
+            "message": f"每次最多查询 {MAX_BATCH_RIDES} 个行程"
+        }), 400
+    try:
+        # 去重并保持请求顺序
+        ride_ids = list(dict.fromkeys(int(ride_id) for ride_id in ride_ids))
+    except (TypeError, ValueError):
+        return jsonify({"success": False, "message": "ride_ids 必须是整数"}), 400
+
+    try:
+        rides = db.session.execute(
+            db.select(Ride)
+            .where(Ride.id.in_(ride_ids))
+            .options(
+                joinedload(Ride.passenger),
+                joinedload(Ride.driver).joinedload(User.vehicle),
+                joinedload(Ride.zones)
+            )
+        ).unique().scalars().all()
+    except Exception as e:
+        return jsonify({"success": False, "message": f"批量获取行程失败: {str(e)}"}), 500
+
+    rides_by_id = {ride.id: ride for ride in rides}
+    ordered = [rides_by_id[ride_id] for ride_id in ride_ids if ride_id in rides_by_id]
+
+    def generate():
+        yield '['
+        for position, ride in enumerate(ordered):
+            body = current_app.json.dumps(ride_with_parties(ride))
+            yield (',' if position else '') + body
+        yield ']'
+
+    response = current_app.response_class(
+        stream_with_context(generate()), mimetype='application/json'
+    )
+    response.headers['X-Missing-Rides'] = str(len(ride_ids) - len(ordered))
+    return response
+
+
+def ride_with_parties(ride):
+    """行程详情，附带乘客、司机及其车辆（均已预加载，不再查询数据库）"""
+    data = ride.to_dict()
+    data['passenger'] = ride.passenger.to_dict() if ride.passenger else None
+    driver = ride.driver
+    if driver is None:
+        data['driver'] = None
+    else:
+        data['driver'] = {
+            **driver.to_dict(),
+            'rating': driver.rating,
+            'vehicle': driver.vehicle.to_dict() if driver.vehicle else None
+        }
+    return data
+
+
+def can_view_ride(passenger_id, driver_id, user_id, user_role):
+    """只有行程的乘客、接单司机和管理员可以查看行程"""
+    return user_role == 'admin' or user_id in (passenger_id, driver_id)
+
+
+@booking_bp.route('/ride/<int:ride_id>/track', methods=['GET'])
+@token_required
+def get_ride_track(ride_id, **kwargs):
+    """获取行程轨迹
+
+    进行中的行程返回内存中的实时简化轨迹，其余返回已保存的轨迹。
+    polyline 为Google Encoded Polyline格式，points 为 [纬度, 经度, Unix秒] 列表。
+    只有行程的乘客、司机和管理员可以查看。
+    """
     try:
-        data = request.get_json()
+        ride = db.session.get(Ride, ride_id)
+        if ride is None:
+            return jsonify({"success": False, "message": "行程不存在"}), 404
+        if not can_view_ride(
+            ride.passenger_id, ride.driver_id, kwargs['user_id'], kwargs['user_role']
+        ):
+            return jsonify({"success": False, "message": "无权查看该行程"}), 403
+
+        points = track_store.points(ride_id)
+        if points is None:
+            track = db.session.get(RideTrack, ride_id)
+            points = track.get_points() if track is not None else []
 
-        # 简化逻辑
         return jsonify({
             "success": True,
-            "message": "行程请求功能待实现",
-            "ride_id": 123,
-            "estimated_wait_time": "5-10 minutes"
-        }), 201
+            "ride_id": ride_id,
+            "status": ride.status,
+            "polyline": encode_polyline(points),
+            "points": [list(point) for point in points],
+            "point_count": len(points)
+        })
 
     except Exception as e:
         return jsonify({
             "success": False,
-            "message": f"请求行程失败: {str(e)}"
+            "message": f"获取行程轨迹失败: {str(e)}"
         }), 500
 
 
-@booking_bp.route('/ride/<int:ride_id>', methods=['GET'])
-def get_ride(ride_id):
-    """获取行程详情"""
-    return jsonify({
-        "success": True,
-        "ride_id": ride_id,
-        "status": "requested",
-        "message": "获取行程详情功能待实现"
-    })
+@booking_bp.route('/ride/<int:ride_id>/cancel', methods=['POST'])
+@token_required
+@role_required('passenger')
+def cancel_ride(ride_id, **kwargs):
+    """乘客取消行程
 
+    通过行程状态机的条件UPDATE，只有该乘客待接单或已接单的行程会被取消；
+    已接单的司机在同一事务中释放。提交后停止派单、行程缓存失效并唤醒等待中的长轮询。
+    """
+    passenger_id = kwargs['user_id']
+    try:
+        ride_event = ride_state_machine.transition(
+            ride_id, CANCEL, passenger_id=passenger_id
+        )
+        if ride_event is None:
+            db.session.rollback()
+            ride = db.session.get(Ride, ride_id)
+            if ride is None or ride.passenger_id != passenger_id:
+                return jsonify({"success": False, "message": "行程不存在"}), 404
+            return jsonify({
+                "success": False,
+                "message": f"无法取消状态为 {ride.status} 的行程"
+            }), 400
 
-@booking_bp.route('/ride/<int:ride_id>/cancel', methods=['POST'])
-def cancel_ride(ride_id):
-    """取消行程"""
+        released = release_drivers([ride_event])
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"success": False, "message": f"取消行程失败: {str(e)}"}), 500
+
+    sync_released_drivers(released)
     return jsonify({
         "success": True,
         "ride_id": ride_id,
-        "message": "行程已取消（模拟）"
+        "status": ride_event.status,
+        "version": ride_event.version,
+        "message": "行程已取消"
     })
\ No newline at end of file
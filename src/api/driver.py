@@ -1,10 +1,24 @@
 from flask import Blueprint, request, jsonify
-import datetime
+import numpy as np
 from src.utils.security import token_required, role_required
 from src.models.user import User
 from src.models.ride import Ride
 from src.services.database import db
 from src.services.location import LocationService
+from src.services.payment import PaymentService
+from src.services.spatial_index import driver_index
+from src.services.location_buffer import (
+    location_buffer, parse_ping_timestamp, clamp_ping_timestamp
+)
+from src.services.trajectory import track_store
+from src.services.dispatcher import batch_dispatcher
+from src.services.offers import offer_manager
+from src.services.forward_dispatch import finishing_drivers
+from src.services.event_log import event_recorder
+from src.services.ride_state import (
+    ride_state_machine, can_transition, ACCEPT, START, COMPLETE, CANCEL, EXPIRE,
+    ACCEPTED, IN_PROGRESS, CANCELLED
+)
 
 driver_bp = Blueprint('driver', __name__)
 
@@ -17,28 +31,146 @@ class SimpleNotificationService:
 
 notification_service = SimpleNotificationService()
 
+# 各转换通知乘客的消息
+TRANSITION_MESSAGES = {
+    ACCEPT: 'A driver has accepted your ride',
+    START: 'Your ride has started',
+    COMPLETE: 'Your ride has been completed. Fare: ${actual_fare:.2f}',
+    CANCEL: 'Your ride has been cancelled',
+    EXPIRE: 'No driver accepted your ride in time'
+}
+
+# 管理员批量转换允许的动作和单次请求的最大行程数
+BULK_ACTIONS = (CANCEL, EXPIRE)
+MAX_BULK_RIDES = 1000
+
+
+def publish_ride_transitions(events):
+    """转换提交后通知乘客，取消的行程不再派单"""
+    for ride_event in events:
+        notification_service.send_ride_status_notification(
+            ride_event.passenger_id,
+            ride_event.ride_id,
+            ride_event.status,
+            TRANSITION_MESSAGES[ride_event.action].format(**ride_event.values)
+        )
+        if ride_event.status == CANCELLED:
+            batch_dispatcher.release(ride_id=ride_event.ride_id)
+            offer_manager.cancel(ride_event.ride_id)
+
+
+ride_state_machine.subscribe(publish_ride_transitions)
+
+
+def sync_driver_index(driver):
+    """根据司机的可用状态和位置更新内存空间索引"""
+    location = driver.get_location()
+    if driver.is_available and location is not None:
+        driver_index.upsert(
+            driver.id, location[0], location[1],
+            name=driver.username,
+            rating=driver.rating,
+            vehicle_type=driver.vehicle.vehicle_type if driver.vehicle else None,
+            zones=LocationService.lookup_zones(location[0], location[1])
+        )
+    else:
+        driver_index.remove(driver.id)
+
+
+def record_availability(driver):
+    """把司机可用状态变化和当前位置写入派单事件日志"""
+    location = driver.get_location() or (None, None)
+    event_recorder.availability_changed(driver.id, driver.is_available, *location)
+
+
+def release_drivers(events):
+    """释放被取消行程的司机，与取消在同一事务中执行（调用方提交）
+
+    仍有其他活跃行程（前向派单）的司机只取消预留，其余恢复可用。
+
+    Returns:
+        恢复可用的司机ID列表，提交后交给 sync_released_drivers
+    """
+    released = []
+    driver_ids = {
+        ride_event.driver_id for ride_event in events
+        if ride_event.driver_id is not None
+    }
+    for driver_id in driver_ids:
+        busy = Ride.query.filter(
+            Ride.driver_id == driver_id,
+            Ride.status.in_([ACCEPTED, IN_PROGRESS])
+        ).first() is not None
+        if busy:
+            finishing_drivers.unreserve(driver_id)
+        elif User.update_availability(driver_id, True):
+            released.append(driver_id)
+    return released
+
+
+def sync_released_drivers(released):
+    """恢复可用的司机提交后重新进入空间索引并写入派单事件日志"""
+    for driver_id in released:
+        driver = db.session.get(User, driver_id)
+        sync_driver_index(driver)
+        record_availability(driver)
+
+
+def transition_error(ride_id, action, verb, driver_id):
+    """转换的条件UPDATE没有命中时，查出原因并返回错误响应（调用方已回滚）"""
+    ride = db.session.get(Ride, ride_id)
+    if ride is None:
+        return jsonify({'error': 'Ride not found'}), 404
+    if not can_transition(ride.status, action):
+        return jsonify({
+            'error': f'Cannot {verb} a ride with status: {ride.status}'
+        }), 400
+    if ride.driver_id != driver_id:
+        return jsonify({'error': f'Unauthorized to {verb} this ride'}), 403
+    return jsonify({'error': f'Ride changed while trying to {verb} it'}), 409
+
 
 
 
 @driver_bp.route('/location/update', methods=['POST'])
 @token_required
 @role_required('driver')
-def update_location():
+def update_location(**kwargs):
     """司机更新位置"""
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True) or {}
 
         # 验证必填字段
         if 'latitude' not in data or 'longitude' not in data:
             return jsonify({'error': 'Latitude and longitude are required'}), 400
 
         # 获取司机信息
-        driver = User.query.get(request.user_id)
+        driver = db.session.get(User, kwargs['user_id'])
         if not driver:
             return jsonify({'error': 'Driver not found'}), 404
 
+        try:
+            latitude = float(data['latitude'])
+            longitude = float(data['longitude'])
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Latitude and longitude must be numbers'}), 400
+
         # 更新位置
-        driver.current_location = f"{data['latitude']},{data['longitude']}"
+        driver.set_location(latitude, longitude)
+
+        # 进行中的行程记录轨迹；本进程尚未登记时（如服务重启后）从数据库恢复
+        if not driver.is_available and track_store.ride_for_driver(driver.id) is None:
+            active_ride = Ride.query.filter_by(
+                driver_id=driver.id, status='in_progress'
+            ).first()
+            if active_ride:
+                track_store.start(active_ride.id, driver.id)
+                finishing_drivers.track_ride(active_ride, latitude, longitude)
+        finishing_drivers.update_position(driver.id, latitude, longitude)
+        if track_store.add_ping(
+            driver.id, latitude, longitude, driver.location_updated_at
+        ):
+            track_store.save(track_store.ride_for_driver(driver.id))
 
         # 如果有地址信息，也更新
         if 'address' in data:
@@ -47,9 +179,16 @@ def update_location():
 
         db.session.commit()
 
+        # 同步内存空间索引：只有可用司机参与附近查询
+        sync_driver_index(driver)
+        event_recorder.location_ping(driver.id, latitude, longitude)
+
         return jsonify({
             'message': 'Location updated successfully',
-            'location': driver.current_location
+            'location': driver.current_location,
+            'latitude': driver.current_lat,
+            'longitude': driver.current_lng,
+            'updated_at': driver.location_updated_at.isoformat()
         }), 200
 
     except Exception as e:
@@ -57,10 +196,113 @@ def update_location():
         return jsonify({'error': str(e)}), 500
 
 
+# 单次批量上报的最大条数
+MAX_PINGS_PER_BATCH = 5000
+
+
+@driver_bp.route('/location/batch', methods=['POST'])
+@token_required
+def ingest_location_batch(**kwargs):
+    """批量上报位置
+
+    请求体: {"pings": [{"driver_id": 1, "latitude": .., "longitude": ..,
+                       "timestamp": ..}, ...]}
+    司机只能上报自己的位置（可省略driver_id）；管理员/网关账号可以上报多个司机。
+    timestamp 超出服务器时间附近有效范围的上报被拒绝。
+    位置进入写缓冲区，每个司机只保留最新一条，由后台线程批量写入数据库。
+    """
+    try:
+        data = request.get_json() or {}
+        pings = data.get('pings')
+        if not isinstance(pings, list) or not pings:
+            return jsonify({'error': 'pings must be a non-empty list'}), 400
+        if len(pings) > MAX_PINGS_PER_BATCH:
+            return jsonify({
+                'error': f'At most {MAX_PINGS_PER_BATCH} pings per request'
+            }), 400
+
+        user_id = kwargs['user_id']
+        user_role = kwargs['user_role']
+        if user_role not in ('driver', 'admin'):
+            return jsonify({'error': 'Insufficient permissions'}), 403
+
+        parsed = []
+        rejected = []
+        for position, ping in enumerate(pings):
+            try:
+                driver_id = int(ping.get('driver_id', user_id))
+                latitude = float(ping['latitude'])
+                longitude = float(ping['longitude'])
+                timestamp = parse_ping_timestamp(ping.get('timestamp'))
+            except (
+                TypeError, ValueError, KeyError, AttributeError, OverflowError, OSError
+            ):
+                rejected.append({'index': position, 'error': 'Invalid ping'})
+                continue
+
+            if user_role == 'driver' and driver_id != user_id:
+                rejected.append({
+                    'index': position,
+                    'error': 'Cannot report location for another driver'
+                })
+                continue
+            if not LocationService.validate_coordinates(latitude, longitude):
+                rejected.append({'index': position, 'error': 'Invalid coordinates'})
+                continue
+            try:
+                timestamp = clamp_ping_timestamp(timestamp)
+            except ValueError:
+                rejected.append({'index': position, 'error': 'Timestamp out of range'})
+                continue
+
+            parsed.append((driver_id, latitude, longitude, timestamp))
+
+        accepted = location_buffer.add_many(parsed)
+        event_recorder.location_pings(parsed)
+
+        # 进行中行程的轨迹和预计空闲时间
+        due_rides = set()
+        for driver_id, latitude, longitude, timestamp in parsed:
+            if track_store.add_ping(driver_id, latitude, longitude, timestamp):
+                due_rides.add(track_store.ride_for_driver(driver_id))
+            if driver_id in finishing_drivers:
+                latest = location_buffer.latest(driver_id)
+                if latest is not None and latest[2] == timestamp:
+                    finishing_drivers.update_position(driver_id, latitude, longitude)
+        if due_rides:
+            for ride_id in due_rides:
+                track_store.save(ride_id)
+            db.session.commit()
+
+        # 内存空间索引立即更新，只移动已在索引中的可用司机
+        for driver_id, latitude, longitude, timestamp in parsed:
+            latest = location_buffer.latest(driver_id)
+            if (
+                driver_id in driver_index
+                and latest is not None
+                and latest[2] == timestamp
+            ):
+                driver_index.upsert(
+                    driver_id, latitude, longitude,
+                    zones=LocationService.lookup_zones(latitude, longitude)
+                )
+
+        return jsonify({
+            'message': 'Locations queued',
+            'received': len(pings),
+            'accepted': accepted,
+            'rejected': rejected
+        }), 202
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+
 @driver_bp.route('/available', methods=['POST'])
 @token_required
 @role_required('driver')
-def set_availability():
+def set_availability(**kwargs):
     """设置司机可用状态"""
     try:
         data = request.get_json()
@@ -69,16 +311,17 @@ def set_availability():
         if 'is_available' not in data:
             return jsonify({'error': 'is_available field is required'}), 400
 
-        # 获取司机信息
-        driver = User.query.get(request.user_id)
-        if not driver:
+        # 条件更新可用状态，不先读后写
+        if not User.update_availability(kwargs['user_id'], bool(data['is_available'])):
+            db.session.rollback()
             return jsonify({'error': 'Driver not found'}), 404
 
-        # 更新可用状态
-        driver.is_available = bool(data['is_available'])
-
         db.session.commit()
 
+        driver = db.session.get(User, kwargs['user_id'])
+        sync_driver_index(driver)
+        record_availability(driver)
+
         return jsonify({
             'message': 'Availability updated successfully',
             'is_available': driver.is_available
@@ -92,47 +335,60 @@ def set_availability():
 @driver_bp.route('/ride/<int:ride_id>/accept', methods=['POST'])
 @token_required
 @role_required('driver')
-def accept_ride(ride_id):
-    """司机接受行程"""
+def accept_ride(ride_id, **kwargs):
+    """司机接受行程
+
+    司机可用状态和行程分配各是一条条件UPDATE，在同一事务中完成；
+    由影响行数决定是否抢到，并发接单时只有一个司机成功，其余看到行程已被接单。
+    即将完成当前行程的司机可以接下一单（前向派单），每个司机只能预留一单。
+    正在派给其他司机且未过期的行程不能被抢，这一条件也在抢单的UPDATE中。
+    """
     try:
-        # 获取行程信息
-        ride = Ride.query.get(ride_id)
-        if not ride:
-            return jsonify({'error': 'Ride not found'}), 404
-
-        # 检查行程状态
-        if ride.status != 'requested':
-            return jsonify({'error': f'Cannot accept a ride with status: {ride.status}'}), 400
-
-        # 获取司机信息
-        driver = User.query.get(request.user_id)
-        if not driver:
-            return jsonify({'error': 'Driver not found'}), 404
-
-        # 检查司机是否可用
-        if not driver.is_available:
-            return jsonify({'error': 'Driver is not available'}), 400
-
-        # 更新行程信息
-        ride.driver_id = driver.id
-        ride.status = 'accepted'
-        ride.accepted_at = datetime.datetime.utcnow()
-
-        # 更新司机状态为不可用
-        driver.is_available = False
-
-        # 发送通知给乘客
-        notification_service.send_ride_status_notification(
-            ride.passenger_id,
-            ride.id,
-            'accepted',
-            f'Driver {driver.username} has accepted your ride'
-        )
+        driver_id = kwargs['user_id']
+
+        # 占用司机：只有当前可用时才置为不可用，同一司机不能同时接多单；
+        # 行程中且还没有预留下一单的司机可以预留一单，由数据库中的行程判断并锁定司机行
+        chained = False
+        if not User.update_availability(driver_id, False, only_if=True):
+            db.session.rollback()
+            if db.session.get(User, driver_id) is None:
+                return jsonify({'error': 'Driver not found'}), 404
+            chained = User.lock_finishing(driver_id)
+            if not chained:
+                db.session.rollback()
+                return jsonify({'error': 'Driver is not available'}), 400
+
+        # 抢单：只有仍待接单、没有司机、没有派给其他司机且该司机没有其他已接单行程时才会更新
+        if ride_state_machine.transition(ride_id, ACCEPT, driver_id=driver_id) is None:
+            db.session.rollback()
+            ride = db.session.get(Ride, ride_id)
+            if ride is None:
+                return jsonify({'error': 'Ride not found'}), 404
+            if not can_transition(ride.status, ACCEPT):
+                return jsonify({
+                    'error': f'Cannot accept a ride with status: {ride.status}'
+                }), 400
+            if ride.offered_to_other(driver_id):
+                return jsonify({
+                    'error': 'Ride is currently offered to another driver'
+                }), 409
+            return jsonify({'error': 'Ride has already been accepted'}), 409
 
         db.session.commit()
 
+        ride = db.session.get(Ride, ride_id)
+        driver = db.session.get(User, driver_id)
+        sync_driver_index(driver)
+        if chained:
+            finishing_drivers.reserve(driver_id, ride_id)
+        else:
+            record_availability(driver)
+        batch_dispatcher.release(ride_id=ride_id, driver_id=driver_id)
+        offer_manager.accepted(ride_id, driver_id)
+
         return jsonify({
             'message': 'Ride accepted successfully',
+            'chained': chained,
             'ride': ride.to_dict()
         }), 200
 
@@ -141,38 +397,48 @@ def accept_ride(ride_id):
         return jsonify({'error': str(e)}), 500
 
 
-@driver_bp.route('/ride/<int:ride_id>/start', methods=['POST'])
+@driver_bp.route('/ride/<int:ride_id>/decline', methods=['POST'])
 @token_required
 @role_required('driver')
-def start_ride(ride_id):
-    """司机开始行程"""
-    try:
-        # 获取行程信息
-        ride = Ride.query.get(ride_id)
-        if not ride:
-            return jsonify({'error': 'Ride not found'}), 404
+def decline_ride(ride_id, **kwargs):
+    """司机拒绝派单，行程立即转给下一个候选司机
 
-        # 检查行程状态
-        if ride.status != 'accepted':
-            return jsonify({'error': f'Cannot start a ride with status: {ride.status}'}), 400
+    只有数据库中派给该司机且未过期的派单可以拒绝；清除后其他司机即可接单。
+    """
+    try:
+        if not Ride.clear_offer(ride_id, kwargs['user_id']):
+            db.session.rollback()
+            return jsonify({'error': 'No pending offer for this ride'}), 404
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
 
-        # 检查司机是否有权开始此行程
-        if ride.driver_id != request.user_id:
-            return jsonify({'error': 'Unauthorized to start this ride'}), 403
+    offer_manager.decline(ride_id, kwargs['user_id'])
+    return jsonify({'message': 'Offer declined', 'ride_id': ride_id}), 200
 
-        # 更新行程状态
-        ride.status = 'in_progress'
-        ride.started_at = datetime.datetime.utcnow()
 
-        # 发送通知给乘客
-        notification_service.send_ride_status_notification(
-            ride.passenger_id,
-            ride.id,
-            'in_progress',
-            'Your ride has started'
-        )
+@driver_bp.route('/ride/<int:ride_id>/start', methods=['POST'])
+@token_required
+@role_required('driver')
+def start_ride(ride_id, **kwargs):
+    """司机开始行程"""
+    try:
+        # 只有已接单且属于该司机的行程才会更新
+        if ride_state_machine.transition(
+            ride_id, START, driver_id=kwargs['user_id']
+        ) is None:
+            db.session.rollback()
+            return transition_error(ride_id, START, 'start', kwargs['user_id'])
 
         db.session.commit()
+        ride = db.session.get(Ride, ride_id)
+
+        # 开始记录行程轨迹，并登记预计空闲时间供前向派单
+        track_store.start(ride.id, ride.driver_id)
+        driver = db.session.get(User, ride.driver_id)
+        location = driver.get_location() if driver else None
+        finishing_drivers.track_ride(ride, *(location or (None, None)))
 
         return jsonify({
             'message': 'Ride started successfully',
@@ -187,47 +453,41 @@ def start_ride(ride_id):
 @driver_bp.route('/ride/<int:ride_id>/complete', methods=['POST'])
 @token_required
 @role_required('driver')
-def complete_ride(ride_id):
+def complete_ride(ride_id, **kwargs):
     """司机完成行程"""
     try:
-        data = request.get_json()
-
-        # 获取行程信息
-        ride = Ride.query.get(ride_id)
-        if not ride:
-            return jsonify({'error': 'Ride not found'}), 404
-
-        # 检查行程状态
-        if ride.status != 'in_progress':
-            return jsonify({'error': f'Cannot complete a ride with status: {ride.status}'}), 400
-
-        # 检查司机是否有权完成此行程
-        if ride.driver_id != request.user_id:
-            return jsonify({'error': 'Unauthorized to complete this ride'}), 403
+        data = request.get_json() or {}
 
         # 验证必填字段
         if 'actual_fare' not in data:
             return jsonify({'error': 'actual_fare field is required'}), 400
+        try:
+            actual_fare = float(data['actual_fare'])
+        except (TypeError, ValueError):
+            return jsonify({'error': 'actual_fare must be a number'}), 400
 
-        # 更新行程信息
-        ride.status = 'completed'
-        ride.actual_fare = float(data['actual_fare'])
-        ride.completed_at = datetime.datetime.utcnow()
+        # 只有进行中且属于该司机的行程才会更新
+        if ride_state_machine.transition(ride_id, COMPLETE, driver_id=kwargs['user_id'],
+                                         actual_fare=actual_fare) is None:
+            db.session.rollback()
+            return transition_error(ride_id, COMPLETE, 'complete', kwargs['user_id'])
 
-        # 更新司机状态为可用
-        driver = User.query.get(request.user_id)
-        if driver:
-            driver.is_available = True
+        # 更新司机状态为可用；已接下一单（前向派单）的司机保持不可用
+        has_next_ride = Ride.query.filter_by(
+            driver_id=kwargs['user_id'], status=ACCEPTED
+        ).first() is not None
+        User.update_availability(kwargs['user_id'], not has_next_ride)
 
-        # 发送通知给乘客
-        notification_service.send_ride_status_notification(
-            ride.passenger_id,
-            ride.id,
-            'completed',
-            f'Your ride has been completed. Fare: ${ride.actual_fare:.2f}'
-        )
+        # 写入最终轨迹
+        track_store.finish(ride_id)
 
         db.session.commit()
+        ride = db.session.get(Ride, ride_id)
+        finishing_drivers.remove(kwargs['user_id'])
+        driver = db.session.get(User, kwargs['user_id'])
+        if driver:
+            sync_driver_index(driver)
+            record_availability(driver)
 
         return jsonify({
             'message': 'Ride completed successfully',
@@ -239,16 +499,66 @@ def complete_ride(ride_id):
         return jsonify({'error': str(e)}), 500
 
 
+@driver_bp.route('/rides/transition', methods=['POST'])
+@token_required
+@role_required('admin')
+def bulk_transition(**kwargs):
+    """管理员批量转换行程状态（管理员账号由 scripts/create_admin.py 创建）
+
+    请求体: {"action": "cancel" 或 "expire", "ride_ids": [1, 2, ...]}
+    不满足转换条件的行程跳过；被取消的已接单行程释放司机（没有其他活跃行程时恢复可用）。
+    """
+    try:
+        data = request.get_json() or {}
+        action = data.get('action')
+        if action not in BULK_ACTIONS:
+            return jsonify({
+                'error': f'action must be one of {list(BULK_ACTIONS)}'
+            }), 400
+
+        ride_ids = data.get('ride_ids')
+        if not isinstance(ride_ids, list) or not ride_ids:
+            return jsonify({'error': 'ride_ids must be a non-empty list'}), 400
+        if len(ride_ids) > MAX_BULK_RIDES:
+            return jsonify({
+                'error': f'At most {MAX_BULK_RIDES} rides per request'
+            }), 400
+        try:
+            ride_ids = [int(ride_id) for ride_id in ride_ids]
+        except (TypeError, ValueError):
+            return jsonify({'error': 'ride_ids must be integers'}), 400
+
+        events = ride_state_machine.transition_many(ride_ids, action)
+        released = release_drivers(events)
+        db.session.commit()
+        sync_released_drivers(released)
+
+        transitioned = [ride_event.ride_id for ride_event in events]
+        moved = set(transitioned)
+        return jsonify({
+            'action': action,
+            'transitioned': transitioned,
+            'skipped': [
+                ride_id for ride_id in dict.fromkeys(ride_ids) if ride_id not in moved
+            ],
+            'released_drivers': released
+        }), 200
+
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+
 @driver_bp.route('/rides/active', methods=['GET'])
 @token_required
 @role_required('driver')
-def get_active_rides():
+def get_active_rides(**kwargs):
     """获取司机的活跃行程"""
     try:
         # 获取司机的活跃行程
         active_rides = Ride.query.filter(
-            Ride.driver_id == request.user_id,
-            Ride.status.in_(['accepted', 'in_progress'])
+            Ride.driver_id == kwargs['user_id'],
+            Ride.status.in_([ACCEPTED, IN_PROGRESS])
         ).order_by(Ride.requested_at.desc()).all()
 
         return jsonify({
@@ -262,7 +572,7 @@ def get_active_rides():
 @driver_bp.route('/rides/history', methods=['GET'])
 @token_required
 @role_required('driver')
-def get_ride_history():
+def get_ride_history(**kwargs):
     """获取司机的行程历史"""
     try:
         # 获取查询参数
@@ -271,7 +581,7 @@ def get_ride_history():
 
         # 获取司机的历史行程
         query = Ride.query.filter(
-            Ride.driver_id == request.user_id,
+            Ride.driver_id == kwargs['user_id'],
             Ride.status.in_(['completed', 'cancelled'])
         ).order_by(Ride.completed_at.desc())
 
@@ -292,54 +602,62 @@ def get_ride_history():
 @driver_bp.route('/nearby-requests', methods=['GET'])
 @token_required
 @role_required('driver')
-def get_nearby_ride_requests():
+def get_nearby_ride_requests(**kwargs):
     """获取附近的行程请求"""
     try:
         # 获取司机当前位置
-        driver = User.query.get(request.user_id)
-        if not driver or not driver.current_location:
+        driver = db.session.get(User, kwargs['user_id'])
+        location = driver.get_location() if driver else None
+        if location is None:
             return jsonify({'error': 'Driver location not set'}), 400
-
-        # 解析司机位置
-        try:
-            lat_str, lon_str = driver.current_location.split(',')
-            driver_lat = float(lat_str)
-            driver_lon = float(lon_str)
-        except (ValueError, AttributeError):
-            return jsonify({'error': 'Invalid driver location format'}), 400
+        driver_lat, driver_lon = location
 
         # 获取半径参数
         radius_km = float(request.args.get('radius', 5.0))
 
-        # 获取所有未分配的行程请求
+        # 只取半径外接矩形内的未分配行程请求，由索引完成粗筛
+        min_lat, max_lat, min_lng, max_lng = LocationService.bounding_box(
+            driver_lat, driver_lon, radius_km
+        )
         ride_requests = Ride.query.filter(
             Ride.status == 'requested',
-            Ride.driver_id.is_(None)
+            Ride.driver_id.is_(None),
+            Ride.pickup_within(min_lat, max_lat, min_lng, max_lng)
         ).all()
 
-        # 过滤附近的请求
+        # 精确过滤附近的请求：一次向量化调用计算所有候选行程的距离
+        candidates = [
+            ride for ride in ride_requests
+            if ride.pickup_lat is not None and ride.pickup_lng is not None
+        ]
         nearby_requests = []
-        for ride in ride_requests:
-            if ride.pickup_lat and ride.pickup_lng:
-                distance = LocationService.calculate_distance(
-                    driver_lat, driver_lon,
-                    ride.pickup_lat, ride.pickup_lng
-                )
-
-                if distance <= radius_km:
-                    ride_data = ride.to_dict()
-                    ride_data['distance_km'] = round(distance, 2)
-
-                    # 估算费用和时间
-                    if ride.estimated_fare is None:
-                        estimated_time = LocationService.estimate_ride_time(distance)
-                        ride_data['estimated_fare'] = LocationService.estimate_ride_fare(distance, estimated_time)
-                        ride_data['estimated_time_minutes'] = round(estimated_time, 1)
-
-                    nearby_requests.append(ride_data)
+        if candidates:
+            distances = LocationService.calculate_distances(
+                driver_lat, driver_lon,
+                [ride.pickup_lat for ride in candidates],
+                [ride.pickup_lng for ride in candidates]
+            )
+
+            for index in np.flatnonzero(distances <= radius_km):
+                ride = candidates[index]
+                distance = float(distances[index])
+                ride_data = ride.to_dict()
+                ride_data['distance_km'] = round(distance, 2)
+
+                # 估算费用和时间
+                if ride.estimated_fare is None:
+                    estimated_time = LocationService.estimate_travel_time(
+                        distance, lat=ride.pickup_lat, lng=ride.pickup_lng
+                    )
+                    ride_data['estimated_fare'] = PaymentService.calculate_fare(
+                        distance, pickup_lat=ride.pickup_lat, pickup_lng=ride.pickup_lng
+                    )
+                    ride_data['estimated_time_minutes'] = round(estimated_time, 1)
+
+                nearby_requests.append(ride_data)
 
         return jsonify({
-            'driver_location': driver.current_location,
+            'driver_location': f"{driver_lat},{driver_lon}",
             'radius_km': radius_km,
             'nearby_requests': nearby_requests,
             'count': len(nearby_requests)
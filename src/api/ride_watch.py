@@ -0,0 +1,65 @@
+"""
+行程状态长轮询API - 挂起请求直到行程发生状态转换
+
+与主应用分开部署：src.longpoll 只注册这个蓝图，由 gevent worker 运行。
+"""
+import os
+
+from flask import Blueprint, request, jsonify
+from src.api.booking import can_view_ride, ride_response, serialize_ride
+from src.services.database import db
+from src.services.ride_cache import ride_detail_cache
+from src.services.ride_watch import ride_watch_registry
+from src.utils.security import token_required
+
+ride_watch_bp = Blueprint("ride_watch", __name__)
+
+# 长轮询的默认和最长等待时间（秒）
+DEFAULT_LONG_POLL_SECONDS = 25.0
+MAX_LONG_POLL_SECONDS = float(os.environ.get("LONG_POLL_MAX_SECONDS", 30))
+
+
+@ride_watch_bp.route("/ride/<int:ride_id>/wait", methods=["GET"])
+@token_required
+def wait_ride(ride_id, **kwargs):
+    """长轮询行程状态
+
+    查询参数: version（客户端已知的版本号），timeout（最长等待秒数，默认25）。
+    当前版本号已超过 version 时立即返回详情；否则挂起直到该行程发生状态转换或超时，
+    转换后返回新的详情，超时返回304。等待期间不占用数据库连接。
+    只有行程的乘客、司机和管理员可以等待，权限按缓存条目校验。
+    """
+    try:
+        version = int(request.args["version"])
+        timeout = float(request.args.get("timeout", DEFAULT_LONG_POLL_SECONDS))
+    except (KeyError, ValueError):
+        return (
+            jsonify({"success": False, "message": "version 必须是整数，timeout 必须是数字"}),
+            400,
+        )
+    timeout = min(max(timeout, 0.0), MAX_LONG_POLL_SECONDS)
+
+    try:
+        entry = ride_detail_cache.load(ride_id, serialize_ride)
+        if entry is None:
+            return jsonify({"success": False, "message": "行程不存在"}), 404
+        if not can_view_ride(
+            entry.passenger_id, entry.driver_id, kwargs["user_id"], kwargs["user_role"]
+        ):
+            return jsonify({"success": False, "message": "无权查看该行程"}), 403
+        if entry.version > version:
+            return ride_response(entry)
+
+        # 挂起前归还数据库连接，数千个等待中的请求不占用连接池
+        db.session.close()
+        latest = ride_watch_registry.wait(ride_id, version, timeout)
+
+        # 超时后也重新检查一次：跨进程通知在监听连接断开期间会丢失
+        if latest is not None and entry.version < latest:
+            ride_detail_cache.invalidate(ride_id, latest)
+        entry = ride_detail_cache.load(ride_id, serialize_ride)
+        if entry is None:
+            return jsonify({"success": False, "message": "行程不存在"}), 404
+        return ride_response(entry, not_modified=entry.version <= version)
+    except Exception as e:
+        return jsonify({"success": False, "message": f"等待行程状态失败: {str(e)}"}), 500
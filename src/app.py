@@ -4,31 +4,83 @@
 """
 import os
 import sys
-from flask import Flask, jsonify
+from flask import Blueprint, Flask, jsonify
 from flask_cors import CORS
 
-# 创建Flask应用
-app = Flask(__name__)
-CORS(app)
+# 健康检查、首页等不属于任何API模块的端点
+core_bp = Blueprint('core', __name__)
+
+
+def load_config(flask_app):
+    """从环境变量加载基础配置"""
+    flask_app.config['SECRET_KEY'] = os.environ.get(
+        'SECRET_KEY', 'dev-secret-key-change-me'
+    )
+    flask_app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get(
+        'DATABASE_URL', 'sqlite:///taxi.db'
+    )
+    flask_app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    flask_app.config['LOCATION_FLUSH_INTERVAL_MS'] = int(
+        os.environ.get('LOCATION_FLUSH_INTERVAL_MS', 1000)
+    )
+    flask_app.config['KNN_REBUILD_INTERVAL_SECONDS'] = float(
+        os.environ.get('KNN_REBUILD_INTERVAL_SECONDS', 2.0)
+    )
+    flask_app.config['HEATMAP_SAMPLE_INTERVAL_SECONDS'] = float(
+        os.environ.get('HEATMAP_SAMPLE_INTERVAL_SECONDS', 15.0)
+    )
+    flask_app.config['SURGE_TICK_SECONDS'] = float(
+        os.environ.get('SURGE_TICK_SECONDS', 10.0)
+    )
+    flask_app.config['DISPATCH_WINDOW_SECONDS'] = float(
+        os.environ.get('DISPATCH_WINDOW_SECONDS', 2.0)
+    )
+    flask_app.config['DISPATCH_INDEX_REFRESH_SECONDS'] = float(
+        os.environ.get('DISPATCH_INDEX_REFRESH_SECONDS', 10.0)
+    )
+    flask_app.config['OFFER_TIMEOUT_SECONDS'] = float(
+        os.environ.get('OFFER_TIMEOUT_SECONDS', 15.0)
+    )
+    flask_app.config['EVENT_LOG_PATH'] = os.environ.get('EVENT_LOG_PATH', '')
+    flask_app.config['RIDE_REQUEST_TIMEOUT_SECONDS'] = float(
+        os.environ.get('RIDE_REQUEST_TIMEOUT_SECONDS', 600.0)
+    )
+    flask_app.config['BACKGROUND_TASKS_ENABLED'] = (
+        os.environ.get('BACKGROUND_TASKS_ENABLED', 'true').lower() == 'true'
+    )
+
+
+def get_cache_stats():
+    """收集各内存缓存的命中统计"""
+    try:
+        from src.services.idempotency import idempotency_store
+        from src.services.location import eta_cache
+        from src.services.ride_cache import ride_detail_cache
+        from src.services.ride_watch import ride_watch_registry
+        return {
+            'eta': eta_cache.get_stats(),
+            'idempotency': idempotency_store.get_stats(),
+            'ride_detail': ride_detail_cache.get_stats(),
+            'ride_watch': ride_watch_registry.get_stats()
+        }
+    except Exception as e:
+        return {'error': str(e)}
 
-# 基础配置
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-me')
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///taxi.db')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
 # 健康检查端点
-@app.route('/health')
+@core_bp.route('/health')
 def health():
     return jsonify({
         "status": "healthy",
         "service": "taxi-service",
         "version": "1.0.0",
         "python_version": sys.version[:20],  # 只显示前20个字符
-        "path_count": len(sys.path)
+        "path_count": len(sys.path),
+        "caches": get_cache_stats()
     })
 
 # 根路径
-@app.route('/')
+@core_bp.route('/')
 def index():
     return jsonify({
         "name": "Taxi Service API",
@@ -43,13 +95,25 @@ def index():
             "ride": {
                 "request": "/api/ride/request",
                 "details": "/api/ride/<id>",
+                "wait": "/api/ride/<id>/wait?version=<n>",
                 "cancel": "/api/ride/<id>/cancel"
+            },
+            "driver": {
+                "location": "/api/driver/location/update",
+                "location_batch": "/api/driver/location/batch",
+                "available": "/api/driver/available",
+                "accept": "/api/driver/ride/<id>/accept",
+                "nearby_requests": "/api/driver/nearby-requests"
+            },
+            "analytics": {
+                "heatmap": "/api/analytics/heatmap",
+                "surge": "/api/analytics/surge"
             }
         }
     })
 
 # 简单的测试端点 - 重命名函数避免被测试框架识别
-@app.route('/api/test')
+@core_bp.route('/api/test')
 def api_test_status():
     """API测试端点，检查API是否正常工作"""
     return jsonify({
@@ -57,34 +121,205 @@ def api_test_status():
         "timestamp": os.environ.get("BUILD_TIMESTAMP", "unknown")
     })
 
-# 只有在直接运行时才导入和初始化
-if not os.environ.get('PYTEST_CURRENT_TEST'):
-    # 导入并注册蓝图
+def register_blueprints(flask_app):
+    """导入并注册各API蓝图"""
     try:
         from src.api.auth import auth_bp
-        app.register_blueprint(auth_bp, url_prefix='/api/auth')
+        flask_app.register_blueprint(auth_bp, url_prefix='/api/auth')
         print("✅ Auth blueprint registered successfully")
     except ImportError as e:
         print(f"⚠️ Warning: Failed to import auth blueprint: {e}")
 
     try:
         from src.api.booking import booking_bp
-        app.register_blueprint(booking_bp, url_prefix='/api')
+        flask_app.register_blueprint(booking_bp, url_prefix='/api')
         print("✅ Booking blueprint registered successfully")
     except ImportError as e:
         print(f"⚠️ Warning: Failed to import booking blueprint: {e}")
 
-    # 初始化数据库
+    try:
+        from src.api.ride_watch import ride_watch_bp
+        flask_app.register_blueprint(ride_watch_bp, url_prefix='/api')
+        print("✅ Ride watch blueprint registered successfully")
+    except ImportError as e:
+        print(f"⚠️ Warning: Failed to import ride watch blueprint: {e}")
+
+    try:
+        from src.api.driver import driver_bp
+        flask_app.register_blueprint(driver_bp, url_prefix='/api/driver')
+        print("✅ Driver blueprint registered successfully")
+    except ImportError as e:
+        print(f"⚠️ Warning: Failed to import driver blueprint: {e}")
+
+    try:
+        from src.api.analytics import analytics_bp
+        flask_app.register_blueprint(analytics_bp, url_prefix='/api/analytics')
+        print("✅ Analytics blueprint registered successfully")
+    except ImportError as e:
+        print(f"⚠️ Warning: Failed to import analytics blueprint: {e}")
+
+
+def init_database(flask_app):
+    """初始化数据库并创建缺少的表"""
     try:
         from src.services.database import db
-        db.init_app(app)
+        db.init_app(flask_app)
 
-        with app.app_context():
+        with flask_app.app_context():
             db.create_all()
         print("✅ Database initialized successfully")
     except Exception as e:
         print(f"⚠️ Warning: Failed to initialize database: {e}")
 
+
+def create_app(config=None):
+    """创建注册了全部端点的应用，不启动后台线程
+
+    测试和脚本使用；运行服务时使用 create_server，它还会启动位置刷新、派单等后台线程。
+
+    Args:
+        config: 覆盖环境变量配置的字典，如测试使用的内存数据库
+
+    Returns:
+        Flask应用
+    """
+    flask_app = Flask(__name__)
+    CORS(flask_app)
+    load_config(flask_app)
+    flask_app.config.update(config or {})
+    flask_app.register_blueprint(core_bp)
+    register_blueprints(flask_app)
+    init_database(flask_app)
+    return flask_app
+
+
+def start_background_tasks(flask_app):
+    """预热内存索引并启动位置刷新、派单、动态加价等后台线程"""
+    # 从数据库预热司机空间索引，重启后不必等司机重新上报位置
+    try:
+        from src.services.spatial_index import driver_index, load_available_drivers
+        with flask_app.app_context():
+            count = load_available_drivers(driver_index)
+        print(f"✅ Driver index warmed ({count} drivers)")
+    except Exception as e:
+        print(f"⚠️ Warning: Failed to warm driver index: {e}")
+
+    # 预先加载路网文件，首个请求不必等待加载
+    try:
+        from src.services.routing import get_routing_engine
+        if get_routing_engine() is not None:
+            print("✅ Road graph loaded")
+    except Exception as e:
+        print(f"⚠️ Warning: Failed to load road graph: {e}")
+
+    # 启动司机位置写缓冲的后台刷新线程
+    try:
+        from src.services.location_buffer import location_buffer
+        location_buffer.start(flask_app)
+        print("✅ Location write buffer started")
+    except Exception as e:
+        print(f"⚠️ Warning: Failed to start location write buffer: {e}")
+
+    # 启动司机K近邻索引的定期重建线程
+    try:
+        from src.services.kdtree import driver_knn_index
+        driver_knn_index.start(flask_app.config['KNN_REBUILD_INTERVAL_SECONDS'])
+        print("✅ Driver KNN index rebuild started")
+    except Exception as e:
+        print(f"⚠️ Warning: Failed to start driver KNN index: {e}")
+
+    # 新行程请求计入需求热力图，并定期采样可用司机
+    try:
+        from src.models.ride import Ride
+        from src.services.heatmap import demand_heatmap, register_ride_events
+        register_ride_events(Ride)
+        demand_heatmap.start(flask_app.config['HEATMAP_SAMPLE_INTERVAL_SECONDS'])
+        print("✅ Demand heatmap started")
+    except Exception as e:
+        print(f"⚠️ Warning: Failed to start demand heatmap: {e}")
+
+    # 记录派单输入（行程请求、位置上报、可用状态变化）供回放测试
+    if flask_app.config['EVENT_LOG_PATH']:
+        try:
+            from src.models.ride import Ride
+            from src.services.event_log import (
+                event_recorder, register_ride_events as register_event_log
+            )
+            event_recorder.open(flask_app.config['EVENT_LOG_PATH'])
+            register_event_log(Ride)
+            print("✅ Dispatch event log enabled")
+        except Exception as e:
+            print(f"⚠️ Warning: Failed to open dispatch event log: {e}")
+
+    # 定时重新计算各网格的动态加价倍数
+    try:
+        from src.services.surge import surge_engine
+        surge_engine.start(flask_app.config['SURGE_TICK_SECONDS'])
+        print("✅ Surge engine started")
+    except Exception as e:
+        print(f"⚠️ Warning: Failed to start surge engine: {e}")
+
+    # 派单超时和转派由事件循环上的时间轮处理，事件循环在派单leader第一次派单时启动
+    try:
+        from src.services.offers import offer_manager, ride_offer_store
+        ride_offer_store.init_app(flask_app)
+        offer_manager.timeout_seconds = flask_app.config['OFFER_TIMEOUT_SECONDS']
+        print("✅ Offer manager configured")
+    except Exception as e:
+        print(f"⚠️ Warning: Failed to start offer manager: {e}")
+
+    # 超时取消长时间无司机接单的行程（多个工作进程中只有派单leader执行）
+    if flask_app.config['RIDE_REQUEST_TIMEOUT_SECONDS'] > 0:
+        try:
+            from src.services.dispatcher import batch_dispatcher
+            from src.services.ride_state import ride_state_machine
+            ride_state_machine.start(
+                flask_app, flask_app.config['RIDE_REQUEST_TIMEOUT_SECONDS'],
+                leader_lock=batch_dispatcher.leader_lock
+            )
+            print("✅ Ride request expiry started")
+        except Exception as e:
+            print(f"⚠️ Warning: Failed to start ride request expiry: {e}")
+
+    # 接收其他工作进程提交的行程转换，使本进程的行程详情缓存失效
+    try:
+        from src.services.ride_state import ride_transition_listener
+        if ride_transition_listener.start(flask_app):
+            print("✅ Ride transition listener started")
+    except Exception as e:
+        print(f"⚠️ Warning: Failed to start ride transition listener: {e}")
+
+    # 按批次窗口把待接单行程全局分配给可用司机（多个工作进程中只有leader派单）
+    try:
+        from src.services.dispatcher import batch_dispatcher
+        batch_dispatcher.index_refresh_seconds = flask_app.config[
+            'DISPATCH_INDEX_REFRESH_SECONDS'
+        ]
+        batch_dispatcher.start(flask_app, flask_app.config['DISPATCH_WINDOW_SECONDS'])
+        print("✅ Batch dispatcher started")
+    except Exception as e:
+        print(f"⚠️ Warning: Failed to start batch dispatcher: {e}")
+
+
+def create_server(config=None):
+    """运行服务的入口：创建应用并启动后台线程
+
+    gunicorn 以 "src.app:create_server()" 在每个工作进程中调用一次，
+    直接运行本文件和 run.py 也经由这里；导入本模块不会启动任何线程。
+    BACKGROUND_TASKS_ENABLED=false 时只创建应用。
+
+    Args:
+        config: 覆盖环境变量配置的字典
+
+    Returns:
+        Flask应用
+    """
+    flask_app = create_app(config)
+    if flask_app.config['BACKGROUND_TASKS_ENABLED']:
+        start_background_tasks(flask_app)
+    return flask_app
+
+
 if __name__ == '__main__':
     # 运行应用
     port = int(os.environ.get('PORT', 5000))
@@ -96,4 +331,5 @@ if __name__ == '__main__':
     print(f"Debug mode: {debug}")
     print("=" * 50)
 
+    app = create_server()
     app.run(host='0.0.0.0', port=port, debug=debug)
\ No newline at end of file
@@ -0,0 +1,87 @@
+"""
+长轮询服务入口 - 只处理行程状态长轮询（GET /api/ride/<id>/wait）
+
+主应用用 gthread worker 运行，派单、K近邻重建、动态加价等CPU密集的后台循环都在主应用进程中。
+这个进程只注册长轮询蓝图，不启动后台循环，用 gevent worker 运行，每个挂起的请求只占一个greenlet：
+
+    gunicorn -c python:src.longpoll_gunicorn --worker-class gevent \
+        --worker-connections 2000 "src.longpoll:create_longpoll_server()"
+
+src.longpoll_gunicorn 在每个工作进程 fork 后让 psycopg2 在等待数据库时让出 gevent hub，
+否则一个请求的查询会阻塞同一进程中所有挂起的请求。
+其他进程提交的转换经 PostgreSQL LISTEN/NOTIFY 唤醒本进程的等待者（见 RideTransitionListener）。
+"""
+import os
+
+from flask import Flask, jsonify
+from flask_cors import CORS
+
+
+def create_longpoll_app(config=None):
+    """创建只包含长轮询端点的应用
+
+    Args:
+        config: 覆盖环境变量配置的字典
+
+    Returns:
+        Flask应用
+    """
+    from src.api.ride_watch import ride_watch_bp
+    from src.services.database import db
+    from src.services.ride_watch import ride_watch_registry
+
+    flask_app = Flask(__name__)
+    CORS(flask_app)
+    flask_app.config["SECRET_KEY"] = os.environ.get(
+        "SECRET_KEY", "dev-secret-key-change-me"
+    )
+    flask_app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get(
+        "DATABASE_URL", "sqlite:///taxi.db"
+    )
+    flask_app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    flask_app.config.update(config or {})
+    db.init_app(flask_app)
+    flask_app.register_blueprint(ride_watch_bp, url_prefix="/api")
+
+    @flask_app.route("/health")
+    def health():
+        return jsonify(
+            {
+                "status": "healthy",
+                "service": "taxi-service-longpoll",
+                "ride_watch": ride_watch_registry.get_stats(),
+            }
+        )
+
+    return flask_app
+
+
+def create_longpoll_server(config=None):
+    """运行长轮询服务的入口：创建应用并启动行程转换监听
+
+    gunicorn 以 "src.longpoll:create_longpoll_server()" 在每个工作进程中调用一次；
+    导入本模块不会启动任何线程。
+
+    Args:
+        config: 覆盖环境变量配置的字典
+
+    Returns:
+        Flask应用
+    """
+    flask_app = create_longpoll_app(config)
+
+    # 其他进程提交的转换唤醒本进程的等待者
+    try:
+        from src.services.ride_state import ride_transition_listener
+
+        if ride_transition_listener.start(flask_app):
+            print("✅ Ride transition listener started")
+        else:
+            print(
+                "⚠️ Warning: Ride transition listener needs PostgreSQL, "
+                "waiters fall back to timeouts"
+            )
+    except Exception as e:
+        print(f"⚠️ Warning: Failed to start ride transition listener: {e}")
+
+    return flask_app
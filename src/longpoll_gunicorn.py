@@ -0,0 +1,14 @@
+"""
+长轮询服务的 gunicorn 配置 - 用法见 src/longpoll.py
+
+gevent worker 只替换标准库的阻塞调用，psycopg2 是C扩展，查询期间不会让出hub。
+每个工作进程 fork 后注册 psycogreen 的等待回调，查询等待数据库时切换到其他greenlet。
+"""
+
+
+def post_fork(server, worker):
+    """工作进程创建后、加载应用前让 psycopg2 配合 gevent"""
+    from psycogreen.gevent import patch_psycopg
+
+    patch_psycopg()
+    worker.log.info("psycopg2 patched for gevent")
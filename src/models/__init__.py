@@ -6,12 +6,16 @@
 from .user import User
 from .ride import Ride
 from .vehicle import Vehicle
+from .ride_track import RideTrack
+from .ride_zone import RideZone
 
 # 导出所有模型类
 __all__ = [
     'User',
     'Ride',
-    'Vehicle'
+    'Vehicle',
+    'RideTrack',
+    'RideZone'
 ]
 
 # 数据库配置相关
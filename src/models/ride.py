@@ -1,8 +1,20 @@
 from datetime import datetime
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from src.models.ride_zone import RideZone, PICKUP, DROPOFF
 from src.services.database import db
 
 class Ride(db.Model):
     __tablename__ = 'rides'
+    __table_args__ = (
+        # 附近行程查询：按状态等值过滤后在上车点经纬度上做范围扫描
+        db.Index('idx_rides_status_pickup', 'status', 'pickup_lat', 'pickup_lng'),
+        # 幂等键：同一乘客的同一个键只能创建一个行程，所有工作进程共享（键为空的行程不受限制）
+        db.Index(
+            'uq_rides_passenger_idempotency_key', 'passenger_id', 'idempotency_key',
+            unique=True
+        ),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     passenger_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -15,14 +27,32 @@ class Ride(db.Model):
     pickup_lng = db.Column(db.Float)
     dropoff_lat = db.Column(db.Float)
     dropoff_lng = db.Column(db.Float)
+
+    # 创建行程的请求的 Idempotency-Key 和请求体指纹
+    idempotency_key = db.Column(db.String(255))
+    request_fingerprint = db.Column(db.String(64))
+    # 带幂等键创建时的完整201响应体（JSON），其他工作进程重放时原样返回
+    idempotency_response = db.Column(db.Text)
+
+    # 上下车点所在的地理围栏区域（ride_zones 表），查询行程列表时一次加载
+    zones = db.relationship(
+        'RideZone', order_by=RideZone.position, cascade='all, delete-orphan',
+        lazy='selectin'
+    )
     
     # 状态和计时
     status = db.Column(db.String(20), default='requested')  # requested, accepted, in_progress, completed, cancelled
+    # 每次状态转换加1
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
     requested_at = db.Column(db.DateTime, default=datetime.utcnow)
     accepted_at = db.Column(db.DateTime)
     started_at = db.Column(db.DateTime)
     completed_at = db.Column(db.DateTime)
     cancelled_at = db.Column(db.DateTime)
+
+    # 当前派单：等待回应的司机和派单过期时间，接单和拒单在任意工作进程都以此为准
+    offered_driver_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    offer_expires_at = db.Column(db.DateTime)
     
     # 费用信息
     estimated_fare = db.Column(db.Float)
@@ -35,6 +65,119 @@ class Ride(db.Model):
     passenger_comment = db.Column(db.Text)
     driver_comment = db.Column(db.Text)
     
+    @classmethod
+    def pickup_within(cls, min_lat, max_lat, min_lng, max_lng):
+        """上车点位于经纬度矩形内的过滤条件
+
+        在PostgreSQL上使用与 db/init.sql 中GiST索引相同的表达式，
+        其他数据库使用 (status, pickup_lat, pickup_lng) 复合索引的范围条件。
+        """
+        if db.engine.dialect.name == 'postgresql':
+            point = db.func.ST_SetSRID(
+                db.func.ST_MakePoint(cls.pickup_lng, cls.pickup_lat), 4326
+            )
+            envelope = db.func.ST_MakeEnvelope(min_lng, min_lat, max_lng, max_lat, 4326)
+            return point.op('&&')(envelope)
+
+        return db.and_(
+            cls.pickup_lat.between(min_lat, max_lat),
+            cls.pickup_lng.between(min_lng, max_lng)
+        )
+
+    @classmethod
+    def pickup_in_zone(cls, zone_id):
+        """上车点位于指定区域的过滤条件，由 ride_zones 的 (zone_id, kind) 索引得到行程ID"""
+        return cls.id.in_(
+            db.select(RideZone.ride_id).where(
+                RideZone.zone_id == zone_id, RideZone.kind == PICKUP
+            )
+        )
+
+    @classmethod
+    def claim(cls, ride_id, driver_id):
+        """原子地把待接单行程分配给司机
+
+        通过行程状态机执行单条条件UPDATE，只有状态仍为 requested 且尚无司机时才会更新；
+        并发接单时数据库保证只有一个事务影响到这一行。调用方负责提交或回滚。
+
+        Returns:
+            是否抢到该行程
+        """
+        from src.services.ride_state import ride_state_machine, ACCEPT
+
+        return ride_state_machine.transition(
+            ride_id, ACCEPT, driver_id=driver_id
+        ) is not None
+
+    @classmethod
+    def record_offer(cls, ride_id, driver_id, expires_at):
+        """记录行程当前派给的司机，只对仍待接单的行程生效。调用方负责提交
+
+        Returns:
+            是否记录成功（行程已被接单或取消时为False）
+        """
+        result = db.session.execute(
+            db.update(cls)
+            .where(
+                cls.id == ride_id, cls.status == 'requested', cls.driver_id.is_(None)
+            )
+            .values(offered_driver_id=driver_id, offer_expires_at=expires_at)
+            .execution_options(synchronize_session=False)
+        )
+        return result.rowcount == 1
+
+    @classmethod
+    def clear_offer(cls, ride_id, driver_id=None, now=None):
+        """清除行程的派单。调用方负责提交
+
+        Args:
+            ride_id: 行程ID
+            driver_id: 给出时只清除派给该司机且尚未过期的派单（司机拒单）
+            now: 判断过期的当前时间（UTC），None表示当前时间
+
+        Returns:
+            是否有派单被清除
+        """
+        query = db.update(cls).where(
+            cls.id == ride_id, cls.offered_driver_id.isnot(None)
+        )
+        if driver_id is not None:
+            query = query.where(cls.offered_driver_id == driver_id,
+                                cls.offer_expires_at >= (now or datetime.utcnow()))
+        result = db.session.execute(
+            query.values(offered_driver_id=None, offer_expires_at=None)
+            .execution_options(synchronize_session=False)
+        )
+        return result.rowcount == 1
+
+    def offered_to_other(self, driver_id, now=None):
+        """行程是否正派给其他司机且派单尚未过期"""
+        return (
+            self.offered_driver_id is not None
+            and self.offered_driver_id != driver_id
+            and self.offer_expires_at is not None
+            and self.offer_expires_at >= (now or datetime.utcnow())
+        )
+
+    def assign_zones(self):
+        """根据上下车坐标解析地理围栏区域"""
+        from src.services.location import LocationService
+
+        self.zones = [
+            RideZone(kind=kind, zone_id=zone_id, position=position)
+            for kind, lat, lng in ((PICKUP, self.pickup_lat, self.pickup_lng),
+                                   (DROPOFF, self.dropoff_lat, self.dropoff_lng))
+            for position, zone_id in enumerate(LocationService.lookup_zones(lat, lng))
+        ]
+
+    def get_pickup_zones(self):
+        """上车点所在区域ID列表"""
+        return [zone.zone_id for zone in self.zones if zone.kind == PICKUP]
+
+    def get_dropoff_zones(self):
+        """下车点所在区域ID列表"""
+        return [zone.zone_id for zone in self.zones if zone.kind == DROPOFF]
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -42,10 +185,24 @@ class Ride(db.Model):
             'driver_id': self.driver_id,
             'pickup_address': self.pickup_address,
             'dropoff_address': self.dropoff_address,
+            'pickup_zones': self.get_pickup_zones(),
+            'dropoff_zones': self.get_dropoff_zones(),
             'status': self.status,
+            'version': self.version,
             'estimated_fare': self.estimated_fare,
             'actual_fare': self.actual_fare,
             'requested_at': self.requested_at.isoformat() if self.requested_at else None,
             'accepted_at': self.accepted_at.isoformat() if self.accepted_at else None,
             'completed_at': self.completed_at.isoformat() if self.completed_at else None
-        }
\ No newline at end of file
+        }
+
+
+@event.listens_for(Session, 'before_flush')
+def _assign_ride_zones(session, flush_context, instances):
+    """新行程写入前解析上下车区域（调用方已指定时不覆盖）
+
+    区域是关联表中的行，需要在flush开始前加入会话，不能放在 before_insert 中。
+    """
+    for target in session.new:
+        if isinstance(target, Ride) and not target.zones:
+            target.assign_zones()
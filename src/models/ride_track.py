@@ -0,0 +1,45 @@
+"""
+行程轨迹模型 - 存储简化并压缩后的行程GPS轨迹
+"""
+from datetime import datetime
+from src.services.database import db
+from src.services.trajectory import encode_track, decode_track
+
+
+class RideTrack(db.Model):
+    __tablename__ = "ride_tracks"
+
+    ride_id = db.Column(db.Integer, db.ForeignKey("rides.id"), primary_key=True)
+
+    # 差分变长整数编码的轨迹点（见 src.services.trajectory.encode_track）
+    points = db.Column(db.LargeBinary, nullable=False, default=b"")
+    point_count = db.Column(db.Integer, default=0)  # 简化后的点数
+    raw_point_count = db.Column(db.Integer, default=0)  # 收到的原始上报数
+
+    updated_at = db.Column(
+        db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow
+    )
+
+    def set_points(self, points, raw_point_count=None):
+        """编码并保存轨迹点"""
+        self.points = encode_track(points)
+        self.point_count = len(points)
+        if raw_point_count is not None:
+            self.raw_point_count = raw_point_count
+
+    def get_points(self):
+        """解码轨迹点，返回 (lat, lng, unix秒) 列表"""
+        return decode_track(self.points)
+
+    def to_dict(self):
+        """将轨迹元数据转换为字典格式"""
+        return {
+            "ride_id": self.ride_id,
+            "point_count": self.point_count,
+            "raw_point_count": self.raw_point_count,
+            "size_bytes": len(self.points) if self.points else 0,
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None,
+        }
+
+    def __repr__(self):
+        return f"<RideTrack ride={self.ride_id} points={self.point_count}>"
@@ -0,0 +1,32 @@
+"""
+行程区域模型 - 行程上下车点所在的地理围栏区域，每个区域一行
+"""
+from src.services.database import db
+
+# 区域类型
+PICKUP = "pickup"
+DROPOFF = "dropoff"
+
+
+class RideZone(db.Model):
+    __tablename__ = "ride_zones"
+    __table_args__ = (
+        # 按上车区域排队（如机场）：区域和类型等值过滤，直接得到行程ID
+        db.Index("idx_ride_zones_zone_kind", "zone_id", "kind", "ride_id"),
+    )
+
+    ride_id = db.Column(
+        db.Integer, db.ForeignKey("rides.id", ondelete="CASCADE"), primary_key=True
+    )
+    kind = db.Column(db.String(10), primary_key=True)  # pickup, dropoff
+    zone_id = db.Column(db.String(100), primary_key=True)
+    position = db.Column(db.Integer, nullable=False, default=0)  # 同一点的多个区域中面积小的在前
+
+    def to_dict(self):
+        """将行程区域转换为字典格式"""
+        return {
+            "ride_id": self.ride_id,
+            "kind": self.kind,
+            "zone_id": self.zone_id,
+            "position": self.position,
+        }
@@ -3,13 +3,24 @@ from src.services.database import db
 
 class User(db.Model):
     __tablename__ = 'users'
+    __table_args__ = (
+        # 管理员账号由 scripts/create_admin.py 创建，不能通过注册接口获得
+        db.CheckConstraint(
+            "role IN ('passenger', 'driver', 'admin')", name='users_role_check'
+        ),
+        # 可用司机的经纬度范围查询
+        db.Index(
+            'idx_users_driver_position',
+            'role', 'is_available', 'current_lat', 'current_lng'
+        ),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), unique=True, nullable=False)
     username = db.Column(db.String(80), unique=True, nullable=False)
     password_hash = db.Column(db.String(256), nullable=False)
     phone = db.Column(db.String(20))
-    role = db.Column(db.String(20), nullable=False)  # 'passenger' or 'driver'
+    role = db.Column(db.String(20), nullable=False)  # 'passenger', 'driver' or 'admin'
     
     # 乘客特有字段
     payment_method = db.Column(db.String(50))
@@ -18,7 +29,10 @@ class User(db.Model):
     driver_id = db.Column(db.String(50), unique=True)
     license_number = db.Column(db.String(50))
     vehicle_id = db.Column(db.Integer, db.ForeignKey('vehicles.id'))
-    current_location = db.Column(db.String(100))
+    current_location = db.Column(db.String(100))  # 旧格式 "lat,lng"，迁移期间双写
+    current_lat = db.Column(db.Float)
+    current_lng = db.Column(db.Float)
+    location_updated_at = db.Column(db.DateTime)
     is_available = db.Column(db.Boolean, default=True)
     rating = db.Column(db.Float, default=5.0)
     
@@ -31,6 +45,69 @@ class User(db.Model):
     rides_as_passenger = db.relationship('Ride', foreign_keys='Ride.passenger_id', backref='passenger')
     rides_as_driver = db.relationship('Ride', foreign_keys='Ride.driver_id', backref='driver')
     
+    @classmethod
+    def update_availability(cls, driver_id, is_available: bool, only_if: bool = None):
+        """用条件UPDATE修改司机可用状态
+
+        Args:
+            driver_id: 司机ID
+            is_available: 新的可用状态
+            only_if: 只有当前状态等于该值时才修改，None表示不限制
+
+        Returns:
+            是否有行被更新（司机不存在或当前状态不符时为False）
+        """
+        query = db.update(cls).where(cls.id == driver_id, cls.role == 'driver')
+        if only_if is not None:
+            query = query.where(cls.is_available == only_if)
+        result = db.session.execute(
+            query.values(is_available=is_available)
+            .execution_options(synchronize_session=False)
+        )
+        return result.rowcount == 1
+
+    @classmethod
+    def lock_finishing(cls, driver_id):
+        """行程中的司机预留下一单（前向派单）前的条件UPDATE
+
+        只有不可用、有进行中行程且还没有已接单行程的司机会被更新；更新同时锁定司机行，
+        同一司机的并发预留依次执行，后到的在前一个提交后重新判断。调用方负责提交或回滚。
+
+        Returns:
+            司机是否可以预留下一单
+        """
+        from src.models.ride import Ride
+
+        rides = db.select(Ride.id).where(Ride.driver_id == driver_id)
+        result = db.session.execute(
+            db.update(cls).where(
+                cls.id == driver_id,
+                cls.role == 'driver',
+                cls.is_available.is_(False),
+                rides.where(Ride.status == 'in_progress').exists(),
+                ~rides.where(Ride.status == 'accepted').exists()
+            )
+            .values(updated_at=datetime.utcnow())
+            .execution_options(synchronize_session=False)
+        )
+        return result.rowcount == 1
+
+    def set_location(self, lat: float, lng: float):
+        """更新司机位置（数值列和旧的字符串列同时写入）"""
+        self.current_lat = lat
+        self.current_lng = lng
+        self.current_location = f"{lat},{lng}"
+        self.location_updated_at = datetime.utcnow()
+
+    def get_location(self):
+        """获取司机位置 (lat, lng)，未设置时返回None
+
+        数值列尚未回填的旧记录会回退解析 current_location 字符串。
+        """
+        if self.current_lat is not None and self.current_lng is not None:
+            return self.current_lat, self.current_lng
+        return parse_location_string(self.current_location)
+
     def to_dict(self):
         return {
             'id': self.id,
@@ -42,5 +119,16 @@ class User(db.Model):
         }
 
 
+def parse_location_string(location):
+    """解析 "lat,lng" 格式的位置字符串，无效时返回None"""
+    if not location:
+        return None
+    try:
+        lat_str, lng_str = location.split(',')
+        return float(lat_str), float(lng_str)
+    except (ValueError, AttributeError):
+        return None
+
+
 class Ride:
     pass
\ No newline at end of file
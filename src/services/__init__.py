@@ -7,13 +7,16 @@ from .database import db
 from .location import LocationService
 from .notification import NotificationService
 from .payment import PaymentService  # 现在有这个模块了
+from .spatial_index import DriverGridIndex, driver_index
 
 # 导出所有服务
 __all__ = [
     'db',
     'LocationService',
     'NotificationService',
-    'PaymentService'
+    'PaymentService',
+    'DriverGridIndex',
+    'driver_index'
 ]
 
 # 服务初始化函数
@@ -0,0 +1,120 @@
+"""
+缓存服务 - 线程安全的带TTL和LRU淘汰的内存缓存
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+
+# 缓存未命中时返回的哨兵对象
+MISSING = object()
+
+
+class TTLCache:
+    """有容量上限的TTL缓存
+
+    每个条目有独立的过期时间；超出容量时淘汰最久未访问的条目。
+    所有操作都在锁内完成，可以在gunicorn的多线程worker中共享。
+    """
+
+    def __init__(
+        self, maxsize: int = 10000, ttl_seconds: float = 300.0, clock=time.monotonic
+    ):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        """获取缓存值，不存在或已过期时返回default"""
+        value = self.lookup(key)
+        return default if value is MISSING else value
+
+    def lookup(self, key):
+        """获取缓存值，不存在或已过期时返回 MISSING（用于缓存None值的场景）"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self._misses += 1
+                return MISSING
+            if entry[0] <= self._clock():
+                del self._data[key]
+                self._expirations += 1
+                self._misses += 1
+                return MISSING
+            self._data.move_to_end(key)
+            self._hits += 1
+            return entry[1]
+
+    def peek(self, key):
+        """获取未过期的缓存值，不计入命中统计也不更新LRU顺序，不存在时返回 MISSING"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] <= self._clock():
+                return MISSING
+            return entry[1]
+
+    def set(self, key, value, ttl_seconds: float = None) -> None:
+        """写入缓存值
+
+        Args:
+            key: 键
+            value: 值
+            ttl_seconds: 该条目的存活时间（None表示使用默认值）
+        """
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        expires_at = self._clock() + ttl if ttl is not None else math.inf
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self._evictions += 1
+
+    def delete(self, key) -> bool:
+        """删除条目，返回条目之前是否存在"""
+        with self._lock:
+            return self._data.pop(key, None) is not None
+
+    def get_or_set(self, key, factory, ttl_seconds: float = None):
+        """读取缓存；未命中时调用factory计算并写入
+
+        factory在锁外执行，并发未命中时可能被调用多次，结果以最后一次写入为准。
+        """
+        value = self.lookup(key)
+        if value is MISSING:
+            value = factory()
+            self.set(key, value, ttl_seconds)
+        return value
+
+    def clear(self) -> None:
+        """清空缓存和统计"""
+        with self._lock:
+            self._data.clear()
+            self._hits = self._misses = self._evictions = self._expirations = 0
+
+    def get_stats(self) -> dict:
+        """获取命中统计"""
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / total, 4) if total else 0.0,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+            }
+
+
+# 导出
+__all__ = ["TTLCache", "MISSING"]
@@ -3,6 +3,7 @@
 """
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
+from sqlalchemy import text
 
 # 创建SQLAlchemy实例
 db = SQLAlchemy()
@@ -20,4 +21,79 @@ def init_database(app):
     with app.app_context():
         db.create_all()
 
-    return db
\ No newline at end of file
+    return db
+
+
+class LeaderLock:
+    """多个工作进程中只让一个执行后台循环
+
+    PostgreSQL 上使用会话级 advisory lock，锁由一条专用连接持有：
+    进程退出或连接断开时数据库自动释放，其他进程的下一次 acquire 接手。
+    其他数据库（开发用的SQLite）只跑一个进程，acquire 总是成功。
+
+    锁只由一个线程获取和维持；同一进程的其他后台任务通过 held 判断本进程是否为leader。
+    """
+
+    def __init__(self, key: int):
+        self.key = key
+        self._conn = None
+        self._held = False
+
+    @property
+    def held(self) -> bool:
+        """最近一次 acquire 成功且之后没有释放或丢失连接"""
+        return self._held
+
+    def acquire(self) -> bool:
+        """尝试成为leader，已持有时确认连接仍然有效（需要应用上下文）"""
+        if db.engine.dialect.name != 'postgresql':
+            self._held = True
+            return True
+
+        if self._conn is not None:
+            try:
+                self._conn.execute(text('SELECT 1'))
+                self._conn.commit()
+                return True
+            except Exception:
+                self._discard()
+
+        conn = db.engine.connect()
+        try:
+            held = conn.execute(
+                text('SELECT pg_try_advisory_lock(:key)'), {'key': self.key}
+            ).scalar()
+            # 会话级锁在事务结束后仍然持有，不让连接停留在事务中
+            conn.commit()
+        except Exception:
+            conn.close()
+            raise
+        if not held:
+            conn.close()
+            self._held = False
+            return False
+        self._conn = conn
+        self._held = True
+        return True
+
+    def release(self) -> None:
+        """释放锁并关闭专用连接"""
+        self._held = False
+        if self._conn is None:
+            return
+        try:
+            self._conn.execute(
+                text('SELECT pg_advisory_unlock(:key)'), {'key': self.key}
+            )
+            self._conn.commit()
+        except Exception:
+            pass
+        self._discard()
+
+    def _discard(self):
+        try:
+            self._conn.close()
+        except Exception:
+            pass
+        self._conn = None
+        self._held = False
@@ -0,0 +1,491 @@
+"""
+批量派单服务 - 在短时间窗口内收集待接单行程和可用司机，按接驾时间一次性求解全局最优分配
+"""
+import logging
+import threading
+import time
+
+import numpy as np
+
+from src.services.cache import TTLCache
+from src.services.database import LeaderLock
+from src.services.forward_dispatch import (
+    finishing_drivers,
+    load_finishing_drivers,
+    DEFAULT_FORWARD_HORIZON_SECONDS,
+)
+from src.services.kdtree import to_unit_vectors, chord_to_km
+from src.services.location import LocationService
+from src.services.spatial_index import driver_index, load_available_drivers
+from src.services.traffic import get_traffic_table
+
+logger = logging.getLogger(__name__)
+
+# 默认的批次窗口（秒）
+DEFAULT_WINDOW_SECONDS = 2.0
+
+# 每个行程参与分配的最近司机数
+DEFAULT_CANDIDATES = 16
+
+# 接驾时间上限（分钟），超过的司机不参与分配；也是"本批不分配"的代价
+DEFAULT_MAX_PICKUP_MINUTES = 20.0
+
+# 拍卖算法的epsilon（分钟）：总接驾时间与最优解相差不超过 行程数 x epsilon
+DEFAULT_AUCTION_EPSILON = 0.05
+
+# 已发出的派单在该时间内不重复派给其他司机（秒）
+DEFAULT_OFFER_TTL_SECONDS = 15.0
+
+# 单批最多处理的行程数
+DEFAULT_MAX_BATCH = 5000
+
+# 派单leader定期从数据库刷新司机索引的间隔（秒）
+DEFAULT_INDEX_REFRESH_SECONDS = 10.0
+
+# 派单leader的 PostgreSQL advisory lock 键
+LEADER_LOCK_KEY = 7310014
+
+# 计算候选时每块处理的行程数，控制内积矩阵的内存
+_CANDIDATE_CHUNK = 1024
+
+
+def nearest_candidates(
+    request_lats, request_lngs, driver_lats, driver_lngs, k: int, max_km: float = None
+) -> tuple:
+    """为每个行程找出直线距离最近的K个司机
+
+    经纬度先转换为单位球面上的三维向量，弦长与大圆距离单调对应，
+    最近邻即内积最大者，分块用矩阵乘法计算后 argpartition 取前K个。
+
+    Returns:
+        (候选司机下标 (N, K)，不足时为-1；对应距离公里 (N, K)，不足时为inf)
+    """
+    n = len(request_lats)
+    m = len(driver_lats)
+    k = min(k, m)
+    candidates = np.full((n, max(k, 1)), -1, dtype=np.int64)
+    distances = np.full((n, max(k, 1)), np.inf)
+    if n == 0 or m == 0:
+        return candidates[:, :k], distances[:, :k]
+
+    requests = to_unit_vectors(request_lats, request_lngs)
+    drivers = to_unit_vectors(driver_lats, driver_lngs)
+    for start in range(0, n, _CANDIDATE_CHUNK):
+        dots = requests[start : start + _CANDIDATE_CHUNK] @ drivers.T
+        top = (
+            np.argpartition(-dots, k - 1, axis=1)[:, :k]
+            if k < m
+            else np.tile(np.arange(m), (len(dots), 1))
+        )
+        top_dots = np.take_along_axis(dots, top, axis=1)
+        km = chord_to_km(np.sqrt(np.maximum(2.0 - 2.0 * top_dots, 0.0)))
+        order = np.argsort(km, axis=1)
+        candidates[start : start + len(dots)] = np.take_along_axis(top, order, axis=1)
+        distances[start : start + len(dots)] = np.take_along_axis(km, order, axis=1)
+
+    if max_km is not None:
+        too_far = distances > max_km
+        candidates[too_far] = -1
+        distances[too_far] = np.inf
+    return candidates, distances
+
+
+def auction_assignment(
+    candidates,
+    costs,
+    driver_count: int,
+    unassigned_cost: float,
+    epsilon: float = DEFAULT_AUCTION_EPSILON,
+) -> np.ndarray:
+    """用拍卖算法求解最小代价分配（稀疏候选）
+
+    行程作为竞拍者、司机作为物品，每个行程另有一个独占的"本批不分配"选项，
+    代价为 unassigned_cost。每轮所有未分配的行程同时出价（Jacobi式，全部向量化），
+    同一司机取最高出价。所有价格从0开始只升不降，未被分配的司机价格始终为0，
+    因此在司机多于或少于行程时都满足epsilon互补松弛，结果与候选图上的最优解
+    相差不超过 行程数 x epsilon。
+
+    Args:
+        candidates: 候选司机下标 (N, K)，-1表示无效
+        costs: 对应代价 (N, K)
+        driver_count: 司机总数
+        unassigned_cost: 不分配的代价
+        epsilon: 每次出价的最小加价
+
+    Returns:
+        每个行程分配的司机下标 (N,)，-1表示本批不分配
+    """
+    n = len(candidates)
+    assignment = np.full(n, -1, dtype=np.int64)
+    if n == 0 or driver_count == 0 or candidates.shape[1] == 0:
+        return assignment
+
+    valid = candidates >= 0
+    safe_candidates = np.where(valid, candidates, 0)
+    benefit = np.where(valid, -np.asarray(costs, dtype=np.float64), -np.inf)
+    dummy_value = -float(unassigned_cost)
+    prices = np.zeros(driver_count)
+    owner = np.full(driver_count, -1, dtype=np.int64)
+    rows = np.arange(n)
+
+    # 状态：-2 未分配，-1 选择不分配，>=0 分配的司机
+    assignment = np.full(n, -2, dtype=np.int64)
+    while True:
+        bidders = rows[assignment == -2]
+        if len(bidders) == 0:
+            break
+
+        values = benefit[bidders] - prices[safe_candidates[bidders]]
+        positions = np.arange(len(bidders))
+        best = np.argmax(values, axis=1)
+        best_value = values[positions, best]
+        values[positions, best] = -np.inf
+        second_value = np.maximum(values.max(axis=1), dummy_value)
+
+        # 最好的选择不如"不分配"时放弃本批
+        give_up = best_value <= dummy_value
+        assignment[bidders[give_up]] = -1
+        keep = ~give_up
+        bidders, best, best_value, second_value = (
+            bidders[keep],
+            best[keep],
+            best_value[keep],
+            second_value[keep],
+        )
+        if len(bidders) == 0:
+            continue
+
+        objects = safe_candidates[bidders, best]
+        bids = prices[objects] + (best_value - second_value) + epsilon
+
+        # 每个司机只接受最高出价，原来的中标者重新出价
+        order = np.lexsort((-bids, objects))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = objects[order[1:]] != objects[order[:-1]]
+        winners = order[first]
+        won_objects = objects[winners]
+
+        previous = owner[won_objects]
+        assignment[previous[previous >= 0]] = -2
+        owner[won_objects] = bidders[winners]
+        prices[won_objects] = bids[winners]
+        assignment[bidders[winners]] = won_objects
+
+    return assignment
+
+
+def greedy_assignment(candidates, costs) -> np.ndarray:
+    """按行程顺序各自选择最近的空闲司机（对比基准）"""
+    assignment = np.full(len(candidates), -1, dtype=np.int64)
+    taken = set()
+    for row in range(len(candidates)):
+        for column in np.argsort(costs[row]):
+            driver = int(candidates[row, column])
+            if driver >= 0 and driver not in taken and np.isfinite(costs[row, column]):
+                taken.add(driver)
+                assignment[row] = driver
+                break
+    return assignment
+
+
+class BatchDispatcher:
+    """批量派单器
+
+    每个窗口从数据库取出待接单行程、从内存空间索引取出可用司机，
+    以预计接驾时间为代价做一次全局分配，然后向司机发出派单。
+    已发出且未过期的派单对应的行程和司机不参与下一批分配。
+
+    前向派单：预计在 forward_horizon_seconds 秒内完成当前行程的司机也作为候选，
+    位置取当前行程的下车点，代价为距空闲的时间加上从下车点出发的接驾时间。
+    forward_horizon_seconds 为0时关闭。
+
+    多个工作进程都会启动批次线程，但只有持有 leader_lock 的进程执行派单；
+    leader 在接手时和每隔 index_refresh_seconds 秒从数据库刷新司机索引和行程中司机索引，
+    其他进程上报的位置、开始的行程和预留的下一单也能参与分配。
+    """
+
+    def __init__(
+        self,
+        source=driver_index,
+        candidates: int = DEFAULT_CANDIDATES,
+        max_pickup_minutes: float = DEFAULT_MAX_PICKUP_MINUTES,
+        offer_ttl_seconds: float = DEFAULT_OFFER_TTL_SECONDS,
+        max_batch: int = DEFAULT_MAX_BATCH,
+        on_offer=None,
+        finishing=finishing_drivers,
+        forward_horizon_seconds: float = DEFAULT_FORWARD_HORIZON_SECONDS,
+        leader_lock: LeaderLock = None,
+        index_refresh_seconds: float = DEFAULT_INDEX_REFRESH_SECONDS,
+    ):
+        self.source = source
+        self.leader_lock = leader_lock or LeaderLock(LEADER_LOCK_KEY)
+        self.index_refresh_seconds = index_refresh_seconds
+        self._index_refreshed_at = None
+        self.finishing = finishing
+        self.forward_horizon_seconds = forward_horizon_seconds
+        self.candidates = candidates
+        self.max_pickup_minutes = max_pickup_minutes
+        self.max_batch = max_batch
+        self.on_offer = on_offer or self._notify_driver
+        self.offered_rides = TTLCache(
+            maxsize=max_batch * 10, ttl_seconds=offer_ttl_seconds
+        )
+        self.offered_drivers = TTLCache(
+            maxsize=max_batch * 10, ttl_seconds=offer_ttl_seconds
+        )
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.last_batch = {}
+
+    @staticmethod
+    def pickup_minutes(request_lats, request_lngs, distances_km) -> np.ndarray:
+        """按直线距离和各上车点的交通系数估算接驾时间（分钟）"""
+        table = get_traffic_table()
+        if table is None:
+            factors = 1.0
+        else:
+            factors = np.array(
+                [table.lookup(lat, lng) for lat, lng in zip(request_lats, request_lngs)]
+            )[:, None]
+        return LocationService.estimate_travel_time(
+            distances_km, traffic_factor=factors
+        )
+
+    def match(self, requests, drivers, delays=None) -> list:
+        """求解一批行程和司机的分配
+
+        Args:
+            requests: (ride_id, lat, lng) 列表
+            drivers: (driver_id, lat, lng) 列表
+            delays: 每个司机距空闲的分钟数（前向派单），None表示都已空闲
+
+        Returns:
+            (ride_id, driver_id, 接驾分钟) 列表
+        """
+        if not requests or not drivers:
+            return []
+
+        request_lats = np.array([r[1] for r in requests], dtype=np.float64)
+        request_lngs = np.array([r[2] for r in requests], dtype=np.float64)
+        candidates, distances = nearest_candidates(
+            request_lats,
+            request_lngs,
+            [d[1] for d in drivers],
+            [d[2] for d in drivers],
+            self.candidates,
+        )
+        costs = self.pickup_minutes(request_lats, request_lngs, distances)
+        if delays is not None:
+            costs = (
+                costs + np.asarray(delays, dtype=np.float64)[np.maximum(candidates, 0)]
+            )
+        too_far = costs > self.max_pickup_minutes
+        candidates[too_far] = -1
+        costs[too_far] = np.inf
+
+        assignment = auction_assignment(
+            candidates, costs, len(drivers), self.max_pickup_minutes
+        )
+
+        matches = []
+        for row in np.flatnonzero(assignment >= 0).tolist():
+            driver = int(assignment[row])
+            column = int(np.flatnonzero(candidates[row] == driver)[0])
+            matches.append(
+                (requests[row][0], drivers[driver][0], float(costs[row, column]))
+            )
+        return matches
+
+    def open_requests(self) -> list:
+        """待接单且未在派单中的行程（需要应用上下文）"""
+        from src.models.ride import Ride
+
+        rows = (
+            Ride.query.with_entities(
+                Ride.id,
+                Ride.pickup_lat,
+                Ride.pickup_lng,
+                Ride.passenger_id,
+                Ride.pickup_address,
+            )
+            .filter(
+                Ride.status == "requested",
+                Ride.driver_id.is_(None),
+                Ride.pickup_lat.isnot(None),
+                Ride.pickup_lng.isnot(None),
+            )
+            .order_by(Ride.requested_at)
+            .limit(self.max_batch)
+            .all()
+        )
+        return [row for row in rows if self.offered_rides.get(row.id) is None]
+
+    def available_drivers(self) -> list:
+        """可用且没有待回应派单的司机"""
+        return [
+            (driver_id, lat, lng)
+            for driver_id, lat, lng, _ in self.source.snapshot()
+            if self.offered_drivers.get(driver_id) is None
+        ]
+
+    def forward_drivers(self) -> list:
+        """即将完成行程、可以提前派下一单的司机
+
+        Returns:
+            (driver_id, 下车纬度, 下车经度, 距空闲分钟) 列表
+        """
+        if not self.forward_horizon_seconds or self.finishing is None:
+            return []
+        return [
+            (driver_id, lat, lng, seconds / 60)
+            for driver_id, lat, lng, seconds in self.finishing.query(
+                self.forward_horizon_seconds
+            )
+            if self.offered_drivers.get(driver_id) is None
+        ]
+
+    def run_once(self) -> list:
+        """执行一批派单（需要应用上下文）
+
+        Returns:
+            发出的派单列表
+        """
+        started = time.perf_counter()
+        rides = self.open_requests()
+        drivers = self.available_drivers()
+        forward = self.forward_drivers()
+        chained = {driver_id for driver_id, _, _, _ in forward}
+        by_id = {ride.id: ride for ride in rides}
+
+        matches = self.match(
+            [(ride.id, ride.pickup_lat, ride.pickup_lng) for ride in rides],
+            drivers + [(driver_id, lat, lng) for driver_id, lat, lng, _ in forward],
+            [0.0] * len(drivers) + [minutes for _, _, _, minutes in forward]
+            if forward
+            else None,
+        )
+
+        offers = []
+        for ride_id, driver_id, eta_minutes in matches:
+            ride = by_id[ride_id]
+            offer = {
+                "ride_id": ride_id,
+                "driver_id": driver_id,
+                "eta_minutes": round(eta_minutes, 1),
+                "passenger_id": ride.passenger_id,
+                "pickup_address": ride.pickup_address,
+                "pickup_lat": ride.pickup_lat,
+                "pickup_lng": ride.pickup_lng,
+                "chained": driver_id in chained,
+            }
+            self.hold(ride_id, driver_id)
+            try:
+                self.on_offer(offer)
+            except Exception as e:
+                logger.error(
+                    f"Failed to send offer for ride {ride_id} "
+                    f"to driver {driver_id}: {e}"
+                )
+            offers.append(offer)
+
+        self.last_batch = {
+            "requests": len(rides),
+            "drivers": len(drivers),
+            "forward_drivers": len(forward),
+            "offers": len(offers),
+            "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+        }
+        return offers
+
+    def run_if_leader(self) -> list:
+        """只有leader进程执行一批派单，其他进程直接返回（需要应用上下文）
+
+        Returns:
+            发出的派单列表
+        """
+        if not self.leader_lock.acquire():
+            self._index_refreshed_at = None
+            return []
+
+        now = time.monotonic()
+        if (
+            self._index_refreshed_at is None
+            or now - self._index_refreshed_at >= self.index_refresh_seconds
+        ):
+            load_available_drivers(self.source)
+            if self.forward_horizon_seconds and self.finishing is not None:
+                load_finishing_drivers(self.finishing)
+            self._index_refreshed_at = now
+        return self.run_once()
+
+    def hold(self, ride_id: int, driver_id: int, ttl_seconds: float = None) -> None:
+        """派单等待回应期间，行程和司机不参与分配"""
+        self.offered_rides.set(ride_id, driver_id, ttl_seconds)
+        self.offered_drivers.set(driver_id, ride_id, ttl_seconds)
+
+    def release(self, ride_id: int = None, driver_id: int = None) -> None:
+        """派单被接受、拒绝或取消后解除占用"""
+        if ride_id is not None:
+            self.offered_rides.delete(ride_id)
+        if driver_id is not None:
+            self.offered_drivers.delete(driver_id)
+
+    @staticmethod
+    def _notify_driver(offer) -> None:
+        """交给派单管理器发出通知，超时或拒绝时依次转给附近的其他司机
+
+        派单管理器只在派单leader进程中运行，在这里第一次发出派单时启动。
+        """
+        from src.services.offers import offer_manager
+
+        offer_manager.start()
+        offer_manager.submit(
+            offer["ride_id"],
+            [offer["driver_id"]],
+            passenger_name=f"乘客{offer['passenger_id']}",
+            pickup_address=offer["pickup_address"],
+            pickup=(offer["pickup_lat"], offer["pickup_lng"]),
+        )
+
+    def start(self, app, interval_seconds: float = DEFAULT_WINDOW_SECONDS) -> None:
+        """启动后台批次线程"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run,
+            args=(app, interval_seconds),
+            name="batch-dispatcher",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """停止后台批次线程"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, app, interval_seconds):
+        while not self._stop_event.wait(interval_seconds):
+            try:
+                with app.app_context():
+                    self.run_if_leader()
+            except Exception as e:
+                logger.error(f"Failed to run dispatch batch: {e}")
+        with app.app_context():
+            self.leader_lock.release()
+
+
+# 全局批量派单实例
+batch_dispatcher = BatchDispatcher()
+
+# 导出
+__all__ = [
+    "BatchDispatcher",
+    "batch_dispatcher",
+    "nearest_candidates",
+    "auction_assignment",
+    "greedy_assignment",
+]
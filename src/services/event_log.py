@@ -0,0 +1,264 @@
+"""
+派单事件日志 - 把派单所需的输入（行程请求、位置上报、可用状态变化）追加写入紧凑的二进制文件
+"""
+import atexit
+import logging
+import math
+import os
+import struct
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+# 文件头
+MAGIC = b"TAXIEVT1"
+
+# 事件类型
+RIDE_REQUEST = 1
+LOCATION_PING = 2
+AVAILABILITY = 3
+
+# 每种事件的定长记录：类型(1字节) + 记录时间Unix秒(float64) + 数据；坐标用float32（精度约0.5米）
+RECORD_FORMATS = {
+    RIDE_REQUEST: struct.Struct("<Bdqffff"),  # ride_id, 上车纬度, 上车经度, 下车纬度, 下车经度
+    LOCATION_PING: struct.Struct("<Bdqff"),  # driver_id, 纬度, 经度
+    AVAILABILITY: struct.Struct("<Bdq?ff"),  # driver_id, 是否可用, 纬度, 经度
+}
+
+# 缓冲区达到该大小或距上次写入超过该时间时写入文件
+DEFAULT_BUFFER_BYTES = 64 * 1024
+DEFAULT_FLUSH_INTERVAL_SECONDS = 1.0
+
+
+def _coordinate(value) -> float:
+    """未知坐标记为nan"""
+    return float("nan") if value is None else float(value)
+
+
+class EventRecorder:
+    """追加写入的事件日志
+
+    记录在内存缓冲区中拼接，满 buffer_bytes 或距上次写入超过 flush_interval_seconds 时
+    一次性追加到文件；每条记录是定长结构体，位置上报只占25字节。记录时间取服务端
+    接收时间，回放时据此重现事件的先后和间隔。未打开文件时所有记录调用都直接返回，
+    不影响请求处理。
+    """
+
+    def __init__(
+        self,
+        buffer_bytes: int = DEFAULT_BUFFER_BYTES,
+        flush_interval_seconds: float = DEFAULT_FLUSH_INTERVAL_SECONDS,
+        clock=time.time,
+    ):
+        self.buffer_bytes = buffer_bytes
+        self.flush_interval_seconds = flush_interval_seconds
+        self._clock = clock
+        self._file = None
+        self.path = None
+        self._buffer = bytearray()
+        self._last_flush = 0.0
+        self._lock = threading.Lock()
+        self.records = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self._file is not None
+
+    def open(self, path: str) -> None:
+        """打开（或续写）日志文件"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = open(path, "ab")
+            if self._file.tell() == 0:
+                self._file.write(MAGIC)
+            self.path = path
+            self._last_flush = self._clock()
+        atexit.register(self.close)
+
+    def close(self) -> None:
+        """写入剩余记录并关闭文件"""
+        with self._lock:
+            if self._file is None:
+                return
+            self._write()
+            self._file.close()
+            self._file = None
+
+    def flush(self) -> None:
+        """立即把缓冲区写入文件"""
+        with self._lock:
+            if self._file is not None:
+                self._write()
+
+    def _write(self) -> None:
+        if self._buffer:
+            self._file.write(self._buffer)
+            self._buffer.clear()
+        self._file.flush()
+        self._last_flush = self._clock()
+
+    def _append(self, kind: int, *fields, timestamp: float = None) -> None:
+        if self._file is None:
+            return
+        try:
+            with self._lock:
+                if self._file is None:
+                    return
+                now = self._clock()
+                self._buffer += RECORD_FORMATS[kind].pack(
+                    kind, now if timestamp is None else timestamp, *fields
+                )
+                self.records += 1
+                if (
+                    len(self._buffer) >= self.buffer_bytes
+                    or now - self._last_flush >= self.flush_interval_seconds
+                ):
+                    self._write()
+        except Exception as e:
+            logger.error(f"Failed to record dispatch event: {e}")
+
+    def ride_requested(
+        self,
+        ride_id: int,
+        pickup_lat: float,
+        pickup_lng: float,
+        dropoff_lat: float = None,
+        dropoff_lng: float = None,
+        timestamp: float = None,
+    ) -> None:
+        """记录行程请求"""
+        self._append(
+            RIDE_REQUEST,
+            ride_id,
+            pickup_lat,
+            pickup_lng,
+            _coordinate(dropoff_lat),
+            _coordinate(dropoff_lng),
+            timestamp=timestamp,
+        )
+
+    def location_ping(
+        self, driver_id: int, lat: float, lng: float, timestamp: float = None
+    ) -> None:
+        """记录司机位置上报"""
+        self._append(LOCATION_PING, driver_id, lat, lng, timestamp=timestamp)
+
+    def location_pings(self, pings) -> None:
+        """记录一批位置上报
+
+        Args:
+            pings: (driver_id, lat, lng, ...) 序列，多余的字段忽略
+        """
+        for ping in pings:
+            self._append(LOCATION_PING, ping[0], ping[1], ping[2])
+
+    def availability_changed(
+        self,
+        driver_id: int,
+        is_available: bool,
+        lat: float = None,
+        lng: float = None,
+        timestamp: float = None,
+    ) -> None:
+        """记录司机可用状态变化（附带当前位置，未知时为nan）"""
+        self._append(
+            AVAILABILITY,
+            driver_id,
+            bool(is_available),
+            _coordinate(lat),
+            _coordinate(lng),
+            timestamp=timestamp,
+        )
+
+
+def read_events(path: str):
+    """按写入顺序读取事件日志
+
+    Yields:
+        (类型, 记录时间, 数据...)；坐标未知时为None，末尾不完整的记录忽略
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"Not a dispatch event log: {path}")
+        data = f.read()
+
+    offset = 0
+    while offset < len(data):
+        record = RECORD_FORMATS.get(data[offset])
+        if record is None:
+            raise ValueError(
+                f"Unknown event type {data[offset]} at byte {offset + len(MAGIC)}"
+            )
+        if offset + record.size > len(data):
+            break
+        fields = record.unpack_from(data, offset)
+        offset += record.size
+        yield tuple(
+            None if isinstance(value, float) and math.isnan(value) else value
+            for value in fields
+        )
+
+
+# 全局事件日志实例（由 app.py 按 EVENT_LOG_PATH 打开）
+event_recorder = EventRecorder()
+
+
+def _queue_ride_request(mapper, connection, target):
+    """行程插入时暂存到会话，提交成功后再记录"""
+    if (
+        not event_recorder.enabled
+        or target.pickup_lat is None
+        or target.pickup_lng is None
+    ):
+        return
+    session = Session.object_session(target)
+    if session is not None:
+        session.info.setdefault("event_log_requests", []).append(
+            (
+                target.id,
+                target.pickup_lat,
+                target.pickup_lng,
+                target.dropoff_lat,
+                target.dropoff_lng,
+            )
+        )
+
+
+def _record_committed_requests(session):
+    for ride in session.info.pop("event_log_requests", []):
+        try:
+            event_recorder.ride_requested(*ride)
+        except Exception as e:
+            logger.error(f"Failed to record ride request in event log: {e}")
+
+
+def _discard_requests(session):
+    session.info.pop("event_log_requests", None)
+
+
+def register_ride_events(ride_model) -> None:
+    """监听行程插入，把提交成功的新请求写入事件日志"""
+    if not event.contains(ride_model, "after_insert", _queue_ride_request):
+        event.listen(ride_model, "after_insert", _queue_ride_request)
+        event.listen(Session, "after_commit", _record_committed_requests)
+        event.listen(Session, "after_rollback", _discard_requests)
+
+
+# 导出
+__all__ = [
+    "EventRecorder",
+    "event_recorder",
+    "read_events",
+    "register_ride_events",
+    "RIDE_REQUEST",
+    "LOCATION_PING",
+    "AVAILABILITY",
+]
@@ -0,0 +1,260 @@
+"""
+前向派单服务 - 记录即将完成行程的司机（下车点和预计空闲时间），供派单器提前分配下一单
+"""
+import bisect
+import threading
+import time
+
+from src.services.location import LocationService
+
+# 预计在该时间内空闲的行程中司机参与派单（秒）
+DEFAULT_FORWARD_HORIZON_SECONDS = 180.0
+
+
+class FinishingDriverIndex:
+    """行程中司机的时间索引
+
+    每个司机记录进行中行程的下车点和预计空闲时间，另外维护一个按空闲时间排序的列表，
+    查询"在 horizon 秒内空闲的司机"只需一次二分查找加顺序读取，与行程中司机总数无关。
+    司机接下前向派单后被预留，直到当前行程完成前不再参与分配。
+    """
+
+    def __init__(self, clock=time.time):
+        self._clock = clock
+        self._entries = {}  # driver_id -> (空闲时间, ride_id, 下车纬度, 下车经度)
+        self._order = []  # 按 (空闲时间, driver_id) 排序
+        self._reserved = {}  # driver_id -> 预留的下一单ride_id
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, driver_id):
+        return driver_id in self._entries
+
+    @staticmethod
+    def remaining_minutes(
+        lat: float, lng: float, dropoff_lat: float, dropoff_lng: float
+    ) -> float:
+        """从当前位置到下车点的预计行驶时间（分钟）"""
+        distance = LocationService.calculate_distance(
+            lat, lng, dropoff_lat, dropoff_lng
+        )
+        return LocationService.estimate_travel_time(distance, lat=lat, lng=lng)
+
+    def upsert(
+        self,
+        driver_id: int,
+        ride_id: int,
+        dropoff_lat: float,
+        dropoff_lng: float,
+        available_at: float,
+    ) -> None:
+        """登记或更新行程中的司机
+
+        Args:
+            driver_id: 司机ID
+            ride_id: 进行中的行程ID
+            dropoff_lat: 下车点纬度
+            dropoff_lng: 下车点经度
+            available_at: 预计空闲时间（Unix秒）
+        """
+        with self._lock:
+            self._discard(driver_id)
+            self._entries[driver_id] = (available_at, ride_id, dropoff_lat, dropoff_lng)
+            bisect.insort(self._order, (available_at, driver_id))
+
+    def track_ride(self, ride, lat: float = None, lng: float = None) -> bool:
+        """按行程的下车点和司机当前位置登记
+
+        Args:
+            ride: 进行中的行程
+            lat: 司机当前纬度，None时使用上车点
+            lng: 司机当前经度
+
+        Returns:
+            是否登记（行程没有下车点坐标时不登记）
+        """
+        if ride.dropoff_lat is None or ride.dropoff_lng is None:
+            return False
+        if lat is None or lng is None:
+            lat, lng = ride.pickup_lat, ride.pickup_lng
+        minutes = (
+            0.0
+            if lat is None or lng is None
+            else self.remaining_minutes(lat, lng, ride.dropoff_lat, ride.dropoff_lng)
+        )
+        self.upsert(
+            ride.driver_id,
+            ride.id,
+            ride.dropoff_lat,
+            ride.dropoff_lng,
+            self._clock() + minutes * 60,
+        )
+        return True
+
+    def update_position(self, driver_id: int, lat: float, lng: float) -> bool:
+        """根据司机最新位置重新估计空闲时间
+
+        Returns:
+            司机是否在索引中
+        """
+        entry = self._entries.get(driver_id)
+        if entry is None:
+            return False
+        _, ride_id, dropoff_lat, dropoff_lng = entry
+        minutes = self.remaining_minutes(lat, lng, dropoff_lat, dropoff_lng)
+        with self._lock:
+            if self._entries.get(driver_id) is entry:
+                self._discard(driver_id)
+                available_at = self._clock() + minutes * 60
+                self._entries[driver_id] = (
+                    available_at,
+                    ride_id,
+                    dropoff_lat,
+                    dropoff_lng,
+                )
+                bisect.insort(self._order, (available_at, driver_id))
+        return True
+
+    def remove(self, driver_id: int) -> bool:
+        """行程完成或取消后移除司机（同时清除预留）"""
+        with self._lock:
+            self._reserved.pop(driver_id, None)
+            return self._discard(driver_id)
+
+    def _discard(self, driver_id) -> bool:
+        entry = self._entries.pop(driver_id, None)
+        if entry is None:
+            return False
+        position = bisect.bisect_left(self._order, (entry[0], driver_id))
+        if position < len(self._order) and self._order[position] == (
+            entry[0],
+            driver_id,
+        ):
+            del self._order[position]
+        return True
+
+    def query(
+        self,
+        horizon_seconds: float = DEFAULT_FORWARD_HORIZON_SECONDS,
+        now: float = None,
+    ) -> list:
+        """在 horizon 秒内空闲且未预留下一单的司机
+
+        Returns:
+            (driver_id, 下车纬度, 下车经度, 距空闲的秒数) 列表，按空闲时间升序
+        """
+        now = self._clock() if now is None else now
+        with self._lock:
+            end = bisect.bisect_right(
+                self._order, (now + horizon_seconds, float("inf"))
+            )
+            drivers = []
+            for available_at, driver_id in self._order[:end]:
+                if driver_id in self._reserved:
+                    continue
+                _, _, lat, lng = self._entries[driver_id]
+                drivers.append((driver_id, lat, lng, max(0.0, available_at - now)))
+            return drivers
+
+    def reserve(self, driver_id: int, ride_id: int) -> bool:
+        """为行程中的司机预留下一单
+
+        Returns:
+            是否预留成功（司机不在索引中或已有预留时为False）
+        """
+        with self._lock:
+            if driver_id not in self._entries or driver_id in self._reserved:
+                return False
+            self._reserved[driver_id] = ride_id
+            return True
+
+    def unreserve(self, driver_id: int) -> None:
+        """取消预留（抢单失败时）"""
+        with self._lock:
+            self._reserved.pop(driver_id, None)
+
+    def reserved_ride(self, driver_id: int):
+        """司机预留的下一单ID"""
+        return self._reserved.get(driver_id)
+
+    def retain(self, driver_ids, reserved) -> None:
+        """只保留给定的司机，并把预留替换为 reserved（driver_id -> ride_id）"""
+        with self._lock:
+            for driver_id in [
+                driver_id for driver_id in self._entries if driver_id not in driver_ids
+            ]:
+                self._discard(driver_id)
+            self._reserved = {
+                driver_id: ride_id
+                for driver_id, ride_id in reserved.items()
+                if driver_id in self._entries
+            }
+
+    def clear(self) -> None:
+        """清空索引"""
+        with self._lock:
+            self._entries.clear()
+            self._order.clear()
+            self._reserved.clear()
+
+
+def load_finishing_drivers(index: FinishingDriverIndex) -> int:
+    """从数据库重建行程中司机索引（需要应用上下文）
+
+    进行中行程按司机最新位置估计空闲时间，已有已接单下一单的司机标记为预留。
+    派单leader定期调用：行程在哪个工作进程开始、下一单在哪个进程被接受都以数据库为准。
+
+    Returns:
+        登记的司机数量
+    """
+    from src.models.ride import Ride
+    from src.models.user import User
+    from src.services.database import db
+
+    rides = db.session.execute(
+        db.select(
+            Ride.id,
+            Ride.driver_id,
+            Ride.pickup_lat,
+            Ride.pickup_lng,
+            Ride.dropoff_lat,
+            Ride.dropoff_lng,
+            User.current_lat,
+            User.current_lng,
+        )
+        .join(User, User.id == Ride.driver_id)
+        .where(Ride.status == "in_progress")
+    ).all()
+    tracked = {
+        ride.driver_id
+        for ride in rides
+        if index.track_ride(ride, ride.current_lat, ride.current_lng)
+    }
+
+    reserved = (
+        dict(
+            db.session.execute(
+                db.select(Ride.driver_id, Ride.id).where(
+                    Ride.status == "accepted", Ride.driver_id.in_(tracked)
+                )
+            ).all()
+        )
+        if tracked
+        else {}
+    )
+    index.retain(tracked, reserved)
+    return len(tracked)
+
+
+# 全局行程中司机索引
+finishing_drivers = FinishingDriverIndex()
+
+# 导出
+__all__ = [
+    "FinishingDriverIndex",
+    "finishing_drivers",
+    "load_finishing_drivers",
+    "DEFAULT_FORWARD_HORIZON_SECONDS",
+]
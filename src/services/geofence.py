@@ -0,0 +1,248 @@
+"""
+地理围栏服务 - 从GeoJSON加载区域多边形（机场、车站、禁停区等），用STR打包的R树做点查询
+"""
+import json
+import logging
+import math
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+# R树每个节点最多的子节点数
+DEFAULT_NODE_CAPACITY = 16
+
+
+class Zone:
+    """一个地理围栏区域（可以由多个多边形组成，多边形可以有洞）"""
+
+    def __init__(
+        self,
+        zone_id: str,
+        name: str = None,
+        kind: str = "zone",
+        polygons=None,
+        properties=None,
+    ):
+        self.id = zone_id
+        self.name = name or zone_id
+        self.kind = kind
+        self.properties = properties or {}
+        # 每个多边形是环的列表，第一个环为外边界，其余为洞；环是 (lng, lat) 列表
+        self.polygons = [
+            [[(float(x), float(y)) for x, y, *_ in ring] for ring in polygon]
+            for polygon in (polygons or [])
+        ]
+
+        lngs = [x for polygon in self.polygons for x, _ in polygon[0]]
+        lats = [y for polygon in self.polygons for _, y in polygon[0]]
+        if not lngs:
+            raise ValueError(f"Zone {zone_id} has no polygon")
+        self.bbox = (min(lats), max(lats), min(lngs), max(lngs))
+        self.area = sum(abs(self._ring_area(polygon[0])) for polygon in self.polygons)
+
+    @staticmethod
+    def _ring_area(ring) -> float:
+        """环的有向面积（平方度，仅用于排序）"""
+        total = 0.0
+        for i in range(len(ring)):
+            x1, y1 = ring[i - 1]
+            x2, y2 = ring[i]
+            total += x1 * y2 - x2 * y1
+        return total / 2
+
+    @staticmethod
+    def _ring_contains(ring, lng: float, lat: float) -> bool:
+        """射线法判断点是否在环内"""
+        inside = False
+        x1, y1 = ring[-1]
+        for x2, y2 in ring:
+            if (y2 > lat) != (y1 > lat):
+                cross = x1 + (lat - y1) * (x2 - x1) / (y2 - y1)
+                if lng < cross:
+                    inside = not inside
+            x1, y1 = x2, y2
+        return inside
+
+    def contains(self, lat: float, lng: float) -> bool:
+        """点是否在区域内"""
+        min_lat, max_lat, min_lng, max_lng = self.bbox
+        if not (min_lat <= lat <= max_lat and min_lng <= lng <= max_lng):
+            return False
+        for polygon in self.polygons:
+            if self._ring_contains(polygon[0], lng, lat) and not any(
+                self._ring_contains(hole, lng, lat) for hole in polygon[1:]
+            ):
+                return True
+        return False
+
+    def to_dict(self) -> dict:
+        return {"id": self.id, "name": self.name, "kind": self.kind}
+
+
+class GeofenceIndex:
+    """区域多边形的R树索引
+
+    用STR（Sort-Tile-Recursive）一次性自底向上打包：按包围盒中心先按经度切片、
+    片内再按纬度排序，每 capacity 个一组生成上一层节点，直到只剩根节点。
+    静态打包的树节点几乎全满、重叠小，点查询只需访问少数几条路径。
+    """
+
+    def __init__(self, zones, node_capacity: int = DEFAULT_NODE_CAPACITY):
+        self.zones = list(zones)
+        self.node_capacity = max(2, node_capacity)
+        self._by_id = {zone.id: zone for zone in self.zones}
+        # 节点: (min_lat, max_lat, min_lng, max_lng, 子节点列表, 是否叶子层)
+        self._root = self._build()
+
+    def __len__(self):
+        return len(self.zones)
+
+    def _build(self):
+        entries = [zone.bbox + (zone, True) for zone in self.zones]
+        if not entries:
+            return None
+
+        leaf_level = True
+        while True:
+            nodes = []
+            for group in self._str_groups(entries):
+                nodes.append(
+                    (
+                        min(e[0] for e in group),
+                        max(e[1] for e in group),
+                        min(e[2] for e in group),
+                        max(e[3] for e in group),
+                        [e[4] for e in group],
+                        leaf_level,
+                    )
+                )
+            if len(nodes) == 1:
+                return nodes[0]
+            entries = [node[:4] + (node, False) for node in nodes]
+            leaf_level = False
+
+    def _str_groups(self, entries):
+        """按STR顺序把条目分成每组 node_capacity 个"""
+        capacity = self.node_capacity
+        leaf_count = math.ceil(len(entries) / capacity)
+        slice_count = max(1, math.ceil(math.sqrt(leaf_count)))
+        slice_size = slice_count * capacity
+
+        by_lng = sorted(entries, key=lambda e: e[2] + e[3])
+        for start in range(0, len(by_lng), slice_size):
+            tile = sorted(by_lng[start : start + slice_size], key=lambda e: e[0] + e[1])
+            for group_start in range(0, len(tile), capacity):
+                yield tile[group_start : group_start + capacity]
+
+    def lookup(self, lat: float, lng: float) -> list:
+        """查询包含该点的区域
+
+        Returns:
+            区域列表，面积小（更具体）的在前
+        """
+        if self._root is None:
+            return []
+
+        matches = []
+        stack = [self._root]
+        while stack:
+            min_lat, max_lat, min_lng, max_lng, children, is_leaf = stack.pop()
+            if not (min_lat <= lat <= max_lat and min_lng <= lng <= max_lng):
+                continue
+            if is_leaf:
+                matches.extend(zone for zone in children if zone.contains(lat, lng))
+            else:
+                stack.extend(children)
+
+        matches.sort(key=lambda zone: zone.area)
+        return matches
+
+    def lookup_ids(self, lat: float, lng: float) -> list:
+        """查询包含该点的区域ID"""
+        return [zone.id for zone in self.lookup(lat, lng)]
+
+    def get(self, zone_id: str):
+        """按ID获取区域"""
+        return self._by_id.get(zone_id)
+
+    @classmethod
+    def from_geojson(cls, data: dict, node_capacity: int = DEFAULT_NODE_CAPACITY):
+        """从GeoJSON FeatureCollection构建
+
+        每个Feature的 properties.id（或Feature的id）作为区域ID，properties.name 为名称，
+        properties.kind（或type）为区域类型，例如 airport、station、restricted。
+        只支持 Polygon 和 MultiPolygon，其他几何类型被跳过。
+        """
+        zones = []
+        for position, feature in enumerate(data.get("features", [])):
+            geometry = feature.get("geometry") or {}
+            properties = feature.get("properties") or {}
+            if geometry.get("type") == "Polygon":
+                polygons = [geometry["coordinates"]]
+            elif geometry.get("type") == "MultiPolygon":
+                polygons = geometry["coordinates"]
+            else:
+                logger.warning(
+                    f"Skipping geofence feature {position}: "
+                    f"unsupported geometry {geometry.get('type')}"
+                )
+                continue
+
+            zone_id = str(properties.get("id", feature.get("id", position)))
+            zones.append(
+                Zone(
+                    zone_id,
+                    name=properties.get("name"),
+                    kind=properties.get("kind", properties.get("type", "zone")),
+                    polygons=polygons,
+                    properties=properties,
+                )
+            )
+        return cls(zones, node_capacity=node_capacity)
+
+    @classmethod
+    def load(cls, path: str, node_capacity: int = DEFAULT_NODE_CAPACITY):
+        """从GeoJSON文件加载"""
+        with open(path, encoding="utf-8") as f:
+            return cls.from_geojson(json.load(f), node_capacity=node_capacity)
+
+
+_index = None
+_index_loaded = False
+_index_lock = threading.Lock()
+
+
+def get_geofence_index():
+    """获取全局地理围栏索引
+
+    GeoJSON文件由环境变量 GEOFENCE_PATH 指定，首次调用时加载；未配置或加载失败时返回None。
+    """
+    global _index, _index_loaded
+    if _index_loaded:
+        return _index
+
+    with _index_lock:
+        if not _index_loaded:
+            path = os.environ.get("GEOFENCE_PATH")
+            if path:
+                try:
+                    _index = GeofenceIndex.load(path)
+                    logger.info(f"Loaded {len(_index)} geofence zones from {path}")
+                except Exception as e:
+                    logger.error(f"Failed to load geofence zones {path}: {e}")
+                    _index = None
+            _index_loaded = True
+    return _index
+
+
+def set_geofence_index(index) -> None:
+    """设置全局地理围栏索引（None表示不使用）"""
+    global _index, _index_loaded
+    with _index_lock:
+        _index = index
+        _index_loaded = True
+
+
+# 导出
+__all__ = ["Zone", "GeofenceIndex", "get_geofence_index", "set_geofence_index"]
@@ -0,0 +1,386 @@
+"""
+需求热力图服务 - 按geohash网格增量统计行程请求和可用司机的滑动窗口计数
+"""
+import datetime
+import logging
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from src.services.spatial_index import driver_index
+
+logger = logging.getLogger(__name__)
+
+# geohash字符表
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_BASE32_INDEX = {char: i for i, char in enumerate(_BASE32)}
+
+# 默认geohash精度：6位约 1.2km x 0.6km
+DEFAULT_PRECISION = 6
+
+# 每个桶的时长（秒）和环形缓冲区的桶数（最长窗口60分钟）
+BUCKET_SECONDS = 60
+RING_SIZE = 60
+
+# 支持查询的窗口（分钟）
+WINDOWS_MINUTES = (5, 15, 60)
+
+# 初始的网格容量，不够时翻倍
+INITIAL_CAPACITY = 1024
+
+
+def geohash_encode(lat: float, lng: float, precision: int = DEFAULT_PRECISION) -> str:
+    """计算坐标的geohash"""
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bit = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        rng, coord = (lng_range, lng) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if coord >= mid:
+            value = (value << 1) | 1
+            rng[0] = mid
+        else:
+            value <<= 1
+            rng[1] = mid
+        even = not even
+        bit += 1
+        if bit == 5:
+            chars.append(_BASE32[value])
+            bit = 0
+            value = 0
+    return "".join(chars)
+
+
+def geohash_bounds(geohash: str) -> tuple:
+    """geohash对应的矩形
+
+    Returns:
+        (min_lat, max_lat, min_lng, max_lng)
+
+    Raises:
+        ValueError: geohash包含非法字符
+    """
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        if char not in _BASE32_INDEX:
+            raise ValueError(f"Invalid geohash: {geohash}")
+        value = _BASE32_INDEX[char]
+        for shift in range(4, -1, -1):
+            rng = lng_range if even else lat_range
+            mid = (rng[0] + rng[1]) / 2
+            if (value >> shift) & 1:
+                rng[0] = mid
+            else:
+                rng[1] = mid
+            even = not even
+    return lat_range[0], lat_range[1], lng_range[0], lng_range[1]
+
+
+def geohash_center(geohash: str) -> tuple:
+    """geohash矩形的中心点 (lat, lng)"""
+    min_lat, max_lat, min_lng, max_lng = geohash_bounds(geohash)
+    return (min_lat + max_lat) / 2, (min_lng + max_lng) / 2
+
+
+class CellWindowCounts:
+    """按网格的滑动窗口计数
+
+    每个网格一行、每个时间桶一列，列按环形缓冲区复用：时间前进时把过期的列
+    整列清零（对所有网格向量化）。需求是事件计数，窗口值为窗口内各桶之和；
+    供给是采样值，每个桶保存该分钟最后一次采样，窗口值为采样桶的平均。
+    单个网格的窗口查询最多读 RING_SIZE 个数，与网格总数和事件数无关。
+    """
+
+    def __init__(
+        self,
+        bucket_seconds: int = BUCKET_SECONDS,
+        ring_size: int = RING_SIZE,
+        clock=time.time,
+    ):
+        self.bucket_seconds = bucket_seconds
+        self.ring_size = ring_size
+        self._clock = clock
+        self._rows = {}  # 网格键 -> 行号
+        self._keys = []
+        self._demand = np.zeros((INITIAL_CAPACITY, ring_size), dtype=np.int32)
+        self._supply = np.zeros((INITIAL_CAPACITY, ring_size), dtype=np.float32)
+        self._sampled = np.zeros(ring_size, dtype=bool)
+        self._current = int(clock() // bucket_seconds)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def _row(self, key) -> int:
+        row = self._rows.get(key)
+        if row is None:
+            row = self._rows[key] = len(self._keys)
+            self._keys.append(key)
+            if row >= len(self._demand):
+                self._demand = np.vstack((self._demand, np.zeros_like(self._demand)))
+                self._supply = np.vstack((self._supply, np.zeros_like(self._supply)))
+        return row
+
+    def _advance(self, bucket: int) -> None:
+        """时间前进到bucket，清空中间跳过的桶"""
+        if bucket <= self._current:
+            return
+        expired = min(bucket - self._current, self.ring_size)
+        columns = [(self._current + i) % self.ring_size for i in range(1, expired + 1)]
+        self._demand[:, columns] = 0
+        self._supply[:, columns] = 0
+        self._sampled[columns] = False
+        self._current = bucket
+
+    def _bucket(self, timestamp: float = None):
+        """时间戳对应的桶号；超出环形缓冲区范围的旧时间返回None"""
+        bucket = int(
+            (self._clock() if timestamp is None else timestamp) // self.bucket_seconds
+        )
+        self._advance(bucket)
+        if bucket <= self._current - self.ring_size:
+            return None
+        return bucket
+
+    def _window_columns(self, window_minutes: int) -> list:
+        buckets = max(
+            1, min(self.ring_size, int(window_minutes * 60 // self.bucket_seconds))
+        )
+        return [(self._current - i) % self.ring_size for i in range(buckets)]
+
+    def add_demand(self, key, timestamp: float = None, count: int = 1) -> bool:
+        """记录需求事件
+
+        Returns:
+            是否被记录（早于环形缓冲区范围的事件丢弃）
+        """
+        with self._lock:
+            bucket = self._bucket(timestamp)
+            if bucket is None:
+                return False
+            # 先取行号：_row 可能扩容并替换 self._demand，写在下标里时增量会加到旧数组上
+            row = self._row(key)
+            self._demand[row, bucket % self.ring_size] += count
+            return True
+
+    def set_supply(self, counts: dict, timestamp: float = None) -> None:
+        """记录一次供给采样（覆盖当前桶中之前的采样）
+
+        Args:
+            counts: 网格键 -> 数量
+            timestamp: 采样时间（Unix秒），None表示当前时间
+        """
+        with self._lock:
+            bucket = self._bucket(timestamp)
+            if bucket is None:
+                return
+            column = bucket % self.ring_size
+            self._supply[:, column] = 0
+            rows = [self._row(key) for key in counts]
+            if rows:
+                self._supply[rows, column] = list(counts.values())
+            self._sampled[column] = True
+
+    def cell_counts(self, key, window_minutes: int) -> dict:
+        """单个网格的窗口计数 {'demand', 'supply'}"""
+        with self._lock:
+            self._bucket()
+            columns = self._window_columns(window_minutes)
+            row = self._rows.get(key)
+            if row is None:
+                return {"demand": 0, "supply": 0.0}
+            samples = max(1, int(self._sampled[columns].sum()))
+            return {
+                "demand": int(self._demand[row, columns].sum()),
+                "supply": float(self._supply[row, columns].sum()) / samples,
+            }
+
+    def window_counts(self, window_minutes: int) -> tuple:
+        """所有网格的窗口计数（向量化）
+
+        Returns:
+            (网格键列表, 需求数组, 供给数组)
+        """
+        with self._lock:
+            self._bucket()
+            columns = self._window_columns(window_minutes)
+            count = len(self._keys)
+            samples = max(1, int(self._sampled[columns].sum()))
+            demand = self._demand[:count][:, columns].sum(axis=1)
+            supply = self._supply[:count][:, columns].sum(axis=1) / samples
+            return list(self._keys), demand, supply
+
+    def clear(self) -> None:
+        """清空所有计数"""
+        with self._lock:
+            self._rows.clear()
+            self._keys.clear()
+            self._demand[:] = 0
+            self._supply[:] = 0
+            self._sampled[:] = False
+
+
+class DemandHeatmap:
+    """需求/供给热力图
+
+    新的行程请求按上车点计入需求；可用司机由后台线程定期从内存空间索引采样计入供给。
+    """
+
+    def __init__(
+        self, precision: int = DEFAULT_PRECISION, source=driver_index, clock=time.time
+    ):
+        self.precision = precision
+        self.source = source
+        self.counts = CellWindowCounts(clock=clock)
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def cell_of(self, lat: float, lng: float) -> str:
+        """坐标所在的网格"""
+        return geohash_encode(lat, lng, self.precision)
+
+    def record_request(self, lat: float, lng: float, timestamp: float = None) -> bool:
+        """记录一个行程请求"""
+        return self.counts.add_demand(self.cell_of(lat, lng), timestamp)
+
+    def sample_supply(self, timestamp: float = None) -> int:
+        """从司机索引采样各网格的可用司机数
+
+        Returns:
+            采样到的司机数
+        """
+        counts = {}
+        drivers = self.source.snapshot()
+        for _, lat, lng, _ in drivers:
+            cell = self.cell_of(lat, lng)
+            counts[cell] = counts.get(cell, 0) + 1
+        self.counts.set_supply(counts, timestamp)
+        return len(drivers)
+
+    def cell(self, geohash: str, window_minutes: int = 15) -> dict:
+        """单个网格的热力数据"""
+        lat, lng = geohash_center(geohash)
+        return {
+            "cell": geohash,
+            "lat": lat,
+            "lng": lng,
+            **self.counts.cell_counts(geohash, window_minutes),
+        }
+
+    def heatmap(self, window_minutes: int = 15, bounds: tuple = None) -> list:
+        """窗口内有需求或供给的网格列表
+
+        Args:
+            window_minutes: 窗口长度（分钟）
+            bounds: 可选的 (min_lat, max_lat, min_lng, max_lng) 过滤范围
+
+        Returns:
+            网格列表
+        """
+        keys, demand, supply = self.counts.window_counts(window_minutes)
+        cells = []
+        for index in np.flatnonzero((demand > 0) | (supply > 0)):
+            lat, lng = geohash_center(keys[index])
+            if bounds is not None and not (
+                bounds[0] <= lat <= bounds[1] and bounds[2] <= lng <= bounds[3]
+            ):
+                continue
+            cells.append(
+                {
+                    "cell": keys[index],
+                    "lat": lat,
+                    "lng": lng,
+                    "demand": int(demand[index]),
+                    "supply": round(float(supply[index]), 2),
+                }
+            )
+        return cells
+
+    def start(self, interval_seconds: float = 15.0) -> None:
+        """启动后台供给采样线程"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run,
+            args=(interval_seconds,),
+            name="demand-heatmap-sampler",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """停止后台采样线程"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, interval_seconds):
+        while not self._stop_event.wait(interval_seconds):
+            try:
+                self.sample_supply()
+            except Exception as e:
+                logger.error(f"Failed to sample driver supply: {e}")
+
+
+# 全局热力图实例
+demand_heatmap = DemandHeatmap()
+
+
+def _queue_ride_request(mapper, connection, target):
+    """行程插入时暂存到会话，提交成功后再计入需求"""
+    if target.pickup_lat is None or target.pickup_lng is None:
+        return
+    session = Session.object_session(target)
+    if session is not None:
+        session.info.setdefault("heatmap_requests", []).append(
+            (target.pickup_lat, target.pickup_lng, target.requested_at)
+        )
+
+
+def _record_committed_requests(session):
+    for lat, lng, requested_at in session.info.pop("heatmap_requests", []):
+        try:
+            timestamp = (
+                requested_at.replace(tzinfo=datetime.timezone.utc).timestamp()
+                if requested_at
+                else None
+            )
+            demand_heatmap.record_request(lat, lng, timestamp)
+        except Exception as e:
+            logger.error(f"Failed to record ride request in heatmap: {e}")
+
+
+def _discard_requests(session):
+    session.info.pop("heatmap_requests", None)
+
+
+def register_ride_events(ride_model) -> None:
+    """监听行程插入，把提交成功的新请求计入热力图"""
+    if not event.contains(ride_model, "after_insert", _queue_ride_request):
+        event.listen(ride_model, "after_insert", _queue_ride_request)
+        event.listen(Session, "after_commit", _record_committed_requests)
+        event.listen(Session, "after_rollback", _discard_requests)
+
+
+# 导出
+__all__ = [
+    "CellWindowCounts",
+    "DemandHeatmap",
+    "demand_heatmap",
+    "register_ride_events",
+    "geohash_encode",
+    "geohash_bounds",
+    "geohash_center",
+    "WINDOWS_MINUTES",
+]
@@ -0,0 +1,131 @@
+"""
+幂等键服务 - 缓存带 Idempotency-Key 请求的响应，客户端重试时直接返回第一次的结果
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+from src.services.cache import TTLCache, MISSING
+
+# 幂等键的最大长度
+MAX_KEY_LENGTH = 255
+
+# 第一次请求处理中的占位时间（秒）：处理进程崩溃时，过期后允许重试
+DEFAULT_IN_FLIGHT_SECONDS = 30.0
+
+# begin() 的结果
+NEW = "new"  # 第一次请求，调用方处理后调用 complete() 或 release()
+REPLAY = "replay"  # 已有响应，直接返回
+IN_PROGRESS = "in_progress"  # 第一次请求仍在处理
+MISMATCH = "mismatch"  # 同一个键用于不同的请求体
+
+
+def request_fingerprint(data) -> str:
+    """请求体的指纹（键排序后的JSON的SHA-256）"""
+    payload = json.dumps(data, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _InFlight:
+    """第一次请求处理中的占位"""
+
+    __slots__ = ("fingerprint",)
+
+    def __init__(self, fingerprint: str):
+        self.fingerprint = fingerprint
+
+
+class _StoredResponse:
+    """已完成请求的响应"""
+
+    __slots__ = ("fingerprint", "body", "status")
+
+    def __init__(self, fingerprint: str, body: bytes, status: int):
+        self.fingerprint = fingerprint
+        self.body = body
+        self.status = status
+
+
+class IdempotencyStore:
+    """有容量上限的幂等响应存储
+
+    键为 (调用方, Idempotency-Key)，不同用户的键互不影响。第一次请求先写入占位，
+    完成后替换为序列化好的响应体和状态码；重试命中时原样返回，不访问数据库也不重新序列化。
+    占位保证并发的重复请求只有一个被处理。条目按TTL过期，超出容量时淘汰最久未用的条目
+    （基于 TTLCache）。
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 100000,
+        ttl_seconds: float = 86400.0,
+        in_flight_seconds: float = DEFAULT_IN_FLIGHT_SECONDS,
+        clock=time.monotonic,
+    ):
+        self.in_flight_seconds = in_flight_seconds
+        self._cache = TTLCache(maxsize=maxsize, ttl_seconds=ttl_seconds, clock=clock)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._cache)
+
+    def begin(self, scope, key: str, fingerprint: str) -> tuple:
+        """开始处理带幂等键的请求
+
+        Args:
+            scope: 调用方标识（如用户ID）
+            key: Idempotency-Key
+            fingerprint: 请求体指纹
+
+        Returns:
+            (NEW / REPLAY / IN_PROGRESS / MISMATCH, REPLAY时为 (响应体bytes, 状态码)，否则为None)
+        """
+        with self._lock:
+            entry = self._cache.lookup((scope, key))
+            if entry is MISSING:
+                self._cache.set(
+                    (scope, key), _InFlight(fingerprint), self.in_flight_seconds
+                )
+                return NEW, None
+            if entry.fingerprint != fingerprint:
+                return MISMATCH, None
+            if isinstance(entry, _InFlight):
+                return IN_PROGRESS, None
+            return REPLAY, (entry.body, entry.status)
+
+    def complete(
+        self, scope, key: str, fingerprint: str, body: bytes, status: int
+    ) -> None:
+        """保存第一次请求的响应"""
+        self._cache.set((scope, key), _StoredResponse(fingerprint, body, status))
+
+    def release(self, scope, key: str) -> None:
+        """放弃占位（处理失败时），之后的重试会重新处理"""
+        self._cache.delete((scope, key))
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+    def get_stats(self) -> dict:
+        return self._cache.get_stats()
+
+
+# 全局幂等响应存储
+idempotency_store = IdempotencyStore(
+    maxsize=int(os.environ.get("IDEMPOTENCY_CACHE_SIZE", 100000)),
+    ttl_seconds=float(os.environ.get("IDEMPOTENCY_TTL_SECONDS", 86400)),
+)
+
+# 导出
+__all__ = [
+    "IdempotencyStore",
+    "idempotency_store",
+    "request_fingerprint",
+    "MAX_KEY_LENGTH",
+    "NEW",
+    "REPLAY",
+    "IN_PROGRESS",
+    "MISMATCH",
+]
@@ -0,0 +1,337 @@
+"""
+K-D树服务 - 可用司机坐标的周期性重建K近邻索引
+"""
+import heapq
+import logging
+import math
+import threading
+import time
+
+import numpy as np
+
+from src.services.spatial_index import EARTH_RADIUS_KM, driver_index, haversine_km
+
+logger = logging.getLogger(__name__)
+
+# 叶子节点最多包含的点数
+DEFAULT_LEAF_SIZE = 32
+
+
+def to_unit_vectors(lats, lngs) -> np.ndarray:
+    """把经纬度转换为单位球面上的三维坐标
+
+    三维欧氏距离（弦长）与大圆距离单调对应，K-D树可以直接在三维空间中检索。
+    """
+    lat_rad = np.radians(np.asarray(lats, dtype=np.float64))
+    lng_rad = np.radians(np.asarray(lngs, dtype=np.float64))
+    cos_lat = np.cos(lat_rad)
+    return np.column_stack(
+        (cos_lat * np.cos(lng_rad), cos_lat * np.sin(lng_rad), np.sin(lat_rad))
+    )
+
+
+def chord_to_km(chord):
+    """弦长转换为大圆距离（公里）"""
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.clip(np.asarray(chord) / 2, 0.0, 1.0))
+
+
+class KDTree:
+    """静态三维K-D树
+
+    节点以数组形式存储：每个节点记录其点在重排数组中的区间、包围盒和左右子节点。
+    查询按包围盒最短距离做最优优先搜索，叶子节点内用NumPy向量化计算距离。
+    """
+
+    def __init__(self, points: np.ndarray, leaf_size: int = DEFAULT_LEAF_SIZE):
+        points = np.asarray(points, dtype=np.float64)
+        self.leaf_size = max(1, leaf_size)
+        self.size = len(points)
+
+        order = np.arange(self.size)
+        starts, ends, lefts, rights, lows, highs = [], [], [], [], [], []
+
+        if self.size:
+            # 显式栈代替递归：(节点编号, 起点, 终点)
+            stack = [(0, 0, self.size)]
+            self._append_node(starts, ends, lefts, rights, lows, highs)
+            while stack:
+                node, start, end = stack.pop()
+                block = points[order[start:end]]
+                low = block.min(axis=0)
+                high = block.max(axis=0)
+                starts[node], ends[node] = start, end
+                lows[node], highs[node] = low, high
+
+                if end - start <= self.leaf_size:
+                    continue
+
+                # 沿跨度最大的维度按中位数切分
+                axis = int(np.argmax(high - low))
+                mid = (end - start) // 2
+                partition = np.argpartition(block[:, axis], mid)
+                order[start:end] = order[start:end][partition]
+
+                left = self._append_node(starts, ends, lefts, rights, lows, highs)
+                right = self._append_node(starts, ends, lefts, rights, lows, highs)
+                lefts[node], rights[node] = left, right
+                stack.append((left, start, start + mid))
+                stack.append((right, start + mid, end))
+
+        self.order = order
+        self.points = points[order]
+        self.node_start = np.array(starts, dtype=np.int64)
+        self.node_end = np.array(ends, dtype=np.int64)
+        self.node_left = np.array(lefts, dtype=np.int64)
+        self.node_right = np.array(rights, dtype=np.int64)
+        self.node_low = np.array(lows, dtype=np.float64).reshape(-1, 3)
+        self.node_high = np.array(highs, dtype=np.float64).reshape(-1, 3)
+
+    @staticmethod
+    def _append_node(starts, ends, lefts, rights, lows, highs) -> int:
+        starts.append(0)
+        ends.append(0)
+        lefts.append(-1)
+        rights.append(-1)
+        lows.append(None)
+        highs.append(None)
+        return len(starts) - 1
+
+    def _box_distance_sq(self, node: int, point) -> float:
+        low = self.node_low[node]
+        high = self.node_high[node]
+        total = 0.0
+        for axis in range(3):
+            value = point[axis]
+            if value < low[axis]:
+                diff = low[axis] - value
+                total += diff * diff
+            elif value > high[axis]:
+                diff = value - high[axis]
+                total += diff * diff
+        return total
+
+    def query(
+        self, point, k: int, mask: np.ndarray = None, max_distance: float = None
+    ) -> tuple:
+        """查询最近的K个点
+
+        Args:
+            point: 三维查询点
+            k: 返回数量
+            mask: 按原始点顺序的布尔数组，False的点被跳过（用于属性过滤）
+            max_distance: 最大弦长距离（None表示不限制）
+
+        Returns:
+            (原始点下标数组, 弦长距离数组)，按距离升序
+        """
+        if self.size == 0 or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+        point = np.asarray(point, dtype=np.float64)
+        query_point = point.tolist()
+        bound = math.inf if max_distance is None else max_distance * max_distance
+        best_idx = np.empty(0, dtype=np.int64)
+        best_dist = np.empty(0, dtype=np.float64)
+
+        node_left = self.node_left
+        heap = [(self._box_distance_sq(0, query_point), 0)]
+        while heap:
+            box_dist, node = heapq.heappop(heap)
+            if box_dist > bound:
+                break
+
+            left = node_left[node]
+            if left < 0:
+                start, end = self.node_start[node], self.node_end[node]
+                diff = self.points[start:end] - point
+                dist = np.einsum("ij,ij->i", diff, diff)
+                idx = self.order[start:end]
+                keep = dist <= bound
+                if mask is not None:
+                    keep &= mask[idx]
+                if not keep.any():
+                    continue
+
+                best_idx = np.concatenate((best_idx, idx[keep]))
+                best_dist = np.concatenate((best_dist, dist[keep]))
+                if len(best_dist) > k:
+                    top = np.argpartition(best_dist, k - 1)[:k]
+                    best_idx, best_dist = best_idx[top], best_dist[top]
+                if len(best_dist) == k:
+                    bound = min(bound, float(best_dist.max()))
+                continue
+
+            right = self.node_right[node]
+            for child in (left, right):
+                child_dist = self._box_distance_sq(child, query_point)
+                if child_dist <= bound:
+                    heapq.heappush(heap, (child_dist, child))
+
+        order = np.argsort(best_dist, kind="stable")
+        return best_idx[order], np.sqrt(best_dist[order])
+
+
+class DriverKNNIndex:
+    """可用司机的K近邻索引
+
+    定期从网格索引拍快照并重建K-D树。快照之间司机位置或可用状态的变化
+    由查询时对照实时网格索引来校正：已不可用的司机被剔除，位置以实时值为准。
+    """
+
+    def __init__(self, source, leaf_size: int = DEFAULT_LEAF_SIZE):
+        self.source = source
+        self.leaf_size = leaf_size
+        self._snapshot = None
+        self._built_at = 0.0
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.last_rebuild_ms = 0.0
+
+    def rebuild(self) -> int:
+        """从网格索引重建K-D树
+
+        Returns:
+            树中的司机数量
+        """
+        started = time.perf_counter()
+        drivers = self.source.snapshot()
+
+        driver_ids = np.array([item[0] for item in drivers], dtype=np.int64)
+        lats = np.array([item[1] for item in drivers], dtype=np.float64)
+        lngs = np.array([item[2] for item in drivers], dtype=np.float64)
+        ratings = np.array(
+            [
+                item[3].get("rating") if item[3].get("rating") is not None else np.nan
+                for item in drivers
+            ],
+            dtype=np.float64,
+        )
+        vehicle_types = np.array(
+            [item[3].get("vehicle_type") or "" for item in drivers], dtype=object
+        )
+
+        tree = KDTree(to_unit_vectors(lats, lngs), leaf_size=self.leaf_size)
+        snapshot = {
+            "tree": tree,
+            "driver_ids": driver_ids,
+            "ratings": ratings,
+            "vehicle_types": vehicle_types,
+        }
+
+        with self._lock:
+            self._snapshot = snapshot
+            self._built_at = time.monotonic()
+        self.last_rebuild_ms = (time.perf_counter() - started) * 1000
+        return len(driver_ids)
+
+    @property
+    def age_seconds(self) -> float:
+        """距离上次重建的秒数"""
+        return (
+            time.monotonic() - self._built_at
+            if self._snapshot is not None
+            else math.inf
+        )
+
+    def query(
+        self,
+        lat: float,
+        lng: float,
+        k: int,
+        vehicle_type: str = None,
+        min_rating: float = None,
+        max_radius_km: float = None,
+    ) -> list:
+        """按直线距离查询最近的K个可用司机
+
+        Args:
+            lat: 纬度
+            lng: 经度
+            k: 返回数量
+            vehicle_type: 只返回该车型的司机
+            min_rating: 最低评分
+            max_radius_km: 最大搜索半径（公里）
+
+        Returns:
+            按距离升序的 (driver_id, distance_km) 列表
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            self.rebuild()
+            snapshot = self._snapshot
+
+        mask = None
+        if vehicle_type is not None:
+            mask = snapshot["vehicle_types"] == vehicle_type
+        if min_rating is not None:
+            rating_mask = snapshot["ratings"] >= min_rating
+            mask = rating_mask if mask is None else mask & rating_mask
+
+        max_chord = None
+        if max_radius_km is not None:
+            max_chord = 2 * math.sin(
+                min(max_radius_km / (2 * EARTH_RADIUS_KM), math.pi / 2)
+            )
+
+        query_point = to_unit_vectors([lat], [lng])[0]
+        # 快照中可能有已下线的司机，多取一些候选再用实时索引校正
+        fetch = k
+        while True:
+            idx, _ = snapshot["tree"].query(
+                query_point, fetch, mask=mask, max_distance=max_chord
+            )
+            results = []
+            for driver_id in snapshot["driver_ids"][idx].tolist():
+                position = self.source.get_position(driver_id)
+                if position is None:
+                    continue
+                distance = haversine_km(lat, lng, position[0], position[1])
+                if max_radius_km is None or distance <= max_radius_km:
+                    results.append((driver_id, distance))
+            if len(results) >= k or len(idx) < fetch:
+                break
+            fetch *= 2
+
+        results.sort(key=lambda item: item[1])
+        return results[:k]
+
+    def start(self, interval_seconds: float = 2.0) -> None:
+        """启动后台定期重建线程"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run,
+            args=(interval_seconds,),
+            name="driver-knn-rebuild",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """停止后台重建线程"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, interval_seconds):
+        while not self._stop_event.wait(interval_seconds):
+            try:
+                self.rebuild()
+            except Exception as e:
+                logger.error(f"Failed to rebuild driver KNN index: {e}")
+
+
+# 全局可用司机K近邻索引实例（基于全局网格索引）
+driver_knn_index = DriverKNNIndex(driver_index)
+
+# 导出
+__all__ = [
+    "KDTree",
+    "DriverKNNIndex",
+    "driver_knn_index",
+    "to_unit_vectors",
+    "chord_to_km",
+]
@@ -1,7 +1,26 @@
 """
 位置服务 - 处理地理位置相关逻辑（简化版）
 """
+import datetime
 import math
+import os
+import numpy as np
+from src.services.spatial_index import driver_index, EARTH_RADIUS_KM, KM_PER_DEG_LAT
+from src.services.kdtree import driver_knn_index
+from src.services.routing import get_routing_engine
+from src.services.traffic import get_traffic_table
+from src.services.geofence import get_geofence_index
+from src.services.cache import TTLCache, MISSING
+
+# 按ETA排序前按直线距离多取的候选倍数
+KNN_CANDIDATE_FACTOR = 3
+
+# 路线缓存：起终点量化到网格（默认约280米）后作为键
+ETA_CACHE_CELL_DEG = float(os.environ.get('ETA_CACHE_CELL_DEG', 0.0025))
+eta_cache = TTLCache(
+    maxsize=int(os.environ.get('ETA_CACHE_SIZE', 100000)),
+    ttl_seconds=float(os.environ.get('ETA_CACHE_TTL_SECONDS', 300))
+)
 
 class LocationService:
     """位置服务类"""
@@ -36,9 +55,90 @@ class LocationService:
 
         return c * r
 
+    @staticmethod
+    def calculate_distances(
+        origin_lat: float, origin_lng: float, lats, lngs
+    ) -> np.ndarray:
+        """批量计算一个起点到N个目标点的距离（向量化Haversine）
+
+        Args:
+            origin_lat: 起点纬度
+            origin_lng: 起点经度
+            lats: 目标纬度数组，形状 (N,)
+            lngs: 目标经度数组，形状 (N,)
+
+        Returns:
+            距离数组（公里），形状 (N,)
+        """
+        lats_rad = np.radians(np.asarray(lats, dtype=np.float64))
+        lngs_rad = np.radians(np.asarray(lngs, dtype=np.float64))
+        origin_lat_rad = math.radians(origin_lat)
+        origin_lng_rad = math.radians(origin_lng)
+
+        a = np.sin((lats_rad - origin_lat_rad) / 2) ** 2 + (
+            math.cos(origin_lat_rad)
+            * np.cos(lats_rad)
+            * np.sin((lngs_rad - origin_lng_rad) / 2) ** 2
+        )
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+    @staticmethod
+    def calculate_distance_matrix(lats1, lngs1, lats2, lngs2) -> np.ndarray:
+        """批量计算N个点到M个点两两之间的距离矩阵（向量化Haversine）
+
+        Args:
+            lats1: 第一组纬度数组，形状 (N,)
+            lngs1: 第一组经度数组，形状 (N,)
+            lats2: 第二组纬度数组，形状 (M,)
+            lngs2: 第二组经度数组，形状 (M,)
+
+        Returns:
+            距离矩阵（公里），形状 (N, M)
+        """
+        lat1 = np.radians(np.asarray(lats1, dtype=np.float64))[:, np.newaxis]
+        lng1 = np.radians(np.asarray(lngs1, dtype=np.float64))[:, np.newaxis]
+        lat2 = np.radians(np.asarray(lats2, dtype=np.float64))[np.newaxis, :]
+        lng2 = np.radians(np.asarray(lngs2, dtype=np.float64))[np.newaxis, :]
+
+        a = (
+            np.sin((lat2 - lat1) / 2) ** 2
+            + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+        )
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+    @staticmethod
+    def bounding_box(lat: float, lng: float, radius_km: float) -> tuple:
+        """计算包含以(lat, lng)为圆心、radius_km为半径的圆的经纬度矩形
+
+        用于在SQL中先按索引范围过滤候选点，再用Haversine精确筛选。
+
+        Args:
+            lat: 中心纬度
+            lng: 中心经度
+            radius_km: 半径（公里）
+
+        Returns:
+            (min_lat, max_lat, min_lng, max_lng)；跨越极点或180度经线时经度范围取全部
+        """
+        dlat = radius_km / KM_PER_DEG_LAT
+        min_lat = max(lat - dlat, -90.0)
+        max_lat = min(lat + dlat, 90.0)
+
+        cos_lat = math.cos(math.radians(max(abs(min_lat), abs(max_lat))))
+        if cos_lat <= 1e-9:
+            return min_lat, max_lat, -180.0, 180.0
+
+        dlng = dlat / cos_lat
+        min_lng = lng - dlng
+        max_lng = lng + dlng
+        if min_lng < -180.0 or max_lng > 180.0:
+            return min_lat, max_lat, -180.0, 180.0
+
+        return min_lat, max_lat, min_lng, max_lng
+
     @staticmethod
     def find_nearby_drivers(lat: float, lng: float, radius_km: float = 5, limit: int = 10) -> list:
-        """查找附近的司机（简化版）
+        """查找附近的可用司机（基于内存网格索引）
 
         Args:
             lat: 纬度
@@ -47,39 +147,93 @@ class LocationService:
             limit: 返回数量限制
 
         Returns:
-            司机列表
+            司机列表（按距离升序）
+        """
+        # 从内存网格索引中查询，避免扫描全部司机记录
+        nearby = driver_index.query_radius(lat, lng, radius_km, limit=limit)
+
+        drivers = []
+        for driver_id, distance in nearby:
+            info = driver_index.get_info(driver_id)
+            drivers.append({
+                'driver_id': driver_id,
+                'name': info.get('name'),
+                'distance_km': round(distance, 2),
+                'eta_minutes': round(
+                    LocationService.estimate_travel_time(distance, lat=lat, lng=lng), 1
+                ),
+                'rating': info.get('rating')
+            })
+
+        return drivers
+
+    @staticmethod
+    def find_nearest_drivers(
+        lat: float, lng: float, k: int = 5, vehicle_type: str = None,
+        min_rating: float = None, max_radius_km: float = None
+    ) -> list:
+        """查找预计到达时间最短的K个可用司机（基于K-D树）
+
+        先按直线距离从K-D树取出若干倍候选，再按预计行驶时间（路网可用时为路网时间）重新排序。
+
+        Args:
+            lat: 纬度
+            lng: 经度
+            k: 返回数量
+            vehicle_type: 车型过滤（None表示不限）
+            min_rating: 最低评分（None表示不限）
+            max_radius_km: 最大搜索半径（公里）
+
+        Returns:
+            司机列表（按ETA升序）
         """
-        # 简化版本：返回空列表或模拟数据
-        # 实际项目中应该使用空间数据库查询
-
-        return [
-            {
-                'driver_id': 1,
-                'name': '司机张三',
-                'distance_km': 1.5,
-                'eta_minutes': 5,
-                'rating': 4.8
-            },
-            {
-                'driver_id': 2,
-                'name': '司机李四',
-                'distance_km': 2.3,
-                'eta_minutes': 8,
-                'rating': 4.9
-            }
-        ]
+        candidates = driver_knn_index.query(
+            lat, lng, k * KNN_CANDIDATE_FACTOR,
+            vehicle_type=vehicle_type,
+            min_rating=min_rating,
+            max_radius_km=max_radius_km
+        )
+
+        drivers = []
+        for driver_id, distance in candidates:
+            info = driver_index.get_info(driver_id)
+            position = driver_index.get_position(driver_id)
+            if position is None:
+                continue
+            route = LocationService.estimate_route(position[0], position[1], lat, lng)
+            drivers.append({
+                'driver_id': driver_id,
+                'name': info.get('name'),
+                'distance_km': round(distance, 2),
+                'eta_minutes': round(route['duration_minutes'], 1),
+                'rating': info.get('rating'),
+                'vehicle_type': info.get('vehicle_type')
+            })
+
+        drivers.sort(key=lambda item: item['eta_minutes'])
+        return drivers[:k]
 
     @staticmethod
-    def estimate_travel_time(distance_km: float, traffic_factor: float = 1.0) -> float:
+    def estimate_travel_time(
+        distance_km: float, traffic_factor: float = None, lat: float = None,
+        lng: float = None, when: datetime.datetime = None
+    ) -> float:
         """估计行驶时间
 
         Args:
             distance_km: 距离（公里）
-            traffic_factor: 交通系数（1.0表示正常交通）
+            traffic_factor: 交通系数（1.0表示正常交通，None表示从交通系数表查询）
+            lat: 出发点纬度（用于按区域查询交通系数）
+            lng: 出发点经度
+            when: 出发时间（UTC），None表示当前时间
 
         Returns:
             行驶时间（分钟）
         """
+        if traffic_factor is None:
+            table = get_traffic_table()
+            traffic_factor = table.lookup(lat, lng, when) if table is not None else 1.0
+
         # 假设平均速度50km/h
         average_speed = 50  # km/h
         base_time_hours = distance_km / average_speed
@@ -88,6 +242,73 @@ class LocationService:
         # 转换为分钟
         return adjusted_time_hours * 60
 
+    @staticmethod
+    def estimate_route(lat1: float, lng1: float, lat2: float, lng2: float) -> dict:
+        """估计两点之间的行驶时间和距离
+
+        配置了路网文件时使用路网最短时间路径，结果按起终点网格对缓存；
+        路网不可用、坐标不在路网范围内或不可达时，回退到直线距离和平均速度估算。
+
+        Args:
+            lat1: 起点纬度
+            lng1: 起点经度
+            lat2: 终点纬度
+            lng2: 终点经度
+
+        Returns:
+            {'distance_km', 'duration_minutes', 'source'}
+        """
+        engine = get_routing_engine()
+        if engine is not None:
+            # 路网查询代价高，按起终点网格对缓存结果
+            key = LocationService.cell_pair_key(lat1, lng1, lat2, lng2)
+            cached = eta_cache.lookup(key)
+            if cached is not MISSING:
+                return dict(cached)
+
+            route = engine.route(lat1, lng1, lat2, lng2)
+            if route is not None:
+                route['source'] = 'road_network'
+            else:
+                route = LocationService._heuristic_route(lat1, lng1, lat2, lng2)
+            eta_cache.set(key, route)
+            return dict(route)
+
+        return LocationService._heuristic_route(lat1, lng1, lat2, lng2)
+
+    @staticmethod
+    def _heuristic_route(lat1: float, lng1: float, lat2: float, lng2: float) -> dict:
+        """按直线距离和平均速度估算路线"""
+        distance = LocationService.calculate_distance(lat1, lng1, lat2, lng2)
+        return {
+            'distance_km': distance,
+            'duration_minutes': LocationService.estimate_travel_time(
+                distance, lat=lat1, lng=lng1
+            ),
+            'source': 'heuristic'
+        }
+
+    @staticmethod
+    def cell_pair_key(lat1: float, lng1: float, lat2: float, lng2: float,
+                      cell_deg: float = None) -> tuple:
+        """把起终点量化到网格，返回用作缓存键的网格对
+
+        Args:
+            lat1: 起点纬度
+            lng1: 起点经度
+            lat2: 终点纬度
+            lng2: 终点经度
+            cell_deg: 网格边长（度），None表示使用 ETA_CACHE_CELL_DEG
+
+        Returns:
+            (起点行, 起点列, 终点行, 终点列)
+        """
+        size = cell_deg or ETA_CACHE_CELL_DEG
+        return (
+            math.floor(lat1 / size), math.floor(lng1 / size),
+            math.floor(lat2 / size), math.floor(lng2 / size)
+        )
+
     @staticmethod
     def validate_coordinates(lat: float, lng: float) -> bool:
         """验证坐标是否有效
@@ -104,11 +325,28 @@ class LocationService:
 
         return -90 <= lat <= 90 and -180 <= lng <= 180
 
+    @staticmethod
+    def lookup_zones(lat: float, lng: float) -> list:
+        """查询坐标所在的地理围栏区域
+
+        Args:
+            lat: 纬度
+            lng: 经度
+
+        Returns:
+            区域ID列表（面积小的在前）；未配置地理围栏时返回空列表
+        """
+        index = get_geofence_index()
+        if index is None or lat is None or lng is None:
+            return []
+        return index.lookup_ids(lat, lng)
+
 # 创建位置服务实例
 location_service = LocationService()
 
 # 导出
 __all__ = [
     'LocationService',
-    'location_service'
+    'location_service',
+    'eta_cache'
 ]
\ No newline at end of file
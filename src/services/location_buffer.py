@@ -0,0 +1,268 @@
+"""
+位置写缓冲服务 - 合并司机GPS上报并批量写入数据库
+"""
+import datetime
+import logging
+import os
+import threading
+
+from sqlalchemy import bindparam, or_
+
+from src.services.database import db
+
+logger = logging.getLogger(__name__)
+
+# 默认刷新间隔（毫秒）
+DEFAULT_FLUSH_INTERVAL_MS = 1000
+
+# 客户端上报时间的有效范围：最多早于服务器时间 MAX_PING_AGE_SECONDS，
+# 最多晚于服务器时间 MAX_PING_SKEW_SECONDS（晚于服务器时间的按服务器时间记录）
+MAX_PING_AGE_SECONDS = float(os.environ.get("LOCATION_PING_MAX_AGE_SECONDS", 300))
+MAX_PING_SKEW_SECONDS = float(os.environ.get("LOCATION_PING_MAX_SKEW_SECONDS", 10))
+
+
+def parse_ping_timestamp(value) -> datetime.datetime:
+    """解析上报时间：支持Unix时间戳（秒）和ISO 8601字符串，统一为UTC naive datetime
+
+    Args:
+        value: 时间戳；None表示使用当前时间
+
+    Returns:
+        UTC时间
+
+    Raises:
+        ValueError: 时间格式无效
+    """
+    if value is None:
+        return datetime.datetime.utcnow()
+    if isinstance(value, bool):
+        raise ValueError(f"Invalid timestamp: {value}")
+    if isinstance(value, (int, float)):
+        return datetime.datetime.utcfromtimestamp(value)
+
+    parsed = datetime.datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def clamp_ping_timestamp(
+    timestamp: datetime.datetime, now: datetime.datetime = None
+) -> datetime.datetime:
+    """把客户端上报时间限制在服务器时间附近
+
+    数据库只接受比已有位置更新的上报，一条远在未来的时间会让该司机之后的真实上报全部被拒绝；
+    单条上报接口使用服务器时间，批量接口也以服务器时间为上限，两条路径的时间可以比较。
+
+    Args:
+        timestamp: 解析后的上报时间（UTC）
+        now: 当前服务器时间（UTC），默认 utcnow()
+
+    Returns:
+        上报时间，晚于服务器时间（时钟偏差范围内）时为服务器时间
+
+    Raises:
+        ValueError: 上报时间早于 MAX_PING_AGE_SECONDS 之前或晚于 MAX_PING_SKEW_SECONDS 之后
+    """
+    now = now or datetime.datetime.utcnow()
+    if timestamp < now - datetime.timedelta(seconds=MAX_PING_AGE_SECONDS):
+        raise ValueError(f"Timestamp too old: {timestamp.isoformat()}")
+    if timestamp > now + datetime.timedelta(seconds=MAX_PING_SKEW_SECONDS):
+        raise ValueError(f"Timestamp in the future: {timestamp.isoformat()}")
+    return min(timestamp, now)
+
+
+class LocationWriteBuffer:
+    """司机位置写缓冲
+
+    每个司机只保留时间最新的一次上报，后台线程每隔固定时间把缓冲区
+    整体换出，用一条批量UPDATE写入数据库。数据库中已有更新位置的行
+    不会被旧的上报覆盖。
+    """
+
+    def __init__(self, flush_interval_ms: int = DEFAULT_FLUSH_INTERVAL_MS):
+        self.flush_interval_ms = flush_interval_ms
+        self._pending = {}  # driver_id -> (lat, lng, timestamp)
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._stats = {
+            "pings_received": 0,
+            "pings_coalesced": 0,
+            "pings_stale": 0,
+            "flushes": 0,
+            "rows_written": 0,
+            "flush_errors": 0,
+        }
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(
+        self,
+        driver_id: int,
+        lat: float,
+        lng: float,
+        timestamp: datetime.datetime = None,
+    ) -> bool:
+        """加入一次位置上报
+
+        Args:
+            driver_id: 司机ID
+            lat: 纬度
+            lng: 经度
+            timestamp: 上报时间（UTC），None表示当前时间
+
+        Returns:
+            是否被采纳（比缓冲区中同一司机的位置更旧时丢弃）
+        """
+        timestamp = timestamp or datetime.datetime.utcnow()
+        with self._lock:
+            self._stats["pings_received"] += 1
+            previous = self._pending.get(driver_id)
+            if previous is not None:
+                if previous[2] > timestamp:
+                    self._stats["pings_stale"] += 1
+                    return False
+                self._stats["pings_coalesced"] += 1
+            self._pending[driver_id] = (lat, lng, timestamp)
+            return True
+
+    def add_many(self, pings) -> int:
+        """批量加入位置上报
+
+        Args:
+            pings: 可迭代的 (driver_id, lat, lng, timestamp)
+
+        Returns:
+            被采纳的上报数量
+        """
+        return sum(
+            1
+            for driver_id, lat, lng, timestamp in pings
+            if self.add(driver_id, lat, lng, timestamp)
+        )
+
+    def latest(self, driver_id: int):
+        """获取缓冲区中司机的最新位置 (lat, lng, timestamp)，没有时返回None"""
+        return self._pending.get(driver_id)
+
+    def drain(self) -> dict:
+        """换出当前缓冲区并返回其内容"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return pending
+
+    def flush(self) -> int:
+        """把缓冲区写入数据库（需要在应用上下文中调用）
+
+        Returns:
+            写入的行数
+        """
+        pending = self.drain()
+        if not pending:
+            return 0
+
+        from src.models.user import User
+
+        users = User.__table__
+        stmt = (
+            users.update()
+            .where(users.c.id == bindparam("b_id"), users.c.role == "driver")
+            .where(
+                or_(
+                    users.c.location_updated_at.is_(None),
+                    users.c.location_updated_at <= bindparam("b_ts"),
+                )
+            )
+            .values(
+                current_lat=bindparam("b_lat"),
+                current_lng=bindparam("b_lng"),
+                current_location=bindparam("b_location"),
+                location_updated_at=bindparam("b_ts"),
+            )
+        )
+        params = [
+            {
+                "b_id": driver_id,
+                "b_lat": lat,
+                "b_lng": lng,
+                "b_location": f"{lat},{lng}",
+                "b_ts": timestamp,
+            }
+            for driver_id, (lat, lng, timestamp) in pending.items()
+        ]
+
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(stmt, params)
+        except Exception:
+            # 写入失败时放回缓冲区，已有更新上报的司机以新上报为准
+            with self._lock:
+                self._stats["flush_errors"] += 1
+                for driver_id, entry in pending.items():
+                    current = self._pending.get(driver_id)
+                    if current is None or current[2] < entry[2]:
+                        self._pending[driver_id] = entry
+            raise
+
+        with self._lock:
+            self._stats["flushes"] += 1
+            self._stats["rows_written"] += len(params)
+        return len(params)
+
+    def start(self, app) -> None:
+        """启动后台刷新线程
+
+        Args:
+            app: Flask应用，刷新时进入其应用上下文；LOCATION_FLUSH_INTERVAL_MS 配置刷新间隔
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        self.flush_interval_ms = app.config.get(
+            "LOCATION_FLUSH_INTERVAL_MS", self.flush_interval_ms
+        )
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(app,), name="location-write-buffer", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, app=None) -> None:
+        """停止后台线程，并在提供app时写入剩余数据"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if app is not None:
+            with app.app_context():
+                self.flush()
+
+    def _run(self, app):
+        interval = self.flush_interval_ms / 1000.0
+        while not self._stop_event.wait(interval):
+            try:
+                with app.app_context():
+                    self.flush()
+            except Exception as e:
+                logger.error(f"Failed to flush driver locations: {e}")
+
+    def get_stats(self) -> dict:
+        """获取缓冲统计信息"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["pending"] = len(self._pending)
+        return stats
+
+
+# 全局位置写缓冲实例
+location_buffer = LocationWriteBuffer()
+
+# 导出
+__all__ = [
+    "LocationWriteBuffer",
+    "location_buffer",
+    "parse_ping_timestamp",
+    "clamp_ping_timestamp",
+]
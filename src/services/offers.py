@@ -0,0 +1,467 @@
+"""
+派单管理服务 - 依次向候选司机发出派单，超时或拒绝时转给下一个候选司机
+"""
+import asyncio
+import concurrent.futures
+import logging
+import threading
+import time
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+
+from flask import has_app_context
+
+from src.services.dispatcher import batch_dispatcher
+from src.services.forward_dispatch import finishing_drivers
+from src.services.notification import NotificationService
+from src.services.spatial_index import driver_index
+from src.services.timing_wheel import HierarchicalTimingWheel
+
+logger = logging.getLogger(__name__)
+
+# 每个司机回应派单的时间（秒）
+DEFAULT_OFFER_TIMEOUT_SECONDS = 15.0
+
+# 时间轮刻度（秒）：超时最多晚一个刻度被处理
+DEFAULT_TICK_SECONDS = 0.1
+
+# 每个行程最多尝试的司机数
+DEFAULT_MAX_ATTEMPTS = 5
+
+# 其他线程等待事件循环返回查询结果的最长时间（秒），超时说明事件循环已停止
+READ_TIMEOUT_SECONDS = 1.0
+
+
+def find_candidate_drivers(lat: float, lng: float, k: int) -> list:
+    """按ETA排序的附近可用司机ID"""
+    from src.services.location import LocationService
+
+    return [
+        driver["driver_id"]
+        for driver in LocationService.find_nearest_drivers(lat, lng, k)
+    ]
+
+
+class RideOfferStore:
+    """把每个行程当前的派单写入 rides 表
+
+    派单管理器只在派单leader进程中运行，接单和拒单请求可能落在任何工作进程，
+    它们都以数据库中的派单（司机和过期时间）为准，而不是各进程内存中的状态。
+    """
+
+    def __init__(self, app=None):
+        self.app = app
+
+    def init_app(self, app) -> None:
+        self.app = app
+
+    def _context(self):
+        """已在应用上下文中（请求内）直接使用，否则进入绑定应用的上下文"""
+        if has_app_context():
+            return nullcontext()
+        return self.app.app_context()
+
+    def record(self, ride_id: int, driver_id: int, expires_at: datetime) -> bool:
+        """记录派单，行程已不再待接单时返回False"""
+        from src.models.ride import Ride
+        from src.services.database import db
+
+        if self.app is None and not has_app_context():
+            return True
+        with self._context():
+            try:
+                recorded = Ride.record_offer(ride_id, driver_id, expires_at)
+                db.session.commit()
+                return recorded
+            except Exception:
+                db.session.rollback()
+                raise
+
+    def clear(self, ride_id: int) -> None:
+        """清除行程的派单"""
+        from src.models.ride import Ride
+        from src.services.database import db
+
+        if self.app is None and not has_app_context():
+            return
+        with self._context():
+            try:
+                Ride.clear_offer(ride_id)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+
+
+class RideOffer:
+    """一个行程的派单状态"""
+
+    def __init__(
+        self,
+        ride_id: int,
+        candidates,
+        passenger_name: str,
+        pickup_address: str,
+        pickup=None,
+    ):
+        self.ride_id = ride_id
+        self.candidates = list(candidates)
+        self.position = 0
+        self.passenger_name = passenger_name
+        self.pickup_address = pickup_address
+        self.pickup = pickup  # 候选用完时按上车点补充附近司机，(lat, lng) 或None
+        self.expanded = pickup is None
+        self.tried = set()
+        self.driver_id = None
+        self.timer = None
+
+
+class OfferManager:
+    """基于asyncio的派单管理器
+
+    每个行程同一时刻只派给一个司机，等待 timeout_seconds 秒；司机拒绝或超时后
+    转给下一个候选司机，候选用完时按上车点补充一次附近司机，仍无人接单则放回
+    批量派单器的待分配行程中。
+
+    所有超时放在一个分层时间轮里，由事件循环上的一个协程按刻度推进，
+    成千上万个并发派单不需要各自的线程或定时器。状态只在事件循环线程上读写，
+    其他线程的修改通过 call_soon_threadsafe 转交，查询通过 run_coroutine_threadsafe
+    等待结果；事件循环未启动时（测试、脚本）直接执行。
+
+    只有派单leader进程会发出派单，批量派单器第一次发出派单时启动事件循环，
+    其他工作进程不运行派单管理器。
+
+    给出 store 时每次派单先写入数据库再通知司机，接单和拒单接口据此校验。
+    在其他工作进程被拒绝的派单不会通知到这里，到期后照常转给下一个司机。
+    """
+
+    def __init__(
+        self,
+        timeout_seconds: float = DEFAULT_OFFER_TIMEOUT_SECONDS,
+        tick_seconds: float = DEFAULT_TICK_SECONDS,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        source=driver_index,
+        dispatcher=batch_dispatcher,
+        notifier=None,
+        candidate_finder=find_candidate_drivers,
+        clock=time.monotonic,
+        finishing=finishing_drivers,
+        store: RideOfferStore = None,
+    ):
+        self.timeout_seconds = timeout_seconds
+        self.tick_seconds = tick_seconds
+        self.max_attempts = max_attempts
+        self.source = source
+        self.finishing = finishing
+        self.dispatcher = dispatcher
+        self.notifier = notifier or NotificationService.send_ride_request_notification
+        self.candidate_finder = candidate_finder
+        self.store = store
+        self._clock = clock
+        self.wheel = HierarchicalTimingWheel(tick_seconds, start=clock())
+        self._offers = {}  # ride_id -> RideOffer
+        self._busy_drivers = {}  # driver_id -> 正在等待其回应的ride_id
+        self._loop = None
+        self._thread = None
+        self._stopping = None
+        self.stats = {
+            "offered": 0,
+            "accepted": 0,
+            "declined": 0,
+            "timed_out": 0,
+            "exhausted": 0,
+        }
+
+    def __len__(self):
+        return len(self._offers)
+
+    def _call(self, callback, *args) -> None:
+        """在事件循环线程上执行状态修改"""
+        loop = self._loop
+        if (
+            loop is not None
+            and loop.is_running()
+            and threading.current_thread() is not self._thread
+        ):
+            loop.call_soon_threadsafe(callback, *args)
+        else:
+            callback(*args)
+
+    def _read(self, callback, *args):
+        """在事件循环线程上查询状态并返回结果"""
+        loop = self._loop
+        if (
+            loop is None
+            or not loop.is_running()
+            or threading.current_thread() is self._thread
+        ):
+            return callback(*args)
+
+        async def read():
+            return callback(*args)
+
+        future = asyncio.run_coroutine_threadsafe(read(), loop)
+        try:
+            return future.result(READ_TIMEOUT_SECONDS)
+        except concurrent.futures.TimeoutError:
+            # 事件循环正在停止，状态不会再被修改
+            future.cancel()
+            return callback(*args)
+
+    def submit(
+        self,
+        ride_id: int,
+        candidates,
+        passenger_name: str = "",
+        pickup_address: str = "",
+        pickup: tuple = None,
+    ) -> None:
+        """开始为行程派单
+
+        Args:
+            ride_id: 行程ID
+            candidates: 按优先级排序的司机ID
+            passenger_name: 乘客称呼（用于通知）
+            pickup_address: 上车地址（用于通知）
+            pickup: 上车点 (lat, lng)，候选用完时用于补充附近司机
+        """
+        self._call(
+            self._submit,
+            RideOffer(ride_id, candidates, passenger_name, pickup_address, pickup),
+        )
+
+    def decline(self, ride_id: int, driver_id: int) -> None:
+        """司机拒绝派单"""
+        self._call(self._finish_attempt, ride_id, driver_id, "declined")
+
+    def accepted(self, ride_id: int, driver_id: int) -> None:
+        """行程已被接单（由 accept_ride 在提交后调用）"""
+        self._call(self._accepted, ride_id, driver_id)
+
+    def cancel(self, ride_id: int) -> None:
+        """停止为行程派单（例如乘客取消）"""
+        self._call(self._cancel, ride_id)
+
+    def current_driver(self, ride_id: int):
+        """正在等待回应的司机ID，没有进行中的派单时返回None"""
+        return self._read(self._current_driver, ride_id)
+
+    def pending_ride(self, driver_id: int):
+        """司机正在等待回应的行程ID，没有时返回None"""
+        return self._read(self._busy_drivers.get, driver_id)
+
+    def _current_driver(self, ride_id: int):
+        offer = self._offers.get(ride_id)
+        return offer.driver_id if offer is not None else None
+
+    def advance(self, now: float = None) -> int:
+        """处理到期的派单（由事件循环按刻度调用）
+
+        Returns:
+            超时的派单数
+        """
+        expired = self.wheel.advance(self._clock() if now is None else now)
+        for ride_id, driver_id in expired:
+            self._finish_attempt(ride_id, driver_id, "timed_out")
+        return len(expired)
+
+    def _submit(self, offer: RideOffer) -> None:
+        if offer.ride_id in self._offers:
+            return
+        self._offers[offer.ride_id] = offer
+        self._offer_next(offer)
+
+    def _finish_attempt(self, ride_id: int, driver_id: int, outcome: str) -> None:
+        """当前司机拒绝或超时，转给下一个候选"""
+        offer = self._offers.get(ride_id)
+        if offer is None or offer.driver_id != driver_id:
+            return
+        self.wheel.cancel(offer.timer)
+        self._free_driver(offer)
+        self.stats[outcome] += 1
+        self._offer_next(offer)
+
+    def _accepted(self, ride_id: int, driver_id: int) -> None:
+        offer = self._offers.pop(ride_id, None)
+        if offer is None:
+            return
+        self.wheel.cancel(offer.timer)
+        self._free_driver(offer)
+        self.stats["accepted"] += 1
+
+    def _cancel(self, ride_id: int) -> None:
+        offer = self._offers.pop(ride_id, None)
+        if offer is None:
+            return
+        self.wheel.cancel(offer.timer)
+        self._free_driver(offer)
+        self.dispatcher.release(ride_id=ride_id)
+        self._run_io(self._clear_offer, ride_id)
+
+    def _free_driver(self, offer: RideOffer) -> None:
+        if offer.driver_id is not None:
+            if self._busy_drivers.get(offer.driver_id) == offer.ride_id:
+                del self._busy_drivers[offer.driver_id]
+            self.dispatcher.release(driver_id=offer.driver_id)
+        offer.driver_id = None
+        offer.timer = None
+
+    def _is_online(self, driver_id) -> bool:
+        """司机空闲，或在行程中且尚未预留下一单（前向派单）"""
+        if driver_id in self.source:
+            return True
+        return (
+            self.finishing is not None
+            and driver_id in self.finishing
+            and self.finishing.reserved_ride(driver_id) is None
+        )
+
+    def _next_candidate(self, offer: RideOffer):
+        """下一个在线且没有其他待回应派单的候选司机"""
+        while len(offer.tried) < self.max_attempts:
+            if offer.position >= len(offer.candidates):
+                if offer.expanded:
+                    return None
+                offer.expanded = True
+                try:
+                    extra = self.candidate_finder(
+                        offer.pickup[0], offer.pickup[1], self.max_attempts * 2
+                    )
+                except Exception as e:
+                    logger.error(
+                        "Failed to find candidate drivers "
+                        f"for ride {offer.ride_id}: {e}"
+                    )
+                    return None
+                offer.candidates.extend(
+                    driver_id for driver_id in extra if driver_id not in offer.tried
+                )
+                continue
+
+            driver_id = offer.candidates[offer.position]
+            offer.position += 1
+            if (
+                driver_id in offer.tried
+                or driver_id in self._busy_drivers
+                or not self._is_online(driver_id)
+            ):
+                continue
+            return driver_id
+        return None
+
+    def _offer_next(self, offer: RideOffer) -> None:
+        driver_id = self._next_candidate(offer)
+        if driver_id is None:
+            # 没有司机接单：交回批量派单器，下个窗口重新分配
+            del self._offers[offer.ride_id]
+            self.stats["exhausted"] += 1
+            self.dispatcher.release(ride_id=offer.ride_id)
+            self._run_io(self._clear_offer, offer.ride_id)
+            logger.info(
+                f"No driver accepted ride {offer.ride_id} "
+                f"after {len(offer.tried)} offers"
+            )
+            return
+
+        offer.tried.add(driver_id)
+        offer.driver_id = driver_id
+        offer.timer = self.wheel.schedule(
+            self._clock() + self.timeout_seconds, (offer.ride_id, driver_id)
+        )
+        self._busy_drivers[driver_id] = offer.ride_id
+        self.dispatcher.hold(offer.ride_id, driver_id, self.timeout_seconds)
+        self.stats["offered"] += 1
+        expires_at = datetime.utcnow() + timedelta(seconds=self.timeout_seconds)
+        self._run_io(
+            self._send,
+            offer.ride_id,
+            driver_id,
+            expires_at,
+            offer.passenger_name,
+            offer.pickup_address,
+        )
+
+    def _run_io(self, callback, *args) -> None:
+        """数据库写入和通知（事件循环运行时放到线程池，不阻塞超时处理）"""
+        loop = self._loop
+        if loop is not None and loop.is_running():
+            loop.run_in_executor(None, callback, *args)
+        else:
+            callback(*args)
+
+    def _send(
+        self, ride_id, driver_id, expires_at, passenger_name, pickup_address
+    ) -> None:
+        """记录派单后通知司机；行程已在其他进程被接单或取消时停止派单"""
+        if self.store is not None:
+            try:
+                if not self.store.record(ride_id, driver_id, expires_at):
+                    self._call(self._cancel, ride_id)
+                    return
+            except Exception as e:
+                logger.error(f"Failed to record offer for ride {ride_id}: {e}")
+        try:
+            self.notifier(driver_id, passenger_name, pickup_address)
+        except Exception as e:
+            logger.error(f"Failed to notify driver {driver_id}: {e}")
+
+    def _clear_offer(self, ride_id) -> None:
+        if self.store is None:
+            return
+        try:
+            self.store.clear(ride_id)
+        except Exception as e:
+            logger.error(f"Failed to clear offer for ride {ride_id}: {e}")
+
+    async def _tick(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                self.advance()
+            except Exception as e:
+                logger.error(f"Failed to process offer timeouts: {e}")
+            try:
+                await asyncio.wait_for(self._stopping.wait(), self.tick_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self) -> None:
+        """在后台线程中启动事件循环（已启动时直接返回）"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._loop = asyncio.new_event_loop()
+        self._stopping = asyncio.Event()
+        started = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(self._loop)
+            self._loop.call_soon(started.set)
+            self._loop.run_until_complete(self._tick())
+
+        self._thread = threading.Thread(target=run, name="offer-manager", daemon=True)
+        self._thread.start()
+        started.wait()
+
+    def stop(self) -> None:
+        """停止事件循环"""
+        if self._thread is None:
+            return
+        self._loop.call_soon_threadsafe(self._stopping.set)
+        self._thread.join()
+        self._loop.close()
+        self._thread = None
+        self._loop = None
+
+
+# 全局派单存储和派单管理器实例（应用启动时绑定 ride_offer_store）
+ride_offer_store = RideOfferStore()
+offer_manager = OfferManager(store=ride_offer_store)
+
+# 导出
+__all__ = [
+    "RideOffer",
+    "RideOfferStore",
+    "ride_offer_store",
+    "OfferManager",
+    "offer_manager",
+    "find_candidate_drivers",
+]
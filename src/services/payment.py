@@ -1,24 +1,51 @@
 """
 支付服务 - 处理支付相关逻辑（简化版）
 """
+from src.services.surge import surge_engine
 
 
 class PaymentService:
     """支付服务类"""
 
     @staticmethod
-    def calculate_fare(distance_km: float, base_rate: float = 2.5, per_km_rate: float = 1.5) -> float:
+    def calculate_fare(
+        distance_km: float, base_rate: float = 2.5, per_km_rate: float = 1.5,
+        pickup_lat: float = None, pickup_lng: float = None,
+        surge_multiplier: float = None
+    ) -> float:
         """计算车费
 
         Args:
             distance_km: 距离（公里）
             base_rate: 基础费用
             per_km_rate: 每公里费用
+            pickup_lat: 上车点纬度（用于查询动态加价）
+            pickup_lng: 上车点经度
+            surge_multiplier: 加价倍数（None表示按上车点查询，没有上车点时为1.0）
 
         Returns:
             总费用
         """
-        return base_rate + (distance_km * per_km_rate)
+        if surge_multiplier is None:
+            surge_multiplier = PaymentService.get_surge_multiplier(
+                pickup_lat, pickup_lng
+            )
+        return (base_rate + (distance_km * per_km_rate)) * surge_multiplier
+
+    @staticmethod
+    def get_surge_multiplier(lat: float = None, lng: float = None) -> float:
+        """查询坐标处的动态加价倍数
+
+        Args:
+            lat: 纬度
+            lng: 经度
+
+        Returns:
+            加价倍数（没有坐标时为1.0）
+        """
+        if lat is None or lng is None:
+            return 1.0
+        return surge_engine.multiplier(lat, lng)
 
     @staticmethod
     def estimate_fare(pickup_lat: float, pickup_lng: float,
@@ -36,14 +63,16 @@ class PaymentService:
         """
         # 简化版本：返回固定费用
         # 实际项目中应该使用地图API计算距离
+        surge_multiplier = PaymentService.get_surge_multiplier(pickup_lat, pickup_lng)
 
         return {
-            'estimated_fare': 25.0,
+            'estimated_fare': round(25.0 * surge_multiplier, 2),
             'currency': 'CNY',
             'distance_km': 10.0,
             'base_fare': 10.0,
             'distance_fare': 15.0,
-            'message': '费用预估基于标准费率'
+            'surge_multiplier': surge_multiplier,
+            'message': '费用预估基于标准费率' if surge_multiplier == 1.0 else '当前区域需求较高，费用已动态调整'
         }
 
     @staticmethod
@@ -0,0 +1,546 @@
+"""
+拼车服务 - 把新的上下车点插入行驶中车辆的停靠序列，先用直线距离下界剪枝，只对少数候选调用ETA
+
+目前只作为库提供（scripts/benchmark_pooling.py 和测试使用）：行程请求和批量派单
+还不会调用拼车引擎，行程模型也还没有拼车和共享车辆的状态，接入时需要另外实现。
+"""
+import logging
+import threading
+import time
+
+import numpy as np
+
+from src.services.location import LocationService
+
+logger = logging.getLogger(__name__)
+
+# 乘客最长等待时间（分钟）
+DEFAULT_MAX_WAIT_MINUTES = 10.0
+
+# 乘客在车时间最多比直达多出的比例
+DEFAULT_MAX_DETOUR_RATIO = 0.5
+
+# 计算下界使用的最高车速（km/h）：任何路线的行驶时间都不少于直线距离按该速度行驶的时间
+DEFAULT_MAX_SPEED_KMH = 80.0
+
+# 通过剪枝后按直线距离保留的最近车辆数
+DEFAULT_MAX_VEHICLES = 64
+
+# 最多用ETA函数精确评估的插入方案数
+DEFAULT_MAX_EVALUATIONS = 12
+
+# 初始的车辆容量，不够时翻倍
+INITIAL_CAPACITY = 1024
+
+
+def default_eta(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """两点间的预计行驶时间（分钟）"""
+    return LocationService.estimate_route(lat1, lng1, lat2, lng2)["duration_minutes"]
+
+
+class Stop:
+    """车辆停靠点"""
+
+    __slots__ = ("kind", "ride_id", "lat", "lng", "passengers", "latest")
+
+    def __init__(
+        self,
+        kind: str,
+        ride_id,
+        lat: float,
+        lng: float,
+        passengers: int = 1,
+        latest: float = None,
+    ):
+        self.kind = kind  # pickup 或 dropoff
+        self.ride_id = ride_id
+        self.lat = lat
+        self.lng = lng
+        self.passengers = passengers
+        self.latest = latest  # 最晚到达时间（Unix秒），None表示不限
+
+    def to_dict(self) -> dict:
+        return {
+            "kind": self.kind,
+            "ride_id": self.ride_id,
+            "lat": self.lat,
+            "lng": self.lng,
+            "passengers": self.passengers,
+            "latest": self.latest,
+        }
+
+
+class PooledVehicle:
+    """拼车车辆的当前位置和停靠序列
+
+    points[0] 是车辆位置，points[k] 是第k个停靠点；legs[k-1] 是 points[k-1] 到 points[k] 的分钟数，
+    loads[k] 是离开 points[k] 时车上的乘客数。
+    """
+
+    def __init__(
+        self, vehicle_id, lat: float, lng: float, capacity: int, onboard: int = 0
+    ):
+        self.vehicle_id = vehicle_id
+        self.lat = lat
+        self.lng = lng
+        self.capacity = capacity
+        self.onboard = onboard
+        self.stops = []
+        self.legs = []
+
+    def points(self) -> list:
+        return [(self.lat, self.lng)] + [(stop.lat, stop.lng) for stop in self.stops]
+
+    def loads(self) -> list:
+        loads = [self.onboard]
+        for stop in self.stops:
+            loads.append(
+                loads[-1]
+                + (stop.passengers if stop.kind == "pickup" else -stop.passengers)
+            )
+        return loads
+
+    def state(self) -> tuple:
+        """影响插入方案的车辆状态（位置、乘客数、容量），提交时用于判断方案是否过期"""
+        return self.lat, self.lng, self.onboard, self.capacity
+
+    def snapshot(self) -> "PooledVehicle":
+        """复制车辆状态和停靠序列（停靠点对象共享），在锁外评估插入方案"""
+        vehicle = PooledVehicle(
+            self.vehicle_id, self.lat, self.lng, self.capacity, self.onboard
+        )
+        vehicle.stops = list(self.stops)
+        vehicle.legs = list(self.legs)
+        return vehicle
+
+    def spare_seats(self) -> int:
+        """停靠序列中最空闲时的剩余座位（插入新乘客的必要条件）"""
+        return self.capacity - min(self.loads())
+
+    def to_dict(self) -> dict:
+        return {
+            "vehicle_id": self.vehicle_id,
+            "lat": self.lat,
+            "lng": self.lng,
+            "capacity": self.capacity,
+            "onboard": self.onboard,
+            "stops": [stop.to_dict() for stop in self.stops],
+            "route_minutes": round(sum(self.legs), 2),
+        }
+
+
+class PoolingEngine:
+    """拼车插入引擎
+
+    为新的拼车请求选择车辆和插入位置，分三步：
+    1. 向量化剪枝：对所有车辆一次计算到上车点的直线距离，直线距离按最高车速
+       也赶不上最长等待时间、或座位不足的车辆直接排除，再保留最近的若干辆；
+    2. 廉价估计：对保留车辆枚举所有 (上车位置, 下车位置) 组合，检查座位约束，
+       用直线距离计算绕路增量并排序；
+    3. 精确评估：只对估计最好的少数方案调用ETA函数（可能走路网），
+       检查已有乘客的最晚到达时间和新乘客的等待、绕路限制，取增加时间最少的方案。
+    同一请求中的ETA结果按坐标对缓存，共享的路段只查询一次。
+
+    ETA函数可能查询路网，耗时远长于索引操作，所以不在引擎锁内调用：
+    锁内只做剪枝并复制候选车辆，锁外估计和评估，commit 时再确认车辆没有变化。
+    """
+
+    def __init__(
+        self,
+        eta_fn=default_eta,
+        max_wait_minutes: float = DEFAULT_MAX_WAIT_MINUTES,
+        max_detour_ratio: float = DEFAULT_MAX_DETOUR_RATIO,
+        max_speed_kmh: float = DEFAULT_MAX_SPEED_KMH,
+        max_vehicles: int = DEFAULT_MAX_VEHICLES,
+        max_evaluations: int = DEFAULT_MAX_EVALUATIONS,
+        clock=time.time,
+    ):
+        self.eta_fn = eta_fn
+        self.max_wait_minutes = max_wait_minutes
+        self.max_detour_ratio = max_detour_ratio
+        self.max_speed_kmh = max_speed_kmh
+        self.max_vehicles = max_vehicles
+        self.max_evaluations = max_evaluations
+        self._clock = clock
+        self._vehicles = {}
+        self._rows = {}  # vehicle_id -> 行号
+        self._ids = []
+        self._lats = np.zeros(INITIAL_CAPACITY)
+        self._lngs = np.zeros(INITIAL_CAPACITY)
+        self._spare = np.zeros(INITIAL_CAPACITY, dtype=np.int32)
+        self._lock = threading.Lock()
+        self.last_stats = {}
+
+    def __len__(self):
+        return len(self._vehicles)
+
+    def __contains__(self, vehicle_id):
+        return vehicle_id in self._vehicles
+
+    def get_vehicle(self, vehicle_id):
+        return self._vehicles.get(vehicle_id)
+
+    def _sync_row(self, vehicle: PooledVehicle) -> None:
+        row = self._rows.get(vehicle.vehicle_id)
+        if row is None:
+            row = self._rows[vehicle.vehicle_id] = len(self._ids)
+            self._ids.append(vehicle.vehicle_id)
+            if row >= len(self._lats):
+                self._lats = np.concatenate((self._lats, np.zeros_like(self._lats)))
+                self._lngs = np.concatenate((self._lngs, np.zeros_like(self._lngs)))
+                self._spare = np.concatenate((self._spare, np.zeros_like(self._spare)))
+        self._lats[row] = vehicle.lat
+        self._lngs[row] = vehicle.lng
+        self._spare[row] = vehicle.spare_seats()
+
+    def upsert_vehicle(
+        self, vehicle_id, lat: float, lng: float, capacity: int, onboard: int = None
+    ) -> None:
+        """登记拼车车辆或更新其位置
+
+        Args:
+            vehicle_id: 车辆ID
+            lat: 当前纬度
+            lng: 当前经度
+            capacity: 乘客容量（Vehicle.capacity）
+            onboard: 车上乘客数，None表示保持不变
+        """
+        with self._lock:
+            vehicle = self._vehicles.get(vehicle_id)
+            if vehicle is None:
+                vehicle = self._vehicles[vehicle_id] = PooledVehicle(
+                    vehicle_id, lat, lng, capacity, onboard or 0
+                )
+            else:
+                vehicle.lat, vehicle.lng, vehicle.capacity = lat, lng, capacity
+                if onboard is not None:
+                    vehicle.onboard = onboard
+            self._sync_row(vehicle)
+            first = vehicle.stops[0] if vehicle.stops else None
+
+        if first is None:
+            return
+        # 到下一个停靠点的路段在锁外重新估计，期间车辆被移除、到达停靠点或再次上报位置时以后者为准
+        leg = self.eta_fn(lat, lng, first.lat, first.lng)
+        with self._lock:
+            if (
+                self._vehicles.get(vehicle_id) is vehicle
+                and vehicle.stops
+                and vehicle.stops[0] is first
+                and (vehicle.lat, vehicle.lng) == (lat, lng)
+            ):
+                vehicle.legs[0] = leg
+
+    def upsert_vehicle_model(self, vehicle) -> bool:
+        """按 Vehicle 模型登记（使用其当前位置和 capacity）
+
+        Returns:
+            是否登记（车辆没有位置或未启用时不登记）
+        """
+        if (
+            not vehicle.is_active
+            or vehicle.current_lat is None
+            or vehicle.current_lng is None
+        ):
+            return False
+        self.upsert_vehicle(
+            vehicle.id, vehicle.current_lat, vehicle.current_lng, vehicle.capacity or 4
+        )
+        return True
+
+    def remove_vehicle(self, vehicle_id) -> bool:
+        """移除车辆"""
+        with self._lock:
+            if self._vehicles.pop(vehicle_id, None) is None:
+                return False
+            row = self._rows.pop(vehicle_id)
+            last = len(self._ids) - 1
+            if row != last:
+                moved = self._ids[last]
+                self._ids[row] = moved
+                self._rows[moved] = row
+                self._lats[row] = self._lats[last]
+                self._lngs[row] = self._lngs[last]
+                self._spare[row] = self._spare[last]
+            self._ids.pop()
+            return True
+
+    def arrive(self, vehicle_id):
+        """车辆到达下一个停靠点，更新车上乘客数
+
+        Returns:
+            到达的停靠点，没有停靠点时返回None
+        """
+        with self._lock:
+            vehicle = self._vehicles.get(vehicle_id)
+            if vehicle is None or not vehicle.stops:
+                return None
+            stop = vehicle.stops.pop(0)
+            vehicle.legs.pop(0)
+            vehicle.lat, vehicle.lng = stop.lat, stop.lng
+            vehicle.onboard += (
+                stop.passengers if stop.kind == "pickup" else -stop.passengers
+            )
+            self._sync_row(vehicle)
+            return stop
+
+    def _prune(self, pickup_lat: float, pickup_lng: float, passengers: int) -> list:
+        """向量化剪枝，返回按距离排序的候选车辆行号"""
+        count = len(self._ids)
+        if count == 0:
+            return []
+        distances = LocationService.calculate_distances(
+            pickup_lat, pickup_lng, self._lats[:count], self._lngs[:count]
+        )
+        reachable_km = self.max_speed_kmh * self.max_wait_minutes / 60
+        rows = np.flatnonzero(
+            (distances <= reachable_km) & (self._spare[:count] >= passengers)
+        )
+        if len(rows) > self.max_vehicles:
+            rows = rows[
+                np.argpartition(distances[rows], self.max_vehicles - 1)[
+                    : self.max_vehicles
+                ]
+            ]
+        return rows[np.argsort(distances[rows])].tolist()
+
+    def _estimate(
+        self, vehicle: PooledVehicle, pickup, dropoff, passengers: int, direct_km: float
+    ) -> list:
+        """用直线距离估计所有满足座位约束的插入方案
+
+        Returns:
+            (绕路公里数, 上车插入位置i, 下车插入位置j) 列表；新上车点插在 points[i] 之后，
+            下车点插在 points[j] 之后（j == i 表示紧接在上车点之后）
+        """
+        points = vehicle.points()
+        loads = vehicle.loads()
+        lats = np.array([p[0] for p in points])
+        lngs = np.array([p[1] for p in points])
+        to_pickup = LocationService.calculate_distances(
+            pickup[0], pickup[1], lats, lngs
+        )
+        to_dropoff = LocationService.calculate_distances(
+            dropoff[0], dropoff[1], lats, lngs
+        )
+        segment = np.array(
+            [
+                LocationService.calculate_distance(
+                    lats[k], lngs[k], lats[k + 1], lngs[k + 1]
+                )
+                for k in range(len(points) - 1)
+            ]
+        )
+
+        n = len(points) - 1
+        options = []
+        for i in range(n + 1):
+            if loads[i] + passengers > vehicle.capacity:
+                continue
+            pickup_detour = to_pickup[i] + (
+                to_pickup[i + 1] - segment[i] if i < n else 0.0
+            )
+            for j in range(i, n + 1):
+                if j > i and loads[j] + passengers > vehicle.capacity:
+                    break
+                if j == i:
+                    detour = (
+                        to_pickup[i]
+                        + direct_km
+                        + (to_dropoff[i + 1] - segment[i] if i < n else 0.0)
+                    )
+                else:
+                    detour = (
+                        pickup_detour
+                        + to_dropoff[j]
+                        + (to_dropoff[j + 1] - segment[j] if j < n else 0.0)
+                    )
+                options.append((detour, i, j))
+        return options
+
+    def _evaluate(
+        self,
+        vehicle: PooledVehicle,
+        i: int,
+        j: int,
+        pickup,
+        dropoff,
+        passengers: int,
+        direct_minutes: float,
+        now: float,
+        eta,
+    ):
+        """用ETA函数精确评估一个插入方案
+
+        Returns:
+            (增加的分钟数, 新停靠序列, 新路段分钟数, 上车到达时间) ，不可行时返回None
+        """
+        new_pickup = Stop(
+            "pickup",
+            None,
+            pickup[0],
+            pickup[1],
+            passengers,
+            now + self.max_wait_minutes * 60,
+        )
+        new_dropoff = Stop("dropoff", None, dropoff[0], dropoff[1], passengers)
+
+        stops = list(vehicle.stops)
+        stops.insert(j, new_dropoff)
+        stops.insert(i, new_pickup)
+
+        # 前一个点没有变化的原有路段直接复用，只查询新增的路段
+        original_previous = {
+            id(stop): (vehicle.stops[m - 1] if m else None, vehicle.legs[m])
+            for m, stop in enumerate(vehicle.stops)
+        }
+        legs = []
+        arrival = now
+        pickup_arrival = None
+        previous = None
+        for stop in stops:
+            known = original_previous.get(id(stop))
+            if known is not None and known[0] is previous:
+                legs.append(known[1])
+            elif previous is None:
+                legs.append(eta(vehicle.lat, vehicle.lng, stop.lat, stop.lng))
+            else:
+                legs.append(eta(previous.lat, previous.lng, stop.lat, stop.lng))
+            previous = stop
+            arrival += legs[-1] * 60
+            if stop is new_pickup:
+                pickup_arrival = arrival
+            elif stop is new_dropoff:
+                # 新乘客的在车时间不超过直达时间的 (1 + max_detour_ratio) 倍
+                stop.latest = (
+                    pickup_arrival
+                    + direct_minutes * (1 + self.max_detour_ratio) * 60
+                    + 1e-6
+                )
+            if stop.latest is not None and arrival > stop.latest:
+                return None
+
+        return sum(legs) - sum(vehicle.legs), stops, legs, pickup_arrival
+
+    def find_insertion(
+        self,
+        pickup_lat: float,
+        pickup_lng: float,
+        dropoff_lat: float,
+        dropoff_lng: float,
+        passengers: int = 1,
+    ):
+        """为拼车请求寻找增加行驶时间最少的车辆和插入位置
+
+        Returns:
+            插入方案字典 {'vehicle_id', 'pickup_index', 'dropoff_index', 'added_minutes',
+            'pickup_eta_minutes', ...}，没有可行车辆时返回None
+        """
+        started = time.perf_counter()
+        now = self._clock()
+        pickup = (pickup_lat, pickup_lng)
+        dropoff = (dropoff_lat, dropoff_lng)
+
+        cache = {}
+
+        def eta(lat1, lng1, lat2, lng2):
+            key = (lat1, lng1, lat2, lng2)
+            if key not in cache:
+                cache[key] = self.eta_fn(lat1, lng1, lat2, lng2)
+            return cache[key]
+
+        # 锁内只剪枝并复制候选车辆，估计和ETA评估在锁外进行
+        with self._lock:
+            vehicles = [
+                self._vehicles[self._ids[row]].snapshot()
+                for row in self._prune(pickup_lat, pickup_lng, passengers)
+            ]
+            vehicle_count = len(self._ids)
+
+        direct_km = LocationService.calculate_distance(
+            pickup_lat, pickup_lng, dropoff_lat, dropoff_lng
+        )
+        options = []
+        for vehicle in vehicles:
+            for detour, i, j in self._estimate(
+                vehicle, pickup, dropoff, passengers, direct_km
+            ):
+                options.append((detour, vehicle, i, j))
+        options.sort(key=lambda option: option[0])
+
+        best = None
+        direct_minutes = (
+            eta(pickup_lat, pickup_lng, dropoff_lat, dropoff_lng) if options else 0.0
+        )
+        evaluated = 0
+        for detour, vehicle, i, j in options[: self.max_evaluations]:
+            result = self._evaluate(
+                vehicle, i, j, pickup, dropoff, passengers, direct_minutes, now, eta
+            )
+            evaluated += 1
+            if result is not None and (best is None or result[0] < best[0]):
+                best = result + (vehicle, i, j)
+
+        self.last_stats = {
+            "vehicles": vehicle_count,
+            "candidates": len(vehicles),
+            "options": len(options),
+            "evaluated": evaluated,
+            "eta_calls": len(cache),
+            "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+        }
+        if best is None:
+            return None
+
+        added, stops, legs, pickup_arrival, vehicle, i, j = best
+        return {
+            "vehicle_id": vehicle.vehicle_id,
+            "pickup_index": i,
+            "dropoff_index": j,
+            "added_minutes": round(added, 2),
+            "pickup_eta_minutes": round((pickup_arrival - now) / 60, 2),
+            "passengers": passengers,
+            "_base": vehicle.stops,
+            "_state": vehicle.state(),
+            "_stops": stops,
+            "_legs": legs,
+        }
+
+    def commit(self, insertion: dict, ride_id) -> bool:
+        """把插入方案写入车辆的停靠序列
+
+        Returns:
+            是否成功（车辆已移除，或停靠序列、位置、乘客数在此期间已变化时返回False，需要重新寻找）
+        """
+        with self._lock:
+            vehicle = self._vehicles.get(insertion["vehicle_id"])
+            if vehicle is None or vehicle.state() != insertion["_state"]:
+                return False
+            base = insertion["_base"]
+            if len(base) != len(vehicle.stops) or any(
+                a is not b for a, b in zip(base, vehicle.stops)
+            ):
+                return False
+            existing = {id(stop) for stop in base}
+            for stop in insertion["_stops"]:
+                if id(stop) not in existing:
+                    stop.ride_id = ride_id
+            stops = insertion["_stops"]
+            vehicle.stops = stops
+            vehicle.legs = insertion["_legs"]
+            self._sync_row(vehicle)
+            return True
+
+    def clear(self) -> None:
+        """清空所有车辆"""
+        with self._lock:
+            self._vehicles.clear()
+            self._rows.clear()
+            self._ids.clear()
+
+
+# 全局拼车引擎实例（未接入行程请求和派单流程）
+pooling_engine = PoolingEngine()
+
+# 导出
+__all__ = ["Stop", "PooledVehicle", "PoolingEngine", "pooling_engine", "default_eta"]
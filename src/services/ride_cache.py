@@ -0,0 +1,151 @@
+"""
+行程详情缓存 - 按行程缓存序列化好的详情响应和版本号，状态转换时失效
+"""
+import os
+import threading
+import time
+from collections import namedtuple
+
+from src.services.cache import TTLCache, MISSING
+from src.services.ride_state import ride_state_machine, ride_transition_listener
+
+# 缓存条目的默认保留时间（秒）：其他worker进程的转换通过 PostgreSQL 通知使缓存失效，
+# 通知丢失（监听连接断开）时缓存最多滞后这么久
+DEFAULT_TTL_SECONDS = 5.0
+
+# 缓存的行程详情：body 为序列化好的JSON响应体，passenger_id/driver_id 用于在不访问数据库的情况下校验查看权限
+CachedRide = namedtuple(
+    "CachedRide", "ride_id version etag body passenger_id driver_id"
+)
+
+
+def ride_etag(ride_id: int, version: int) -> str:
+    """行程详情的ETag（不含引号）"""
+    return f"ride-{ride_id}-v{version}"
+
+
+class _Invalidated:
+    """转换后的失效标记，记录新版本号，防止失效前读到的旧数据再写回缓存"""
+
+    __slots__ = ("version",)
+
+    def __init__(self, version):
+        self.version = version
+
+
+class RideDetailCache:
+    """行程详情的读穿缓存
+
+    未命中时调用 loader 从数据库读取并序列化，之后同一版本的请求直接返回缓存的响应体，
+    条件请求（If-None-Match）比较ETag即可返回304，不访问数据库也不重新序列化。
+    订阅行程状态机和跨进程转换监听器，每次提交的转换都会使对应行程的缓存失效。
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 100000,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        clock=time.monotonic,
+    ):
+        self._cache = TTLCache(maxsize=maxsize, ttl_seconds=ttl_seconds, clock=clock)
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def __len__(self):
+        return len(self._cache)
+
+    def get(self, ride_id: int):
+        """获取缓存的行程详情，未命中或已失效时返回None"""
+        entry = self._cache.lookup(ride_id)
+        if isinstance(entry, CachedRide):
+            self._hits += 1
+            return entry
+        self._misses += 1
+        return None
+
+    def load(self, ride_id: int, loader):
+        """读穿：命中时返回缓存，否则调用 loader(ride_id) 并写入缓存
+
+        Args:
+            ride_id: 行程ID
+            loader: 返回 (版本号, 响应体bytes, 乘客ID, 司机ID) 的函数，行程不存在时返回None
+
+        Returns:
+            CachedRide，行程不存在时为None
+        """
+        entry = self.get(ride_id)
+        if entry is not None:
+            return entry
+        loaded = loader(ride_id)
+        if loaded is None:
+            return None
+        return self.store(ride_id, *loaded)
+
+    def store(
+        self,
+        ride_id: int,
+        version: int,
+        body: bytes,
+        passenger_id: int = None,
+        driver_id: int = None,
+    ) -> CachedRide:
+        """写入行程详情；比缓存中已有版本或失效标记更旧的数据不写入
+
+        司机ID随接单等转换改变，转换同时使版本号加1，因此同一版本的条目中乘客和司机不会过时。
+        """
+        entry = CachedRide(
+            ride_id, version, ride_etag(ride_id, version), body, passenger_id, driver_id
+        )
+        with self._lock:
+            current = self._cache.peek(ride_id)
+            if current is MISSING or current.version <= version:
+                self._cache.set(ride_id, entry)
+        return entry
+
+    def invalidate(self, ride_id: int, version: int = None) -> None:
+        """使行程缓存失效
+
+        Args:
+            ride_id: 行程ID
+            version: 转换后的版本号，给出时保留失效标记，之后只接受不低于该版本的数据；
+                缓存中已是该版本或更新时不做处理（同一转换的重复通知）
+        """
+        with self._lock:
+            if version is None:
+                self._cache.delete(ride_id)
+                return
+            current = self._cache.peek(ride_id)
+            if current is MISSING or current.version < version:
+                self._cache.set(ride_id, _Invalidated(version))
+
+    def on_transitions(self, events) -> None:
+        """行程状态机的订阅者"""
+        for event in events:
+            self.invalidate(event.ride_id, event.version)
+
+    def clear(self) -> None:
+        self._cache.clear()
+        self._hits = self._misses = 0
+
+    def get_stats(self) -> dict:
+        """命中统计（失效标记计为未命中）"""
+        total = self._hits + self._misses
+        return {
+            **self._cache.get_stats(),
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": round(self._hits / total, 4) if total else 0.0,
+        }
+
+
+# 全局行程详情缓存
+ride_detail_cache = RideDetailCache(
+    maxsize=int(os.environ.get("RIDE_CACHE_SIZE", 100000)),
+    ttl_seconds=float(os.environ.get("RIDE_CACHE_TTL_SECONDS", DEFAULT_TTL_SECONDS)),
+)
+ride_state_machine.subscribe(ride_detail_cache.on_transitions)
+ride_transition_listener.subscribe(ride_detail_cache.invalidate)
+
+# 导出
+__all__ = ["RideDetailCache", "ride_detail_cache", "CachedRide", "ride_etag"]
@@ -0,0 +1,619 @@
+"""
+行程状态机 - 集中定义行程状态转换，用条件UPDATE执行，提交成功后批量发布转换事件
+"""
+import itertools
+import logging
+import select as io_select
+import threading
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, event, exists, or_, select, text, update
+from sqlalchemy.orm import Session
+
+from src.models.ride import Ride
+from src.services.database import db
+
+logger = logging.getLogger(__name__)
+
+# 行程状态
+REQUESTED = "requested"
+ACCEPTED = "accepted"
+IN_PROGRESS = "in_progress"
+COMPLETED = "completed"
+CANCELLED = "cancelled"
+
+# 转换动作
+ACCEPT = "accept"
+START = "start"
+COMPLETE = "complete"
+CANCEL = "cancel"
+EXPIRE = "expire"
+
+# 批量转换时每条UPDATE包含的行程数上限
+BULK_CHUNK_SIZE = 500
+
+# 待接单超过该时间仍无司机接单的行程被超时取消（秒）
+DEFAULT_REQUEST_TIMEOUT_SECONDS = 600.0
+
+# 超时检查间隔（秒）
+DEFAULT_EXPIRY_INTERVAL_SECONDS = 30.0
+
+# 跨进程转换通知的 PostgreSQL LISTEN/NOTIFY 频道，以及每条通知包含的转换数上限（负载不超过8000字节）
+NOTIFY_CHANNEL = "ride_transitions"
+NOTIFY_BATCH_SIZE = 200
+
+# 通知连接断开后重连的间隔（秒）
+DEFAULT_RECONNECT_SECONDS = 5.0
+
+# 提交后发布的转换事件；version 为转换后的行程版本号，values 为本次转换写入的其他列（如 actual_fare）
+RideTransition = namedtuple(
+    "RideTransition", "ride_id action status version passenger_id driver_id values at"
+)
+
+
+class Transition:
+    """一种状态转换
+
+    Args:
+        action: 动作名
+        sources: 允许的原状态
+        target: 目标状态
+        timestamp: 记录转换时间的列
+        guards: 可选的相等条件列（如只有行程的司机可以开始行程），调用时不给出则不限制
+        assigns: 转换时同时写入的列，调用时必须给出
+        unassigned: 是否要求行程尚无司机
+        offered: 是否要求行程没有派给其他司机（或派单已过期），与写入的 driver_id 比较，转换时清除派单
+        exclusive: 是否要求写入的 driver_id 没有其他已接单未开始的行程（每个司机最多预留一单）
+    """
+
+    def __init__(
+        self,
+        action: str,
+        sources,
+        target: str,
+        timestamp: str,
+        guards=(),
+        assigns=(),
+        unassigned: bool = False,
+        offered: bool = False,
+        exclusive: bool = False,
+    ):
+        self.action = action
+        self.sources = tuple(sources)
+        self.target = target
+        self.timestamp = timestamp
+        self.guards = tuple(guards)
+        self.assigns = tuple(assigns)
+        self.unassigned = unassigned
+        self.offered = offered
+        self.exclusive = exclusive
+        self._statements = {}
+
+    def compile(self) -> None:
+        """为每种守卫组合预先构造 UPDATE ... RETURNING 和对应的 SELECT ... FOR UPDATE 语句"""
+        table = Ride.__table__
+        values = {
+            "status": self.target,
+            "version": table.c.version + 1,
+            self.timestamp: bindparam("now"),
+        }
+        values.update({column: bindparam(f"set_{column}") for column in self.assigns})
+        if self.offered:
+            values.update({"offered_driver_id": None, "offer_expires_at": None})
+        returning = (
+            table.c.id,
+            table.c.version,
+            table.c.passenger_id,
+            table.c.driver_id,
+        )
+        other = table.alias("other_rides")
+
+        for count in range(len(self.guards) + 1):
+            for guards in itertools.combinations(self.guards, count):
+                conditions = [
+                    table.c.id.in_(bindparam("ride_ids", expanding=True)),
+                    table.c.status.in_(self.sources),
+                ]
+                if self.unassigned:
+                    conditions.append(table.c.driver_id.is_(None))
+                if self.offered:
+                    conditions.append(
+                        or_(
+                            table.c.offered_driver_id.is_(None),
+                            table.c.offered_driver_id == bindparam("set_driver_id"),
+                            table.c.offer_expires_at < bindparam("now"),
+                        )
+                    )
+                if self.exclusive:
+                    conditions.append(
+                        ~exists().where(
+                            other.c.driver_id == bindparam("set_driver_id"),
+                            other.c.status == ACCEPTED,
+                        )
+                    )
+                conditions.extend(
+                    table.c[guard] == bindparam(f"guard_{guard}") for guard in guards
+                )
+
+                statement = update(table).where(*conditions).values(values)
+                self._statements[frozenset(guards)] = (
+                    statement.returning(*returning),
+                    statement,
+                    select(*returning).where(*conditions).with_for_update(),
+                )
+
+    def statements(self, guards) -> tuple:
+        return self._statements[frozenset(guards)]
+
+
+# 转换表：动作 -> 转换
+TRANSITIONS = {
+    transition.action: transition
+    for transition in (
+        Transition(
+            ACCEPT,
+            (REQUESTED,),
+            ACCEPTED,
+            "accepted_at",
+            assigns=("driver_id",),
+            unassigned=True,
+            offered=True,
+            exclusive=True,
+        ),
+        Transition(
+            START, (ACCEPTED,), IN_PROGRESS, "started_at", guards=("driver_id",)
+        ),
+        Transition(
+            COMPLETE,
+            (IN_PROGRESS,),
+            COMPLETED,
+            "completed_at",
+            guards=("driver_id",),
+            assigns=("actual_fare",),
+        ),
+        Transition(
+            CANCEL,
+            (REQUESTED, ACCEPTED),
+            CANCELLED,
+            "cancelled_at",
+            guards=("passenger_id",),
+        ),
+        Transition(EXPIRE, (REQUESTED,), CANCELLED, "cancelled_at", unassigned=True),
+    )
+}
+for _transition in TRANSITIONS.values():
+    _transition.compile()
+
+# 状态 -> 允许的动作
+ALLOWED_ACTIONS = {
+    status: frozenset(
+        action
+        for action, transition in TRANSITIONS.items()
+        if status in transition.sources
+    )
+    for status in (REQUESTED, ACCEPTED, IN_PROGRESS, COMPLETED, CANCELLED)
+}
+
+
+def format_notification(events) -> str:
+    """转换通知负载：逗号分隔的 行程ID:版本号"""
+    return ",".join(
+        f"{ride_event.ride_id}:{ride_event.version}" for ride_event in events
+    )
+
+
+def parse_notification(payload: str) -> list:
+    """解析转换通知负载，返回 [(行程ID, 版本号), ...]，忽略格式错误的项"""
+    pairs = []
+    for item in (payload or "").split(","):
+        ride_id, _, version = item.partition(":")
+        try:
+            pairs.append((int(ride_id), int(version)))
+        except ValueError:
+            continue
+    return pairs
+
+
+def can_transition(status: str, action: str) -> bool:
+    """当前状态是否允许该动作"""
+    return action in ALLOWED_ACTIONS.get(status, ())
+
+
+class RideStateMachine:
+    """行程状态机
+
+    所有状态变化都通过这里：每个动作对应转换表中预先构造好的条件UPDATE，
+    原状态、守卫条件（如行程属于该司机）都在WHERE中，由影响的行判断是否成功，
+    不先查后改，并发请求中只有一个能完成同一转换。每次转换把行程的 version 加1。调用方负责提交或回滚，
+    可以把转换和其他写入（如司机可用状态）放在同一事务中。
+
+    成功的转换先暂存在会话上，提交成功后每次提交作为一批发布给订阅者（通知、
+    缓存失效等）；回滚时丢弃，订阅者不会看到未生效的转换。
+    PostgreSQL 上同一事务中还会 NOTIFY 行程ID和新版本号，由其他进程的 RideTransitionListener 接收。
+    """
+
+    def __init__(self, chunk_size: int = BULK_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self._pending_key = ("ride_transitions", id(self))
+        self._subscribers = []
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.stats = {
+            "transitions": 0,
+            "rejected": 0,
+            "batches": 0,
+            "published": 0,
+            "expired": 0,
+        }
+        if not event.contains(Session, "after_commit", self._publish):
+            event.listen(Session, "after_commit", self._publish)
+            event.listen(Session, "after_rollback", self._discard)
+
+    def subscribe(self, callback) -> None:
+        """订阅转换事件，callback(events) 在每次提交后以该事务的全部转换调用一次"""
+        if callback not in self._subscribers:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback) -> None:
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    def transition(self, ride_id: int, action: str, now: datetime = None, **params):
+        """执行单个行程的转换
+
+        Args:
+            ride_id: 行程ID
+            action: 动作（见 TRANSITIONS）
+            now: 转换时间（UTC），None表示当前时间
+            **params: 转换需要写入的列和可选的守卫条件，如 driver_id、actual_fare
+
+        Returns:
+            转换事件；行程不存在、状态不允许或守卫条件不满足时为None
+        """
+        events = self.transition_many([ride_id], action, now=now, **params)
+        return events[0] if events else None
+
+    def transition_many(
+        self, ride_ids, action: str, now: datetime = None, **params
+    ) -> list:
+        """批量执行同一种转换（管理操作和超时任务）
+
+        每 chunk_size 个行程一条UPDATE，不满足条件的行程跳过。
+
+        Returns:
+            成功转换的事件列表
+        """
+        transition = TRANSITIONS.get(action)
+        if transition is None:
+            raise ValueError(f"Unknown ride transition: {action}")
+        missing = [
+            column for column in transition.assigns if params.get(column) is None
+        ]
+        if missing:
+            raise ValueError(f'{action} requires {", ".join(missing)}')
+        unknown = set(params) - set(transition.assigns) - set(transition.guards)
+        if unknown:
+            raise ValueError(
+                f'Unexpected parameters for {action}: {", ".join(sorted(unknown))}'
+            )
+
+        ride_ids = list(dict.fromkeys(ride_ids))
+        if not ride_ids:
+            return []
+
+        guards = [
+            column for column in transition.guards if params.get(column) is not None
+        ]
+        returning, plain, locking = transition.statements(guards)
+        now = now or datetime.utcnow()
+        bind = {"now": now}
+        bind.update({f"set_{column}": params[column] for column in transition.assigns})
+        bind.update({f"guard_{column}": params[column] for column in guards})
+        values = {column: params[column] for column in transition.assigns}
+
+        session = db.session()
+        supports_returning = session.get_bind().dialect.update_returning
+        events = []
+        for start in range(0, len(ride_ids), self.chunk_size):
+            bind["ride_ids"] = ride_ids[start : start + self.chunk_size]
+            if supports_returning:
+                rows = session.execute(returning, bind).all()
+            else:
+                # 先锁定满足条件的行再更新，读到的是更新前的版本号
+                rows = session.execute(locking, bind).all()
+                if rows:
+                    session.execute(
+                        plain, {**bind, "ride_ids": [row.id for row in rows]}
+                    )
+                rows = [
+                    (row.id, row.version + 1, row.passenger_id, row.driver_id)
+                    for row in rows
+                ]
+            for ride_id, version, passenger_id, driver_id in rows:
+                driver_id = values.get("driver_id", driver_id)
+                events.append(
+                    RideTransition(
+                        ride_id,
+                        action,
+                        transition.target,
+                        version,
+                        passenger_id,
+                        driver_id,
+                        values,
+                        now,
+                    )
+                )
+
+        # 会话中已加载的行程对象过期，之后读取时从数据库刷新
+        for ride_event in events:
+            ride = session.identity_map.get(
+                session.identity_key(Ride, ride_event.ride_id)
+            )
+            if ride is not None:
+                session.expire(ride)
+
+        self.stats["transitions"] += len(events)
+        self.stats["rejected"] += len(ride_ids) - len(events)
+        if events:
+            session.info.setdefault(self._pending_key, []).extend(events)
+            if session.get_bind().dialect.name == "postgresql":
+                self._notify(session, events)
+        return events
+
+    def _notify(self, session, events) -> None:
+        """在当前事务中通知其他进程：NOTIFY 在提交时才投递，回滚时丢弃"""
+        for start in range(0, len(events), NOTIFY_BATCH_SIZE):
+            session.execute(
+                text("SELECT pg_notify(:channel, :payload)"),
+                {
+                    "channel": NOTIFY_CHANNEL,
+                    "payload": format_notification(
+                        events[start : start + NOTIFY_BATCH_SIZE]
+                    ),
+                },
+            )
+
+    def expire_requests(
+        self,
+        timeout_seconds: float = DEFAULT_REQUEST_TIMEOUT_SECONDS,
+        now: datetime = None,
+        limit: int = BULK_CHUNK_SIZE * 10,
+    ) -> list:
+        """超时取消等待过久仍无司机接单的行程并提交（需要应用上下文）
+
+        Returns:
+            被取消的转换事件列表
+        """
+        now = now or datetime.utcnow()
+        ride_ids = (
+            db.session.execute(
+                select(Ride.id)
+                .where(
+                    Ride.status == REQUESTED,
+                    Ride.driver_id.is_(None),
+                    Ride.requested_at < now - timedelta(seconds=timeout_seconds),
+                )
+                .order_by(Ride.requested_at)
+                .limit(limit)
+            )
+            .scalars()
+            .all()
+        )
+        if not ride_ids:
+            return []
+
+        try:
+            events = self.transition_many(ride_ids, EXPIRE, now=now)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        self.stats["expired"] += len(events)
+        return events
+
+    def expire_if_leader(
+        self,
+        timeout_seconds: float = DEFAULT_REQUEST_TIMEOUT_SECONDS,
+        leader_lock=None,
+    ) -> list:
+        """只在持有 leader_lock 的进程执行超时取消，其他进程直接返回（需要应用上下文）
+
+        锁由批量派单线程获取和维持，这里只读取 held，不使用锁的连接。
+        没有给出 leader_lock 时总是执行。
+        """
+        if leader_lock is not None and not leader_lock.held:
+            return []
+        return self.expire_requests(timeout_seconds)
+
+    def _publish(self, session) -> None:
+        events = session.info.pop(self._pending_key, None)
+        if not events:
+            return
+        self.stats["batches"] += 1
+        self.stats["published"] += len(events)
+        for callback in list(self._subscribers):
+            try:
+                callback(events)
+            except Exception as e:
+                logger.error(f"Ride transition subscriber failed: {e}")
+
+    def _discard(self, session) -> None:
+        session.info.pop(self._pending_key, None)
+
+    def start(
+        self,
+        app,
+        timeout_seconds: float = DEFAULT_REQUEST_TIMEOUT_SECONDS,
+        interval_seconds: float = DEFAULT_EXPIRY_INTERVAL_SECONDS,
+        leader_lock=None,
+    ) -> None:
+        """启动后台超时任务
+
+        每个工作进程都会启动线程，给出 leader_lock（批量派单器的锁）时
+        只有派单leader进程执行超时取消。
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run,
+            args=(app, timeout_seconds, interval_seconds, leader_lock),
+            name="ride-expiry",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """停止后台超时任务"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, app, timeout_seconds, interval_seconds, leader_lock):
+        while not self._stop_event.wait(interval_seconds):
+            try:
+                with app.app_context():
+                    self.expire_if_leader(timeout_seconds, leader_lock)
+            except Exception as e:
+                logger.error(f"Failed to expire ride requests: {e}")
+
+
+class RideTransitionListener:
+    """接收其他进程提交的行程转换
+
+    本进程的订阅者只看到本进程提交的转换。PostgreSQL 上监听器在一条专用连接上 LISTEN，
+    把其他工作进程（以及本进程自己）提交的转换以 handler(行程ID, 版本号) 转发，
+    用于唤醒长轮询等待者、使行程详情缓存失效；处理函数需要能接受重复的通知。
+    其他数据库（开发用的SQLite）只跑一个进程，不启动监听。
+    连接断开期间的通知会丢失，等待者的超时重查和缓存的TTL兜底。
+    """
+
+    def __init__(
+        self,
+        channel: str = NOTIFY_CHANNEL,
+        poll_seconds: float = 1.0,
+        reconnect_seconds: float = DEFAULT_RECONNECT_SECONDS,
+    ):
+        self.channel = channel
+        self.poll_seconds = poll_seconds
+        self.reconnect_seconds = reconnect_seconds
+        self._handlers = []
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.stats = {"notifications": 0, "transitions": 0, "reconnects": 0}
+
+    def subscribe(self, handler) -> None:
+        """订阅其他进程的转换，handler(ride_id, version)"""
+        if handler not in self._handlers:
+            self._handlers.append(handler)
+
+    def unsubscribe(self, handler) -> None:
+        if handler in self._handlers:
+            self._handlers.remove(handler)
+
+    def dispatch(self, payload: str) -> None:
+        """把一条通知转发给订阅者"""
+        self.stats["notifications"] += 1
+        for ride_id, version in parse_notification(payload):
+            self.stats["transitions"] += 1
+            for handler in list(self._handlers):
+                try:
+                    handler(ride_id, version)
+                except Exception as e:
+                    logger.error(f"Ride transition handler failed: {e}")
+
+    def start(self, app) -> bool:
+        """启动后台监听线程
+
+        Returns:
+            是否启动（非PostgreSQL数据库时不启动）
+        """
+        with app.app_context():
+            if db.engine.dialect.name != "postgresql":
+                return False
+        if self._thread is not None and self._thread.is_alive():
+            return True
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(app,), name="ride-transition-listener", daemon=True
+        )
+        self._thread.start()
+        return True
+
+    def stop(self) -> None:
+        """停止后台监听线程"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _connect(self, app):
+        """打开不归还连接池的专用连接并开始监听"""
+        with app.app_context():
+            pooled = db.engine.raw_connection()
+        pooled.detach()
+        connection = pooled.driver_connection
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute(f"LISTEN {self.channel}")
+        return connection
+
+    def _run(self, app):
+        while not self._stop_event.is_set():
+            connection = None
+            try:
+                connection = self._connect(app)
+                while not self._stop_event.is_set():
+                    if io_select.select([connection], [], [], self.poll_seconds) == (
+                        [],
+                        [],
+                        [],
+                    ):
+                        continue
+                    connection.poll()
+                    while connection.notifies:
+                        self.dispatch(connection.notifies.pop(0).payload)
+            except Exception as e:
+                logger.error(f"Ride transition listener disconnected: {e}")
+                self.stats["reconnects"] += 1
+            finally:
+                if connection is not None:
+                    try:
+                        connection.close()
+                    except Exception:
+                        pass
+            self._stop_event.wait(self.reconnect_seconds)
+
+
+# 全局行程状态机
+ride_state_machine = RideStateMachine()
+
+# 全局跨进程转换监听器
+ride_transition_listener = RideTransitionListener()
+
+# 导出
+__all__ = [
+    "RideStateMachine",
+    "ride_state_machine",
+    "RideTransitionListener",
+    "ride_transition_listener",
+    "RideTransition",
+    "format_notification",
+    "parse_notification",
+    "Transition",
+    "TRANSITIONS",
+    "ALLOWED_ACTIONS",
+    "can_transition",
+    "REQUESTED",
+    "ACCEPTED",
+    "IN_PROGRESS",
+    "COMPLETED",
+    "CANCELLED",
+    "ACCEPT",
+    "START",
+    "COMPLETE",
+    "CANCEL",
+    "EXPIRE",
+]
@@ -0,0 +1,145 @@
+"""
+行程状态等待 - 长轮询请求按行程登记等待条件，状态转换提交后唤醒
+"""
+import os
+import threading
+import time
+
+from src.services.cache import TTLCache, MISSING
+from src.services.ride_state import ride_state_machine, ride_transition_listener
+
+# 单个进程同时等待的请求数上限，超过时不再等待，立即返回当前状态
+DEFAULT_MAX_WAITERS = 10000
+
+# 记住最近转换版本号的时间（秒），用于发现检查和开始等待之间发生的转换
+DEFAULT_VERSION_TTL_SECONDS = 120.0
+
+
+class _Watch:
+    """同一行程的全部等待者共享一个条件变量"""
+
+    __slots__ = ("condition", "waiters")
+
+    def __init__(self, lock):
+        self.condition = threading.Condition(lock)
+        self.waiters = 0
+
+
+class RideWatchRegistry:
+    """按行程登记的等待条件
+
+    所有条件变量共用一把锁，每个有等待者的行程一个条件变量，最后一个等待者离开时删除；
+    没有等待者的行程不占用任何对象。转换提交后只唤醒该行程的等待者。
+
+    长轮询由单独的 gevent 进程（src.longpoll）处理，标准库的锁和条件变量被替换为协程版本，
+    一个进程可以同时挂起数千个请求，每个只占一个greenlet；主应用的 gthread worker 不受影响。
+    其他进程提交的转换经跨进程转换监听器唤醒等待者。
+    最近的版本号单独记录一段时间，请求检查状态之后、开始等待之前发生的转换不会被错过。
+    """
+
+    def __init__(
+        self,
+        max_waiters: int = DEFAULT_MAX_WAITERS,
+        version_ttl_seconds: float = DEFAULT_VERSION_TTL_SECONDS,
+        clock=time.monotonic,
+    ):
+        self.max_waiters = max_waiters
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._watches = {}  # ride_id -> _Watch
+        self._versions = TTLCache(
+            maxsize=max(max_waiters * 10, 1000),
+            ttl_seconds=version_ttl_seconds,
+            clock=clock,
+        )
+        self.waiting = 0
+        self.stats = {
+            "waits": 0,
+            "woken": 0,
+            "timeouts": 0,
+            "rejected": 0,
+            "notifications": 0,
+        }
+
+    def __len__(self):
+        """有等待者的行程数"""
+        return len(self._watches)
+
+    def latest_version(self, ride_id: int):
+        """最近转换后的版本号，没有记录时为None"""
+        version = self._versions.peek(ride_id)
+        return None if version is MISSING else version
+
+    def wait(self, ride_id: int, version: int, timeout: float):
+        """等待行程版本号超过 version
+
+        Args:
+            ride_id: 行程ID
+            version: 客户端已知的版本号
+            timeout: 最长等待时间（秒）
+
+        Returns:
+            新的版本号；超时或等待者已满时为None
+        """
+        deadline = self._clock() + timeout
+        with self._lock:
+            latest = self.latest_version(ride_id)
+            if latest is not None and latest > version:
+                return latest
+            if self.waiting >= self.max_waiters:
+                self.stats["rejected"] += 1
+                return None
+
+            watch = self._watches.get(ride_id)
+            if watch is None:
+                watch = self._watches[ride_id] = _Watch(self._lock)
+            watch.waiters += 1
+            self.waiting += 1
+            self.stats["waits"] += 1
+            try:
+                while True:
+                    latest = self.latest_version(ride_id)
+                    if latest is not None and latest > version:
+                        self.stats["woken"] += 1
+                        return latest
+                    remaining = deadline - self._clock()
+                    if remaining <= 0:
+                        self.stats["timeouts"] += 1
+                        return None
+                    watch.condition.wait(remaining)
+            finally:
+                watch.waiters -= 1
+                self.waiting -= 1
+                if watch.waiters == 0:
+                    del self._watches[ride_id]
+
+    def notify(self, ride_id: int, version: int) -> None:
+        """记录行程的新版本号并唤醒它的等待者"""
+        with self._lock:
+            latest = self.latest_version(ride_id)
+            if latest is None or version > latest:
+                self._versions.set(ride_id, version)
+            watch = self._watches.get(ride_id)
+            if watch is not None:
+                self.stats["notifications"] += 1
+                watch.condition.notify_all()
+
+    def on_transitions(self, events) -> None:
+        """行程状态机的订阅者"""
+        for event in events:
+            self.notify(event.ride_id, event.version)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {**self.stats, "waiting": self.waiting, "rides": len(self._watches)}
+
+
+# 全局行程等待登记
+ride_watch_registry = RideWatchRegistry(
+    max_waiters=int(os.environ.get("RIDE_WATCH_MAX_WAITERS", DEFAULT_MAX_WAITERS))
+)
+ride_state_machine.subscribe(ride_watch_registry.on_transitions)
+ride_transition_listener.subscribe(ride_watch_registry.notify)
+
+# 导出
+__all__ = ["RideWatchRegistry", "ride_watch_registry"]
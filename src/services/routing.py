@@ -0,0 +1,375 @@
+"""
+路网路由服务 - 加载本地路网文件，基于ALT（A*+地标+三角不等式）计算最短行驶时间
+"""
+import heapq
+import logging
+import math
+import os
+import threading
+
+import numpy as np
+
+from src.services.kdtree import KDTree, to_unit_vectors, chord_to_km
+
+logger = logging.getLogger(__name__)
+
+# 默认地标数量
+DEFAULT_LANDMARK_COUNT = 16
+
+# 坐标吸附到路网节点的最大距离（公里），超出则认为不在路网覆盖范围内
+DEFAULT_MAX_SNAP_KM = 1.0
+
+
+class RoadGraph:
+    """压缩邻接表（CSR）形式的有向路网
+
+    文件格式为NumPy .npz：
+        lats, lngs            节点坐标 (float64)
+        offsets               每个节点出边在边数组中的起始位置 (int64, 节点数+1)
+        targets               边的终点 (int32)
+        times                 边的行驶时间，秒 (float32)
+        lengths               边的长度，米 (float32)
+        landmarks             可选，地标节点 (int32)
+        landmark_from         可选，地标到各节点的最短时间 (float32, 地标数 x 节点数)
+        landmark_to           可选，各节点到地标的最短时间 (float32, 地标数 x 节点数)
+    """
+
+    def __init__(
+        self,
+        lats,
+        lngs,
+        offsets,
+        targets,
+        times,
+        lengths,
+        landmarks=None,
+        landmark_from=None,
+        landmark_to=None,
+    ):
+        self.lats = np.asarray(lats, dtype=np.float64)
+        self.lngs = np.asarray(lngs, dtype=np.float64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.targets = np.asarray(targets, dtype=np.int32)
+        self.times = np.asarray(times, dtype=np.float32)
+        self.lengths = np.asarray(lengths, dtype=np.float32)
+        self.landmarks = (
+            None if landmarks is None else np.asarray(landmarks, dtype=np.int32)
+        )
+        self.landmark_from = (
+            None
+            if landmark_from is None
+            else np.asarray(landmark_from, dtype=np.float32)
+        )
+        self.landmark_to = (
+            None if landmark_to is None else np.asarray(landmark_to, dtype=np.float32)
+        )
+
+    @property
+    def node_count(self) -> int:
+        return len(self.lats)
+
+    @property
+    def edge_count(self) -> int:
+        return len(self.targets)
+
+    @classmethod
+    def from_edges(cls, lats, lngs, sources, targets, times, lengths):
+        """从边列表构建路网
+
+        Args:
+            lats: 节点纬度
+            lngs: 节点经度
+            sources: 边的起点
+            targets: 边的终点
+            times: 边的行驶时间（秒）
+            lengths: 边的长度（米）
+        """
+        sources = np.asarray(sources, dtype=np.int64)
+        order = np.argsort(sources, kind="stable")
+        counts = np.bincount(sources, minlength=len(lats))
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        return cls(
+            lats,
+            lngs,
+            offsets,
+            np.asarray(targets)[order],
+            np.asarray(times)[order],
+            np.asarray(lengths)[order],
+        )
+
+    @classmethod
+    def load(cls, path: str):
+        """从 .npz 文件加载路网"""
+        with np.load(path) as data:
+            optional = {
+                name: data[name]
+                for name in ("landmarks", "landmark_from", "landmark_to")
+                if name in data
+            }
+            return cls(
+                data["lats"],
+                data["lngs"],
+                data["offsets"],
+                data["targets"],
+                data["times"],
+                data["lengths"],
+                **optional,
+            )
+
+    def save(self, path: str) -> None:
+        """保存为压缩的 .npz 文件"""
+        arrays = {
+            "lats": self.lats,
+            "lngs": self.lngs,
+            "offsets": self.offsets,
+            "targets": self.targets,
+            "times": self.times,
+            "lengths": self.lengths,
+        }
+        if self.landmarks is not None:
+            arrays.update(
+                landmarks=self.landmarks,
+                landmark_from=self.landmark_from,
+                landmark_to=self.landmark_to,
+            )
+        np.savez_compressed(path, **arrays)
+
+    def reversed(self):
+        """返回所有边反向后的路网"""
+        sources = np.repeat(np.arange(self.node_count), np.diff(self.offsets))
+        return RoadGraph.from_edges(
+            self.lats, self.lngs, self.targets, sources, self.times, self.lengths
+        )
+
+    def shortest_times_from(self, source: int) -> np.ndarray:
+        """单源Dijkstra，返回到所有节点的最短行驶时间（不可达为inf）"""
+        offsets = self.offsets.tolist()
+        targets = self.targets.tolist()
+        times = self.times.tolist()
+
+        dist = [math.inf] * self.node_count
+        dist[source] = 0.0
+        heap = [(0.0, source)]
+        while heap:
+            d, node = heapq.heappop(heap)
+            if d > dist[node]:
+                continue
+            for edge in range(offsets[node], offsets[node + 1]):
+                target = targets[edge]
+                candidate = d + times[edge]
+                if candidate < dist[target]:
+                    dist[target] = candidate
+                    heapq.heappush(heap, (candidate, target))
+        return np.array(dist, dtype=np.float64)
+
+    def build_landmarks(
+        self, count: int = DEFAULT_LANDMARK_COUNT, seed: int = 0
+    ) -> None:
+        """选择地标并预计算地标距离表（最远点策略）
+
+        Args:
+            count: 地标数量
+            seed: 随机种子（决定第一个起始点）
+        """
+        if self.node_count == 0:
+            return
+
+        count = min(count, self.node_count)
+        reverse = self.reversed()
+        rng = np.random.default_rng(seed)
+
+        landmarks = []
+        from_rows = []
+        to_rows = []
+        # 离已选地标最远（按双向时间之和）的节点作为下一个地标
+        score = np.zeros(self.node_count)
+        candidate = int(rng.integers(self.node_count))
+        for _ in range(count):
+            landmarks.append(candidate)
+            forward = self.shortest_times_from(candidate)
+            backward = reverse.shortest_times_from(candidate)
+            from_rows.append(forward)
+            to_rows.append(backward)
+
+            reach = np.where(np.isfinite(forward), forward, 0) + np.where(
+                np.isfinite(backward), backward, 0
+            )
+            score = reach if len(landmarks) == 1 else np.minimum(score, reach)
+            score[landmarks] = -1
+            candidate = int(np.argmax(score))
+
+        self.landmarks = np.array(landmarks, dtype=np.int32)
+        self.landmark_from = np.array(from_rows, dtype=np.float32)
+        self.landmark_to = np.array(to_rows, dtype=np.float32)
+
+
+class RoutingEngine:
+    """点到点最短行驶时间查询
+
+    坐标先吸附到最近的路网节点，然后用ALT启发式的A*搜索：
+    h(v) = max_l max(d(l,t) - d(l,v), d(v,l) - d(t,l))，由三角不等式保证可采纳。
+
+    地标距离表必须离线预计算（scripts/build_road_graph.py），大路网上现算需要
+    几十次完整Dijkstra，不能放在服务进程的请求路径上。
+    """
+
+    def __init__(self, graph: RoadGraph, max_snap_km: float = DEFAULT_MAX_SNAP_KM):
+        if graph.landmarks is None or len(graph.landmarks) == 0:
+            raise ValueError(
+                "Road graph has no precomputed landmarks; "
+                "rebuild it with scripts/build_road_graph.py"
+            )
+
+        self.graph = graph
+        self.max_snap_km = max_snap_km
+        self._offsets = graph.offsets.tolist()
+        self._targets = graph.targets.tolist()
+        self._times = graph.times.tolist()
+        self._lengths = graph.lengths.tolist()
+        # 按节点存放地标距离，启发函数中避免NumPy的单元素访问开销
+        self._landmark_from = (
+            graph.landmark_from.T.tolist() if graph.landmark_from is not None else []
+        )
+        self._landmark_to = (
+            graph.landmark_to.T.tolist() if graph.landmark_to is not None else []
+        )
+        self._tree = KDTree(to_unit_vectors(graph.lats, graph.lngs))
+
+    @classmethod
+    def load(cls, path: str, max_snap_km: float = DEFAULT_MAX_SNAP_KM):
+        """从路网文件创建路由引擎"""
+        return cls(RoadGraph.load(path), max_snap_km=max_snap_km)
+
+    def snap(self, lat: float, lng: float):
+        """返回离坐标最近的路网节点；超出吸附距离时返回None"""
+        idx, dist = self._tree.query(to_unit_vectors([lat], [lng])[0], 1)
+        if len(idx) == 0 or float(chord_to_km(dist[0])) > self.max_snap_km:
+            return None
+        return int(idx[0])
+
+    def shortest_path(self, source: int, target: int):
+        """计算两个节点之间的最短行驶时间路径
+
+        Returns:
+            (行驶时间秒, 长度米)；不可达时返回None
+        """
+        if source == target:
+            return 0.0, 0.0
+
+        target_from = self._landmark_from[target]
+        target_to = self._landmark_to[target]
+        landmark_from = self._landmark_from
+        landmark_to = self._landmark_to
+        inf = math.inf
+
+        def heuristic(node):
+            best = 0.0
+            node_from = landmark_from[node]
+            node_to = landmark_to[node]
+            for landmark in range(len(target_from)):
+                forward = target_from[landmark] - node_from[landmark]
+                if forward > best and forward != inf:
+                    best = forward
+                backward = node_to[landmark] - target_to[landmark]
+                if backward > best and backward != inf:
+                    best = backward
+            return best
+
+        offsets, targets, times, lengths = (
+            self._offsets,
+            self._targets,
+            self._times,
+            self._lengths,
+        )
+        dist = {source: 0.0}
+        length = {source: 0.0}
+        settled = set()
+        heap = [(heuristic(source), source)]
+        while heap:
+            _, node = heapq.heappop(heap)
+            if node in settled:
+                continue
+            if node == target:
+                return dist[node], length[node]
+            settled.add(node)
+
+            d = dist[node]
+            for edge in range(offsets[node], offsets[node + 1]):
+                neighbor = targets[edge]
+                if neighbor in settled:
+                    continue
+                candidate = d + times[edge]
+                if candidate < dist.get(neighbor, inf):
+                    dist[neighbor] = candidate
+                    length[neighbor] = length[node] + lengths[edge]
+                    heapq.heappush(heap, (candidate + heuristic(neighbor), neighbor))
+        return None
+
+    def route(self, lat1: float, lng1: float, lat2: float, lng2: float):
+        """计算两个坐标之间的行驶时间和距离
+
+        Returns:
+            {'duration_minutes', 'distance_km'}；坐标不在路网范围内或不可达时返回None
+        """
+        source = self.snap(lat1, lng1)
+        target = self.snap(lat2, lng2)
+        if source is None or target is None:
+            return None
+
+        result = self.shortest_path(source, target)
+        if result is None:
+            return None
+
+        seconds, meters = result
+        return {"duration_minutes": seconds / 60.0, "distance_km": meters / 1000.0}
+
+
+_engine = None
+_engine_loaded = False
+_engine_lock = threading.Lock()
+
+
+def get_routing_engine():
+    """获取全局路由引擎
+
+    路网文件由环境变量 ROAD_GRAPH_PATH 指定，首次调用时加载（服务启动时预先调用）；
+    未配置、加载失败或文件缺少地标时返回None，调用方应回退到直线距离估算。
+    """
+    global _engine, _engine_loaded
+    if _engine_loaded:
+        return _engine
+
+    with _engine_lock:
+        if not _engine_loaded:
+            path = os.environ.get("ROAD_GRAPH_PATH")
+            if path:
+                try:
+                    _engine = RoutingEngine.load(
+                        path,
+                        max_snap_km=float(
+                            os.environ.get(
+                                "ROAD_GRAPH_MAX_SNAP_KM", DEFAULT_MAX_SNAP_KM
+                            )
+                        ),
+                    )
+                    logger.info(
+                        f"Loaded road graph from {path}: "
+                        f"{_engine.graph.node_count} nodes"
+                    )
+                except Exception as e:
+                    logger.error(f"Failed to load road graph {path}: {e}")
+                    _engine = None
+            _engine_loaded = True
+    return _engine
+
+
+def set_routing_engine(engine) -> None:
+    """设置全局路由引擎（None表示禁用路网路由）"""
+    global _engine, _engine_loaded
+    with _engine_lock:
+        _engine = engine
+        _engine_loaded = True
+
+
+# 导出
+__all__ = ["RoadGraph", "RoutingEngine", "get_routing_engine", "set_routing_engine"]
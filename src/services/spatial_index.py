@@ -0,0 +1,364 @@
+"""
+空间索引服务 - 在内存中维护可用司机位置的均匀经纬度网格索引
+"""
+import heapq
+import math
+import threading
+
+# 地球半径（公里）
+EARTH_RADIUS_KM = 6371.0
+
+# 每纬度对应的公里数
+KM_PER_DEG_LAT = math.pi * EARTH_RADIUS_KM / 180.0
+
+# 默认网格边长（度），约1.1公里
+DEFAULT_CELL_SIZE_DEG = 0.01
+
+
+def haversine_km(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """计算两个坐标点之间的大圆距离（公里）"""
+    lat1_rad = math.radians(lat1)
+    lat2_rad = math.radians(lat2)
+    dlat = lat2_rad - lat1_rad
+    dlng = math.radians(lng2 - lng1)
+    a = (
+        math.sin(dlat / 2) ** 2
+        + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(dlng / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class DriverGridIndex:
+    """可用司机的网格空间索引
+
+    把经纬度平面按固定边长切分为网格，每个网格保存落在其中的司机坐标。
+    位置更新只移动单个司机所在的网格，半径查询只扫描覆盖圆的网格，
+    Top-K查询从中心网格逐圈向外扩展，直到剩余网格不可能更近为止。
+
+    注意：索引是进程内状态，gunicorn的每个worker各自维护一份，
+    启动时可以用 bulk_load 从数据库预热。
+    """
+
+    def __init__(self, cell_size_deg: float = DEFAULT_CELL_SIZE_DEG):
+        self.cell_size_deg = cell_size_deg
+        self._cells = {}  # (row, col) -> {driver_id: (lat, lng)}
+        self._positions = {}  # driver_id -> (lat, lng, (row, col))
+        self._info = {}  # driver_id -> 附加信息（姓名、评分等）
+        self._bounds = None  # 出现过的网格行列范围 [row_min, row_max, col_min, col_max]
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, driver_id):
+        return driver_id in self._positions
+
+    def _cell_of(self, lat: float, lng: float) -> tuple:
+        size = self.cell_size_deg
+        return int(math.floor(lat / size)), int(math.floor(lng / size))
+
+    def upsert(self, driver_id: int, lat: float, lng: float, **info) -> None:
+        """插入或移动一个司机
+
+        Args:
+            driver_id: 司机ID
+            lat: 纬度
+            lng: 经度
+            **info: 附加信息，会合并到已有信息中
+        """
+        cell = self._cell_of(lat, lng)
+        with self._lock:
+            previous = self._positions.get(driver_id)
+            if previous is not None and previous[2] != cell:
+                self._discard_from_cell(driver_id, previous[2])
+
+            self._cells.setdefault(cell, {})[driver_id] = (lat, lng)
+            self._positions[driver_id] = (lat, lng, cell)
+            if info:
+                self._info.setdefault(driver_id, {}).update(info)
+
+            row, col = cell
+            if self._bounds is None:
+                self._bounds = [row, row, col, col]
+            else:
+                bounds = self._bounds
+                bounds[0] = min(bounds[0], row)
+                bounds[1] = max(bounds[1], row)
+                bounds[2] = min(bounds[2], col)
+                bounds[3] = max(bounds[3], col)
+
+    def remove(self, driver_id: int) -> bool:
+        """移除一个司机（例如下线或接单后）
+
+        Returns:
+            司机之前是否在索引中
+        """
+        with self._lock:
+            previous = self._positions.pop(driver_id, None)
+            self._info.pop(driver_id, None)
+            if previous is None:
+                return False
+            self._discard_from_cell(driver_id, previous[2])
+            return True
+
+    def _discard_from_cell(self, driver_id, cell):
+        members = self._cells.get(cell)
+        if members is not None:
+            members.pop(driver_id, None)
+            if not members:
+                del self._cells[cell]
+
+    def bulk_load(self, drivers) -> int:
+        """批量加载司机位置
+
+        Args:
+            drivers: 可迭代的 (driver_id, lat, lng) 或 (driver_id, lat, lng, info_dict)
+
+        Returns:
+            加载的司机数量
+        """
+        count = 0
+        with self._lock:
+            for item in drivers:
+                info = item[3] if len(item) > 3 and item[3] else {}
+                self.upsert(item[0], item[1], item[2], **info)
+                count += 1
+        return count
+
+    def clear(self) -> None:
+        """清空索引"""
+        with self._lock:
+            self._cells.clear()
+            self._positions.clear()
+            self._info.clear()
+            self._bounds = None
+
+    def snapshot(self) -> list:
+        """获取所有司机的快照
+
+        Returns:
+            (driver_id, lat, lng, info_dict) 列表
+        """
+        with self._lock:
+            return [
+                (driver_id, lat, lng, dict(self._info.get(driver_id, {})))
+                for driver_id, (lat, lng, _) in self._positions.items()
+            ]
+
+    def get_position(self, driver_id: int):
+        """获取司机在索引中的位置，不存在时返回None"""
+        position = self._positions.get(driver_id)
+        return (position[0], position[1]) if position else None
+
+    def get_info(self, driver_id: int) -> dict:
+        """获取司机的附加信息"""
+        return dict(self._info.get(driver_id, {}))
+
+    def query_radius(
+        self, lat: float, lng: float, radius_km: float, limit: int = None
+    ) -> list:
+        """查询半径内的司机
+
+        Args:
+            lat: 中心纬度
+            lng: 中心经度
+            radius_km: 半径（公里）
+            limit: 最多返回数量（None表示不限制）
+
+        Returns:
+            按距离升序排列的 (driver_id, distance_km) 列表
+        """
+        size = self.cell_size_deg
+        dlat = radius_km / KM_PER_DEG_LAT
+        cos_lat = max(math.cos(math.radians(lat)), 1e-6)
+        dlng = dlat / cos_lat
+        row_lo = int(math.floor((lat - dlat) / size))
+        row_hi = int(math.floor((lat + dlat) / size))
+        col_lo = int(math.floor((lng - dlng) / size))
+        col_hi = int(math.floor((lng + dlng) / size))
+
+        # 先用等距矩形投影的平方距离做快速过滤，再用Haversine精确计算
+        kx = KM_PER_DEG_LAT * cos_lat
+        ky = KM_PER_DEG_LAT
+        prefilter = (radius_km * 1.01) ** 2
+
+        results = []
+        with self._lock:
+            cells = self._cells
+            if (row_hi - row_lo + 1) * (col_hi - col_lo + 1) > len(cells):
+                # 查询范围覆盖的网格比实际存在的网格还多时，直接遍历已有网格
+                candidate_cells = [
+                    members
+                    for (row, col), members in cells.items()
+                    if row_lo <= row <= row_hi and col_lo <= col <= col_hi
+                ]
+            else:
+                candidate_cells = []
+                for row in range(row_lo, row_hi + 1):
+                    for col in range(col_lo, col_hi + 1):
+                        members = cells.get((row, col))
+                        if members:
+                            candidate_cells.append(members)
+
+            for members in candidate_cells:
+                for driver_id, (d_lat, d_lng) in members.items():
+                    x = (d_lng - lng) * kx
+                    y = (d_lat - lat) * ky
+                    if x * x + y * y <= prefilter:
+                        distance = haversine_km(lat, lng, d_lat, d_lng)
+                        if distance <= radius_km:
+                            results.append((driver_id, distance))
+
+        if limit is not None and limit < len(results):
+            return heapq.nsmallest(limit, results, key=lambda item: item[1])
+        results.sort(key=lambda item: item[1])
+        return results
+
+    def query_nearest(
+        self, lat: float, lng: float, k: int = 10, max_radius_km: float = None
+    ) -> list:
+        """查询最近的K个司机
+
+        从查询点所在网格开始逐圈向外扩展；当已找到K个司机且第K个的距离
+        不超过已扫描区域边界的最短距离时停止。
+
+        Args:
+            lat: 中心纬度
+            lng: 中心经度
+            k: 返回数量
+            max_radius_km: 最大搜索半径（None表示不限制）
+
+        Returns:
+            按距离升序排列的 (driver_id, distance_km) 列表
+        """
+        if k <= 0:
+            return []
+
+        size = self.cell_size_deg
+        center_row, center_col = self._cell_of(lat, lng)
+        cos_lat = max(math.cos(math.radians(lat)), 1e-6)
+        heap = []  # 最大堆：(-distance, driver_id)
+
+        with self._lock:
+            if not self._positions:
+                return []
+            row_min, row_max, col_min, col_max = self._bounds
+            max_ring = max(
+                abs(center_row - row_min),
+                abs(center_row - row_max),
+                abs(center_col - col_min),
+                abs(center_col - col_max),
+            )
+            cells = self._cells
+
+            ring = 0
+            while ring <= max_ring:
+                for cell in self._ring_cells(center_row, center_col, ring):
+                    members = cells.get(cell)
+                    if not members:
+                        continue
+                    for driver_id, (d_lat, d_lng) in members.items():
+                        distance = haversine_km(lat, lng, d_lat, d_lng)
+                        if max_radius_km is not None and distance > max_radius_km:
+                            continue
+                        if len(heap) < k:
+                            heapq.heappush(heap, (-distance, driver_id))
+                        elif distance < -heap[0][0]:
+                            heapq.heapreplace(heap, (-distance, driver_id))
+
+                # 已扫描区域边界到查询点的最短距离
+                lat_lo = (center_row - ring) * size
+                lat_hi = (center_row + ring + 1) * size
+                lng_lo = (center_col - ring) * size
+                lng_hi = (center_col + ring + 1) * size
+                covered_km = min(
+                    (lat - lat_lo) * KM_PER_DEG_LAT,
+                    (lat_hi - lat) * KM_PER_DEG_LAT,
+                    (lng - lng_lo) * KM_PER_DEG_LAT * cos_lat,
+                    (lng_hi - lng) * KM_PER_DEG_LAT * cos_lat,
+                )
+                if len(heap) >= k and -heap[0][0] <= covered_km:
+                    break
+                if max_radius_km is not None and covered_km >= max_radius_km:
+                    break
+                ring += 1
+
+        return sorted(
+            ((driver_id, -neg) for neg, driver_id in heap), key=lambda item: item[1]
+        )
+
+    @staticmethod
+    def _ring_cells(center_row: int, center_col: int, ring: int):
+        """生成与中心网格切比雪夫距离恰好为ring的网格"""
+        if ring == 0:
+            yield center_row, center_col
+            return
+        top = center_row + ring
+        bottom = center_row - ring
+        for col in range(center_col - ring, center_col + ring + 1):
+            yield top, col
+            yield bottom, col
+        for row in range(bottom + 1, top):
+            yield row, center_col - ring
+            yield row, center_col + ring
+
+
+def load_available_drivers(index: DriverGridIndex) -> int:
+    """从数据库加载全部可用且有位置的司机，并移除已不可用的司机（需要应用上下文）
+
+    进程启动时预热索引；派单leader也定期调用，纳入在其他工作进程上报的位置。
+
+    Returns:
+        加载的司机数量
+    """
+    from sqlalchemy.orm import joinedload
+    from src.models.user import User
+    from src.services.location import LocationService
+
+    drivers = (
+        User.query.options(joinedload(User.vehicle))
+        .filter(
+            User.role == "driver",
+            User.is_available.is_(True),
+            User.current_lat.isnot(None),
+            User.current_lng.isnot(None),
+        )
+        .all()
+    )
+
+    loaded = index.bulk_load(
+        (
+            driver.id,
+            driver.current_lat,
+            driver.current_lng,
+            {
+                "name": driver.username,
+                "rating": driver.rating,
+                "vehicle_type": driver.vehicle.vehicle_type if driver.vehicle else None,
+                "zones": LocationService.lookup_zones(
+                    driver.current_lat, driver.current_lng
+                ),
+            },
+        )
+        for driver in drivers
+    )
+
+    available = {driver.id for driver in drivers}
+    for driver_id, _, _, _ in index.snapshot():
+        if driver_id not in available:
+            index.remove(driver_id)
+    return loaded
+
+
+# 全局可用司机索引实例
+driver_index = DriverGridIndex()
+
+# 导出
+__all__ = [
+    "DriverGridIndex",
+    "driver_index",
+    "load_available_drivers",
+    "haversine_km",
+    "EARTH_RADIUS_KM",
+    "KM_PER_DEG_LAT",
+]
@@ -0,0 +1,144 @@
+"""
+动态加价服务 - 根据各网格滑动窗口内的需求/供给，定时计算平滑后的加价倍数
+"""
+import logging
+import threading
+import time
+
+import numpy as np
+
+from src.services.heatmap import demand_heatmap
+
+logger = logging.getLogger(__name__)
+
+# 计算加价使用的窗口（分钟）
+DEFAULT_WINDOW_MINUTES = 15
+
+# 默认的计算间隔（秒）
+DEFAULT_TICK_SECONDS = 10.0
+
+# 需求/供给比每超过1一个单位，目标倍数增加的量
+DEFAULT_SENSITIVITY = 0.25
+
+# 指数平滑系数：越小倍数变化越平缓
+DEFAULT_SMOOTHING = 0.3
+
+# 倍数上限和发布粒度
+MAX_MULTIPLIER = 3.0
+MULTIPLIER_STEP = 0.1
+
+
+class SurgeEngine:
+    """按网格的动态加价倍数
+
+    每个tick从热力图取出所有网格的需求（窗口内新请求数）和供给（窗口内平均可用司机数），
+    对所有网格一次向量化计算：
+        目标倍数 = clip(1 + sensitivity * max(0, 需求 / (供给 + 1) - 1), 1, MAX_MULTIPLIER)
+        平滑倍数 = smoothing * 目标倍数 + (1 - smoothing) * 上次平滑倍数
+    只把大于1的网格发布到字典中，查询是一次geohash计算加一次字典查找。
+    """
+
+    def __init__(
+        self,
+        heatmap=demand_heatmap,
+        window_minutes: int = DEFAULT_WINDOW_MINUTES,
+        sensitivity: float = DEFAULT_SENSITIVITY,
+        smoothing: float = DEFAULT_SMOOTHING,
+        max_multiplier: float = MAX_MULTIPLIER,
+    ):
+        self.heatmap = heatmap
+        self.window_minutes = window_minutes
+        self.sensitivity = sensitivity
+        self.smoothing = smoothing
+        self.max_multiplier = max_multiplier
+        self._smoothed = np.ones(0, dtype=np.float64)  # 与热力图网格行号对齐
+        self._published = {}  # geohash -> 倍数
+        self._tick_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.last_tick_ms = 0.0
+
+    def tick(self) -> int:
+        """重新计算所有网格的倍数
+
+        Returns:
+            倍数大于1的网格数
+        """
+        started = time.perf_counter()
+        with self._tick_lock:
+            keys, demand, supply = self.heatmap.counts.window_counts(
+                self.window_minutes
+            )
+
+            smoothed = self._smoothed
+            if len(smoothed) < len(keys):
+                smoothed = np.concatenate(
+                    (smoothed, np.ones(len(keys) - len(smoothed)))
+                )
+
+            pressure = demand / (supply + 1.0)
+            target = np.clip(
+                1.0 + self.sensitivity * np.maximum(pressure - 1.0, 0.0),
+                1.0,
+                self.max_multiplier,
+            )
+            smoothed = self.smoothing * target + (1.0 - self.smoothing) * smoothed
+            self._smoothed = smoothed
+
+            # 向下取整到发布粒度，避免价格频繁抖动
+            published = np.floor(smoothed / MULTIPLIER_STEP + 1e-9) * MULTIPLIER_STEP
+            surging = np.flatnonzero(published > 1.0)
+            values = np.round(published[surging], 1).tolist()
+            self._published = dict(zip([keys[i] for i in surging.tolist()], values))
+
+        self.last_tick_ms = (time.perf_counter() - started) * 1000
+        return len(surging)
+
+    def multiplier(self, lat: float, lng: float) -> float:
+        """坐标所在网格的当前加价倍数"""
+        return self._published.get(self.heatmap.cell_of(lat, lng), 1.0)
+
+    def multiplier_for_cell(self, cell: str) -> float:
+        """网格的当前加价倍数"""
+        return self._published.get(cell, 1.0)
+
+    def surging_cells(self) -> dict:
+        """当前加价的网格 {geohash: 倍数}"""
+        return dict(self._published)
+
+    def reset(self) -> None:
+        """清空所有倍数"""
+        with self._tick_lock:
+            self._smoothed = np.ones(0, dtype=np.float64)
+            self._published = {}
+
+    def start(self, interval_seconds: float = DEFAULT_TICK_SECONDS) -> None:
+        """启动后台定时计算线程"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(interval_seconds,), name="surge-engine", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """停止后台计算线程"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, interval_seconds):
+        while not self._stop_event.wait(interval_seconds):
+            try:
+                self.tick()
+            except Exception as e:
+                logger.error(f"Failed to update surge multipliers: {e}")
+
+
+# 全局动态加价实例（基于全局热力图）
+surge_engine = SurgeEngine()
+
+# 导出
+__all__ = ["SurgeEngine", "surge_engine"]
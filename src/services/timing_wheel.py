@@ -0,0 +1,141 @@
+"""
+分层时间轮 - 大量定时器的O(1)调度、取消和到期处理
+"""
+import math
+
+# 默认的刻度（秒）、每层槽数和层数：0.1秒 x 64 x 64 x 64 约7.3小时
+DEFAULT_TICK_SECONDS = 0.1
+DEFAULT_WHEEL_SIZE = 64
+DEFAULT_LEVELS = 3
+
+
+class TimerHandle:
+    """时间轮中的一个定时器"""
+
+    __slots__ = ("deadline_tick", "payload", "active")
+
+    def __init__(self, deadline_tick: int, payload):
+        self.deadline_tick = deadline_tick
+        self.payload = payload
+        self.active = True
+
+
+class HierarchicalTimingWheel:
+    """分层时间轮
+
+    第0层每个槽是一个刻度，第L层每个槽覆盖 wheel_size^L 个刻度。定时器按距到期的
+    刻度数放入能容纳它的最低一层；每当低层转完一圈，把高一层当前槽里的定时器
+    重新放入更低的层（级联），最终在第0层到期。超出最高层范围的定时器放在溢出列表，
+    最高层转完一圈时重新放置。
+
+    调度和取消都是O(1)（取消只做标记，到达槽位时丢弃），推进一个刻度只处理一个槽，
+    与定时器总数无关。时间轮本身不加锁，由调用方保证单线程访问。
+    """
+
+    def __init__(
+        self,
+        tick_seconds: float = DEFAULT_TICK_SECONDS,
+        wheel_size: int = DEFAULT_WHEEL_SIZE,
+        levels: int = DEFAULT_LEVELS,
+        start: float = 0.0,
+    ):
+        self.tick_seconds = tick_seconds
+        self.wheel_size = wheel_size
+        self.levels = levels
+        self._origin = start
+        self._tick = 0  # 已处理到的刻度
+        self._wheels = [[[] for _ in range(wheel_size)] for _ in range(levels)]
+        self._overflow = []
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def schedule(self, deadline: float, payload) -> TimerHandle:
+        """添加定时器
+
+        Args:
+            deadline: 到期时间（与 start、advance 使用同一时钟）
+            payload: 到期时返回的数据
+
+        Returns:
+            定时器句柄，可用于取消
+        """
+        # 向上取整到刻度，保证不会提前到期
+        tick = math.ceil((deadline - self._origin) / self.tick_seconds - 1e-9)
+        handle = TimerHandle(max(tick, self._tick + 1), payload)
+        self._place(handle)
+        self._count += 1
+        return handle
+
+    def cancel(self, handle: TimerHandle) -> bool:
+        """取消定时器
+
+        Returns:
+            定时器是否仍在等待（已到期或已取消时为False）
+        """
+        if handle is None or not handle.active:
+            return False
+        handle.active = False
+        self._count -= 1
+        return True
+
+    def _place(self, handle: TimerHandle) -> None:
+        delta = handle.deadline_tick - self._tick
+        span = 1
+        for level in range(self.levels):
+            if delta < span * self.wheel_size:
+                self._wheels[level][
+                    (handle.deadline_tick // span) % self.wheel_size
+                ].append(handle)
+                return
+            span *= self.wheel_size
+        self._overflow.append(handle)
+
+    def _cascade(self, tick: int) -> None:
+        """低层转完一圈时把高层当前槽的定时器放回低层（从最高层开始）"""
+        top_span = self.wheel_size**self.levels
+        if tick % top_span == 0 and self._overflow:
+            handles, self._overflow = self._overflow, []
+            for handle in handles:
+                if handle.active:
+                    self._place(handle)
+
+        for level in range(self.levels - 1, 0, -1):
+            span = self.wheel_size**level
+            if tick % span:
+                continue
+            slot = (tick // span) % self.wheel_size
+            handles, self._wheels[level][slot] = self._wheels[level][slot], []
+            for handle in handles:
+                if handle.active:
+                    self._place(handle)
+
+    def advance(self, now: float) -> list:
+        """推进到当前时间
+
+        Returns:
+            到期定时器的payload列表（按到期顺序）
+        """
+        target = math.floor((now - self._origin) / self.tick_seconds + 1e-9)
+        expired = []
+        while self._tick < target:
+            if self._count == 0:
+                # 没有等待中的定时器时直接跳到目标刻度（槽中只剩已取消的句柄）
+                self._tick = target
+                break
+
+            self._tick += 1
+            self._cascade(self._tick)
+            slot = self._tick % self.wheel_size
+            handles, self._wheels[0][slot] = self._wheels[0][slot], []
+            for handle in handles:
+                if handle.active:
+                    handle.active = False
+                    self._count -= 1
+                    expired.append(handle.payload)
+        return expired
+
+
+# 导出
+__all__ = ["TimerHandle", "HierarchicalTimingWheel"]
@@ -0,0 +1,291 @@
+"""
+交通系数服务 - 由历史完成行程学习按"周内小时 x 粗粒度区域"的交通系数表
+"""
+import datetime
+import logging
+import math
+import os
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 一周的小时数
+HOURS_PER_WEEK = 7 * 24
+
+# 粗粒度区域边长（度），约5.5公里
+DEFAULT_ZONE_DEG = 0.05
+
+# 基准速度（km/h），与 LocationService.estimate_travel_time 的平均速度一致
+REFERENCE_SPEED_KMH = 50.0
+
+# 单个格子最少的样本数，不足时回退到全局同一小时的系数
+DEFAULT_MIN_SAMPLES = 5
+
+# 系数范围，防止异常数据产生极端ETA
+MIN_FACTOR = 0.5
+MAX_FACTOR = 4.0
+
+# 有效行程的速度和时长范围
+MIN_SPEED_KMH = 1.0
+MAX_SPEED_KMH = 150.0
+MIN_DURATION_HOURS = 1.0 / 60
+
+
+def hour_of_week(when: datetime.datetime) -> int:
+    """周内小时：周一0点为0，周日23点为167"""
+    return when.weekday() * 24 + when.hour
+
+
+def zone_of(lat: float, lng: float, zone_deg: float = DEFAULT_ZONE_DEG) -> tuple:
+    """坐标所在的粗粒度区域"""
+    return math.floor(lat / zone_deg), math.floor(lng / zone_deg)
+
+
+class TrafficFactorTable:
+    """交通系数表
+
+    factors[i, h] 是第i个区域在周内小时h的系数（观测速度越慢系数越大），
+    global_factors[h] 是所有区域合并后的系数。查询是一次字典查找加一次数组下标。
+    """
+
+    def __init__(
+        self, zones, factors, global_factors, zone_deg: float = DEFAULT_ZONE_DEG
+    ):
+        self.zone_deg = zone_deg
+        self.factors = np.asarray(factors, dtype=np.float32).reshape(-1, HOURS_PER_WEEK)
+        self.global_factors = np.asarray(global_factors, dtype=np.float32)
+        self._zone_index = {
+            tuple(int(v) for v in zone): i for i, zone in enumerate(zones)
+        }
+        self._factor_rows = self.factors.tolist()
+        self._global_row = self.global_factors.tolist()
+
+    @property
+    def zone_count(self) -> int:
+        return len(self._zone_index)
+
+    def lookup(
+        self, lat: float = None, lng: float = None, when: datetime.datetime = None
+    ) -> float:
+        """查询交通系数
+
+        Args:
+            lat: 纬度（None表示只用全局系数）
+            lng: 经度
+            when: 时间（UTC），None表示当前时间
+
+        Returns:
+            交通系数
+        """
+        hour = hour_of_week(when or datetime.datetime.utcnow())
+        if lat is not None and lng is not None:
+            row = self._zone_index.get(zone_of(lat, lng, self.zone_deg))
+            if row is not None:
+                return self._factor_rows[row][hour]
+        return self._global_row[hour]
+
+    def save(self, path: str) -> None:
+        """保存为压缩的 .npz 文件"""
+        zones = sorted(self._zone_index, key=self._zone_index.get)
+        np.savez_compressed(
+            path,
+            zones=np.array(zones, dtype=np.int32).reshape(-1, 2),
+            factors=self.factors,
+            global_factors=self.global_factors,
+            zone_deg=np.float64(self.zone_deg),
+        )
+
+    @classmethod
+    def load(cls, path: str):
+        """从 .npz 文件加载"""
+        with np.load(path) as data:
+            return cls(
+                data["zones"],
+                data["factors"],
+                data["global_factors"],
+                float(data["zone_deg"]),
+            )
+
+
+class TrafficFactorBuilder:
+    """流式聚合行程样本并生成交通系数表
+
+    每个 (区域, 周内小时) 累计距离和时长，用总距离/总时长作为平均速度，
+    对个别极端行程不敏感；内存只与区域数成正比，与行程数无关。
+    """
+
+    def __init__(self, zone_deg: float = DEFAULT_ZONE_DEG):
+        self.zone_deg = zone_deg
+        self._zones = {}  # zone -> 行号
+        self._distance = []  # 每个区域一个长度168的数组
+        self._duration = []
+        self._count = []
+        self.samples = 0
+        self.rejected = 0
+
+    def add(
+        self,
+        lat: float,
+        lng: float,
+        started_at: datetime.datetime,
+        distance_km: float,
+        duration_hours: float,
+    ) -> bool:
+        """加入一个行程样本
+
+        Returns:
+            样本是否有效
+        """
+        if duration_hours < MIN_DURATION_HOURS or distance_km <= 0:
+            self.rejected += 1
+            return False
+        speed = distance_km / duration_hours
+        if not MIN_SPEED_KMH <= speed <= MAX_SPEED_KMH:
+            self.rejected += 1
+            return False
+
+        zone = zone_of(lat, lng, self.zone_deg)
+        row = self._zones.get(zone)
+        if row is None:
+            row = self._zones[zone] = len(self._distance)
+            self._distance.append(np.zeros(HOURS_PER_WEEK))
+            self._duration.append(np.zeros(HOURS_PER_WEEK))
+            self._count.append(np.zeros(HOURS_PER_WEEK, dtype=np.int64))
+
+        hour = hour_of_week(started_at)
+        self._distance[row][hour] += distance_km
+        self._duration[row][hour] += duration_hours
+        self._count[row][hour] += 1
+        self.samples += 1
+        return True
+
+    def add_ride(self, ride) -> bool:
+        """从完成的行程中提取样本（距离取上下车点直线距离）"""
+        from src.services.spatial_index import haversine_km
+
+        if None in (
+            ride.pickup_lat,
+            ride.pickup_lng,
+            ride.dropoff_lat,
+            ride.dropoff_lng,
+            ride.started_at,
+            ride.completed_at,
+        ):
+            self.rejected += 1
+            return False
+
+        distance = haversine_km(
+            ride.pickup_lat, ride.pickup_lng, ride.dropoff_lat, ride.dropoff_lng
+        )
+        duration = (ride.completed_at - ride.started_at).total_seconds() / 3600.0
+        return self.add(
+            ride.pickup_lat, ride.pickup_lng, ride.started_at, distance, duration
+        )
+
+    def build(self, min_samples: int = DEFAULT_MIN_SAMPLES) -> TrafficFactorTable:
+        """生成交通系数表"""
+        zones = sorted(self._zones, key=self._zones.get)
+        if zones:
+            distance = np.vstack(self._distance)
+            duration = np.vstack(self._duration)
+            count = np.vstack(self._count)
+        else:
+            distance = duration = np.zeros((0, HOURS_PER_WEEK))
+            count = np.zeros((0, HOURS_PER_WEEK), dtype=np.int64)
+
+        global_factors = self._factors(
+            distance.sum(axis=0),
+            duration.sum(axis=0),
+            count.sum(axis=0) >= min_samples,
+            np.ones(HOURS_PER_WEEK),
+        )
+        factors = self._factors(
+            distance,
+            duration,
+            count >= min_samples,
+            np.broadcast_to(global_factors, distance.shape),
+        )
+        return TrafficFactorTable(zones, factors, global_factors, self.zone_deg)
+
+    @staticmethod
+    def _factors(distance, duration, enough, fallback):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            speed = distance / duration
+            factors = np.clip(REFERENCE_SPEED_KMH / speed, MIN_FACTOR, MAX_FACTOR)
+        return np.where(enough, factors, fallback)
+
+
+def build_from_rides(
+    query,
+    zone_deg: float = DEFAULT_ZONE_DEG,
+    min_samples: int = DEFAULT_MIN_SAMPLES,
+    batch_size: int = 1000,
+) -> TrafficFactorTable:
+    """从行程查询流式构建交通系数表
+
+    Args:
+        query: 返回已完成行程的SQLAlchemy查询
+        zone_deg: 区域边长（度）
+        min_samples: 每个格子最少样本数
+        batch_size: 每批从数据库读取的行数
+    """
+    builder = TrafficFactorBuilder(zone_deg)
+    for ride in query.yield_per(batch_size):
+        builder.add_ride(ride)
+    logger.info(
+        f"Traffic table built from {builder.samples} rides "
+        f"({builder.rejected} rejected)"
+    )
+    return builder.build(min_samples)
+
+
+_table = None
+_table_loaded = False
+_table_lock = threading.Lock()
+
+
+def get_traffic_table():
+    """获取全局交通系数表
+
+    文件由环境变量 TRAFFIC_TABLE_PATH 指定，首次调用时加载；未配置或加载失败时返回None。
+    """
+    global _table, _table_loaded
+    if _table_loaded:
+        return _table
+
+    with _table_lock:
+        if not _table_loaded:
+            path = os.environ.get("TRAFFIC_TABLE_PATH")
+            if path:
+                try:
+                    _table = TrafficFactorTable.load(path)
+                    logger.info(
+                        f"Loaded traffic table from {path}: {_table.zone_count} zones"
+                    )
+                except Exception as e:
+                    logger.error(f"Failed to load traffic table {path}: {e}")
+                    _table = None
+            _table_loaded = True
+    return _table
+
+
+def set_traffic_table(table) -> None:
+    """设置全局交通系数表（None表示不使用）"""
+    global _table, _table_loaded
+    with _table_lock:
+        _table = table
+        _table_loaded = True
+
+
+# 导出
+__all__ = [
+    "TrafficFactorTable",
+    "TrafficFactorBuilder",
+    "build_from_rides",
+    "get_traffic_table",
+    "set_traffic_table",
+    "hour_of_week",
+    "zone_of",
+]
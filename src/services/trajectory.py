@@ -0,0 +1,322 @@
+"""
+行程轨迹服务 - 流式简化行程中的GPS轨迹，并以差分变长整数编码压缩存储
+"""
+import calendar
+import datetime
+import logging
+import math
+import threading
+
+from src.services.database import db
+from src.services.spatial_index import EARTH_RADIUS_KM
+
+logger = logging.getLogger(__name__)
+
+# 坐标量化精度：1e-5度，约1.1米
+COORD_SCALE = 100000
+
+# 编码格式版本
+TRACK_FORMAT_VERSION = 1
+
+# 默认简化容差（米）：偏离保留线段不超过该距离的点被丢弃
+DEFAULT_TOLERANCE_M = 10.0
+
+# 滑动窗口的最大点数，限制每个点的计算量
+DEFAULT_MAX_WINDOW = 64
+
+# 新保留的点累计达到该数量时写入数据库
+DEFAULT_SAVE_EVERY = 20
+
+
+def _write_varint(out: bytearray, value: int) -> None:
+    """写入zigzag变长整数"""
+    value = (value << 1) ^ (value >> 63)
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data: bytes, pos: int) -> tuple:
+    """读取zigzag变长整数，返回 (值, 新位置)"""
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            break
+        shift += 7
+    return (result >> 1) ^ -(result & 1), pos
+
+
+def encode_track(points) -> bytes:
+    """把轨迹点编码为二进制
+
+    每个点依次写入纬度、经度（1e-5度）和时间（秒）相对上一个点的差值，
+    行驶中的相邻点差值很小，通常每个点只占5~7字节。
+
+    Args:
+        points: (lat, lng, unix秒) 列表
+
+    Returns:
+        编码后的字节串
+    """
+    out = bytearray([TRACK_FORMAT_VERSION])
+    prev_lat = prev_lng = prev_ts = 0
+    for lat, lng, ts in points:
+        lat_i = round(lat * COORD_SCALE)
+        lng_i = round(lng * COORD_SCALE)
+        ts_i = int(ts)
+        _write_varint(out, lat_i - prev_lat)
+        _write_varint(out, lng_i - prev_lng)
+        _write_varint(out, ts_i - prev_ts)
+        prev_lat, prev_lng, prev_ts = lat_i, lng_i, ts_i
+    return bytes(out)
+
+
+def decode_track(data: bytes) -> list:
+    """解码 encode_track 生成的字节串
+
+    Returns:
+        (lat, lng, unix秒) 列表
+
+    Raises:
+        ValueError: 格式版本不支持
+    """
+    if not data:
+        return []
+    if data[0] != TRACK_FORMAT_VERSION:
+        raise ValueError(f"Unsupported track format version: {data[0]}")
+
+    points = []
+    lat_i = lng_i = ts_i = 0
+    pos = 1
+    while pos < len(data):
+        delta, pos = _read_varint(data, pos)
+        lat_i += delta
+        delta, pos = _read_varint(data, pos)
+        lng_i += delta
+        delta, pos = _read_varint(data, pos)
+        ts_i += delta
+        points.append((lat_i / COORD_SCALE, lng_i / COORD_SCALE, ts_i))
+    return points
+
+
+def encode_polyline(points, precision: int = 5) -> str:
+    """编码为Google Encoded Polyline字符串（地图SDK可直接绘制）"""
+    factor = 10**precision
+    out = []
+    prev_lat = prev_lng = 0
+    for point in points:
+        lat_i = round(point[0] * factor)
+        lng_i = round(point[1] * factor)
+        for delta in (lat_i - prev_lat, lng_i - prev_lng):
+            value = ~(delta << 1) if delta < 0 else delta << 1
+            while value >= 0x20:
+                out.append(chr((0x20 | (value & 0x1F)) + 63))
+                value >>= 5
+            out.append(chr(value + 63))
+        prev_lat, prev_lng = lat_i, lng_i
+    return "".join(out)
+
+
+def to_unix_seconds(when: datetime.datetime) -> int:
+    """UTC naive datetime 转换为Unix秒"""
+    return calendar.timegm(when.utctimetuple())
+
+
+def segment_distance_m(point, start, end) -> float:
+    """点到线段的距离（米），在起点附近做等距投影近似"""
+    scale = EARTH_RADIUS_KM * 1000 * math.pi / 180
+    cos_lat = math.cos(math.radians(start[0]))
+    px = (point[1] - start[1]) * cos_lat * scale
+    py = (point[0] - start[0]) * scale
+    ex = (end[1] - start[1]) * cos_lat * scale
+    ey = (end[0] - start[0]) * scale
+
+    length_sq = ex * ex + ey * ey
+    if length_sq == 0:
+        return math.hypot(px, py)
+    t = max(0.0, min(1.0, (px * ex + py * ey) / length_sq))
+    return math.hypot(px - t * ex, py - t * ey)
+
+
+class StreamingSimplifier:
+    """流式轨迹简化（开窗式Douglas-Peucker）
+
+    从上一个保留点出发维护一个窗口，新点到来时检查窗口内所有点到
+    "保留点→新点"线段的距离；有点超出容差（或窗口已满）时，把新点之前的
+    那个点确定为保留点并重新开窗。每个点的计算量不超过窗口大小。
+    """
+
+    def __init__(
+        self,
+        tolerance_m: float = DEFAULT_TOLERANCE_M,
+        max_window: int = DEFAULT_MAX_WINDOW,
+    ):
+        self.tolerance_m = tolerance_m
+        self.max_window = max(2, max_window)
+        self.kept = []
+        self._window = []
+        self.raw_count = 0
+
+    def seed(self, points) -> None:
+        """用已保存的轨迹初始化（服务重启后继续追加）"""
+        self.kept = list(points)
+        self._window = []
+
+    def add(self, point) -> bool:
+        """加入一个点
+
+        Args:
+            point: (lat, lng, unix秒)
+
+        Returns:
+            是否有点被确定保留
+        """
+        self.raw_count += 1
+        if not self.kept:
+            self.kept.append(point)
+            return True
+
+        last = self._window[-1] if self._window else self.kept[-1]
+        if point[2] < last[2]:
+            # 乱序的旧点直接丢弃
+            return False
+
+        self._window.append(point)
+        if len(self._window) == 1:
+            return False
+
+        anchor = self.kept[-1]
+        exceeded = len(self._window) > self.max_window or any(
+            segment_distance_m(p, anchor, point) > self.tolerance_m
+            for p in self._window[:-1]
+        )
+        if not exceeded:
+            return False
+
+        self.kept.append(self._window[-2])
+        self._window = [point]
+        return True
+
+    def points(self) -> list:
+        """当前的简化轨迹（包含尚未确定的最后一个点）"""
+        if self._window:
+            return self.kept + [self._window[-1]]
+        return list(self.kept)
+
+
+class TrackStore:
+    """进行中行程的轨迹存储
+
+    行程开始时登记 司机→行程 的对应关系，之后该司机的位置上报被送入
+    该行程的流式简化器；简化后的轨迹周期性写入 ride_tracks 表，行程结束时
+    写入最终轨迹并释放内存。
+    """
+
+    def __init__(
+        self,
+        tolerance_m: float = DEFAULT_TOLERANCE_M,
+        save_every: int = DEFAULT_SAVE_EVERY,
+    ):
+        self.tolerance_m = tolerance_m
+        self.save_every = save_every
+        self._rides = {}  # driver_id -> ride_id
+        self._tracks = {}  # ride_id -> StreamingSimplifier
+        self._unsaved = {}  # ride_id -> 上次保存后新保留的点数
+        self._lock = threading.Lock()
+
+    def start(self, ride_id: int, driver_id: int) -> None:
+        """开始记录行程轨迹（已有保存的轨迹时在其后追加）"""
+        from src.models.ride_track import RideTrack
+
+        simplifier = StreamingSimplifier(self.tolerance_m)
+        saved = db.session.get(RideTrack, ride_id)
+        if saved is not None:
+            simplifier.seed(saved.get_points())
+            simplifier.raw_count = saved.raw_point_count or 0
+
+        with self._lock:
+            self._rides[driver_id] = ride_id
+            self._tracks[ride_id] = simplifier
+            self._unsaved[ride_id] = 0
+
+    def ride_for_driver(self, driver_id: int):
+        """司机正在记录的行程ID（没有时返回None）"""
+        return self._rides.get(driver_id)
+
+    def add_ping(
+        self, driver_id: int, lat: float, lng: float, timestamp: datetime.datetime
+    ) -> bool:
+        """加入一次位置上报
+
+        Returns:
+            是否需要保存（没有进行中行程时返回False）
+        """
+        with self._lock:
+            ride_id = self._rides.get(driver_id)
+            if ride_id is None:
+                return False
+            if self._tracks[ride_id].add((lat, lng, to_unix_seconds(timestamp))):
+                self._unsaved[ride_id] += 1
+            return self._unsaved[ride_id] >= self.save_every
+
+    def points(self, ride_id: int):
+        """进行中行程的当前轨迹（未在记录时返回None）"""
+        with self._lock:
+            simplifier = self._tracks.get(ride_id)
+            return simplifier.points() if simplifier is not None else None
+
+    def save(self, ride_id: int):
+        """把行程的当前轨迹写入会话（由调用方提交）"""
+        from src.models.ride_track import RideTrack
+
+        with self._lock:
+            simplifier = self._tracks.get(ride_id)
+            if simplifier is None:
+                return None
+            points = simplifier.points()
+            raw_count = simplifier.raw_count
+            self._unsaved[ride_id] = 0
+
+        track = db.session.get(RideTrack, ride_id)
+        if track is None:
+            track = RideTrack(ride_id=ride_id)
+            db.session.add(track)
+        track.set_points(points, raw_count)
+        return track
+
+    def finish(self, ride_id: int):
+        """行程结束：写入最终轨迹并停止记录"""
+        track = self.save(ride_id)
+        with self._lock:
+            self._tracks.pop(ride_id, None)
+            self._unsaved.pop(ride_id, None)
+            for driver_id in [d for d, r in self._rides.items() if r == ride_id]:
+                del self._rides[driver_id]
+        return track
+
+    def clear(self) -> None:
+        """清空所有记录中的轨迹（不写入数据库）"""
+        with self._lock:
+            self._rides.clear()
+            self._tracks.clear()
+            self._unsaved.clear()
+
+
+# 全局轨迹存储实例
+track_store = TrackStore()
+
+# 导出
+__all__ = [
+    "StreamingSimplifier",
+    "TrackStore",
+    "track_store",
+    "encode_track",
+    "decode_track",
+    "encode_polyline",
+    "to_unix_seconds",
+]
@@ -0,0 +1,18 @@
+"""
+模拟器模块 - 离散事件城市模拟，用于本地复现高峰负载和评估派单效果
+"""
+
+from .city import CityMap
+from .events import EventQueue
+from .simulation import Simulation, DriverFleet, percentiles
+from .replay import EventReplayer
+
+# 导出
+__all__ = [
+    "CityMap",
+    "EventQueue",
+    "Simulation",
+    "DriverFleet",
+    "percentiles",
+    "EventReplayer",
+]
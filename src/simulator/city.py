@@ -0,0 +1,104 @@
+"""
+城市地图 - 生成模拟乘客和司机的位置，估计行驶时间
+"""
+import numpy as np
+
+from src.services.location import LocationService
+
+# 默认城市范围（约30公里 x 30公里，以纽约为中心）
+CENTER_LAT, CENTER_LNG = 40.7128, -74.0060
+DEFAULT_SPAN_DEG = 0.135
+
+# 需求热点数、热点请求占比和热点半径（度）
+DEFAULT_HOTSPOTS = 6
+DEFAULT_HOTSPOT_SHARE = 0.6
+DEFAULT_HOTSPOT_SIGMA_DEG = 0.02
+
+
+class CityMap:
+    """矩形城市范围
+
+    司机初始位置和下车点在城市内均匀分布；上车点有 hotspot_share 的比例集中在
+    若干热点附近（正态分布），其余均匀分布，模拟商圈、车站等需求集中的区域。
+    所有随机数来自同一个带种子的生成器，相同种子生成相同的城市和需求。
+    """
+
+    def __init__(
+        self,
+        center_lat: float = CENTER_LAT,
+        center_lng: float = CENTER_LNG,
+        span_deg: float = DEFAULT_SPAN_DEG,
+        hotspots: int = DEFAULT_HOTSPOTS,
+        hotspot_share: float = DEFAULT_HOTSPOT_SHARE,
+        hotspot_sigma_deg: float = DEFAULT_HOTSPOT_SIGMA_DEG,
+        traffic_factor: float = 1.0,
+        seed: int = None,
+    ):
+        self.center_lat = center_lat
+        self.center_lng = center_lng
+        self.span_deg = span_deg
+        self.hotspot_share = hotspot_share
+        self.hotspot_sigma_deg = hotspot_sigma_deg
+        self.traffic_factor = traffic_factor
+        self.rng = np.random.default_rng(seed)
+        self.hotspots = np.column_stack(self.uniform_points(hotspots, margin=0.5))
+
+    def _clip(self, lats, lngs) -> tuple:
+        return (
+            np.clip(
+                lats, self.center_lat - self.span_deg, self.center_lat + self.span_deg
+            ),
+            np.clip(
+                lngs, self.center_lng - self.span_deg, self.center_lng + self.span_deg
+            ),
+        )
+
+    def uniform_points(self, count: int, margin: float = 1.0) -> tuple:
+        """城市内均匀分布的点
+
+        Args:
+            count: 点数
+            margin: 范围比例（0.5表示只在中间一半的范围内）
+
+        Returns:
+            (纬度数组, 经度数组)
+        """
+        span = self.span_deg * margin
+        return (
+            self.center_lat + self.rng.uniform(-span, span, count),
+            self.center_lng + self.rng.uniform(-span, span, count),
+        )
+
+    def demand_points(self, count: int) -> tuple:
+        """按热点分布生成上车点
+
+        Returns:
+            (纬度数组, 经度数组)
+        """
+        lats, lngs = self.uniform_points(count)
+        if len(self.hotspots) == 0:
+            return lats, lngs
+        from_hotspot = self.rng.random(count) < self.hotspot_share
+        chosen = self.hotspots[
+            self.rng.integers(0, len(self.hotspots), int(from_hotspot.sum()))
+        ]
+        lats[from_hotspot] = chosen[:, 0] + self.rng.normal(
+            0, self.hotspot_sigma_deg, len(chosen)
+        )
+        lngs[from_hotspot] = chosen[:, 1] + self.rng.normal(
+            0, self.hotspot_sigma_deg, len(chosen)
+        )
+        return self._clip(lats, lngs)
+
+    def travel_minutes(
+        self, lat1: float, lng1: float, lat2: float, lng2: float
+    ) -> float:
+        """两点之间的行驶时间（分钟），按直线距离和固定交通系数估计"""
+        distance = LocationService.calculate_distance(lat1, lng1, lat2, lng2)
+        return LocationService.estimate_travel_time(
+            distance, traffic_factor=self.traffic_factor
+        )
+
+
+# 导出
+__all__ = ["CityMap"]
@@ -0,0 +1,61 @@
+"""
+离散事件队列 - 按模拟时间顺序处理事件
+"""
+import heapq
+import itertools
+
+
+class EventQueue:
+    """离散事件优先队列
+
+    事件按 (时间, 序号) 排序，同一时刻的事件按加入顺序处理，保证相同种子的
+    模拟结果完全一致。弹出事件时模拟时钟跳到该事件的时间，事件之间不消耗真实时间。
+    """
+
+    def __init__(self, start: float = 0.0):
+        self.now = start
+        self._heap = []
+        self._sequence = itertools.count()
+        self.processed = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def __call__(self) -> float:
+        """当前模拟时间（可直接作为各服务的clock参数）"""
+        return self.now
+
+    def schedule(self, time: float, kind: str, *args) -> None:
+        """加入事件
+
+        Args:
+            time: 事件时间（模拟秒），早于当前时间时按当前时间处理
+            kind: 事件类型
+            *args: 事件参数
+        """
+        heapq.heappush(
+            self._heap, (max(time, self.now), next(self._sequence), kind, args)
+        )
+
+    def schedule_after(self, delay: float, kind: str, *args) -> None:
+        """在当前时间之后 delay 秒加入事件"""
+        self.schedule(self.now + delay, kind, *args)
+
+    def peek_time(self):
+        """下一个事件的时间，队列为空时返回None"""
+        return self._heap[0][0] if self._heap else None
+
+    def pop(self) -> tuple:
+        """弹出下一个事件并推进模拟时钟
+
+        Returns:
+            (时间, 事件类型, 参数元组)
+        """
+        time, _, kind, args = heapq.heappop(self._heap)
+        self.now = time
+        self.processed += 1
+        return time, kind, args
+
+
+# 导出
+__all__ = ["EventQueue"]
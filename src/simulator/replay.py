@@ -0,0 +1,226 @@
+"""
+事件日志回放 - 把记录的派单输入按时间顺序送入位置索引和批量派单，测量延迟和派单质量
+"""
+import time
+
+from src.services.dispatcher import BatchDispatcher, DEFAULT_WINDOW_SECONDS
+from src.services.event_log import (
+    read_events,
+    RIDE_REQUEST,
+    LOCATION_PING,
+    AVAILABILITY,
+)
+from src.services.spatial_index import DriverGridIndex
+from src.simulator.simulation import percentiles
+
+# 行程等待超过该时间仍未分配时记为未匹配（秒）
+DEFAULT_MAX_WAIT_SECONDS = 300.0
+
+
+class EventReplayer:
+    """事件日志回放器
+
+    按日志顺序处理事件：位置上报和可用状态变化更新空间索引（与 driver.py 的处理一致，
+    只有可用司机在索引中），行程请求进入待分配池。回放时间完全由记录时间决定：
+    批量派单窗口在 起始时间 + k x window_seconds 处执行，窗口内看到的正是该时刻之前的事件，
+    因此同一个日志每次回放的分配结果相同，与回放速度和机器快慢无关。
+
+    speed 为None时不等待，尽可能快地回放；否则按记录间隔除以 speed 等待真实时间
+    （例如60表示一分钟的日志用一秒回放）。被分配的司机在日志中出现其下一次可用状态变化之前
+    视为忙碌。
+    """
+
+    def __init__(
+        self,
+        path: str,
+        dispatcher: BatchDispatcher = None,
+        index: DriverGridIndex = None,
+        window_seconds: float = DEFAULT_WINDOW_SECONDS,
+        max_wait_seconds: float = DEFAULT_MAX_WAIT_SECONDS,
+        speed: float = None,
+        sleep=time.sleep,
+        timer=time.perf_counter,
+    ):
+        """
+        Args:
+            path: 事件日志路径
+            dispatcher: 用于分配的派单器，None表示使用默认参数的新实例
+            index: 司机空间索引，None表示新建
+            window_seconds: 批量派单窗口（记录时间的秒数）
+            max_wait_seconds: 行程最长等待分配时间（秒）
+            speed: 回放倍速，None表示不等待
+            sleep: 等待函数（测试时替换）
+            timer: 计时函数（测试时替换）
+        """
+        self.path = path
+        self.dispatcher = dispatcher or BatchDispatcher(
+            source=None, finishing=None, forward_horizon_seconds=0
+        )
+        self.index = index if index is not None else DriverGridIndex()
+        self.window_seconds = window_seconds
+        self.max_wait_seconds = max_wait_seconds
+        self.speed = speed
+        self._sleep = sleep
+        self._timer = timer
+
+        self.open_rides = {}  # ride_id -> (请求时间, 纬度, 经度)
+        self.available = set()
+        self.positions = {}  # driver_id -> (纬度, 经度)
+        self.busy = set()
+        self.matches = []  # (ride_id, driver_id, 窗口时间, 接驾分钟)
+        self.counts = {
+            "events": 0,
+            "requests": 0,
+            "pings": 0,
+            "availability": 0,
+            "expired": 0,
+        }
+        self.windows = 0
+        self.window_ms = []  # 有待分配行程的窗口耗时
+        self.match_waits = []
+        self.wall_seconds = 0.0
+        self.start_time = None
+        self.end_time = None
+
+    def _sync(self, driver_id: int) -> None:
+        """可用、不忙且位置已知的司机放入索引"""
+        position = self.positions.get(driver_id)
+        if (
+            driver_id in self.available
+            and driver_id not in self.busy
+            and position is not None
+        ):
+            self.index.upsert(driver_id, position[0], position[1])
+        else:
+            self.index.remove(driver_id)
+
+    def apply(self, kind: int, timestamp: float, *fields) -> None:
+        """处理一条事件"""
+        self.counts["events"] += 1
+        if kind == RIDE_REQUEST:
+            ride_id, lat, lng = fields[0], fields[1], fields[2]
+            self.open_rides[ride_id] = (timestamp, lat, lng)
+            self.counts["requests"] += 1
+        elif kind == LOCATION_PING:
+            driver_id, lat, lng = fields
+            self.positions[driver_id] = (lat, lng)
+            if driver_id in self.index:
+                self.index.upsert(driver_id, lat, lng)
+            self.counts["pings"] += 1
+        elif kind == AVAILABILITY:
+            driver_id, is_available, lat, lng = fields
+            if lat is not None and lng is not None:
+                self.positions[driver_id] = (lat, lng)
+            if is_available:
+                self.available.add(driver_id)
+            else:
+                self.available.discard(driver_id)
+            self.busy.discard(driver_id)
+            self._sync(driver_id)
+            self.counts["availability"] += 1
+
+    def dispatch(self, now: float) -> list:
+        """在记录时间 now 执行一个批量派单窗口
+
+        Returns:
+            本窗口的 (ride_id, driver_id, 接驾分钟) 列表
+        """
+        for ride_id in [
+            ride_id
+            for ride_id, ride in self.open_rides.items()
+            if now - ride[0] > self.max_wait_seconds
+        ]:
+            del self.open_rides[ride_id]
+            self.counts["expired"] += 1
+
+        self.windows += 1
+        if not self.open_rides:
+            return []
+
+        started = time.perf_counter()
+        requests = [
+            (ride_id, lat, lng) for ride_id, (_, lat, lng) in self.open_rides.items()
+        ]
+        requests = requests[: self.dispatcher.max_batch]
+        drivers = [
+            (driver_id, lat, lng) for driver_id, lat, lng, _ in self.index.snapshot()
+        ]
+        matches = self.dispatcher.match(requests, drivers)
+        self.window_ms.append((time.perf_counter() - started) * 1000)
+
+        for ride_id, driver_id, eta_minutes in matches:
+            self.match_waits.append(now - self.open_rides.pop(ride_id)[0])
+            self.busy.add(driver_id)
+            self.index.remove(driver_id)
+            self.matches.append((ride_id, driver_id, now, eta_minutes))
+        return matches
+
+    def run(self) -> dict:
+        """回放整个日志
+
+        Returns:
+            回放报告（见 report）
+        """
+        started = self._timer()
+        next_window = None
+        clock = None
+        for kind, timestamp, *fields in read_events(self.path):
+            # 并发写入的记录可能有微小的乱序，回放时钟只进不退
+            clock = timestamp if clock is None else max(clock, timestamp)
+            if self.start_time is None:
+                self.start_time = clock
+                next_window = clock + self.window_seconds
+            while next_window <= clock:
+                self._wait_until(next_window, started)
+                self.dispatch(next_window)
+                next_window += self.window_seconds
+            self._wait_until(clock, started)
+            self.apply(kind, clock, *fields)
+
+        # 日志结束后再执行一个窗口，分配最后到达的请求
+        if next_window is not None:
+            self._wait_until(next_window, started)
+            self.dispatch(next_window)
+        self.end_time = next_window
+        self.wall_seconds = self._timer() - started
+        return self.report()
+
+    def _wait_until(self, timestamp: float, started: float) -> None:
+        if not self.speed:
+            return
+        delay = (timestamp - self.start_time) / self.speed - (self._timer() - started)
+        if delay > 0:
+            self._sleep(delay)
+
+    def report(self) -> dict:
+        """回放报告
+
+        Returns:
+            事件数、日志时长、回放耗时和倍速、派单窗口耗时百分位（毫秒）、
+            匹配数、过期数、匹配率、等待分配时间百分位（秒）和接驾时间
+        """
+        duration = (
+            (self.end_time - self.start_time) if self.start_time is not None else 0.0
+        )
+        etas = [eta for _, _, _, eta in self.matches]
+        decided = len(self.matches) + self.counts["expired"]
+        return {
+            **self.counts,
+            "log_seconds": round(duration, 1),
+            "wall_seconds": round(self.wall_seconds, 3),
+            "speedup": round(duration / self.wall_seconds, 1)
+            if self.wall_seconds
+            else None,
+            "windows": self.windows,
+            "window_ms": percentiles(self.window_ms),
+            "matched": len(self.matches),
+            "unmatched": len(self.open_rides),
+            "match_rate": round(len(self.matches) / decided, 4) if decided else 0.0,
+            "match_wait_seconds": percentiles(self.match_waits),
+            "pickup_eta_minutes": percentiles(etas),
+            "total_pickup_minutes": round(sum(etas), 2),
+        }
+
+
+# 导出
+__all__ = ["EventReplayer"]
@@ -0,0 +1,464 @@
+"""
+城市模拟 - 用离散事件驱动派单服务层，测量吞吐、延迟和匹配质量
+"""
+import time
+
+import numpy as np
+
+from src.services.dispatcher import BatchDispatcher, DEFAULT_WINDOW_SECONDS
+from src.services.forward_dispatch import (
+    FinishingDriverIndex,
+    DEFAULT_FORWARD_HORIZON_SECONDS,
+)
+from src.services.location import LocationService
+from src.services.offers import OfferManager, DEFAULT_OFFER_TIMEOUT_SECONDS
+from src.services.payment import PaymentService
+from src.simulator.city import CityMap
+from src.simulator.events import EventQueue
+
+# 每个司机每小时产生的平均请求数（默认需求强度）
+DEFAULT_REQUESTS_PER_DRIVER_HOUR = 1.5
+
+# 派单超时的检查间隔（模拟秒）
+DEFAULT_SIM_TICK_SECONDS = 1.0
+
+# 司机接单率、不回应率和回应时间范围（秒）
+DEFAULT_ACCEPT_RATE = 0.9
+DEFAULT_NO_RESPONSE_RATE = 0.02
+DEFAULT_RESPONSE_SECONDS = (2.0, 8.0)
+
+# 乘客等待接单的最长时间（秒），超过后取消
+DEFAULT_PATIENCE_SECONDS = 300.0
+
+# 司机状态
+IDLE, EN_ROUTE, ON_TRIP = 0, 1, 2
+
+# 行程状态（与 Ride.status 对应）
+RIDE_STATUSES = (
+    "pending",
+    "requested",
+    "accepted",
+    "in_progress",
+    "completed",
+    "cancelled",
+)
+PENDING, REQUESTED, ACCEPTED, IN_PROGRESS, COMPLETED, CANCELLED = range(
+    len(RIDE_STATUSES)
+)
+
+
+def percentiles(values, points=(50, 95, 99)) -> dict:
+    """计算百分位数，没有数据时为0"""
+    values = np.asarray(values, dtype=np.float64)
+    values = values[~np.isnan(values)]
+    if len(values) == 0:
+        return {f"p{point}": 0.0 for point in points}
+    return {
+        f"p{point}": round(float(np.percentile(values, point)), 3) for point in points
+    }
+
+
+class DriverFleet:
+    """模拟司机的位置和状态
+
+    位置和状态保存在numpy数组中，下标即司机ID；`driver_id in fleet` 表示司机空闲，
+    可以直接作为派单管理器的在线司机来源。
+    """
+
+    def __init__(self, lats, lngs):
+        self.lats = np.asarray(lats, dtype=np.float64).copy()
+        self.lngs = np.asarray(lngs, dtype=np.float64).copy()
+        self.state = np.full(len(self.lats), IDLE, dtype=np.int8)
+        self.offered = np.zeros(len(self.lats), dtype=bool)  # 有待回应的派单
+
+    def __len__(self):
+        return len(self.lats)
+
+    def __contains__(self, driver_id):
+        return 0 <= driver_id < len(self.lats) and self.state[driver_id] == IDLE
+
+    def position(self, driver_id: int) -> tuple:
+        return float(self.lats[driver_id]), float(self.lngs[driver_id])
+
+    def move(self, driver_id: int, lat: float, lng: float, state: int) -> None:
+        """更新司机位置和状态"""
+        self.lats[driver_id] = lat
+        self.lngs[driver_id] = lng
+        self.state[driver_id] = state
+
+    def available(self) -> list:
+        """空闲且没有待回应派单的司机
+
+        Returns:
+            (driver_id, lat, lng) 列表
+        """
+        ids = np.flatnonzero((self.state == IDLE) & ~self.offered)
+        return list(zip(ids.tolist(), self.lats[ids].tolist(), self.lngs[ids].tolist()))
+
+
+class Simulation:
+    """离散事件城市模拟
+
+    乘客请求按泊松过程到达，每个行程经历 请求 → 批量派单 → 派给司机 → 接单/拒绝/超时
+    → 到达上车点开始行程 → 到达下车点完成行程；乘客等待超过 patience_seconds 仍未被接单时取消。
+
+    直接驱动服务层而不经过HTTP和数据库：批量分配使用 BatchDispatcher.match，
+    派单、转派和超时使用 OfferManager（时间轮），前向派单使用 FinishingDriverIndex，
+    车费使用 PaymentService。所有服务共享事件队列的模拟时钟，事件之间不等待真实时间，
+    同一种子的两次运行事件顺序完全相同。模拟器自身实现派单器的 hold/release 接口，
+    记录哪些行程和司机正在等待回应。
+    """
+
+    def __init__(
+        self,
+        drivers: int = 1000,
+        duration_seconds: float = 3600.0,
+        requests_per_hour: float = None,
+        city: CityMap = None,
+        window_seconds: float = DEFAULT_WINDOW_SECONDS,
+        offer_timeout_seconds: float = DEFAULT_OFFER_TIMEOUT_SECONDS,
+        tick_seconds: float = DEFAULT_SIM_TICK_SECONDS,
+        accept_rate: float = DEFAULT_ACCEPT_RATE,
+        no_response_rate: float = DEFAULT_NO_RESPONSE_RATE,
+        response_seconds: tuple = DEFAULT_RESPONSE_SECONDS,
+        patience_seconds: float = DEFAULT_PATIENCE_SECONDS,
+        forward_horizon_seconds: float = DEFAULT_FORWARD_HORIZON_SECONDS,
+        seed: int = 42,
+        recorder=None,
+    ):
+        """
+        Args:
+            drivers: 司机数
+            duration_seconds: 模拟时长（秒）
+            requests_per_hour: 每小时请求数，None表示按司机数 x DEFAULT_REQUESTS_PER_DRIVER_HOUR
+            city: 城市地图，None表示按种子生成默认城市
+            window_seconds: 批量派单窗口（秒）
+            offer_timeout_seconds: 司机回应派单的时间（秒）
+            tick_seconds: 派单超时的检查间隔（秒）
+            accept_rate: 司机回应时接单的概率
+            no_response_rate: 司机不回应（等待超时）的概率
+            response_seconds: 司机回应时间的范围（秒）
+            patience_seconds: 乘客等待接单的最长时间（秒）
+            forward_horizon_seconds: 前向派单的时间范围（秒），0表示关闭
+            seed: 随机种子
+            recorder: 事件日志（EventRecorder），记录请求和司机可用状态变化供回放，时间为模拟秒
+        """
+        self.duration_seconds = duration_seconds
+        self.window_seconds = window_seconds
+        self.tick_seconds = tick_seconds
+        self.accept_rate = accept_rate
+        self.no_response_rate = no_response_rate
+        self.response_seconds = response_seconds
+        self.patience_seconds = patience_seconds
+        self.forward_horizon_seconds = forward_horizon_seconds
+        self.recorder = recorder
+
+        self.city = city or CityMap(seed=seed)
+        self.rng = np.random.default_rng(None if seed is None else seed + 1)
+        self.queue = EventQueue()
+        self.fleet = DriverFleet(*self.city.uniform_points(drivers))
+        self.finishing = FinishingDriverIndex(clock=self.queue)
+        self.dispatcher = BatchDispatcher(
+            source=None, finishing=None, forward_horizon_seconds=0
+        )
+        self.offers = OfferManager(
+            timeout_seconds=offer_timeout_seconds,
+            tick_seconds=tick_seconds,
+            max_attempts=1,
+            source=self.fleet,
+            dispatcher=self,
+            notifier=self._notify,
+            candidate_finder=None,
+            clock=self.queue,
+            finishing=self.finishing,
+        )
+
+        # 预先生成全部请求的到达时间、上车点和下车点
+        if requests_per_hour is None:
+            requests_per_hour = drivers * DEFAULT_REQUESTS_PER_DRIVER_HOUR
+        count = int(self.rng.poisson(requests_per_hour * duration_seconds / 3600))
+        self.request_times = np.sort(self.rng.uniform(0, duration_seconds, count))
+        pickup_lats, pickup_lngs = self.city.demand_points(count)
+        dropoff_lats, dropoff_lngs = self.city.uniform_points(count)
+        self.pickups = list(zip(pickup_lats.tolist(), pickup_lngs.tolist()))
+        self.dropoffs = list(zip(dropoff_lats.tolist(), dropoff_lngs.tolist()))
+
+        # 各行程的状态和时间点（模拟秒，未发生为nan）
+        self.ride_status = np.full(count, PENDING, dtype=np.int8)
+        self.ride_driver = np.full(count, -1, dtype=np.int64)
+        self.accepted_at = np.full(count, np.nan)
+        self.picked_up_at = np.full(count, np.nan)
+        self.completed_at = np.full(count, np.nan)
+        self.pickup_estimate = np.full(count, np.nan)  # 派单时估计的接驾分钟
+        self.chained = np.zeros(count, dtype=bool)
+        self.fares = np.zeros(count)
+
+        self.waiting = {}  # 待接单的ride_id（按请求顺序）
+        self.offered_rides = set()
+        self.dispatch_ms = []
+        self.wall_seconds = 0.0
+        self.stats = {"late_responses": 0, "unavailable_on_accept": 0}
+        self._handlers = {
+            "request": self._on_request,
+            "window": self._on_window,
+            "tick": self._on_tick,
+            "respond": self._on_respond,
+            "pickup": self._on_pickup,
+            "complete": self._on_complete,
+            "abandon": self._on_abandon,
+        }
+
+    # 派单器接口：OfferManager 通过它标记等待回应的行程和司机
+
+    def hold(self, ride_id: int, driver_id: int, ttl_seconds: float = None) -> None:
+        self.offered_rides.add(ride_id)
+        self.fleet.offered[driver_id] = True
+
+    def release(self, ride_id: int = None, driver_id: int = None) -> None:
+        if ride_id is not None:
+            self.offered_rides.discard(ride_id)
+        if driver_id is not None:
+            self.fleet.offered[driver_id] = False
+
+    def run(self) -> dict:
+        """运行模拟直到 duration_seconds
+
+        Returns:
+            模拟报告（见 report）
+        """
+        if len(self.request_times):
+            self.queue.schedule(self.request_times[0], "request", 0)
+        self.queue.schedule(self.window_seconds, "window")
+        self.queue.schedule(self.tick_seconds, "tick")
+        if self.recorder is not None:
+            for driver_id in range(len(self.fleet)):
+                self._record_availability(driver_id, True)
+
+        started = time.perf_counter()
+        while self.queue and self.queue.peek_time() <= self.duration_seconds:
+            _, kind, args = self.queue.pop()
+            self._handlers[kind](*args)
+        self.wall_seconds = time.perf_counter() - started
+        return self.report()
+
+    def _travel_seconds(self, origin: tuple, destination: tuple) -> float:
+        return (
+            self.city.travel_minutes(
+                origin[0], origin[1], destination[0], destination[1]
+            )
+            * 60
+        )
+
+    def _record_availability(self, driver_id: int, is_available: bool) -> None:
+        if self.recorder is not None:
+            self.recorder.availability_changed(
+                driver_id,
+                is_available,
+                *self.fleet.position(driver_id),
+                timestamp=self.queue.now,
+            )
+
+    def _on_request(self, ride_id: int) -> None:
+        if self.recorder is not None:
+            self.recorder.ride_requested(
+                ride_id,
+                *self.pickups[ride_id],
+                *self.dropoffs[ride_id],
+                timestamp=self.queue.now,
+            )
+        self.ride_status[ride_id] = REQUESTED
+        self.waiting[ride_id] = None
+        self.queue.schedule_after(self.patience_seconds, "abandon", ride_id)
+        if ride_id + 1 < len(self.request_times):
+            self.queue.schedule(self.request_times[ride_id + 1], "request", ride_id + 1)
+
+    def _on_window(self) -> None:
+        """一个批量派单窗口：全局分配后逐个发出派单"""
+        started = time.perf_counter()
+        requests = [
+            (ride_id, self.pickups[ride_id][0], self.pickups[ride_id][1])
+            for ride_id in self.waiting
+            if ride_id not in self.offered_rides
+        ][: self.dispatcher.max_batch]
+        drivers = self.fleet.available()
+        delays = None
+        if self.forward_horizon_seconds:
+            forward = [
+                (driver_id, lat, lng, seconds / 60)
+                for driver_id, lat, lng, seconds in self.finishing.query(
+                    self.forward_horizon_seconds
+                )
+                if not self.fleet.offered[driver_id]
+            ]
+            if forward:
+                delays = [0.0] * len(drivers) + [
+                    minutes for _, _, _, minutes in forward
+                ]
+                drivers = drivers + [
+                    (driver_id, lat, lng) for driver_id, lat, lng, _ in forward
+                ]
+
+        for ride_id, driver_id, eta_minutes in self.dispatcher.match(
+            requests, drivers, delays
+        ):
+            self.pickup_estimate[ride_id] = eta_minutes
+            self.offers.submit(ride_id, [driver_id], passenger_name=f"乘客{ride_id}")
+        self.dispatch_ms.append((time.perf_counter() - started) * 1000)
+        self.queue.schedule_after(self.window_seconds, "window")
+
+    def _on_tick(self) -> None:
+        self.offers.advance()
+        self.queue.schedule_after(self.tick_seconds, "tick")
+
+    def _notify(self, driver_id: int, passenger_name: str, pickup_address: str) -> None:
+        """司机收到派单：按概率安排接单、拒绝或不回应"""
+        ride_id = self.offers.pending_ride(driver_id)
+        if ride_id is None or self.rng.random() < self.no_response_rate:
+            return
+        accept = bool(self.rng.random() < self.accept_rate)
+        delay = self.rng.uniform(*self.response_seconds)
+        self.queue.schedule_after(delay, "respond", ride_id, driver_id, accept)
+
+    def _on_respond(self, ride_id: int, driver_id: int, accept: bool) -> None:
+        if self.offers.current_driver(ride_id) != driver_id:
+            # 派单已超时或行程已取消
+            self.stats["late_responses"] += 1
+            return
+        if not accept:
+            self.offers.decline(ride_id, driver_id)
+            return
+
+        # 与 accept_ride 相同：空闲司机直接接单，行程中的司机预留下一单
+        chained = False
+        if self.fleet.state[driver_id] == IDLE:
+            self.fleet.state[driver_id] = EN_ROUTE
+            self._record_availability(driver_id, False)
+        elif self.finishing.reserve(driver_id, ride_id):
+            chained = True
+        else:
+            self.stats["unavailable_on_accept"] += 1
+            self.offers.decline(ride_id, driver_id)
+            return
+
+        self.offered_rides.discard(ride_id)
+        self.waiting.pop(ride_id, None)
+        self.ride_status[ride_id] = ACCEPTED
+        self.ride_driver[ride_id] = driver_id
+        self.accepted_at[ride_id] = self.queue.now
+        self.chained[ride_id] = chained
+        self.offers.accepted(ride_id, driver_id)
+        if not chained:
+            travel = self._travel_seconds(
+                self.fleet.position(driver_id), self.pickups[ride_id]
+            )
+            self.queue.schedule_after(travel, "pickup", ride_id)
+
+    def _on_pickup(self, ride_id: int) -> None:
+        driver_id = int(self.ride_driver[ride_id])
+        pickup, dropoff = self.pickups[ride_id], self.dropoffs[ride_id]
+        self.fleet.move(driver_id, pickup[0], pickup[1], ON_TRIP)
+        self.ride_status[ride_id] = IN_PROGRESS
+        self.picked_up_at[ride_id] = self.queue.now
+
+        travel = self._travel_seconds(pickup, dropoff)
+        self.finishing.upsert(
+            driver_id, ride_id, dropoff[0], dropoff[1], self.queue.now + travel
+        )
+        self.queue.schedule_after(travel, "complete", ride_id)
+
+    def _on_complete(self, ride_id: int) -> None:
+        driver_id = int(self.ride_driver[ride_id])
+        pickup, dropoff = self.pickups[ride_id], self.dropoffs[ride_id]
+        self.ride_status[ride_id] = COMPLETED
+        self.completed_at[ride_id] = self.queue.now
+        distance = LocationService.calculate_distance(
+            pickup[0], pickup[1], dropoff[0], dropoff[1]
+        )
+        self.fares[ride_id] = PaymentService.calculate_fare(
+            distance, surge_multiplier=1.0
+        )
+
+        # 已预留下一单的司机直接前往下一个上车点
+        next_ride = self.finishing.reserved_ride(driver_id)
+        self.finishing.remove(driver_id)
+        if next_ride is None:
+            self.fleet.move(driver_id, dropoff[0], dropoff[1], IDLE)
+            self._record_availability(driver_id, True)
+            return
+        self.fleet.move(driver_id, dropoff[0], dropoff[1], EN_ROUTE)
+        self.queue.schedule_after(
+            self._travel_seconds(dropoff, self.pickups[next_ride]), "pickup", next_ride
+        )
+
+    def _on_abandon(self, ride_id: int) -> None:
+        if self.ride_status[ride_id] != REQUESTED:
+            return
+        self.ride_status[ride_id] = CANCELLED
+        self.waiting.pop(ride_id, None)
+        self.offers.cancel(ride_id)
+        self.offered_rides.discard(ride_id)
+
+    def report(self) -> dict:
+        """模拟报告
+
+        Returns:
+            吞吐（事件数、模拟/真实时间比、每小时完成行程）、派单窗口耗时百分位（毫秒）、
+            乘客等待接单和等待上车的百分位、匹配质量（匹配率、取消数、接驾时间、前向派单数、司机利用率）
+        """
+        requested = int(np.count_nonzero(self.ride_status != PENDING))
+        accepted_mask = ~np.isnan(self.accepted_at)
+        accepted = int(np.count_nonzero(accepted_mask))
+        completed = int(np.count_nonzero(self.ride_status == COMPLETED))
+        simulated = min(self.queue.now, self.duration_seconds) or self.duration_seconds
+        request_times = self.request_times[: len(self.ride_status)]
+
+        # 司机从接单到完成（或模拟结束）都算忙碌
+        busy_until = np.where(
+            np.isnan(self.completed_at), simulated, self.completed_at
+        )[accepted_mask]
+        busy_from = np.maximum(
+            self.accepted_at[accepted_mask], request_times[accepted_mask]
+        )
+        utilization = (
+            float(np.sum(busy_until - busy_from)) / (len(self.fleet) * simulated)
+            if len(self.fleet)
+            else 0.0
+        )
+
+        return {
+            "drivers": len(self.fleet),
+            "simulated_seconds": round(simulated, 1),
+            "wall_seconds": round(self.wall_seconds, 3),
+            "speedup": round(simulated / self.wall_seconds, 1)
+            if self.wall_seconds
+            else None,
+            "events": self.queue.processed,
+            "events_per_second": round(self.queue.processed / self.wall_seconds)
+            if self.wall_seconds
+            else None,
+            "requests": requested,
+            "accepted": accepted,
+            "completed": completed,
+            "cancelled": int(np.count_nonzero(self.ride_status == CANCELLED)),
+            "completed_per_hour": round(completed * 3600 / simulated, 1),
+            "match_rate": round(accepted / requested, 4) if requested else 0.0,
+            "chained": int(np.count_nonzero(self.chained)),
+            "offers": dict(self.offers.stats),
+            "late_responses": self.stats["late_responses"],
+            "dispatch_ms": percentiles(self.dispatch_ms),
+            "accept_wait_seconds": percentiles(self.accepted_at - request_times),
+            "pickup_wait_minutes": percentiles(
+                (self.picked_up_at - request_times) / 60
+            ),
+            "mean_pickup_eta_minutes": round(
+                float(np.nanmean(self.pickup_estimate[accepted_mask])), 2
+            )
+            if accepted
+            else 0.0,
+            "fares": round(float(self.fares.sum()), 2),
+            "utilization": round(utilization, 4),
+        }
+
+
+# 导出
+__all__ = ["Simulation", "DriverFleet", "percentiles", "RIDE_STATUSES"]
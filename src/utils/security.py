@@ -8,6 +8,10 @@ from functools import wraps
 from flask import request, jsonify
 
 
+# token_required 校验JWT使用的密钥（暂时固定，签发令牌时使用同一个值）
+TOKEN_SECRET_KEY = 'your-secret-key-change-me'
+
+
 class SecurityUtils:
     """安全工具类"""
 
@@ -192,8 +196,7 @@ def token_required(f):
         try:
             # 这里需要SECRET_KEY，暂时使用默认值
             # 实际项目中应该从配置中获取
-            secret_key = 'your-secret-key-change-me'
-            data = SecurityUtils.verify_token(token, secret_key)
+            data = SecurityUtils.verify_token(token, TOKEN_SECRET_KEY)
 
             if data is None:
                 return jsonify({
@@ -265,6 +268,7 @@ validate_password = security.validate_password
 
 # 导出类
 __all__ = [
+    'TOKEN_SECRET_KEY',
     'SecurityUtils',
     'security',
     'hash_password',
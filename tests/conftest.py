@@ -4,6 +4,17 @@
 import pytest
 from flask import Flask
 from src.services.database import db
+from src.utils.security import generate_token, TOKEN_SECRET_KEY
+
+
+class FakeClock:
+    """可手动推进的时钟"""
+
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
 
 @pytest.fixture
 def app():
@@ -34,4 +45,26 @@ def client(app):
 @pytest.fixture
 def runner(app):
     """CLI运行器"""
-    return app.test_cli_runner()
\ No newline at end of file
+    return app.test_cli_runner()
+
+@pytest.fixture
+def clock_start():
+    """假时钟的初始时间，测试模块可覆盖"""
+    return 0.0
+
+
+@pytest.fixture
+def clock(clock_start):
+    """可手动推进的时钟"""
+    return FakeClock(clock_start)
+
+
+@pytest.fixture
+def auth_header():
+    """生成带JWT的请求头：auth_header(用户ID, 角色)"""
+    def make(user_id, role='driver'):
+        token = generate_token(
+            user_id, f'{role}{user_id}@example.com', role, TOKEN_SECRET_KEY
+        )
+        return {'Authorization': f'Bearer {token}'}
+    return make
@@ -0,0 +1,190 @@
+"""
+应用冒烟测试 - 通过 create_app() 创建的完整应用调用各蓝图的端点
+"""
+import threading
+
+import pytest
+
+from src.app import create_app, create_server
+from src.longpoll import create_longpoll_app, create_longpoll_server
+from src.models.user import User
+from src.services.database import db
+from src.services.dispatcher import BatchDispatcher
+from src.services.offers import OfferManager
+from src.services.spatial_index import DriverGridIndex
+
+
+@pytest.fixture
+def full_app(monkeypatch):
+    """注册了全部蓝图的应用，使用内存数据库和独立的司机索引、派单管理器"""
+    index = DriverGridIndex()
+    monkeypatch.setattr("src.api.driver.driver_index", index)
+    monkeypatch.setattr(
+        "src.api.driver.offer_manager",
+        OfferManager(
+            source=index,
+            dispatcher=BatchDispatcher(source=index),
+            notifier=lambda *args: True,
+        ),
+    )
+    app = create_app({"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:"})
+    yield app
+    with app.app_context():
+        db.drop_all()
+
+
+@pytest.fixture
+def users(full_app):
+    with full_app.app_context():
+        passenger = User(
+            email="p@example.com", username="p", password_hash="x", role="passenger"
+        )
+        driver = User(
+            email="d@example.com",
+            username="d",
+            password_hash="x",
+            role="driver",
+            is_available=False,
+        )
+        db.session.add_all([passenger, driver])
+        db.session.commit()
+        return passenger.id, driver.id
+
+
+class TestCreateApp:
+    """测试应用工厂注册的端点"""
+
+    def test_core_and_blueprint_routes(self, full_app):
+        """健康检查和各蓝图的路由都已注册"""
+        client = full_app.test_client()
+        assert client.get("/health").status_code == 200
+        assert client.get("/api/auth/test").status_code == 200
+
+        rules = {rule.rule for rule in full_app.url_map.iter_rules()}
+        for rule in (
+            "/api/ride/request",
+            "/api/ride/<int:ride_id>/wait",
+            "/api/rides/batch",
+            "/api/driver/location/update",
+            "/api/driver/location/batch",
+            "/api/driver/ride/<int:ride_id>/decline",
+            "/api/driver/rides/transition",
+            "/api/analytics/heatmap",
+        ):
+            assert rule in rules
+
+    def test_create_app_starts_no_threads(self):
+        """导入模块和创建应用都不启动后台线程"""
+        before = set(threading.enumerate())
+        app = create_app(
+            {"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:"}
+        )
+        assert set(threading.enumerate()) == before
+        with app.app_context():
+            db.drop_all()
+
+    def test_create_server_starts_background_tasks(self, monkeypatch):
+        """只有运行服务的入口启动后台线程，BACKGROUND_TASKS_ENABLED=false 时不启动"""
+        started = []
+        monkeypatch.setattr("src.app.start_background_tasks", started.append)
+        config = {"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:"}
+
+        app = create_server({**config, "BACKGROUND_TASKS_ENABLED": True})
+        assert started == [app]
+
+        create_server({**config, "BACKGROUND_TASKS_ENABLED": False})
+        assert started == [app]
+
+    def test_longpoll_app_routes(self):
+        """长轮询应用只注册长轮询端点和健康检查"""
+        app = create_longpoll_app(
+            {"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:"}
+        )
+
+        rules = {rule.rule for rule in app.url_map.iter_rules()} - {
+            "/static/<path:filename>"
+        }
+        assert rules == {"/api/ride/<int:ride_id>/wait", "/health"}
+        assert app.test_client().get("/health").status_code == 200
+
+    def test_longpoll_server_starts_listener(self, monkeypatch):
+        """只有长轮询服务的入口启动行程转换监听"""
+        started = []
+        monkeypatch.setattr(
+            "src.services.ride_state.ride_transition_listener.start", started.append
+        )
+
+        app = create_longpoll_server(
+            {"TESTING": True, "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:"}
+        )
+
+        assert started == [app]
+
+    def test_ride_lifecycle(self, full_app, users, auth_header):
+        """司机上线、乘客叫车、司机接单到完成行程"""
+        client = full_app.test_client()
+        passenger_id, driver_id = users
+        driver_headers = auth_header(driver_id, "driver")
+
+        response = client.post(
+            "/api/driver/location/update",
+            json={"latitude": 40.7128, "longitude": -74.0060},
+            headers=driver_headers,
+        )
+        assert response.status_code == 200
+        response = client.post(
+            "/api/driver/available", json={"is_available": True}, headers=driver_headers
+        )
+        assert response.status_code == 200
+        response = client.post(
+            "/api/driver/location/batch",
+            json={"pings": [{"latitude": 40.7129, "longitude": -74.0061}]},
+            headers=driver_headers,
+        )
+        assert response.status_code == 202
+
+        response = client.post(
+            "/api/ride/request",
+            json={
+                "pickup_address": "123 Main Street, New York, NY",
+                "dropoff_address": "456 Park Avenue, New York, NY",
+                "pickup_lat": 40.7130,
+                "pickup_lng": -74.0060,
+                "dropoff_lat": 40.7489,
+                "dropoff_lng": -73.9680,
+            },
+            headers=auth_header(passenger_id, "passenger"),
+        )
+        assert response.status_code == 201
+        ride_id = response.get_json()["ride_id"]
+
+        response = client.get("/api/driver/nearby-requests", headers=driver_headers)
+        assert response.status_code == 200
+        assert [ride["id"] for ride in response.get_json()["nearby_requests"]] == [
+            ride_id
+        ]
+
+        assert (
+            client.post(
+                f"/api/driver/ride/{ride_id}/accept", headers=driver_headers
+            ).status_code
+            == 200
+        )
+        assert (
+            client.post(
+                f"/api/driver/ride/{ride_id}/start", headers=driver_headers
+            ).status_code
+            == 200
+        )
+        response = client.get("/api/driver/rides/active", headers=driver_headers)
+        assert [ride["id"] for ride in response.get_json()["rides"]] == [ride_id]
+
+        response = client.post(
+            f"/api/driver/ride/{ride_id}/complete",
+            json={"actual_fare": 20.0},
+            headers=driver_headers,
+        )
+        assert response.status_code == 200
+        assert response.get_json()["ride"]["status"] == "completed"
+        response = client.get("/api/driver/rides/history", headers=driver_headers)
+        assert response.get_json()["total"] == 1
@@ -45,6 +45,76 @@ class TestLocationService:
         time_smooth = LocationService.estimate_travel_time(distance_km, traffic_factor=0.8)
         assert time_smooth == 96.0  # 减少20%
 
+    def test_calculate_distances_batch(self):
+        """测试批量距离计算与单点计算一致"""
+        ny_lat, ny_lng = 40.7128, -74.0060
+        lats = [34.0522, 40.7589, 40.7128]
+        lngs = [-118.2437, -74.0567, -74.0060]
+
+        distances = LocationService.calculate_distances(ny_lat, ny_lng, lats, lngs)
+
+        assert distances.shape == (3,)
+        for i in range(3):
+            expected = LocationService.calculate_distance(
+                ny_lat, ny_lng, lats[i], lngs[i]
+            )
+            assert distances[i] == pytest.approx(expected, abs=1e-9)
+
+    def test_calculate_distance_matrix(self):
+        """测试N×M距离矩阵"""
+        lats1, lngs1 = [40.7128, 34.0522], [-74.0060, -118.2437]
+        lats2, lngs2 = [40.7589, 41.8781, 40.7128], [-73.9851, -87.6298, -74.0060]
+
+        matrix = LocationService.calculate_distance_matrix(lats1, lngs1, lats2, lngs2)
+
+        assert matrix.shape == (2, 3)
+        for i in range(2):
+            for j in range(3):
+                expected = LocationService.calculate_distance(
+                    lats1[i], lngs1[i], lats2[j], lngs2[j]
+                )
+                assert matrix[i, j] == pytest.approx(expected, abs=1e-9)
+
+    def test_bounding_box_contains_radius(self):
+        """测试外接矩形包含整个搜索圆"""
+        lat, lng, radius_km = 40.7128, -74.0060, 5.0
+
+        min_lat, max_lat, min_lng, max_lng = LocationService.bounding_box(
+            lat, lng, radius_km
+        )
+
+        assert min_lat < lat < max_lat
+        assert min_lng < lng < max_lng
+        # 矩形边界中点到圆心的距离不小于半径
+        north = LocationService.calculate_distance(lat, lng, max_lat, lng)
+        east = LocationService.calculate_distance(lat, lng, lat, max_lng)
+        assert north >= radius_km - 1e-6
+        assert east >= radius_km - 1e-6
+
+        # 跨越180度经线时不限制经度
+        assert LocationService.bounding_box(0.0, 179.99, 5.0)[2:] == (-180.0, 180.0)
+
+    def test_pickup_within_filters_rides(self, app):
+        """测试按上车点矩形过滤行程"""
+        from src.services.database import db
+        from src.models.ride import Ride
+
+        with app.app_context():
+            db.session.add_all([
+                Ride(passenger_id=1, pickup_address='near', dropoff_address='x',
+                     pickup_lat=40.713, pickup_lng=-74.006),
+                Ride(passenger_id=1, pickup_address='far', dropoff_address='x',
+                     pickup_lat=41.5, pickup_lng=-74.006),
+            ])
+            db.session.commit()
+
+            box = LocationService.bounding_box(40.7128, -74.0060, 5.0)
+            rides = Ride.query.filter(
+                Ride.status == 'requested', Ride.pickup_within(*box)
+            ).all()
+
+            assert [ride.pickup_address for ride in rides] == ['near']
+
     def test_find_nearby_drivers(self):
         """测试查找附近司机"""
         # 纽约坐标
@@ -0,0 +1,121 @@
+"""
+缓存单元测试 - 测试TTL/LRU缓存和路线缓存
+"""
+import threading
+import pytest
+from src.services.cache import TTLCache, MISSING
+from src.services.location import LocationService, eta_cache
+from src.services.routing import set_routing_engine
+
+
+class TestTTLCache:
+    """测试TTL缓存"""
+
+    def test_lru_eviction(self):
+        """测试超出容量时淘汰最久未访问的条目"""
+        cache = TTLCache(maxsize=2, ttl_seconds=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        assert cache.get("a") == 1  # a 变为最近访问
+        cache.set("c", 3)
+
+        assert cache.get("b") is None
+        assert cache.get("a") == 1
+        assert cache.get("c") == 3
+        assert cache.get_stats()["evictions"] == 1
+
+    def test_ttl_expiration(self, clock):
+        """测试条目按各自TTL过期"""
+        cache = TTLCache(maxsize=10, ttl_seconds=10, clock=clock)
+        cache.set("short", 1, ttl_seconds=1)
+        cache.set("long", 2)
+
+        clock.now = 5
+        assert cache.lookup("short") is MISSING
+        assert cache.get("long") == 2
+
+        clock.now = 11
+        assert cache.get("long") is None
+        assert cache.get_stats()["expirations"] == 2
+
+    def test_hit_miss_counters(self):
+        """测试命中统计"""
+        cache = TTLCache()
+        calls = []
+
+        def factory():
+            calls.append(1)
+            return None
+
+        assert cache.get_or_set("k", factory) is None
+        assert cache.get_or_set("k", factory) is None  # 缓存的None也算命中
+        assert len(calls) == 1
+
+        stats = cache.get_stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+        assert stats["hit_rate"] == 0.5
+
+    def test_concurrent_access(self):
+        """测试多线程并发读写"""
+        cache = TTLCache(maxsize=100, ttl_seconds=60)
+
+        def worker(offset):
+            for i in range(2000):
+                key = (offset + i) % 150
+                if cache.get(key) is None:
+                    cache.set(key, key)
+
+        threads = [threading.Thread(target=worker, args=(n * 10,)) for n in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        stats = cache.get_stats()
+        assert len(cache) <= 100
+        assert stats["hits"] + stats["misses"] == 8 * 2000
+
+
+class TestRouteCache:
+    """测试路线缓存"""
+
+    def test_route_cached_by_cell_pair(self):
+        """测试同一网格对的查询只调用一次路由引擎"""
+
+        class CountingEngine:
+            calls = 0
+
+            def route(self, lat1, lng1, lat2, lng2):
+                CountingEngine.calls += 1
+                return {"duration_minutes": 12.0, "distance_km": 6.0}
+
+        eta_cache.clear()
+        set_routing_engine(CountingEngine())
+        try:
+            first = LocationService.estimate_route(
+                40.71281, -74.00601, 40.75891, -73.98511
+            )
+            # 同一网格内的邻近坐标
+            second = LocationService.estimate_route(
+                40.71282, -74.00602, 40.75892, -73.98512
+            )
+            second["duration_minutes"] = 0  # 修改返回值不影响缓存
+
+            third = LocationService.estimate_route(
+                40.71281, -74.00601, 40.75891, -73.98511
+            )
+        finally:
+            set_routing_engine(None)
+            eta_cache.clear()
+
+        assert CountingEngine.calls == 1
+        assert first == third
+        assert first["source"] == "road_network"
+
+    def test_cell_pair_key(self):
+        """测试坐标量化"""
+        key = LocationService.cell_pair_key(
+            40.7128, -74.0060, 40.7589, -73.9851, cell_deg=0.01
+        )
+        assert key == (4071, -7401, 4075, -7399)
@@ -0,0 +1,262 @@
+"""
+批量派单单元测试 - 测试候选司机生成、拍卖分配和派单批次
+"""
+import itertools
+import time
+
+import numpy as np
+import pytest
+from src.models.ride import Ride
+from src.models.user import User
+from src.services.database import db, LeaderLock
+from src.services.dispatcher import (
+    BatchDispatcher,
+    nearest_candidates,
+    auction_assignment,
+    greedy_assignment,
+)
+from src.services.kdtree import to_unit_vectors
+from src.services.spatial_index import DriverGridIndex
+
+
+NY_LAT, NY_LNG = 40.7128, -74.0060
+
+
+def total_cost(assignment, candidates, costs):
+    """分配方案的总代价"""
+    total = 0.0
+    for row, driver in enumerate(assignment):
+        if driver >= 0:
+            total += costs[row][list(candidates[row]).index(driver)]
+    return total
+
+
+class TestNearestCandidates:
+    """测试候选司机生成"""
+
+    def test_matches_brute_force(self):
+        """测试与暴力计算的最近K个司机一致"""
+        rng = np.random.default_rng(1)
+        request_lats = NY_LAT + rng.uniform(-0.1, 0.1, 50)
+        request_lngs = NY_LNG + rng.uniform(-0.1, 0.1, 50)
+        driver_lats = NY_LAT + rng.uniform(-0.1, 0.1, 200)
+        driver_lngs = NY_LNG + rng.uniform(-0.1, 0.1, 200)
+
+        candidates, distances = nearest_candidates(
+            request_lats, request_lngs, driver_lats, driver_lngs, 5
+        )
+
+        requests = to_unit_vectors(request_lats, request_lngs)
+        drivers = to_unit_vectors(driver_lats, driver_lngs)
+        for row in range(50):
+            expected = np.argsort(((drivers - requests[row]) ** 2).sum(axis=1))[:5]
+            assert list(candidates[row]) == list(expected)
+            assert list(distances[row]) == sorted(distances[row])
+
+    def test_pads_when_few_drivers_or_too_far(self):
+        """测试司机不足或超出距离时填充-1"""
+        candidates, distances = nearest_candidates(
+            [NY_LAT],
+            [NY_LNG],
+            [NY_LAT + 0.001, NY_LAT + 1.0],
+            [NY_LNG, NY_LNG],
+            4,
+            max_km=10,
+        )
+
+        assert candidates.shape == (1, 2)
+        assert list(candidates[0]) == [0, -1]
+        assert np.isinf(distances[0, 1])
+
+
+class TestAuctionAssignment:
+    """测试拍卖算法分配"""
+
+    def test_beats_greedy_on_crossing_requests(self):
+        """测试贪心先到先得会错过全局最优"""
+        candidates = np.array([[0, 1], [0, 1]])
+        costs = np.array([[0.9, 1.0], [0.1, 2.0]])
+
+        auction = auction_assignment(candidates, costs, 2, unassigned_cost=20)
+        greedy = greedy_assignment(candidates, costs)
+
+        assert list(auction) == [1, 0]
+        assert list(greedy) == [0, 1]
+        assert total_cost(auction, candidates, costs) < total_cost(
+            greedy, candidates, costs
+        )
+
+    def test_matches_exhaustive_optimum(self):
+        """测试小规模时与穷举最优解一致（误差不超过 行程数 x epsilon）"""
+        rng = np.random.default_rng(7)
+        for _ in range(20):
+            costs = rng.uniform(0, 10, (4, 5))
+            candidates = np.tile(np.arange(5), (4, 1))
+            assignment = auction_assignment(
+                candidates, costs, 5, unassigned_cost=100, epsilon=0.01
+            )
+
+            best = min(
+                sum(costs[row, driver] for row, driver in enumerate(drivers))
+                for drivers in itertools.permutations(range(5), 4)
+            )
+            assert len(set(assignment)) == 4
+            assert total_cost(assignment, candidates, costs) <= best + 4 * 0.01
+
+    def test_more_requests_than_drivers(self):
+        """测试司机不足时每个司机只分配一次，其余行程留到下一批"""
+        rng = np.random.default_rng(3)
+        candidates = np.tile(np.arange(3), (6, 1))
+        costs = rng.uniform(0, 10, (6, 3))
+
+        assignment = auction_assignment(candidates, costs, 3, unassigned_cost=20)
+
+        assigned = assignment[assignment >= 0]
+        assert len(assigned) == 3
+        assert len(set(assigned.tolist())) == 3
+        assert (assignment == -1).sum() == 3
+
+    def test_skips_invalid_candidates(self):
+        """测试没有候选司机的行程不分配"""
+        candidates = np.array([[0, -1], [-1, -1]])
+        costs = np.array([[5.0, np.inf], [np.inf, np.inf]])
+
+        assert list(auction_assignment(candidates, costs, 1, unassigned_cost=20)) == [
+            0,
+            -1,
+        ]
+
+
+class TestBatchDispatcher:
+    """测试批量派单器"""
+
+    def test_match_returns_ride_and_driver_ids(self):
+        """测试按ID返回分配结果和接驾时间"""
+        dispatcher = BatchDispatcher(source=DriverGridIndex())
+        requests = [(101, NY_LAT, NY_LNG), (102, NY_LAT + 0.01, NY_LNG)]
+        drivers = [(7, NY_LAT + 0.011, NY_LNG), (8, NY_LAT - 0.002, NY_LNG)]
+
+        matches = dispatcher.match(requests, drivers)
+
+        assert sorted((ride_id, driver_id) for ride_id, driver_id, _ in matches) == [
+            (101, 8),
+            (102, 7),
+        ]
+        assert all(eta >= 0 for _, _, eta in matches)
+
+    def test_drivers_beyond_max_pickup_are_ignored(self):
+        """测试接驾时间超过上限的司机不参与分配"""
+        dispatcher = BatchDispatcher(source=DriverGridIndex(), max_pickup_minutes=5)
+
+        assert (
+            dispatcher.match([(1, NY_LAT, NY_LNG)], [(2, NY_LAT + 1.0, NY_LNG)]) == []
+        )
+
+    def test_run_once_sends_offers_once(self, app):
+        """测试派单后行程和司机在有效期内不再参与分配"""
+        index = DriverGridIndex()
+        index.upsert(7, NY_LAT + 0.001, NY_LNG)
+        offers = []
+        dispatcher = BatchDispatcher(source=index, on_offer=offers.append)
+
+        with app.app_context():
+            ride = Ride(
+                passenger_id=1,
+                pickup_address="A",
+                dropoff_address="B",
+                pickup_lat=NY_LAT,
+                pickup_lng=NY_LNG,
+            )
+            db.session.add(ride)
+            db.session.commit()
+
+            assert [(o["ride_id"], o["driver_id"]) for o in dispatcher.run_once()] == [
+                (ride.id, 7)
+            ]
+            assert dispatcher.last_batch["offers"] == 1
+            assert dispatcher.run_once() == []
+
+            dispatcher.release(ride_id=ride.id, driver_id=7)
+            assert len(dispatcher.run_once()) == 1
+        assert len(offers) == 2
+
+    def test_only_leader_dispatches(self, app):
+        """未持有leader锁的进程不派单；leader接手时从数据库加载可用司机"""
+
+        class Follower:
+            def acquire(self):
+                return False
+
+        index = DriverGridIndex()
+        index.upsert(99, NY_LAT, NY_LNG)
+        with app.app_context():
+            driver = User(
+                email="d@example.com",
+                username="d",
+                password_hash="x",
+                role="driver",
+                is_available=True,
+                current_lat=NY_LAT + 0.001,
+                current_lng=NY_LNG,
+            )
+            db.session.add(driver)
+            db.session.add(
+                Ride(
+                    passenger_id=1,
+                    pickup_address="A",
+                    dropoff_address="B",
+                    pickup_lat=NY_LAT,
+                    pickup_lng=NY_LNG,
+                )
+            )
+            db.session.commit()
+
+            follower = BatchDispatcher(
+                source=index, on_offer=lambda offer: None, leader_lock=Follower()
+            )
+            assert follower.run_if_leader() == []
+            assert 99 in index
+
+            leader = BatchDispatcher(source=index, on_offer=lambda offer: None)
+            offers = leader.run_if_leader()
+
+            assert [offer["driver_id"] for offer in offers] == [driver.id]
+            assert 99 not in index
+            assert index.get_info(driver.id)["name"] == "d"
+
+    def test_leader_lock_without_postgres(self, app):
+        """非PostgreSQL数据库只有一个进程，总是leader"""
+        lock = LeaderLock(1)
+        with app.app_context():
+            assert lock.acquire()
+            lock.release()
+        assert not lock.held
+
+    def test_large_batch_within_window(self):
+        """测试5000 x 5000 的批次在2秒窗口内完成"""
+        rng = np.random.default_rng(42)
+        requests = [
+            (i, lat, lng)
+            for i, (lat, lng) in enumerate(
+                zip(
+                    NY_LAT + rng.uniform(-0.135, 0.135, 5000),
+                    NY_LNG + rng.uniform(-0.135, 0.135, 5000),
+                )
+            )
+        ]
+        drivers = [
+            (i, lat, lng)
+            for i, (lat, lng) in enumerate(
+                zip(
+                    NY_LAT + rng.uniform(-0.135, 0.135, 5000),
+                    NY_LNG + rng.uniform(-0.135, 0.135, 5000),
+                )
+            )
+        ]
+
+        started = time.perf_counter()
+        matches = BatchDispatcher(source=DriverGridIndex()).match(requests, drivers)
+
+        assert time.perf_counter() - started < 2.0
+        assert len(matches) > 4500
+        assert len({driver_id for _, driver_id, _ in matches}) == len(matches)
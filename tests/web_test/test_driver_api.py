@@ -0,0 +1,278 @@
+"""
+司机接口单元测试 - 通过测试客户端调用司机蓝图的接口
+"""
+import datetime
+import time
+
+import pytest
+from src.api.driver import driver_bp
+from src.models.ride import Ride
+from src.models.user import User
+from src.services.database import db
+from src.services.event_log import EventRecorder, read_events, LOCATION_PING
+from src.services.forward_dispatch import FinishingDriverIndex
+from src.services.location_buffer import LocationWriteBuffer
+from src.services.spatial_index import DriverGridIndex
+from src.services.trajectory import TrackStore
+
+
+@pytest.fixture
+def driver_client(app):
+    app.register_blueprint(driver_bp, url_prefix="/api/driver")
+    return app.test_client()
+
+
+def add_driver(app, lat=None, lng=None, is_available=True):
+    with app.app_context():
+        driver = User(
+            email="d@example.com",
+            username="d",
+            password_hash="x",
+            role="driver",
+            is_available=is_available,
+        )
+        if lat is not None:
+            driver.set_location(lat, lng)
+        db.session.add(driver)
+        db.session.commit()
+        return driver.id
+
+
+class TestNearbyRequestsEndpoint:
+    """测试附近行程请求接口"""
+
+    def test_returns_rides_within_radius(self, app, driver_client, auth_header):
+        """只返回半径内的待接单行程，坐标为0的上车点不被丢弃"""
+        driver_id = add_driver(app, 0.0, 0.0)
+        with app.app_context():
+            passenger = User(
+                email="p@example.com", username="p", password_hash="x", role="passenger"
+            )
+            db.session.add(passenger)
+            db.session.commit()
+            db.session.add_all(
+                [
+                    Ride(
+                        passenger_id=passenger.id,
+                        pickup_address="origin",
+                        dropoff_address="x",
+                        pickup_lat=0.0,
+                        pickup_lng=0.0,
+                    ),
+                    Ride(
+                        passenger_id=passenger.id,
+                        pickup_address="near",
+                        dropoff_address="x",
+                        pickup_lat=0.01,
+                        pickup_lng=0.0,
+                    ),
+                    Ride(
+                        passenger_id=passenger.id,
+                        pickup_address="far",
+                        dropoff_address="x",
+                        pickup_lat=1.0,
+                        pickup_lng=0.0,
+                    ),
+                ]
+            )
+            db.session.commit()
+
+        response = driver_client.get(
+            "/api/driver/nearby-requests?radius=5", headers=auth_header(driver_id)
+        )
+
+        assert response.status_code == 200
+        data = response.get_json()
+        assert sorted(ride["pickup_address"] for ride in data["nearby_requests"]) == [
+            "near",
+            "origin",
+        ]
+        assert data["count"] == 2
+
+    def test_location_not_set(self, app, driver_client, auth_header):
+        """司机没有位置时返回400"""
+        driver_id = add_driver(app)
+
+        response = driver_client.get(
+            "/api/driver/nearby-requests", headers=auth_header(driver_id)
+        )
+
+        assert response.status_code == 400
+
+    def test_requires_driver_token(self, driver_client, auth_header):
+        """未登录返回401，非司机返回403"""
+        assert driver_client.get("/api/driver/nearby-requests").status_code == 401
+        response = driver_client.get(
+            "/api/driver/nearby-requests", headers=auth_header(1, "passenger")
+        )
+        assert response.status_code == 403
+
+
+class TestUpdateLocationEndpoint:
+    """测试位置上报接口"""
+
+    @pytest.fixture
+    def index(self, monkeypatch):
+        index = DriverGridIndex()
+        monkeypatch.setattr("src.api.driver.driver_index", index)
+        return index
+
+    def test_writes_position_and_syncs_index(
+        self, app, driver_client, index, tmp_path, monkeypatch, auth_header
+    ):
+        """写入数值位置列，可用司机进入空间索引，并记录派单事件"""
+        recorder = EventRecorder()
+        recorder.open(str(tmp_path / "events.log"))
+        monkeypatch.setattr("src.api.driver.event_recorder", recorder)
+        driver_id = add_driver(app)
+
+        response = driver_client.post(
+            "/api/driver/location/update",
+            json={"latitude": 40.72, "longitude": -74.0},
+            headers=auth_header(driver_id),
+        )
+        recorder.close()
+
+        assert response.status_code == 200
+        assert response.get_json()["latitude"] == 40.72
+        with app.app_context():
+            driver = db.session.get(User, driver_id)
+            assert (driver.current_lat, driver.current_lng) == (40.72, -74.0)
+        assert index.get_position(driver_id) == pytest.approx((40.72, -74.0))
+        event = list(read_events(str(tmp_path / "events.log")))[-1]
+        assert event[0] == LOCATION_PING and event[2] == driver_id
+
+    def test_restores_active_ride_track(
+        self, app, driver_client, index, monkeypatch, auth_header
+    ):
+        """进行中行程的司机上报位置时恢复轨迹记录，不进入空间索引"""
+        tracks = TrackStore()
+        finishing = FinishingDriverIndex()
+        monkeypatch.setattr("src.api.driver.track_store", tracks)
+        monkeypatch.setattr("src.api.driver.finishing_drivers", finishing)
+        driver_id = add_driver(app, is_available=False)
+        with app.app_context():
+            ride = Ride(
+                passenger_id=99,
+                driver_id=driver_id,
+                status="in_progress",
+                pickup_address="A",
+                dropoff_address="B",
+                dropoff_lat=40.75,
+                dropoff_lng=-73.98,
+            )
+            db.session.add(ride)
+            db.session.commit()
+            ride_id = ride.id
+
+        response = driver_client.post(
+            "/api/driver/location/update",
+            json={"latitude": 40.72, "longitude": -74.0},
+            headers=auth_header(driver_id),
+        )
+
+        assert response.status_code == 200
+        assert tracks.ride_for_driver(driver_id) == ride_id
+        assert len(tracks.points(ride_id)) == 1
+        assert driver_id in finishing
+        assert driver_id not in index
+
+    def test_invalid_body(self, app, driver_client, auth_header):
+        """缺少或无效的坐标返回400"""
+        driver_id = add_driver(app)
+        headers = auth_header(driver_id)
+
+        assert (
+            driver_client.post(
+                "/api/driver/location/update", json={}, headers=headers
+            ).status_code
+            == 400
+        )
+        response = driver_client.post(
+            "/api/driver/location/update",
+            json={"latitude": "x", "longitude": 1},
+            headers=headers,
+        )
+        assert response.status_code == 400
+
+
+class TestLocationBatchEndpoint:
+    """测试批量位置上报接口"""
+
+    @pytest.fixture
+    def buffer(self, monkeypatch):
+        buffer = LocationWriteBuffer()
+        monkeypatch.setattr("src.api.driver.location_buffer", buffer)
+        monkeypatch.setattr("src.api.driver.driver_index", DriverGridIndex())
+        return buffer
+
+    def test_driver_reports_own_pings(self, driver_client, buffer, auth_header):
+        """司机可以省略driver_id，不能替其他司机上报"""
+        now = time.time()
+        response = driver_client.post(
+            "/api/driver/location/batch",
+            json={
+                "pings": [
+                    {"latitude": 40.71, "longitude": -74.0, "timestamp": now - 2},
+                    {"latitude": 40.72, "longitude": -74.0, "timestamp": now - 1},
+                    {"driver_id": 8, "latitude": 40.73, "longitude": -74.0},
+                ]
+            },
+            headers=auth_header(7),
+        )
+
+        assert response.status_code == 202
+        data = response.get_json()
+        assert data["accepted"] == 2
+        assert data["rejected"] == [
+            {"index": 2, "error": "Cannot report location for another driver"}
+        ]
+        assert buffer.latest(7)[:2] == (40.72, -74.0)
+        assert buffer.latest(8) is None
+
+    def test_admin_reports_many_drivers(self, driver_client, buffer, auth_header):
+        """管理员可以上报多个司机"""
+        response = driver_client.post(
+            "/api/driver/location/batch",
+            json={
+                "pings": [
+                    {"driver_id": 1, "latitude": 40.71, "longitude": -74.0},
+                    {"driver_id": 2, "latitude": 40.72, "longitude": -74.0},
+                ]
+            },
+            headers=auth_header(100, "admin"),
+        )
+
+        assert response.status_code == 202
+        assert response.get_json()["accepted"] == 2
+        assert len(buffer) == 2
+
+    def test_rejects_timestamps_out_of_range(self, driver_client, buffer, auth_header):
+        """远在未来或过旧的上报被拒绝，稍晚于服务器时间的按服务器时间记录"""
+        now = time.time()
+        response = driver_client.post(
+            "/api/driver/location/batch",
+            json={
+                "pings": [
+                    {"latitude": 40.71, "longitude": -74.0, "timestamp": now + 86400},
+                    {"latitude": 40.71, "longitude": -74.0, "timestamp": now - 86400},
+                    {"latitude": 40.72, "longitude": -74.0, "timestamp": now + 2},
+                ]
+            },
+            headers=auth_header(7),
+        )
+
+        data = response.get_json()
+        assert [item["index"] for item in data["rejected"]] == [0, 1]
+        assert data["accepted"] == 1
+        assert buffer.latest(7)[2] <= datetime.datetime.utcnow()
+
+    def test_passenger_forbidden(self, driver_client, buffer, auth_header):
+        """乘客不能上报位置"""
+        response = driver_client.post(
+            "/api/driver/location/batch",
+            json={"pings": [{"latitude": 40.71, "longitude": -74.0}]},
+            headers=auth_header(3, "passenger"),
+        )
+
+        assert response.status_code == 403
@@ -0,0 +1,257 @@
+"""
+派单事件日志单元测试 - 测试记录格式、提交后记录行程请求和确定性回放
+"""
+import pytest
+from src.api.driver import driver_bp
+from src.models.ride import Ride
+from src.models.user import User
+from src.services.database import db
+from src.services.event_log import (
+    EventRecorder,
+    read_events,
+    register_ride_events,
+    MAGIC,
+    RIDE_REQUEST,
+    LOCATION_PING,
+    AVAILABILITY,
+)
+from src.simulator.replay import EventReplayer
+
+
+@pytest.fixture
+def clock_start():
+    return 1000.0
+
+
+@pytest.fixture
+def log_path(tmp_path):
+    return str(tmp_path / "events.log")
+
+
+def write_log(path, events):
+    """按 (时间, 方法名, 参数...) 写入事件日志"""
+    recorder = EventRecorder()
+    recorder.open(path)
+    for timestamp, method, *args in events:
+        getattr(recorder, method)(*args, timestamp=timestamp)
+    recorder.close()
+
+
+class TestEventRecorder:
+    """测试事件记录"""
+
+    def test_round_trip(self, log_path, clock):
+        """测试三种事件写入后按顺序读出，未知坐标为None"""
+        recorder = EventRecorder(clock=clock)
+        recorder.open(log_path)
+        recorder.ride_requested(7, 40.7128, -74.006)
+        clock.now += 1
+        recorder.location_pings([(3, 40.75, -73.99, "ignored")])
+        recorder.availability_changed(3, False)
+        recorder.close()
+
+        events = list(read_events(log_path))
+        assert [event[0] for event in events] == [
+            RIDE_REQUEST,
+            LOCATION_PING,
+            AVAILABILITY,
+        ]
+        assert events[0][1] == 1000.0 and events[1][1] == 1001.0
+        assert events[0][2] == 7
+        assert events[0][3] == pytest.approx(40.7128, abs=1e-5)
+        assert events[0][5:] == (None, None)
+        assert events[2][2:] == (3, False, None, None)
+
+    def test_disabled_recorder_is_noop(self):
+        """测试未打开文件时记录调用直接返回"""
+        recorder = EventRecorder()
+        recorder.location_ping(1, 40.0, -74.0)
+
+        assert not recorder.enabled
+        assert recorder.records == 0
+
+    def test_reopen_appends(self, log_path):
+        """测试重新打开时续写，不重复写入文件头"""
+        write_log(log_path, [(1.0, "location_ping", 1, 40.0, -74.0)])
+        write_log(log_path, [(2.0, "location_ping", 2, 40.0, -74.0)])
+
+        assert [event[2] for event in read_events(log_path)] == [1, 2]
+        with open(log_path, "rb") as f:
+            assert f.read().count(MAGIC) == 1
+
+    def test_truncated_tail_ignored(self, log_path):
+        """测试末尾不完整的记录（写入中断）被忽略"""
+        write_log(
+            log_path,
+            [
+                (1.0, "location_ping", 1, 40.0, -74.0),
+                (2.0, "location_ping", 2, 40.0, -74.0),
+            ],
+        )
+        with open(log_path, "rb+") as f:
+            f.truncate(f.seek(0, 2) - 3)
+
+        assert [event[2] for event in read_events(log_path)] == [1]
+
+    def test_rejects_other_files(self, log_path):
+        """测试不是事件日志的文件报错"""
+        with open(log_path, "wb") as f:
+            f.write(b"not a log")
+
+        with pytest.raises(ValueError):
+            list(read_events(log_path))
+
+    def test_records_committed_rides_only(self, app, log_path, monkeypatch):
+        """测试只记录提交成功的行程请求"""
+        recorder = EventRecorder()
+        recorder.open(log_path)
+        monkeypatch.setattr("src.services.event_log.event_recorder", recorder)
+        register_ride_events(Ride)
+
+        with app.app_context():
+            passenger = User(
+                email="p@example.com", username="p", password_hash="x", role="passenger"
+            )
+            db.session.add(passenger)
+            db.session.commit()
+
+            db.session.add(
+                Ride(
+                    passenger_id=passenger.id,
+                    pickup_address="A",
+                    dropoff_address="B",
+                    pickup_lat=40.7,
+                    pickup_lng=-74.0,
+                )
+            )
+            db.session.flush()
+            db.session.rollback()
+
+            ride = Ride(
+                passenger_id=passenger.id,
+                pickup_address="A",
+                dropoff_address="B",
+                pickup_lat=40.71,
+                pickup_lng=-74.01,
+                dropoff_lat=40.75,
+                dropoff_lng=-73.98,
+            )
+            db.session.add(ride)
+            db.session.commit()
+            ride_id = ride.id
+        recorder.close()
+
+        events = list(read_events(log_path))
+        assert len(events) == 1
+        assert events[0][0] == RIDE_REQUEST and events[0][2] == ride_id
+        assert events[0][5] == pytest.approx(40.75, abs=1e-5)
+
+    def test_availability_endpoint_records(
+        self, app, client, log_path, monkeypatch, auth_header
+    ):
+        """测试设置可用状态的接口写入事件日志"""
+        app.register_blueprint(driver_bp, url_prefix="/api/driver")
+        recorder = EventRecorder()
+        recorder.open(log_path)
+        monkeypatch.setattr("src.api.driver.event_recorder", recorder)
+        with app.app_context():
+            driver = User(
+                email="d@example.com",
+                username="d",
+                password_hash="x",
+                role="driver",
+                is_available=False,
+            )
+            driver.set_location(40.72, -74.0)
+            db.session.add(driver)
+            db.session.commit()
+            driver_id = driver.id
+
+        response = client.post(
+            "/api/driver/available",
+            json={"is_available": True},
+            headers=auth_header(driver_id),
+        )
+        recorder.close()
+
+        assert response.status_code == 200
+        event = list(read_events(log_path))[-1]
+        assert event[0] == AVAILABILITY
+        assert event[2:4] == (driver_id, True)
+        assert event[4] == pytest.approx(40.72, abs=1e-5)
+
+
+class TestEventReplayer:
+    """测试事件回放"""
+
+    def trace(self):
+        return [
+            (0.0, "availability_changed", 1, True, 40.7128, -74.0060),
+            (0.0, "availability_changed", 2, True, 40.7500, -74.0060),
+            (1.0, "ride_requested", 10, 40.7130, -74.0060),
+            (3.0, "ride_requested", 11, 40.7130, -74.0060),
+            (10.0, "availability_changed", 1, True, 40.7200, -74.0060),
+            (10.5, "location_ping", 1, 40.7140, -74.0060),
+            (11.0, "ride_requested", 12, 40.7135, -74.0060),
+        ]
+
+    def test_dispatches_on_recorded_windows(self, log_path):
+        """测试在记录时间的窗口边界分配，被分配的司机在下次可用前不再参与"""
+        write_log(log_path, self.trace())
+        replayer = EventReplayer(log_path, window_seconds=2.0)
+        report = replayer.run()
+
+        assert [(ride, driver, at) for ride, driver, at, _ in replayer.matches] == [
+            (10, 1, 2.0),
+            (11, 2, 4.0),
+            (12, 1, 12.0),
+        ]
+        assert report["matched"] == 3
+        assert report["match_rate"] == 1.0
+        assert report["pings"] == 1
+        assert report["match_wait_seconds"]["p50"] == pytest.approx(1.0)
+
+    def test_deterministic(self, log_path):
+        """测试同一日志多次回放结果相同"""
+        write_log(log_path, self.trace())
+
+        first = EventReplayer(log_path)
+        second = EventReplayer(log_path)
+        first.run()
+        second.run()
+        assert first.matches == second.matches
+
+    def test_paced_replay(self, log_path, clock):
+        """测试按倍速等待，结果与不等待时相同"""
+        write_log(log_path, self.trace())
+        slept = []
+
+        def sleep(seconds):
+            slept.append(seconds)
+            clock.now += seconds
+
+        paced = EventReplayer(log_path, speed=10.0, sleep=sleep, timer=clock)
+        paced.run()
+
+        # 最后一个窗口在12秒，10倍速共等待1.2秒
+        assert sum(slept) == pytest.approx(1.2)
+        unpaced = EventReplayer(log_path)
+        unpaced.run()
+        assert paced.matches == unpaced.matches
+
+    def test_expires_unmatched_rides(self, log_path):
+        """测试没有司机时行程等待超时后记为未匹配"""
+        write_log(
+            log_path,
+            [
+                (0.0, "ride_requested", 1, 40.7, -74.0),
+                (30.0, "location_ping", 5, 40.7, -74.0),
+            ],
+        )
+        report = EventReplayer(
+            log_path, window_seconds=5.0, max_wait_seconds=10.0
+        ).run()
+
+        assert report["expired"] == 1
+        assert report["matched"] == 0
+        assert report["match_rate"] == 0.0
@@ -0,0 +1,276 @@
+"""
+前向派单单元测试 - 测试行程中司机的时间索引、前向分配和连续接单
+"""
+import pytest
+from src.api.driver import driver_bp
+from src.models.ride import Ride
+from src.models.user import User
+from src.services.database import db
+from src.services.dispatcher import BatchDispatcher
+from src.services.forward_dispatch import FinishingDriverIndex, load_finishing_drivers
+from src.services.spatial_index import DriverGridIndex
+
+
+NY_LAT, NY_LNG = 40.7128, -74.0060
+
+
+@pytest.fixture
+def clock_start():
+    return 1704110400.0
+
+
+class TestFinishingDriverIndex:
+    """测试行程中司机的时间索引"""
+
+    def test_query_by_horizon(self, clock):
+        """测试只返回在时间范围内空闲的司机，按空闲时间排序"""
+        index = FinishingDriverIndex(clock=clock)
+        index.upsert(1, 100, NY_LAT, NY_LNG, clock.now + 300)
+        index.upsert(2, 101, NY_LAT, NY_LNG, clock.now + 60)
+        index.upsert(3, 102, NY_LAT, NY_LNG, clock.now + 120)
+
+        assert [d[0] for d in index.query(180)] == [2, 3]
+        assert index.query(180)[0][3] == 60
+        assert [d[0] for d in index.query(600)] == [2, 3, 1]
+
+    def test_upsert_moves_driver(self, clock):
+        """测试更新空闲时间后顺序随之变化"""
+        index = FinishingDriverIndex(clock=clock)
+        index.upsert(1, 100, NY_LAT, NY_LNG, clock.now + 30)
+        index.upsert(2, 101, NY_LAT, NY_LNG, clock.now + 60)
+        index.upsert(1, 100, NY_LAT, NY_LNG, clock.now + 90)
+
+        assert [d[0] for d in index.query(600)] == [2, 1]
+        assert len(index) == 2
+        assert index.remove(1)
+        assert not index.remove(1)
+        assert [d[0] for d in index.query(600)] == [2]
+
+    def test_update_position_estimates_remaining_time(self, clock):
+        """测试按当前位置到下车点的距离重新估计空闲时间"""
+        index = FinishingDriverIndex(clock=clock)
+        index.upsert(1, 100, NY_LAT, NY_LNG, clock.now + 3600)
+
+        assert index.update_position(1, NY_LAT, NY_LNG)
+        assert index.query(1)[0][3] == pytest.approx(0.0)
+        assert not index.update_position(2, NY_LAT, NY_LNG)
+
+    def test_reserved_drivers_excluded(self, clock):
+        """测试已预留下一单的司机不再参与查询，每个司机只能预留一单"""
+        index = FinishingDriverIndex(clock=clock)
+        index.upsert(1, 100, NY_LAT, NY_LNG, clock.now + 30)
+
+        assert index.reserve(1, 200)
+        assert not index.reserve(1, 201)
+        assert not index.reserve(2, 200)
+        assert index.query(600) == []
+        index.unreserve(1)
+        assert index.reserved_ride(1) is None
+        assert [d[0] for d in index.query(600)] == [1]
+
+
+class TestLoadFinishingDrivers:
+    """测试从数据库重建行程中司机索引"""
+
+    def test_rebuilds_entries_and_reservations(self, app, clock):
+        """进行中行程登记司机，已接单的下一单标记为预留，已完成的司机被移除"""
+        index = FinishingDriverIndex(clock=clock)
+        index.upsert(99, 1, NY_LAT, NY_LNG, 1000.0)
+        with app.app_context():
+            driver = User(
+                email="d@example.com",
+                username="d",
+                password_hash="x",
+                role="driver",
+                is_available=False,
+            )
+            db.session.add(driver)
+            db.session.commit()
+            driver.set_location(NY_LAT, NY_LNG)
+            current = Ride(
+                passenger_id=1,
+                driver_id=driver.id,
+                status="in_progress",
+                pickup_address="A",
+                dropoff_address="B",
+                dropoff_lat=NY_LAT + 0.01,
+                dropoff_lng=NY_LNG,
+            )
+            nxt = Ride(
+                passenger_id=2,
+                driver_id=driver.id,
+                status="accepted",
+                pickup_address="B",
+                dropoff_address="C",
+            )
+            db.session.add_all([current, nxt])
+            db.session.commit()
+
+            assert load_finishing_drivers(index) == 1
+            assert driver.id in index and 99 not in index
+            assert index.reserved_ride(driver.id) == nxt.id
+            assert index.query(horizon_seconds=3600) == []
+
+
+class TestForwardMatching:
+    """测试前向派单分配"""
+
+    def test_prefers_finishing_driver_near_pickup(self, clock):
+        """测试即将在上车点附近下车的司机优先于远处的空闲司机"""
+        finishing = FinishingDriverIndex(clock=clock)
+        # 1分钟后在上车点旁下车
+        finishing.upsert(7, 100, NY_LAT + 0.001, NY_LNG, clock.now + 60)
+        idle = DriverGridIndex()
+        # 约6公里外的空闲司机
+        idle.upsert(8, NY_LAT + 0.055, NY_LNG)
+
+        dispatcher = BatchDispatcher(source=idle, finishing=finishing)
+        forward = dispatcher.forward_drivers()
+        drivers = dispatcher.available_drivers()
+        matches = dispatcher.match(
+            [(1, NY_LAT, NY_LNG)],
+            drivers + [(d, lat, lng) for d, lat, lng, _ in forward],
+            [0.0] * len(drivers) + [minutes for _, _, _, minutes in forward],
+        )
+
+        assert [(ride_id, driver_id) for ride_id, driver_id, _ in matches] == [(1, 7)]
+        assert matches[0][2] == pytest.approx(1.0, abs=0.2)
+
+    def test_forward_mode_can_be_disabled(self):
+        """测试 forward_horizon_seconds 为0时不使用行程中司机"""
+        finishing = FinishingDriverIndex()
+        finishing.upsert(7, 100, NY_LAT, NY_LNG, 0)
+
+        dispatcher = BatchDispatcher(
+            source=DriverGridIndex(), finishing=finishing, forward_horizon_seconds=0
+        )
+        assert dispatcher.forward_drivers() == []
+
+
+class TestChainedAccept:
+    """测试行程中司机接下一单"""
+
+    def test_accept_next_ride_while_in_progress(
+        self, app, client, monkeypatch, auth_header
+    ):
+        """测试行程中司机可以预留一单，完成当前行程后保持不可用"""
+        app.register_blueprint(driver_bp, url_prefix="/api/driver")
+        finishing = FinishingDriverIndex()
+        monkeypatch.setattr("src.api.driver.finishing_drivers", finishing)
+
+        with app.app_context():
+            passenger = User(
+                email="p@example.com", username="p", password_hash="x", role="passenger"
+            )
+            driver = User(
+                email="d@example.com",
+                username="d",
+                password_hash="x",
+                role="driver",
+                is_available=False,
+            )
+            db.session.add_all([passenger, driver])
+            db.session.commit()
+            current = Ride(
+                passenger_id=passenger.id,
+                driver_id=driver.id,
+                status="in_progress",
+                pickup_address="A",
+                dropoff_address="B",
+                pickup_lat=NY_LAT,
+                pickup_lng=NY_LNG,
+                dropoff_lat=NY_LAT + 0.01,
+                dropoff_lng=NY_LNG,
+            )
+            nxt = Ride(
+                passenger_id=passenger.id,
+                pickup_address="B",
+                dropoff_address="C",
+                pickup_lat=NY_LAT + 0.011,
+                pickup_lng=NY_LNG,
+            )
+            other = Ride(
+                passenger_id=passenger.id, pickup_address="B", dropoff_address="D"
+            )
+            db.session.add_all([current, nxt, other])
+            db.session.commit()
+            driver_id, current_id, next_id, other_id = (
+                driver.id,
+                current.id,
+                nxt.id,
+                other.id,
+            )
+            finishing.track_ride(current)
+
+        headers = auth_header(driver_id)
+
+        response = client.post(f"/api/driver/ride/{next_id}/accept", headers=headers)
+        assert response.status_code == 200
+        assert response.get_json()["chained"] is True
+        # 每个司机只能预留一单
+        assert (
+            client.post(
+                f"/api/driver/ride/{other_id}/accept", headers=headers
+            ).status_code
+            == 400
+        )
+
+        response = client.post(
+            f"/api/driver/ride/{current_id}/complete",
+            headers=headers,
+            json={"actual_fare": 20},
+        )
+        assert response.status_code == 200
+        assert driver_id not in finishing
+        with app.app_context():
+            assert db.session.get(User, driver_id).is_available is False
+            assert db.session.get(Ride, next_id).driver_id == driver_id
+
+    def test_chained_accept_uses_database(self, app, client, monkeypatch, auth_header):
+        """行程在其他工作进程开始（本进程索引中没有司机）时仍可预留下一单"""
+        app.register_blueprint(driver_bp, url_prefix="/api/driver")
+        monkeypatch.setattr("src.api.driver.finishing_drivers", FinishingDriverIndex())
+
+        with app.app_context():
+            driver = User(
+                email="d@example.com",
+                username="d",
+                password_hash="x",
+                role="driver",
+                is_available=False,
+            )
+            idle = User(
+                email="i@example.com",
+                username="i",
+                password_hash="x",
+                role="driver",
+                is_available=False,
+            )
+            db.session.add_all([driver, idle])
+            db.session.commit()
+            db.session.add(
+                Ride(
+                    passenger_id=1,
+                    driver_id=driver.id,
+                    status="in_progress",
+                    pickup_address="A",
+                    dropoff_address="B",
+                )
+            )
+            nxt = Ride(passenger_id=2, pickup_address="B", dropoff_address="C")
+            db.session.add(nxt)
+            db.session.commit()
+            driver_id, idle_id, next_id = driver.id, idle.id, nxt.id
+
+        # 不可用且没有进行中行程的司机不能接单
+        assert (
+            client.post(
+                f"/api/driver/ride/{next_id}/accept", headers=auth_header(idle_id)
+            ).status_code
+            == 400
+        )
+        response = client.post(
+            f"/api/driver/ride/{next_id}/accept", headers=auth_header(driver_id)
+        )
+        assert response.status_code == 200
+        assert response.get_json()["chained"] is True
@@ -0,0 +1,174 @@
+"""
+地理围栏单元测试 - 测试多边形区域的R树索引和行程区域标记
+"""
+import random
+import pytest
+from src.services.database import db
+from src.services.geofence import GeofenceIndex, Zone, set_geofence_index
+from src.services.location import LocationService
+from src.models.ride import Ride
+
+
+def square(min_lng, min_lat, size):
+    """正方形外环（GeoJSON坐标顺序为 [经度, 纬度]）"""
+    return [
+        [min_lng, min_lat],
+        [min_lng + size, min_lat],
+        [min_lng + size, min_lat + size],
+        [min_lng, min_lat + size],
+        [min_lng, min_lat],
+    ]
+
+
+GEOJSON = {
+    "type": "FeatureCollection",
+    "features": [
+        {
+            "type": "Feature",
+            "properties": {"id": "city", "name": "City", "kind": "city"},
+            "geometry": {"type": "Polygon", "coordinates": [square(-74.1, 40.6, 0.4)]},
+        },
+        {
+            "type": "Feature",
+            "properties": {"id": "jfk", "name": "JFK Airport", "kind": "airport"},
+            # 带洞的多边形：中间的洞不属于机场
+            "geometry": {
+                "type": "Polygon",
+                "coordinates": [
+                    square(-73.82, 40.62, 0.04),
+                    square(-73.81, 40.63, 0.01),
+                ],
+            },
+        },
+        {
+            "type": "Feature",
+            "properties": {"id": "stations", "kind": "station"},
+            "geometry": {
+                "type": "MultiPolygon",
+                "coordinates": [
+                    [square(-74.0, 40.75, 0.01)],
+                    [square(-73.95, 40.70, 0.01)],
+                ],
+            },
+        },
+        {
+            "type": "Feature",
+            "properties": {"id": "ignored"},
+            "geometry": {"type": "Point", "coordinates": [-74.0, 40.7]},
+        },
+    ],
+}
+
+
+@pytest.fixture
+def geofence():
+    """设置全局地理围栏，测试结束后恢复为不使用"""
+    index = GeofenceIndex.from_geojson(GEOJSON)
+    set_geofence_index(index)
+    yield index
+    set_geofence_index(None)
+
+
+class TestGeofenceIndex:
+    """测试地理围栏索引"""
+
+    def test_lookup_polygons(self, geofence):
+        """测试多边形、洞和多多边形，面积小的区域在前"""
+        assert len(geofence) == 3
+        assert geofence.lookup_ids(40.64, -73.80) == ["jfk", "city"]
+        # 机场的洞内只属于城市
+        assert geofence.lookup_ids(40.635, -73.805) == ["city"]
+        assert geofence.lookup_ids(40.705, -73.945) == ["stations", "city"]
+        assert geofence.lookup_ids(10.0, 10.0) == []
+        assert geofence.get("jfk").kind == "airport"
+
+    def test_str_tree_matches_brute_force(self):
+        """测试大量区域时R树查询与逐个判断结果一致"""
+        rng = random.Random(42)
+        zones = [
+            Zone(
+                str(i),
+                polygons=[
+                    [
+                        square(
+                            rng.uniform(-74.5, -73.5),
+                            rng.uniform(40.0, 41.0),
+                            rng.uniform(0.005, 0.05),
+                        )
+                    ]
+                ],
+            )
+            for i in range(2000)
+        ]
+        index = GeofenceIndex(zones, node_capacity=8)
+
+        for _ in range(200):
+            lat, lng = rng.uniform(40.0, 41.0), rng.uniform(-74.5, -73.5)
+            expected = {zone.id for zone in zones if zone.contains(lat, lng)}
+            assert set(index.lookup_ids(lat, lng)) == expected
+
+    def test_location_service_lookup_zones(self, geofence):
+        """测试位置服务的区域查询"""
+        assert LocationService.lookup_zones(40.64, -73.80) == ["jfk", "city"]
+        set_geofence_index(None)
+        assert LocationService.lookup_zones(40.64, -73.80) == []
+
+    def test_ride_zones_assigned_on_insert(self, app, geofence):
+        """测试新行程写入时标记上下车区域"""
+        with app.app_context():
+            ride = Ride(
+                passenger_id=1,
+                pickup_address="JFK",
+                dropoff_address="Midtown",
+                pickup_lat=40.64,
+                pickup_lng=-73.80,
+                dropoff_lat=40.755,
+                dropoff_lng=-73.995,
+            )
+            db.session.add(ride)
+            db.session.commit()
+
+            assert ride.get_pickup_zones() == ["jfk", "city"]
+            assert ride.to_dict()["dropoff_zones"] == ["stations", "city"]
+
+            airport_rides = Ride.query.filter(Ride.pickup_in_zone("jfk")).all()
+            assert [r.id for r in airport_rides] == [ride.id]
+            assert Ride.query.filter(Ride.pickup_in_zone("stations")).count() == 0
+
+    def test_zone_ids_match_exactly(self, app):
+        """区域ID中的 % 和 _ 按原样匹配，多层嵌套的长ID完整保存"""
+        zones = [
+            Zone("T_1%", polygons=[[square(-73.82, 40.62, 0.04)]]),
+            Zone("T11", polygons=[[square(-74.1, 40.6, 0.4)]]),
+        ]
+        zones += [
+            Zone(
+                f"district-{i:02d}-" + "x" * 60,
+                polygons=[[square(-74.5 + i * 0.01, 40.0 + i * 0.01, 2.0 - i * 0.02)]],
+            )
+            for i in range(10)
+        ]
+        set_geofence_index(GeofenceIndex(zones))
+        try:
+            with app.app_context():
+                ride = Ride(
+                    passenger_id=1,
+                    pickup_address="JFK",
+                    dropoff_address="JFK",
+                    pickup_lat=40.64,
+                    pickup_lng=-73.80,
+                    dropoff_lat=40.64,
+                    dropoff_lng=-73.80,
+                )
+                db.session.add(ride)
+                db.session.commit()
+                db.session.expire_all()
+
+                ride = db.session.get(Ride, ride.id)
+                assert len(ride.get_pickup_zones()) == 12
+                assert ride.get_pickup_zones()[0] == "T_1%"
+                assert Ride.query.filter(Ride.pickup_in_zone("T_1%")).count() == 1
+                assert Ride.query.filter(Ride.pickup_in_zone("T11%")).count() == 0
+                assert Ride.query.filter(Ride.pickup_in_zone("T_")).count() == 0
+        finally:
+            set_geofence_index(None)
@@ -0,0 +1,152 @@
+"""
+需求热力图单元测试 - 测试geohash网格和滑动窗口计数
+"""
+import datetime
+import pytest
+from src.services.database import db
+from src.services.heatmap import (
+    CellWindowCounts,
+    DemandHeatmap,
+    demand_heatmap,
+    register_ride_events,
+    geohash_encode,
+    geohash_center,
+    INITIAL_CAPACITY,
+)
+from src.services.spatial_index import DriverGridIndex
+from src.models.ride import Ride
+
+
+@pytest.fixture
+def clock_start():
+    return 1704110400.0
+
+
+class TestGeohash:
+    """测试geohash编码"""
+
+    def test_encode_and_center(self):
+        """测试已知坐标的geohash和中心点"""
+        assert geohash_encode(57.64911, 10.40744, 11) == "u4pruydqqvj"
+
+        lat, lng = geohash_center(geohash_encode(40.7128, -74.0060))
+        assert lat == pytest.approx(40.7128, abs=0.01)
+        assert lng == pytest.approx(-74.0060, abs=0.01)
+
+
+class TestCellWindowCounts:
+    """测试滑动窗口计数"""
+
+    def test_demand_windows_expire(self, clock):
+        """测试需求按窗口累计，过期的桶被清空"""
+        counts = CellWindowCounts(clock=clock)
+
+        counts.add_demand("a")
+        clock.now += 10 * 60
+        counts.add_demand("a")
+        counts.add_demand("b")
+
+        assert counts.cell_counts("a", 5)["demand"] == 1
+        assert counts.cell_counts("a", 15)["demand"] == 2
+        assert counts.cell_counts("missing", 15) == {"demand": 0, "supply": 0.0}
+
+        # 超过60分钟后全部过期，早于缓冲区范围的事件被丢弃
+        clock.now += 61 * 60
+        assert counts.cell_counts("a", 60)["demand"] == 0
+        assert counts.add_demand("a", timestamp=clock.now - 2 * 3600) is False
+
+    def test_demand_recorded_when_rows_grow(self, clock):
+        """测试新网格使计数数组扩容时，该网格的第一个需求事件不会丢失"""
+        counts = CellWindowCounts(clock=clock)
+        cells = [f"cell{index}" for index in range(INITIAL_CAPACITY * 2 + 1)]
+
+        for key in cells:
+            assert counts.add_demand(key) is True
+
+        keys, demand, _ = counts.window_counts(5)
+        assert keys == cells
+        assert demand.tolist() == [1] * len(cells)
+
+    def test_supply_is_averaged_over_samples(self, clock):
+        """测试供给取窗口内各次采样的平均"""
+        counts = CellWindowCounts(clock=clock)
+
+        counts.set_supply({"a": 4})
+        clock.now += 60
+        counts.set_supply({"a": 2, "b": 1})
+
+        keys, demand, supply = counts.window_counts(5)
+        assert dict(zip(keys, supply.tolist())) == {"a": 3.0, "b": 0.5}
+        assert demand.tolist() == [0, 0]
+
+
+class TestDemandHeatmap:
+    """测试热力图"""
+
+    def test_heatmap_cells(self, clock):
+        """测试需求和供给汇总到网格"""
+        index = DriverGridIndex()
+        index.upsert(1, 40.7128, -74.0060)
+        index.upsert(2, 40.7129, -74.0061)
+        heatmap = DemandHeatmap(source=index, clock=clock)
+
+        heatmap.record_request(40.7128, -74.0060)
+        assert heatmap.sample_supply() == 2
+
+        cells = heatmap.heatmap(15)
+        assert len(cells) == 1
+        assert cells[0]["demand"] == 1
+        assert cells[0]["supply"] == 2.0
+        assert heatmap.cell(cells[0]["cell"], 5)["demand"] == 1
+        assert heatmap.heatmap(15, bounds=(0.0, 1.0, 0.0, 1.0)) == []
+
+    def test_records_committed_ride_requests(self, app):
+        """测试提交成功的新行程计入需求，回滚的不计入"""
+        register_ride_events(Ride)
+        demand_heatmap.counts.clear()
+        cell = demand_heatmap.cell_of(40.7128, -74.0060)
+
+        with app.app_context():
+            db.session.add(
+                Ride(
+                    passenger_id=1,
+                    pickup_address="a",
+                    dropoff_address="b",
+                    pickup_lat=40.7128,
+                    pickup_lng=-74.0060,
+                )
+            )
+            db.session.commit()
+
+            db.session.add(
+                Ride(
+                    passenger_id=1,
+                    pickup_address="a",
+                    dropoff_address="b",
+                    pickup_lat=40.7128,
+                    pickup_lng=-74.0060,
+                )
+            )
+            db.session.flush()
+            db.session.rollback()
+
+        assert demand_heatmap.counts.cell_counts(cell, 5)["demand"] == 1
+        demand_heatmap.counts.clear()
+
+    def test_heatmap_endpoint(self, app, client, auth_header):
+        """测试热力图接口需要管理员权限"""
+        from src.api.analytics import analytics_bp
+
+        app.register_blueprint(analytics_bp, url_prefix="/api/analytics")
+
+        admin = auth_header(1, "admin")
+
+        response = client.get("/api/analytics/heatmap?window=15", headers=admin)
+        assert response.status_code == 200
+        assert response.get_json()["window_minutes"] == 15
+
+        response = client.get("/api/analytics/heatmap?window=7", headers=admin)
+        assert response.status_code == 400
+
+        response = client.get("/api/analytics/heatmap", headers=auth_header(2))
+        assert response.status_code == 403
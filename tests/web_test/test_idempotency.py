@@ -0,0 +1,242 @@
+"""
+幂等键单元测试 - 测试幂等响应存储和带 Idempotency-Key 的行程请求
+"""
+import json
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+from src.api.booking import booking_bp, create_ride
+from src.models.ride import Ride
+from src.services.database import db
+from src.services.idempotency import (
+    IdempotencyStore,
+    request_fingerprint,
+    NEW,
+    REPLAY,
+    IN_PROGRESS,
+    MISMATCH,
+)
+
+RIDE_DATA = {
+    "pickup_address": "123 Main Street, New York, NY",
+    "dropoff_address": "456 Park Avenue, New York, NY",
+    "pickup_lat": 40.7128,
+    "pickup_lng": -74.0060,
+    "dropoff_lat": 40.7489,
+    "dropoff_lng": -73.9680,
+}
+
+
+@pytest.fixture
+def store(monkeypatch):
+    """接口使用独立的幂等存储"""
+    store = IdempotencyStore()
+    monkeypatch.setattr("src.api.booking.idempotency_store", store)
+    return store
+
+
+@pytest.fixture
+def booking_client(app, store):
+    app.register_blueprint(booking_bp, url_prefix="/api")
+    return app.test_client()
+
+
+@pytest.fixture
+def post_ride(booking_client, auth_header):
+    """以乘客身份请求行程，可带幂等键"""
+
+    def post(user_id=1, key=None, data=None):
+        headers = auth_header(user_id, "passenger")
+        if key is not None:
+            headers["Idempotency-Key"] = key
+        return booking_client.post(
+            "/api/ride/request",
+            data=json.dumps(data or RIDE_DATA),
+            content_type="application/json",
+            headers=headers,
+        )
+
+    return post
+
+
+class TestIdempotencyStore:
+    """测试幂等响应存储"""
+
+    def test_first_request_then_replay(self):
+        """完成后用同一个键重试返回保存的响应"""
+        store = IdempotencyStore()
+        fingerprint = request_fingerprint(RIDE_DATA)
+
+        assert store.begin(1, "k1", fingerprint) == (NEW, None)
+        store.complete(1, "k1", fingerprint, b'{"ride_id": 7}', 201)
+
+        assert store.begin(1, "k1", fingerprint) == (REPLAY, (b'{"ride_id": 7}', 201))
+
+    def test_in_progress_and_release(self):
+        """处理中的重复请求被拒绝，放弃占位后可以重新处理"""
+        store = IdempotencyStore()
+
+        assert store.begin(1, "k1", "fp")[0] == NEW
+        assert store.begin(1, "k1", "fp")[0] == IN_PROGRESS
+
+        store.release(1, "k1")
+        assert store.begin(1, "k1", "fp")[0] == NEW
+
+    def test_mismatched_body(self):
+        """同一个键用于不同的请求体"""
+        store = IdempotencyStore()
+        store.begin(1, "k1", "fp-a")
+        store.complete(1, "k1", "fp-a", b"{}", 201)
+
+        assert store.begin(1, "k1", "fp-b") == (MISMATCH, None)
+
+    def test_keys_are_scoped_per_caller(self):
+        """不同用户的相同键互不影响"""
+        store = IdempotencyStore()
+        store.begin(1, "k1", "fp")
+        store.complete(1, "k1", "fp", b"{}", 201)
+
+        assert store.begin(2, "k1", "fp")[0] == NEW
+
+    def test_expiry(self, clock):
+        """处理中的占位和保存的响应都会过期"""
+        store = IdempotencyStore(ttl_seconds=100, in_flight_seconds=10, clock=clock)
+
+        store.begin(1, "crashed", "fp")
+        clock.now = 11
+        assert store.begin(1, "crashed", "fp")[0] == NEW
+
+        store.complete(1, "crashed", "fp", b"{}", 201)
+        clock.now = 111
+        assert store.begin(1, "crashed", "fp")[0] == NEW
+
+    def test_fingerprint_ignores_key_order(self):
+        """请求体指纹与字段顺序无关"""
+        reordered = dict(reversed(list(RIDE_DATA.items())))
+        assert request_fingerprint(reordered) == request_fingerprint(RIDE_DATA)
+        assert request_fingerprint(
+            {**RIDE_DATA, "pickup_lat": 40.0}
+        ) != request_fingerprint(RIDE_DATA)
+
+
+class TestRequestRideEndpoint:
+    """测试行程请求接口"""
+
+    def test_creates_ride_with_estimate(self, app, post_ride):
+        """请求创建行程并返回预估车费"""
+        response = post_ride()
+
+        assert response.status_code == 201
+        data = response.get_json()
+        assert data["success"] is True
+        assert data["ride"]["status"] == "requested"
+        assert data["estimated_fare"] > 0
+        assert data["distance_km"] > 0
+        with app.app_context():
+            ride = db.session.get(Ride, data["ride_id"])
+            assert ride.passenger_id == 1
+            assert ride.estimated_fare == data["estimated_fare"]
+
+    def test_retry_replays_without_database(self, app, monkeypatch, post_ride):
+        """同一个键重试返回相同的行程，不访问数据库也不重复创建"""
+        first = post_ride(key="retry-1")
+        assert first.status_code == 201
+
+        def fail(*args, **kwargs):
+            raise AssertionError("replay must not touch the database")
+
+        monkeypatch.setattr("src.api.booking.create_ride", fail)
+        second = post_ride(key="retry-1")
+
+        assert second.status_code == 201
+        assert second.headers["Idempotent-Replayed"] == "true"
+        assert second.data == first.data
+        with app.app_context():
+            assert Ride.query.count() == 1
+
+    def test_different_keys_create_separate_rides(self, app, post_ride):
+        """不同的键是不同的请求"""
+        first = post_ride(key="a")
+        second = post_ride(key="b")
+
+        assert first.get_json()["ride_id"] != second.get_json()["ride_id"]
+        with app.app_context():
+            assert Ride.query.count() == 2
+
+    def test_key_reused_with_different_body(self, post_ride):
+        """同一个键用于不同的请求体返回422"""
+        post_ride(key="k")
+        response = post_ride(key="k", data={**RIDE_DATA, "dropoff_lat": 40.7306})
+
+        assert response.status_code == 422
+
+    def test_duplicate_while_in_progress(self, store, post_ride):
+        """第一次请求尚未完成时重复请求返回409"""
+        store.begin(1, "busy", request_fingerprint(RIDE_DATA))
+
+        response = post_ride(key="busy")
+
+        assert response.status_code == 409
+
+    def test_retry_on_another_worker(self, app, monkeypatch, post_ride):
+        """重试落在没有前置缓存的工作进程时按数据库中的行程返回，不重复创建"""
+        first = post_ride(key="shared-1")
+        monkeypatch.setattr("src.api.booking.idempotency_store", IdempotencyStore())
+
+        second = post_ride(key="shared-1")
+
+        assert second.status_code == 201
+        assert second.headers["Idempotent-Replayed"] == "true"
+        assert second.get_json() == first.get_json()
+        assert "estimated_wait_minutes" in second.get_json()
+        monkeypatch.setattr("src.api.booking.idempotency_store", IdempotencyStore())
+        response = post_ride(key="shared-1", data={**RIDE_DATA, "dropoff_lat": 40.7306})
+        assert response.status_code == 422
+        with app.app_context():
+            assert Ride.query.count() == 1
+
+    def test_unique_key_per_passenger(self, app):
+        """并发创建时唯一索引冲突的一方不创建行程；不同乘客可以使用相同的键"""
+        fingerprint = request_fingerprint(RIDE_DATA)
+        with app.test_request_context():
+            assert create_ride(1, RIDE_DATA, "race", fingerprint)[1] == 201
+            assert create_ride(1, RIDE_DATA, "race", fingerprint) is None
+            assert create_ride(2, RIDE_DATA, "race", fingerprint)[1] == 201
+            assert Ride.query.count() == 2
+
+    def test_other_integrity_error(self, app, monkeypatch, store, post_ride):
+        """不是幂等键冲突的约束错误返回500，并释放键以便重试"""
+
+        def violate():
+            raise IntegrityError("INSERT INTO rides", {}, Exception("CHECK failed"))
+
+        monkeypatch.setattr(db.session, "flush", violate)
+
+        assert post_ride(key="broken").status_code == 500
+        assert post_ride().status_code == 500
+        assert store.begin(1, "broken", request_fingerprint(RIDE_DATA)) == (NEW, None)
+        with app.app_context():
+            assert Ride.query.count() == 0
+
+    def test_validation_errors(self, app, post_ride):
+        """缺失地址、无效坐标和超长距离返回400，且不创建行程"""
+        missing_address = {**RIDE_DATA, "pickup_address": ""}
+        bad_coordinate = {**RIDE_DATA, "pickup_lat": 123.0}
+        too_far = {**RIDE_DATA, "dropoff_lat": 42.3601, "dropoff_lng": -71.0589}
+
+        for data in (missing_address, bad_coordinate, too_far):
+            assert post_ride(data=data).status_code == 400
+        assert post_ride(key="x" * 256).status_code == 400
+        with app.app_context():
+            assert Ride.query.count() == 0
+
+    def test_requires_passenger(self, booking_client, auth_header):
+        """只有乘客可以请求行程"""
+        response = booking_client.post(
+            "/api/ride/request",
+            data=json.dumps(RIDE_DATA),
+            content_type="application/json",
+            headers=auth_header(2, role="driver"),
+        )
+
+        assert response.status_code == 403
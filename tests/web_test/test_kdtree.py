@@ -0,0 +1,111 @@
+"""
+K-D树单元测试 - 测试K近邻检索和按ETA排序的司机查询
+"""
+import numpy as np
+import pytest
+from src.services.kdtree import KDTree, DriverKNNIndex, to_unit_vectors, chord_to_km
+from src.services.spatial_index import DriverGridIndex, haversine_km
+from src.services.location import LocationService
+
+
+class TestKDTree:
+    """测试K-D树"""
+
+    def test_query_matches_brute_force(self):
+        """测试查询结果与暴力检索一致"""
+        rng = np.random.default_rng(3)
+        points = to_unit_vectors(
+            rng.uniform(40.5, 40.9, 5000), rng.uniform(-74.2, -73.8, 5000)
+        )
+        tree = KDTree(points, leaf_size=16)
+
+        for query in to_unit_vectors(
+            rng.uniform(40.5, 40.9, 10), rng.uniform(-74.2, -73.8, 10)
+        ):
+            idx, dist = tree.query(query, 8)
+            expected = np.argsort(np.linalg.norm(points - query, axis=1))[:8]
+            assert list(idx) == list(expected)
+            assert np.all(np.diff(dist) >= 0)
+
+    def test_query_with_mask(self):
+        """测试按掩码过滤"""
+        points = to_unit_vectors([40.0, 40.001, 40.002], [-74.0, -74.0, -74.0])
+        tree = KDTree(points, leaf_size=1)
+
+        idx, _ = tree.query(points[0], 2, mask=np.array([False, True, True]))
+        assert list(idx) == [1, 2]
+
+    def test_chord_to_km(self):
+        """测试弦长与大圆距离换算"""
+        a, b = to_unit_vectors([40.7128, 34.0522], [-74.0060, -118.2437])
+        expected = haversine_km(40.7128, -74.0060, 34.0522, -118.2437)
+        assert float(chord_to_km(np.linalg.norm(a - b))) == pytest.approx(
+            expected, rel=1e-9
+        )
+
+    def test_empty_tree(self):
+        """测试空树"""
+        tree = KDTree(np.empty((0, 3)))
+        idx, dist = tree.query([1.0, 0.0, 0.0], 3)
+        assert len(idx) == 0 and len(dist) == 0
+
+
+class TestDriverKNNIndex:
+    """测试司机K近邻索引"""
+
+    @pytest.fixture
+    def grid(self):
+        """包含不同车型和评分的司机"""
+        grid = DriverGridIndex()
+        grid.upsert(
+            1, 40.7130, -74.0060, name="d1", rating=4.2, vehicle_type="standard"
+        )
+        grid.upsert(2, 40.7200, -74.0060, name="d2", rating=4.9, vehicle_type="premium")
+        grid.upsert(
+            3, 40.7400, -74.0060, name="d3", rating=4.8, vehicle_type="standard"
+        )
+        grid.upsert(4, 40.9000, -74.0060, name="d4", rating=5.0, vehicle_type="premium")
+        return grid
+
+    def test_query_with_filters(self, grid):
+        """测试车型和评分过滤"""
+        index = DriverKNNIndex(grid)
+        index.rebuild()
+
+        assert [d for d, _ in index.query(40.7128, -74.0060, 2)] == [1, 2]
+        assert [
+            d for d, _ in index.query(40.7128, -74.0060, 2, vehicle_type="premium")
+        ] == [2, 4]
+        assert [d for d, _ in index.query(40.7128, -74.0060, 2, min_rating=4.8)] == [
+            2,
+            3,
+        ]
+        assert [d for d, _ in index.query(40.7128, -74.0060, 5, max_radius_km=5)] == [
+            1,
+            2,
+            3,
+        ]
+
+    def test_query_reflects_live_index(self, grid):
+        """测试快照之后下线或移动的司机被校正"""
+        index = DriverKNNIndex(grid)
+        index.rebuild()
+
+        grid.remove(1)
+        grid.upsert(2, 40.9001, -74.0060)
+
+        assert [d for d, _ in index.query(40.7128, -74.0060, 2)] == [3, 4]
+
+    def test_find_nearest_drivers_ranked_by_eta(self, grid, monkeypatch):
+        """测试LocationService返回按ETA排序的司机"""
+        index = DriverKNNIndex(grid)
+        monkeypatch.setattr("src.services.location.driver_knn_index", index)
+        monkeypatch.setattr("src.services.location.driver_index", grid)
+
+        drivers = LocationService.find_nearest_drivers(
+            40.7128, -74.0060, k=2, vehicle_type="standard"
+        )
+
+        assert [d["driver_id"] for d in drivers] == [1, 3]
+        assert drivers[0]["eta_minutes"] <= drivers[1]["eta_minutes"]
+        assert drivers[0]["vehicle_type"] == "standard"
@@ -0,0 +1,133 @@
+"""
+位置写缓冲单元测试 - 测试GPS上报合并和批量写入
+"""
+import datetime
+import pytest
+from src.services.database import db
+from src.services.location_buffer import (
+    LocationWriteBuffer,
+    parse_ping_timestamp,
+    clamp_ping_timestamp,
+)
+from src.models.user import User
+
+
+T0 = datetime.datetime(2024, 1, 1, 12, 0, 0)
+
+
+def make_driver(user_id, **kwargs):
+    """创建司机用户"""
+    return User(
+        id=user_id,
+        email=f"driver{user_id}@example.com",
+        username=f"driver{user_id}",
+        password_hash="hash",
+        role="driver",
+        **kwargs,
+    )
+
+
+class TestLocationWriteBuffer:
+    """测试位置写缓冲"""
+
+    def test_keeps_latest_ping_per_driver(self):
+        """测试每个司机只保留最新上报"""
+        buffer = LocationWriteBuffer()
+
+        assert buffer.add(1, 40.0, -74.0, T0) is True
+        assert buffer.add(1, 40.1, -74.1, T0 + datetime.timedelta(seconds=4)) is True
+        # 乱序到达的旧上报被丢弃
+        assert buffer.add(1, 39.9, -73.9, T0 + datetime.timedelta(seconds=2)) is False
+        assert buffer.add(2, 41.0, -75.0, T0) is True
+
+        assert len(buffer) == 2
+        assert buffer.latest(1) == (40.1, -74.1, T0 + datetime.timedelta(seconds=4))
+
+        stats = buffer.get_stats()
+        assert stats["pings_received"] == 4
+        assert stats["pings_coalesced"] == 1
+        assert stats["pings_stale"] == 1
+
+    def test_flush_writes_batch(self, app):
+        """测试一次批量写入并且不覆盖数据库中更新的位置"""
+        buffer = LocationWriteBuffer()
+
+        with app.app_context():
+            db.session.add_all(
+                [
+                    make_driver(1),
+                    make_driver(
+                        2,
+                        current_lat=10.0,
+                        current_lng=10.0,
+                        location_updated_at=T0 + datetime.timedelta(minutes=5),
+                    ),
+                ]
+            )
+            db.session.commit()
+
+            buffer.add(1, 40.0, -74.0, T0)
+            buffer.add(1, 40.5, -74.5, T0 + datetime.timedelta(seconds=4))
+            buffer.add(2, 20.0, 20.0, T0)
+
+            assert buffer.flush() == 2
+            assert len(buffer) == 0
+            assert buffer.flush() == 0
+
+            db.session.expire_all()
+            driver1 = db.session.get(User, 1)
+            driver2 = db.session.get(User, 2)
+
+            assert (driver1.current_lat, driver1.current_lng) == (40.5, -74.5)
+            assert driver1.current_location == "40.5,-74.5"
+            assert driver1.location_updated_at == T0 + datetime.timedelta(seconds=4)
+            # 数据库中的位置比缓冲的上报更新，保持不变
+            assert (driver2.current_lat, driver2.current_lng) == (10.0, 10.0)
+
+    def test_flush_skips_non_drivers(self, app):
+        """测试上报中的乘客ID不会把位置写进乘客行"""
+        buffer = LocationWriteBuffer()
+
+        with app.app_context():
+            passenger = User(
+                id=3,
+                email="passenger3@example.com",
+                username="passenger3",
+                password_hash="hash",
+                role="passenger",
+            )
+            db.session.add_all([make_driver(1), passenger])
+            db.session.commit()
+
+            buffer.add(1, 40.0, -74.0, T0)
+            buffer.add(3, 41.0, -75.0, T0)
+            buffer.flush()
+
+            db.session.expire_all()
+            assert db.session.get(User, 1).current_lat == 40.0
+            passenger = db.session.get(User, 3)
+            assert passenger.current_lat is None
+            assert passenger.location_updated_at is None
+
+    def test_parse_ping_timestamp(self):
+        """测试上报时间解析"""
+        assert parse_ping_timestamp(0) == datetime.datetime(1970, 1, 1)
+        assert parse_ping_timestamp("2024-01-01T12:00:00Z") == T0
+        assert parse_ping_timestamp("2024-01-01T20:00:00+08:00") == T0
+        assert isinstance(parse_ping_timestamp(None), datetime.datetime)
+
+        with pytest.raises(ValueError):
+            parse_ping_timestamp("not-a-time")
+
+    def test_clamp_ping_timestamp(self):
+        """测试上报时间限制在服务器时间附近"""
+        assert clamp_ping_timestamp(
+            T0 - datetime.timedelta(seconds=30), now=T0
+        ) == T0 - datetime.timedelta(seconds=30)
+        # 时钟偏差范围内的未来时间按服务器时间记录
+        assert clamp_ping_timestamp(T0 + datetime.timedelta(seconds=5), now=T0) == T0
+
+        with pytest.raises(ValueError):
+            clamp_ping_timestamp(T0 + datetime.timedelta(days=1), now=T0)
+        with pytest.raises(ValueError):
+            clamp_ping_timestamp(T0 - datetime.timedelta(days=1), now=T0)
@@ -84,6 +84,25 @@ class TestUserModel:
         assert driver.vehicle_id == vehicle.id
         assert driver.current_location is not None
 
+    def test_driver_location_columns(self):
+        """测试司机位置数值列的读写"""
+        driver = User(username='driver2', role='driver')
+
+        # 尚未设置位置
+        assert driver.get_location() is None
+
+        # 旧数据只有字符串列时回退解析
+        driver.current_location = '40.7128,-74.0060'
+        assert driver.get_location() == (40.7128, -74.006)
+
+        # 新写入同时更新数值列、字符串列和时间戳
+        driver.set_location(40.7589, -73.9851)
+        assert driver.current_lat == 40.7589
+        assert driver.current_lng == -73.9851
+        assert driver.current_location == '40.7589,-73.9851'
+        assert driver.location_updated_at is not None
+        assert driver.get_location() == (40.7589, -73.9851)
+
 
 class TestRideModel:
     """测试行程模型"""
@@ -0,0 +1,312 @@
+"""
+派单管理单元测试 - 测试派单超时转派和接单/拒单接口
+"""
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+from src.api.driver import driver_bp
+from src.models.ride import Ride
+from src.models.user import User
+from src.services.database import db
+from src.services.dispatcher import BatchDispatcher
+from src.services.offers import OfferManager, RideOfferStore
+from src.services.spatial_index import DriverGridIndex
+
+
+@pytest.fixture
+def clock_start():
+    return 1000.0
+
+
+@pytest.fixture
+def drivers():
+    index = DriverGridIndex()
+    for driver_id in (1, 2, 3, 4):
+        index.upsert(driver_id, 40.7128 + driver_id * 0.001, -74.0060)
+    return index
+
+
+def make_manager(drivers, clock, finder=None):
+    sent = []
+    manager = OfferManager(
+        timeout_seconds=15,
+        tick_seconds=0.1,
+        max_attempts=3,
+        source=drivers,
+        dispatcher=BatchDispatcher(source=drivers),
+        notifier=lambda driver_id, name, address: sent.append(driver_id),
+        candidate_finder=finder or (lambda lat, lng, k: []),
+        clock=clock,
+    )
+    return manager, sent
+
+
+class TestOfferManager:
+    """测试派单管理器"""
+
+    def test_cascades_on_timeout(self, drivers, clock):
+        """测试超时后转给下一个候选司机"""
+        manager, sent = make_manager(drivers, clock)
+
+        manager.submit(10, [1, 2, 3])
+        assert sent == [1]
+        assert manager.current_driver(10) == 1
+        assert manager.dispatcher.offered_rides.get(10) == 1
+
+        clock.now += 14.9
+        assert manager.advance() == 0
+        clock.now += 0.2
+        assert manager.advance() == 1
+        assert sent == [1, 2]
+        assert manager.stats["timed_out"] == 1
+
+    def test_decline_cascades_immediately(self, drivers, clock):
+        """测试拒绝后立即转派，非当前司机的拒绝被忽略"""
+        manager, sent = make_manager(drivers, clock)
+        manager.submit(10, [1, 2])
+
+        manager.decline(10, 2)
+        assert manager.current_driver(10) == 1
+        manager.decline(10, 1)
+        assert manager.current_driver(10) == 2
+        assert sent == [1, 2]
+        assert len(manager.wheel) == 1
+
+    def test_skips_unavailable_and_busy_drivers(self, drivers, clock):
+        """测试跳过不在线的司机和正在回应其他派单的司机"""
+        manager, sent = make_manager(drivers, clock)
+        manager.submit(10, [1])
+        manager.submit(11, [99, 1, 2])
+
+        assert manager.current_driver(11) == 2
+        assert sent == [1, 2]
+
+    def test_accepted_stops_cascade(self, drivers, clock):
+        """测试接单后取消超时"""
+        manager, sent = make_manager(drivers, clock)
+        manager.submit(10, [1, 2])
+
+        manager.accepted(10, 1)
+        clock.now += 60
+        assert manager.advance() == 0
+        assert manager.current_driver(10) is None
+        assert sent == [1]
+        assert manager.stats["accepted"] == 1
+
+    def test_exhausted_after_expanding_candidates(self, drivers, clock):
+        """测试候选用完后补充附近司机，最多尝试 max_attempts 个，之后交回批量派单器"""
+        calls = []
+
+        def finder(lat, lng, k):
+            calls.append((lat, lng))
+            return [1, 3, 4]
+
+        manager, sent = make_manager(drivers, clock, finder)
+        manager.submit(10, [1], pickup=(40.7, -74.0))
+        for _ in range(3):
+            manager.decline(10, manager.current_driver(10))
+
+        assert sent == [1, 3, 4]
+        assert calls == [(40.7, -74.0)]
+        assert len(manager) == 0
+        assert manager.stats["exhausted"] == 1
+        assert manager.dispatcher.offered_rides.get(10) is None
+
+    def test_event_loop_processes_timeouts(self, drivers):
+        """测试后台事件循环按刻度处理超时并发送通知"""
+        delivered = threading.Event()
+        sent = []
+
+        def notifier(driver_id, name, address):
+            sent.append(driver_id)
+            if len(sent) == 2:
+                delivered.set()
+
+        manager = OfferManager(
+            timeout_seconds=0.05,
+            tick_seconds=0.01,
+            source=drivers,
+            dispatcher=BatchDispatcher(source=drivers),
+            notifier=notifier,
+        )
+        manager.start()
+        try:
+            manager.submit(10, [1, 2])
+            assert delivered.wait(2.0)
+            assert sent == [1, 2]
+        finally:
+            manager.stop()
+
+    def test_queries_run_on_event_loop(self, drivers):
+        """测试其他线程的查询在事件循环上执行，能看到之前提交的派单"""
+        manager = OfferManager(
+            timeout_seconds=60,
+            source=drivers,
+            dispatcher=BatchDispatcher(source=drivers),
+            notifier=lambda driver_id, name, address: True,
+        )
+        manager.start()
+        try:
+            manager.submit(10, [1, 2])
+            assert manager.current_driver(10) == 1
+            assert manager.pending_ride(1) == 10
+            assert manager.pending_ride(2) is None
+        finally:
+            manager.stop()
+        assert manager.current_driver(10) == 1
+
+    def test_started_by_first_dispatch(self, drivers, monkeypatch):
+        """测试派单管理器在批量派单器第一次派单时启动"""
+        manager = OfferManager(
+            timeout_seconds=60,
+            source=drivers,
+            dispatcher=BatchDispatcher(source=drivers),
+            notifier=lambda driver_id, name, address: True,
+        )
+        monkeypatch.setattr("src.services.offers.offer_manager", manager)
+        offer = {
+            "ride_id": 10,
+            "driver_id": 1,
+            "passenger_id": 5,
+            "pickup_address": "123 Main Street",
+            "pickup_lat": 40.7128,
+            "pickup_lng": -74.0060,
+        }
+        try:
+            BatchDispatcher(source=drivers).on_offer(offer)
+            assert manager._thread.is_alive()
+            assert manager.current_driver(10) == 1
+        finally:
+            manager.stop()
+
+
+class TestOfferEndpoints:
+    """测试接单和拒单接口与派单管理器的配合"""
+
+    def test_accept_and_decline(self, app, client, monkeypatch, auth_header):
+        """测试派单期间只有当前司机能接单，拒绝后转给下一个司机"""
+        app.register_blueprint(driver_bp, url_prefix="/api/driver")
+        with app.app_context():
+            passenger = User(
+                email="p@example.com", username="p", password_hash="x", role="passenger"
+            )
+            first = User(
+                email="d1@example.com", username="d1", password_hash="x", role="driver"
+            )
+            second = User(
+                email="d2@example.com", username="d2", password_hash="x", role="driver"
+            )
+            db.session.add_all([passenger, first, second])
+            db.session.commit()
+            ride = Ride(
+                passenger_id=passenger.id, pickup_address="A", dropoff_address="B"
+            )
+            db.session.add(ride)
+            db.session.commit()
+            ride_id, first_id, second_id = ride.id, first.id, second.id
+
+        index = DriverGridIndex()
+        index.upsert(first_id, 40.71, -74.0)
+        index.upsert(second_id, 40.72, -74.0)
+        manager = OfferManager(
+            source=index,
+            dispatcher=BatchDispatcher(source=index),
+            notifier=lambda *args: True,
+            store=RideOfferStore(app),
+        )
+        monkeypatch.setattr("src.api.driver.offer_manager", manager)
+        manager.submit(ride_id, [first_id, second_id])
+        with app.app_context():
+            assert db.session.get(Ride, ride_id).offered_driver_id == first_id
+
+        response = client.post(
+            f"/api/driver/ride/{ride_id}/accept", headers=auth_header(second_id)
+        )
+        assert response.status_code == 409
+        assert (
+            client.post(
+                f"/api/driver/ride/{ride_id}/decline", headers=auth_header(second_id)
+            ).status_code
+            == 404
+        )
+
+        assert (
+            client.post(
+                f"/api/driver/ride/{ride_id}/decline", headers=auth_header(first_id)
+            ).status_code
+            == 200
+        )
+        assert manager.current_driver(ride_id) == second_id
+        with app.app_context():
+            assert db.session.get(Ride, ride_id).offered_driver_id == second_id
+
+        response = client.post(
+            f"/api/driver/ride/{ride_id}/accept", headers=auth_header(second_id)
+        )
+        assert response.status_code == 200
+        assert manager.current_driver(ride_id) is None
+        assert manager.stats["accepted"] == 1
+        with app.app_context():
+            assert db.session.get(Ride, ride_id).offered_driver_id is None
+
+    def test_offer_checked_in_database(self, app, client, monkeypatch, auth_header):
+        """其他工作进程记录的派单同样阻止抢单和拒单，过期后任何司机都能接单"""
+        app.register_blueprint(driver_bp, url_prefix="/api/driver")
+        with app.app_context():
+            first = User(
+                email="d1@example.com", username="d1", password_hash="x", role="driver"
+            )
+            second = User(
+                email="d2@example.com", username="d2", password_hash="x", role="driver"
+            )
+            db.session.add_all([first, second])
+            db.session.commit()
+            ride = Ride(passenger_id=99, pickup_address="A", dropoff_address="B")
+            db.session.add(ride)
+            db.session.commit()
+            ride_id, first_id, second_id = ride.id, first.id, second.id
+            # 派单由另一个进程的派单管理器写入，本进程的管理器中没有这个派单
+            assert Ride.record_offer(
+                ride_id, first_id, datetime.utcnow() + timedelta(seconds=15)
+            )
+            db.session.commit()
+
+        monkeypatch.setattr(
+            "src.api.driver.offer_manager", OfferManager(notifier=lambda *args: True)
+        )
+        response = client.post(
+            f"/api/driver/ride/{ride_id}/accept", headers=auth_header(second_id)
+        )
+        assert response.status_code == 409
+        assert (
+            response.get_json()["error"]
+            == "Ride is currently offered to another driver"
+        )
+        assert (
+            client.post(
+                f"/api/driver/ride/{ride_id}/decline", headers=auth_header(second_id)
+            ).status_code
+            == 404
+        )
+
+        with app.app_context():
+            Ride.record_offer(
+                ride_id, first_id, datetime.utcnow() - timedelta(seconds=1)
+            )
+            db.session.commit()
+        assert (
+            client.post(
+                f"/api/driver/ride/{ride_id}/decline", headers=auth_header(first_id)
+            ).status_code
+            == 404
+        )
+        assert (
+            client.post(
+                f"/api/driver/ride/{ride_id}/accept", headers=auth_header(second_id)
+            ).status_code
+            == 200
+        )
+        with app.app_context():
+            ride = db.session.get(Ride, ride_id)
+            assert (ride.driver_id, ride.offered_driver_id) == (second_id, None)
@@ -0,0 +1,250 @@
+"""
+拼车单元测试 - 测试停靠序列插入、座位和时间约束以及剪枝
+"""
+import time
+
+import numpy as np
+import pytest
+from src.services.location import LocationService
+from src.services.pooling import PoolingEngine, Stop
+
+
+NY_LAT, NY_LNG = 40.7128, -74.0060
+
+
+@pytest.fixture
+def clock_start():
+    return 1704110400.0
+
+
+def straight_eta(lat1, lng1, lat2, lng2):
+    """直线距离按30km/h行驶的分钟数"""
+    return LocationService.calculate_distance(lat1, lng1, lat2, lng2) / 30 * 60
+
+
+def brute_force(engine, pickup, dropoff):
+    """枚举所有车辆和插入位置的最优增加时间"""
+    best = None
+    now = engine._clock()
+    direct = straight_eta(*pickup, *dropoff)
+    for vehicle in engine._vehicles.values():
+        n = len(vehicle.stops)
+        for i in range(n + 1):
+            for j in range(i, n + 1):
+                loads = vehicle.loads()
+                if any(loads[k] + 1 > vehicle.capacity for k in range(i, j + 1)):
+                    continue
+                result = engine._evaluate(
+                    vehicle, i, j, pickup, dropoff, 1, direct, now, straight_eta
+                )
+                if result is not None and (best is None or result[0] < best):
+                    best = result[0]
+    return best
+
+
+class TestPoolingEngine:
+    """测试拼车插入引擎"""
+
+    def test_inserts_into_nearest_empty_vehicle(self, clock):
+        """测试空车时选择最近的车辆，上下车点依次插入"""
+        engine = PoolingEngine(eta_fn=straight_eta, clock=clock)
+        engine.upsert_vehicle(1, NY_LAT + 0.05, NY_LNG, capacity=4)
+        engine.upsert_vehicle(2, NY_LAT + 0.005, NY_LNG, capacity=4)
+
+        insertion = engine.find_insertion(NY_LAT, NY_LNG, NY_LAT - 0.02, NY_LNG)
+
+        assert insertion["vehicle_id"] == 2
+        assert (insertion["pickup_index"], insertion["dropoff_index"]) == (0, 0)
+        assert engine.commit(insertion, 100)
+        assert [(s.kind, s.ride_id) for s in engine.get_vehicle(2).stops] == [
+            ("pickup", 100),
+            ("dropoff", 100),
+        ]
+
+    def test_shares_vehicle_along_route(self, clock):
+        """测试顺路的请求插入已有乘客的停靠序列中"""
+        engine = PoolingEngine(eta_fn=straight_eta, clock=clock)
+        engine.upsert_vehicle(1, NY_LAT, NY_LNG, capacity=4)
+        engine.commit(engine.find_insertion(NY_LAT, NY_LNG, NY_LAT + 0.04, NY_LNG), 100)
+
+        insertion = engine.find_insertion(NY_LAT + 0.01, NY_LNG, NY_LAT + 0.03, NY_LNG)
+
+        assert insertion["vehicle_id"] == 1
+        assert insertion["added_minutes"] == pytest.approx(0.0, abs=0.01)
+        assert engine.commit(insertion, 101)
+        assert [(s.kind, s.ride_id) for s in engine.get_vehicle(1).stops] == [
+            ("pickup", 100),
+            ("pickup", 101),
+            ("dropoff", 101),
+            ("dropoff", 100),
+        ]
+
+    def test_respects_capacity(self, clock):
+        """测试座位已满的车辆不参与拼车"""
+        engine = PoolingEngine(eta_fn=straight_eta, clock=clock)
+        engine.upsert_vehicle(1, NY_LAT, NY_LNG, capacity=2, onboard=2)
+
+        assert engine.find_insertion(NY_LAT, NY_LNG, NY_LAT + 0.01, NY_LNG) is None
+        assert engine.last_stats["candidates"] == 0
+
+        engine.upsert_vehicle(1, NY_LAT, NY_LNG, capacity=2, onboard=1)
+        assert (
+            engine.find_insertion(NY_LAT, NY_LNG, NY_LAT + 0.01, NY_LNG, passengers=2)
+            is None
+        )
+        assert engine.find_insertion(NY_LAT, NY_LNG, NY_LAT + 0.01, NY_LNG) is not None
+
+    def test_respects_existing_deadlines(self, clock):
+        """测试不会让已有乘客超过最晚到达时间"""
+        engine = PoolingEngine(eta_fn=straight_eta, clock=clock)
+        engine.upsert_vehicle(1, NY_LAT, NY_LNG, capacity=4, onboard=1)
+        vehicle = engine.get_vehicle(1)
+        # 车上乘客3分钟内必须到达约1公里外的下车点（直达约2分钟）
+        vehicle.stops = [
+            Stop("dropoff", 100, NY_LAT + 0.009, NY_LNG, latest=clock.now + 180)
+        ]
+        vehicle.legs = [straight_eta(NY_LAT, NY_LNG, NY_LAT + 0.009, NY_LNG)]
+
+        # 反方向的请求只能排在已有乘客下车之后
+        insertion = engine.find_insertion(NY_LAT - 0.005, NY_LNG, NY_LAT - 0.01, NY_LNG)
+        assert insertion["pickup_index"] == 1
+
+    def test_prunes_unreachable_vehicles(self, clock):
+        """测试直线距离超出最长等待范围的车辆不参与评估"""
+        engine = PoolingEngine(eta_fn=straight_eta, max_wait_minutes=5, clock=clock)
+        engine.upsert_vehicle(1, NY_LAT + 1.0, NY_LNG, capacity=4)
+
+        assert engine.find_insertion(NY_LAT, NY_LNG, NY_LAT + 0.01, NY_LNG) is None
+        assert engine.last_stats["eta_calls"] == 0
+
+    def test_matches_brute_force(self, clock):
+        """测试精确评估足够多方案时与穷举结果一致"""
+        rng = np.random.default_rng(3)
+        engine = PoolingEngine(
+            eta_fn=straight_eta,
+            max_wait_minutes=30,
+            max_evaluations=10000,
+            max_vehicles=1000,
+            clock=clock,
+        )
+        for vehicle_id in range(20):
+            engine.upsert_vehicle(
+                vehicle_id,
+                NY_LAT + rng.uniform(-0.05, 0.05),
+                NY_LNG + rng.uniform(-0.05, 0.05),
+                capacity=3,
+            )
+        for ride_id in range(60):
+            pickup = (
+                NY_LAT + rng.uniform(-0.05, 0.05),
+                NY_LNG + rng.uniform(-0.05, 0.05),
+            )
+            dropoff = (
+                NY_LAT + rng.uniform(-0.05, 0.05),
+                NY_LNG + rng.uniform(-0.05, 0.05),
+            )
+            expected = brute_force(engine, pickup, dropoff)
+            insertion = engine.find_insertion(*pickup, *dropoff)
+            if expected is None:
+                assert insertion is None
+                continue
+            assert insertion["added_minutes"] == pytest.approx(expected, abs=0.01)
+            assert engine.commit(insertion, ride_id)
+
+    def test_commit_rejects_stale_insertion(self, clock):
+        """测试停靠序列在此期间变化时提交失败"""
+        engine = PoolingEngine(eta_fn=straight_eta, clock=clock)
+        engine.upsert_vehicle(1, NY_LAT, NY_LNG, capacity=4)
+        first = engine.find_insertion(NY_LAT, NY_LNG, NY_LAT + 0.01, NY_LNG)
+        second = engine.find_insertion(NY_LAT, NY_LNG, NY_LAT + 0.02, NY_LNG)
+
+        assert engine.commit(first, 100)
+        assert not engine.commit(second, 101)
+
+        # 车辆位置在寻找和提交之间变化，方案中的路段已过期
+        third = engine.find_insertion(NY_LAT, NY_LNG, NY_LAT + 0.02, NY_LNG)
+        engine.upsert_vehicle(1, NY_LAT + 0.001, NY_LNG, capacity=4)
+        assert not engine.commit(third, 102)
+
+    def test_eta_called_outside_lock(self, clock):
+        """测试ETA函数不在引擎锁内调用"""
+        engine = None
+
+        def eta(lat1, lng1, lat2, lng2):
+            assert not engine._lock.locked()
+            return straight_eta(lat1, lng1, lat2, lng2)
+
+        engine = PoolingEngine(eta_fn=eta, clock=clock)
+        engine.upsert_vehicle(1, NY_LAT, NY_LNG, capacity=4)
+        assert engine.commit(
+            engine.find_insertion(NY_LAT, NY_LNG, NY_LAT + 0.02, NY_LNG), 100
+        )
+
+        engine.upsert_vehicle(1, NY_LAT + 0.001, NY_LNG, capacity=4)
+        vehicle = engine.get_vehicle(1)
+        assert vehicle.legs[0] == pytest.approx(
+            straight_eta(NY_LAT + 0.001, NY_LNG, NY_LAT, NY_LNG)
+        )
+        assert (
+            engine.find_insertion(NY_LAT + 0.005, NY_LNG, NY_LAT + 0.015, NY_LNG)
+            is not None
+        )
+
+    def test_arrive_updates_onboard(self, clock):
+        """测试到达停靠点后更新位置和车上人数"""
+        engine = PoolingEngine(eta_fn=straight_eta, clock=clock)
+        engine.upsert_vehicle(1, NY_LAT, NY_LNG, capacity=4)
+        engine.commit(
+            engine.find_insertion(NY_LAT + 0.001, NY_LNG, NY_LAT + 0.01, NY_LNG), 100
+        )
+
+        assert engine.arrive(1).kind == "pickup"
+        assert engine.get_vehicle(1).onboard == 1
+        assert engine.arrive(1).kind == "dropoff"
+        assert engine.get_vehicle(1).onboard == 0
+        assert engine.arrive(1) is None
+
+    def test_remove_vehicle(self, clock):
+        """测试移除车辆后不再参与拼车"""
+        engine = PoolingEngine(eta_fn=straight_eta, clock=clock)
+        engine.upsert_vehicle(1, NY_LAT, NY_LNG, capacity=4)
+        engine.upsert_vehicle(2, NY_LAT + 0.01, NY_LNG, capacity=4)
+
+        assert engine.remove_vehicle(1)
+        assert not engine.remove_vehicle(1)
+        assert (
+            engine.find_insertion(NY_LAT, NY_LNG, NY_LAT + 0.01, NY_LNG)["vehicle_id"]
+            == 2
+        )
+
+    def test_decision_latency(self):
+        """测试数千辆拼车车辆时单次决策在50毫秒内"""
+        rng = np.random.default_rng(42)
+        engine = PoolingEngine(eta_fn=straight_eta)
+        for vehicle_id in range(3000):
+            engine.upsert_vehicle(
+                vehicle_id,
+                NY_LAT + rng.uniform(-0.135, 0.135),
+                NY_LNG + rng.uniform(-0.135, 0.135),
+                capacity=4,
+            )
+        for ride_id in range(1500):
+            pickup = (
+                NY_LAT + rng.uniform(-0.135, 0.135),
+                NY_LNG + rng.uniform(-0.135, 0.135),
+            )
+            insertion = engine.find_insertion(*pickup, pickup[0] + 0.02, pickup[1])
+            if insertion is not None:
+                engine.commit(insertion, ride_id)
+
+        latencies = []
+        for _ in range(50):
+            pickup = (
+                NY_LAT + rng.uniform(-0.135, 0.135),
+                NY_LNG + rng.uniform(-0.135, 0.135),
+            )
+            started = time.perf_counter()
+            engine.find_insertion(*pickup, pickup[0] - 0.02, pickup[1])
+            latencies.append(time.perf_counter() - started)
+
+        assert np.median(latencies) < 0.05
@@ -0,0 +1,229 @@
+"""
+接单单元测试 - 测试条件UPDATE实现的原子接单和并发抢单
+"""
+import random
+import threading
+
+import pytest
+from flask import Flask
+from src.api.driver import driver_bp
+from src.models.ride import Ride
+from src.models.user import User
+from src.services.database import db
+from src.services.dispatcher import BatchDispatcher
+from src.services.offers import OfferManager
+from src.services.spatial_index import DriverGridIndex
+
+
+def add_driver(index, is_available=True):
+    driver = User(
+        email=f"driver{index}@example.com",
+        username=f"driver{index}",
+        password_hash="x",
+        role="driver",
+        is_available=is_available,
+    )
+    db.session.add(driver)
+    return driver
+
+
+def add_ride(passenger_id):
+    ride = Ride(
+        passenger_id=passenger_id,
+        pickup_address="A",
+        dropoff_address="B",
+        pickup_lat=40.7128,
+        pickup_lng=-74.0060,
+    )
+    db.session.add(ride)
+    return ride
+
+
+@pytest.fixture(autouse=True)
+def isolated_offers(monkeypatch):
+    """接口使用独立的派单管理器，不受后台派单线程向全局实例提交的派单影响"""
+    index = DriverGridIndex()
+    manager = OfferManager(
+        source=index,
+        dispatcher=BatchDispatcher(source=index),
+        notifier=lambda *args: True,
+    )
+    monkeypatch.setattr("src.api.driver.offer_manager", manager)
+    return manager
+
+
+@pytest.fixture
+def file_app(tmp_path):
+    """使用文件数据库的应用，多个线程各自持有连接"""
+    app = Flask(__name__)
+    app.config.update(
+        {
+            "TESTING": True,
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'accept.db'}",
+            "SQLALCHEMY_TRACK_MODIFICATIONS": False,
+            "SQLALCHEMY_ENGINE_OPTIONS": {"connect_args": {"timeout": 30}},
+        }
+    )
+    db.init_app(app)
+    app.register_blueprint(driver_bp, url_prefix="/api/driver")
+    with app.app_context():
+        db.create_all()
+    yield app
+    with app.app_context():
+        db.drop_all()
+        db.engine.dispose()
+
+
+class TestConditionalUpdates:
+    """测试模型上的条件更新"""
+
+    def test_claim_only_once(self, app):
+        """测试同一行程只能被抢到一次"""
+        with app.app_context():
+            passenger = User(
+                email="p@example.com", username="p", password_hash="x", role="passenger"
+            )
+            db.session.add(passenger)
+            db.session.commit()
+            ride = add_ride(passenger.id)
+            first, second = add_driver(1), add_driver(2)
+            db.session.commit()
+
+            assert Ride.claim(ride.id, first.id)
+            assert not Ride.claim(ride.id, second.id)
+            db.session.commit()
+
+            ride = db.session.get(Ride, ride.id)
+            assert ride.driver_id == first.id
+            assert ride.status == "accepted"
+            assert ride.accepted_at is not None
+
+    def test_update_availability_only_if(self, app):
+        """测试只在当前状态符合时修改可用状态"""
+        with app.app_context():
+            driver = add_driver(1)
+            db.session.commit()
+
+            assert User.update_availability(driver.id, False, only_if=True)
+            assert not User.update_availability(driver.id, False, only_if=True)
+            assert User.update_availability(driver.id, True)
+            assert not User.update_availability(999, True)
+            db.session.commit()
+            assert db.session.get(User, driver.id).is_available is True
+
+
+class TestAcceptRide:
+    """测试接单接口"""
+
+    def test_accept_and_reject_second_driver(self, file_app, auth_header):
+        """测试第二个司机接同一行程失败且仍保持可用"""
+        with file_app.app_context():
+            passenger = User(
+                email="p@example.com", username="p", password_hash="x", role="passenger"
+            )
+            db.session.add(passenger)
+            db.session.commit()
+            ride = add_ride(passenger.id)
+            first, second = add_driver(1), add_driver(2)
+            db.session.commit()
+            ride_id, first_id, second_id = ride.id, first.id, second.id
+
+        client = file_app.test_client()
+        response = client.post(
+            f"/api/driver/ride/{ride_id}/accept", headers=auth_header(first_id)
+        )
+        assert response.status_code == 200
+        assert response.get_json()["ride"]["driver_id"] == first_id
+
+        response = client.post(
+            f"/api/driver/ride/{ride_id}/accept", headers=auth_header(second_id)
+        )
+        assert response.status_code == 400
+        assert (
+            client.post(
+                "/api/driver/ride/999/accept", headers=auth_header(second_id)
+            ).status_code
+            == 404
+        )
+
+        with file_app.app_context():
+            assert db.session.get(User, first_id).is_available is False
+            assert db.session.get(User, second_id).is_available is True
+
+    def test_unavailable_driver_cannot_accept(self, file_app, auth_header):
+        """测试不可用的司机不能接单"""
+        with file_app.app_context():
+            passenger = User(
+                email="p@example.com", username="p", password_hash="x", role="passenger"
+            )
+            db.session.add(passenger)
+            db.session.commit()
+            ride = add_ride(passenger.id)
+            driver = add_driver(1, is_available=False)
+            db.session.commit()
+            ride_id, driver_id = ride.id, driver.id
+
+        response = file_app.test_client().post(
+            f"/api/driver/ride/{ride_id}/accept", headers=auth_header(driver_id)
+        )
+        assert response.status_code == 400
+
+        with file_app.app_context():
+            assert db.session.get(Ride, ride_id).status == "requested"
+
+    def test_concurrent_accepts(self, file_app, auth_header):
+        """测试大量线程同时抢单：每个行程恰好一个司机，每个司机最多一个行程"""
+        ride_count, driver_count = 10, 24
+        with file_app.app_context():
+            passenger = User(
+                email="p@example.com", username="p", password_hash="x", role="passenger"
+            )
+            db.session.add(passenger)
+            db.session.commit()
+            rides = [add_ride(passenger.id) for _ in range(ride_count)]
+            drivers = [add_driver(i) for i in range(driver_count)]
+            db.session.commit()
+            ride_ids = [ride.id for ride in rides]
+            driver_ids = [driver.id for driver in drivers]
+
+        barrier = threading.Barrier(driver_count)
+        results = {}
+        errors = []
+
+        def race(driver_id):
+            client = file_app.test_client()
+            order = random.Random(driver_id).sample(ride_ids, len(ride_ids))
+            barrier.wait()
+            won = []
+            for ride_id in order:
+                response = client.post(
+                    f"/api/driver/ride/{ride_id}/accept", headers=auth_header(driver_id)
+                )
+                if response.status_code == 200:
+                    won.append(ride_id)
+                elif response.status_code != 400:
+                    errors.append(response.get_json())
+            results[driver_id] = won
+
+        threads = [
+            threading.Thread(target=race, args=(driver_id,)) for driver_id in driver_ids
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert errors == []
+        won = [ride_id for rides_won in results.values() for ride_id in rides_won]
+        assert sorted(won) == sorted(ride_ids)
+        assert all(len(rides_won) <= 1 for rides_won in results.values())
+
+        with file_app.app_context():
+            for ride_id in ride_ids:
+                ride = db.session.get(Ride, ride_id)
+                assert ride.status == "accepted"
+                assert ride_id in results[ride.driver_id]
+            unavailable = User.query.filter_by(
+                role="driver", is_available=False
+            ).count()
+            assert unavailable == ride_count
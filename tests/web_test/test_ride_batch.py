@@ -0,0 +1,178 @@
+"""
+批量行程查询单元测试 - 测试顺序、缺失行程、预加载和参数校验
+"""
+import pytest
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from src.api.booking import booking_bp
+from src.models.ride import Ride
+from src.models.user import User
+from src.models.vehicle import Vehicle
+from src.services.database import db
+
+
+@pytest.fixture
+def batch_client(app):
+    app.register_blueprint(booking_bp, url_prefix="/api")
+    return app.test_client()
+
+
+@pytest.fixture
+def admin_headers(auth_header):
+    return auth_header(1, "admin")
+
+
+@pytest.fixture
+def ride_ids(app):
+    """三个行程：两个已接单（司机有车辆），一个待接单"""
+    with app.app_context():
+        vehicle = Vehicle(make="Toyota", model="Camry", license_plate="A12345")
+        db.session.add(vehicle)
+        db.session.commit()
+        passenger = User(
+            email="p@example.com", username="p", password_hash="x", role="passenger"
+        )
+        driver = User(
+            email="d@example.com",
+            username="d",
+            password_hash="x",
+            role="driver",
+            vehicle_id=vehicle.id,
+            rating=4.8,
+        )
+        db.session.add_all([passenger, driver])
+        db.session.commit()
+        rides = [
+            Ride(
+                passenger_id=passenger.id,
+                driver_id=driver.id,
+                status="accepted",
+                pickup_address="A",
+                dropoff_address="B",
+            ),
+            Ride(passenger_id=passenger.id, pickup_address="C", dropoff_address="D"),
+            Ride(
+                passenger_id=passenger.id,
+                driver_id=driver.id,
+                status="accepted",
+                pickup_address="E",
+                dropoff_address="F",
+            ),
+        ]
+        db.session.add_all(rides)
+        db.session.commit()
+        return [ride.id for ride in rides]
+
+
+class TestRidesBatchEndpoint:
+    """测试批量行程查询接口"""
+
+    def test_returns_rides_in_request_order(
+        self, batch_client, admin_headers, ride_ids
+    ):
+        """按请求顺序返回，附带乘客、司机和车辆；重复和不存在的ID不出现"""
+        requested = [ride_ids[2], 999, ride_ids[1], ride_ids[0], ride_ids[2]]
+        response = batch_client.post(
+            "/api/rides/batch", json={"ride_ids": requested}, headers=admin_headers
+        )
+
+        assert response.status_code == 200
+        assert response.headers["X-Missing-Rides"] == "1"
+        data = response.get_json()
+        assert [ride["id"] for ride in data] == [ride_ids[2], ride_ids[1], ride_ids[0]]
+
+        accepted = data[0]
+        assert accepted["passenger"]["username"] == "p"
+        assert accepted["driver"]["username"] == "d"
+        assert accepted["driver"]["rating"] == 4.8
+        assert accepted["driver"]["vehicle"]["license_plate"] == "A12345"
+        assert data[1]["driver"] is None
+
+    def test_single_query(self, app, batch_client, admin_headers, ride_ids):
+        """行程、乘客、司机和车辆在一次查询中读取"""
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, "before_cursor_execute", record)
+        try:
+            response = batch_client.post(
+                "/api/rides/batch", json={"ride_ids": ride_ids}, headers=admin_headers
+            )
+            assert len(response.get_json()) == 3
+        finally:
+            event.remove(engine, "before_cursor_execute", record)
+
+        assert len(statements) == 1
+        assert " IN " in statements[0]
+
+    def test_empty_result(self, batch_client, admin_headers, ride_ids):
+        """全部不存在时返回空数组"""
+        response = batch_client.post(
+            "/api/rides/batch", json={"ride_ids": [998, 999]}, headers=admin_headers
+        )
+
+        assert response.status_code == 200
+        assert response.get_json() == []
+        assert response.headers["X-Missing-Rides"] == "2"
+
+    def test_invalid_requests(self, batch_client, admin_headers, monkeypatch):
+        """空列表、非整数和超过上限返回400"""
+        monkeypatch.setattr("src.api.booking.MAX_BATCH_RIDES", 3)
+        for body in (
+            {},
+            {"ride_ids": []},
+            {"ride_ids": "x"},
+            {"ride_ids": ["a"]},
+            {"ride_ids": [1, 2, 3, 4]},
+        ):
+            response = batch_client.post(
+                "/api/rides/batch", json=body, headers=admin_headers
+            )
+            assert response.status_code == 400
+
+    def test_admin_account(self, app, batch_client, auth_header, ride_ids):
+        """管理员账号可以写入 users 表并调用接口，未知角色被约束拒绝"""
+        with app.app_context():
+            admin = User(
+                email="ops@example.com", username="ops", password_hash="x", role="admin"
+            )
+            db.session.add(admin)
+            db.session.commit()
+            admin_id = admin.id
+
+            db.session.add(
+                User(
+                    email="x@example.com",
+                    username="x",
+                    password_hash="x",
+                    role="superuser",
+                )
+            )
+            with pytest.raises(IntegrityError):
+                db.session.commit()
+            db.session.rollback()
+
+        response = batch_client.post(
+            "/api/rides/batch",
+            json={"ride_ids": ride_ids},
+            headers=auth_header(admin_id, "admin"),
+        )
+        assert response.status_code == 200
+        assert len(response.get_json()) == 3
+
+    def test_requires_admin(self, batch_client, auth_header):
+        """非管理员返回403，未登录返回401"""
+        response = batch_client.post(
+            "/api/rides/batch",
+            json={"ride_ids": [1]},
+            headers=auth_header(2, "passenger"),
+        )
+        assert response.status_code == 403
+        assert (
+            batch_client.post("/api/rides/batch", json={"ride_ids": [1]}).status_code
+            == 401
+        )
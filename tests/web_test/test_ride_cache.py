@@ -0,0 +1,215 @@
+"""
+行程详情缓存单元测试 - 测试读穿缓存、转换失效和ETag条件请求
+"""
+import pytest
+from src.api.booking import booking_bp
+from src.models.ride import Ride
+from src.models.user import User
+from src.services.database import db
+from src.services.ride_cache import RideDetailCache, ride_etag
+from src.services.ride_state import ride_state_machine, ACCEPT, START
+
+
+class CountingLoader:
+    def __init__(self, version=1):
+        self.version = version
+        self.calls = 0
+
+    def __call__(self, ride_id):
+        self.calls += 1
+        return (
+            self.version,
+            f'{{"ride_id": {ride_id}, "version": {self.version}}}'.encode(),
+            1,
+            None,
+        )
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    """接口使用独立的缓存，并订阅全局状态机的转换"""
+    cache = RideDetailCache()
+    monkeypatch.setattr("src.api.booking.ride_detail_cache", cache)
+    ride_state_machine.subscribe(cache.on_transitions)
+    yield cache
+    ride_state_machine.unsubscribe(cache.on_transitions)
+
+
+@pytest.fixture
+def ride_client(app, cache):
+    app.register_blueprint(booking_bp, url_prefix="/api")
+    return app.test_client()
+
+
+@pytest.fixture
+def ride_ids(app):
+    """一个乘客的待接单行程和一个司机"""
+    with app.app_context():
+        passenger = User(
+            email="p@example.com", username="p", password_hash="x", role="passenger"
+        )
+        driver = User(
+            email="d@example.com",
+            username="d",
+            password_hash="x",
+            role="driver",
+            is_available=True,
+        )
+        db.session.add_all([passenger, driver])
+        db.session.commit()
+        ride = Ride(
+            passenger_id=passenger.id,
+            pickup_address="A",
+            dropoff_address="B",
+            pickup_lat=40.7128,
+            pickup_lng=-74.0060,
+        )
+        db.session.add(ride)
+        db.session.commit()
+        return ride.id, passenger.id, driver.id
+
+
+@pytest.fixture
+def passenger_header(ride_ids, auth_header):
+    return auth_header(ride_ids[1], "passenger")
+
+
+class TestRideDetailCache:
+    """测试读穿缓存"""
+
+    def test_read_through(self):
+        """未命中时读取一次，之后直接返回缓存"""
+        cache = RideDetailCache()
+        loader = CountingLoader()
+
+        first = cache.load(7, loader)
+        second = cache.load(7, loader)
+
+        assert loader.calls == 1
+        assert second is first
+        assert first.etag == ride_etag(7, 1)
+        assert cache.get_stats()["hits"] == 1
+
+    def test_missing_ride_not_cached(self):
+        """行程不存在时不缓存"""
+        cache = RideDetailCache()
+        calls = []
+
+        assert cache.load(7, lambda ride_id: calls.append(ride_id)) is None
+        assert cache.load(7, lambda ride_id: calls.append(ride_id)) is None
+        assert calls == [7, 7]
+
+    def test_invalidate_rejects_stale_reload(self):
+        """失效标记之后，转换前读到的旧版本不会写回缓存"""
+        cache = RideDetailCache()
+        cache.load(7, CountingLoader(version=1))
+
+        cache.invalidate(7, version=2)
+        assert cache.get(7) is None
+
+        cache.store(7, 1, b"old")
+        assert cache.get(7) is None
+
+        loader = CountingLoader(version=2)
+        assert cache.load(7, loader).version == 2
+        assert cache.get(7).etag == ride_etag(7, 2)
+
+    def test_expiry(self, clock):
+        """条目按TTL过期后重新读取"""
+        cache = RideDetailCache(ttl_seconds=5, clock=clock)
+        loader = CountingLoader()
+
+        cache.load(7, loader)
+        clock.now = 6
+        cache.load(7, loader)
+
+        assert loader.calls == 2
+
+
+class TestGetRideEndpoint:
+    """测试行程详情接口"""
+
+    def test_etag_and_not_modified(
+        self, ride_client, ride_ids, passenger_header, monkeypatch
+    ):
+        """相同版本的条件请求返回304，不访问数据库"""
+        ride_id, _, _ = ride_ids
+        response = ride_client.get(f"/api/ride/{ride_id}", headers=passenger_header)
+        assert response.status_code == 200
+        data = response.get_json()
+        assert data["status"] == "requested"
+        assert data["version"] == 1
+        etag = response.headers["ETag"]
+
+        def fail(ride_id):
+            raise AssertionError("cached poll must not touch the database")
+
+        monkeypatch.setattr("src.api.booking.serialize_ride", fail)
+        response = ride_client.get(
+            f"/api/ride/{ride_id}", headers={**passenger_header, "If-None-Match": etag}
+        )
+        assert response.status_code == 304
+        assert response.data == b""
+        assert response.headers["ETag"] == etag
+
+        response = ride_client.get(f"/api/ride/{ride_id}", headers=passenger_header)
+        assert response.status_code == 200
+        assert response.get_json()["version"] == 1
+
+    def test_transition_invalidates(self, app, ride_client, ride_ids, passenger_header):
+        """状态转换提交后返回新版本和新的ETag"""
+        ride_id, _, driver_id = ride_ids
+        etag = ride_client.get(
+            f"/api/ride/{ride_id}", headers=passenger_header
+        ).headers["ETag"]
+
+        with app.app_context():
+            ride_state_machine.transition(ride_id, ACCEPT, driver_id=driver_id)
+            ride_state_machine.transition(ride_id, START, driver_id=driver_id)
+            db.session.commit()
+
+        response = ride_client.get(
+            f"/api/ride/{ride_id}", headers={**passenger_header, "If-None-Match": etag}
+        )
+        assert response.status_code == 200
+        data = response.get_json()
+        assert data["status"] == "in_progress"
+        assert data["version"] == 3
+        assert response.headers["ETag"] != etag
+
+    def test_access_checked_against_cache(
+        self, app, ride_client, ride_ids, passenger_header, auth_header, monkeypatch
+    ):
+        """只有乘客、接单司机和管理员可以查看，缓存命中时校验权限不访问数据库"""
+        ride_id, passenger_id, driver_id = ride_ids
+        url = f"/api/ride/{ride_id}"
+        assert ride_client.get(url).status_code == 401
+        assert ride_client.get(url, headers=passenger_header).status_code == 200
+
+        def fail(ride_id):
+            raise AssertionError("cached poll must not touch the database")
+
+        monkeypatch.setattr("src.api.booking.serialize_ride", fail)
+        assert (
+            ride_client.get(
+                url, headers=auth_header(passenger_id + 100, "passenger")
+            ).status_code
+            == 403
+        )
+        assert ride_client.get(url, headers=auth_header(driver_id)).status_code == 403
+        assert ride_client.get(url, headers=auth_header(1, "admin")).status_code == 200
+        monkeypatch.undo()
+
+        with app.app_context():
+            ride_state_machine.transition(ride_id, ACCEPT, driver_id=driver_id)
+            db.session.commit()
+        assert ride_client.get(url, headers=auth_header(driver_id)).status_code == 200
+
+    def test_missing_ride(self, ride_client, auth_header):
+        """行程不存在返回404"""
+        assert (
+            ride_client.get(
+                "/api/ride/999", headers=auth_header(1, "admin")
+            ).status_code
+            == 404
+        )
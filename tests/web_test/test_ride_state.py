@@ -0,0 +1,488 @@
+"""
+行程状态机单元测试 - 测试转换表、条件转换、批量转换和提交后发布的事件
+"""
+from datetime import datetime, timedelta
+
+import pytest
+from src.api.booking import booking_bp
+from src.api.driver import driver_bp
+from src.models.ride import Ride
+from src.models.user import User
+from src.services.database import db, LeaderLock
+from src.services.dispatcher import BatchDispatcher
+from src.services.offers import OfferManager
+from src.services.ride_state import (
+    RideStateMachine,
+    TRANSITIONS,
+    can_transition,
+    ACCEPT,
+    START,
+    COMPLETE,
+    CANCEL,
+    EXPIRE,
+    REQUESTED,
+    ACCEPTED,
+    IN_PROGRESS,
+    COMPLETED,
+    CANCELLED,
+)
+from src.services.spatial_index import DriverGridIndex
+
+
+def add_user(index, role="driver", is_available=True):
+    user = User(
+        email=f"{role}{index}@example.com",
+        username=f"{role}{index}",
+        password_hash="x",
+        role=role,
+        is_available=is_available,
+    )
+    db.session.add(user)
+    return user
+
+
+def add_ride(passenger_id, requested_at=None):
+    ride = Ride(
+        passenger_id=passenger_id,
+        pickup_address="A",
+        dropoff_address="B",
+        pickup_lat=40.7128,
+        pickup_lng=-74.0060,
+        requested_at=requested_at or datetime.utcnow(),
+    )
+    db.session.add(ride)
+    return ride
+
+
+@pytest.fixture
+def machine():
+    machine = RideStateMachine(chunk_size=3)
+    published = []
+    machine.subscribe(published.append)
+    machine.published = published
+    return machine
+
+
+@pytest.fixture
+def setup(app):
+    """一个乘客、两个司机"""
+    with app.app_context():
+        passenger = add_user(1, role="passenger")
+        first, second = add_user(1), add_user(2)
+        db.session.commit()
+        return passenger.id, first.id, second.id
+
+
+class TestTransitionTable:
+    """测试转换表"""
+
+    def test_allowed_actions(self):
+        """每个状态只允许表中的动作"""
+        assert can_transition(REQUESTED, ACCEPT)
+        assert can_transition(ACCEPTED, START)
+        assert can_transition(IN_PROGRESS, COMPLETE)
+        assert can_transition(ACCEPTED, CANCEL)
+        assert not can_transition(REQUESTED, START)
+        assert not can_transition(IN_PROGRESS, CANCEL)
+        assert not any(can_transition(COMPLETED, action) for action in TRANSITIONS)
+        assert not any(can_transition(CANCELLED, action) for action in TRANSITIONS)
+
+    def test_statements_compiled_for_every_guard_combination(self):
+        """每种守卫组合的语句都预先构造好"""
+        for transition in TRANSITIONS.values():
+            assert transition.statements(transition.guards) is not None
+            assert transition.statements(()) is not None
+
+
+class TestRideStateMachine:
+    """测试条件转换"""
+
+    def test_full_lifecycle(self, app, setup, machine):
+        """接单、开始、完成依次转换，时间列和写入的列都更新"""
+        passenger_id, driver_id, _ = setup
+        with app.app_context():
+            ride = add_ride(passenger_id)
+            db.session.commit()
+            ride_id = ride.id
+
+            event = machine.transition(ride_id, ACCEPT, driver_id=driver_id)
+            assert (
+                event.ride_id,
+                event.status,
+                event.passenger_id,
+                event.driver_id,
+            ) == (ride_id, ACCEPTED, passenger_id, driver_id)
+            assert event.version == 2
+            assert (
+                machine.transition(ride_id, START, driver_id=driver_id).status
+                == IN_PROGRESS
+            )
+            assert (
+                machine.transition(
+                    ride_id, COMPLETE, driver_id=driver_id, actual_fare=31.5
+                ).status
+                == COMPLETED
+            )
+            db.session.commit()
+
+            ride = db.session.get(Ride, ride_id)
+            assert ride.status == COMPLETED
+            assert ride.driver_id == driver_id
+            assert ride.actual_fare == 31.5
+            assert ride.accepted_at and ride.started_at and ride.completed_at
+            assert ride.version == 4
+
+    def test_rejects_wrong_state_and_driver(self, app, setup, machine):
+        """原状态不符或不是行程的司机时不更新"""
+        passenger_id, driver_id, other_id = setup
+        with app.app_context():
+            ride = add_ride(passenger_id)
+            db.session.commit()
+
+            assert machine.transition(ride.id, START, driver_id=driver_id) is None
+            assert machine.transition(ride.id, ACCEPT, driver_id=driver_id) is not None
+            assert machine.transition(ride.id, ACCEPT, driver_id=other_id) is None
+            assert machine.transition(ride.id, START, driver_id=other_id) is None
+            assert machine.transition(999, ACCEPT, driver_id=driver_id) is None
+            db.session.commit()
+
+            assert db.session.get(Ride, ride.id).status == ACCEPTED
+            assert machine.stats["rejected"] == 4
+
+    def test_driver_reserves_at_most_one_ride(self, app, setup, machine):
+        """司机已有已接单未开始的行程时不能再接单"""
+        passenger_id, driver_id, _ = setup
+        with app.app_context():
+            first, second = add_ride(passenger_id), add_ride(passenger_id)
+            db.session.commit()
+
+            assert machine.transition(first.id, ACCEPT, driver_id=driver_id) is not None
+            assert machine.transition(second.id, ACCEPT, driver_id=driver_id) is None
+            assert machine.transition(first.id, START, driver_id=driver_id) is not None
+            assert (
+                machine.transition(second.id, ACCEPT, driver_id=driver_id) is not None
+            )
+            db.session.commit()
+
+    def test_loaded_object_sees_transition(self, app, setup, machine):
+        """会话中已加载的行程在转换后读到新状态"""
+        passenger_id, driver_id, _ = setup
+        with app.app_context():
+            ride = add_ride(passenger_id)
+            db.session.commit()
+            assert ride.status == REQUESTED
+
+            machine.transition(ride.id, ACCEPT, driver_id=driver_id)
+            assert ride.status == ACCEPTED
+
+    def test_invalid_parameters(self, app, machine):
+        """未知动作、缺少写入的列或多余参数时报错"""
+        with app.app_context():
+            with pytest.raises(ValueError):
+                machine.transition(1, "teleport")
+            with pytest.raises(ValueError):
+                machine.transition(1, COMPLETE, driver_id=1)
+            with pytest.raises(ValueError):
+                machine.transition(1, START, driver_id=1, actual_fare=10)
+
+
+class TestTransitionEvents:
+    """测试提交后批量发布"""
+
+    def test_published_once_per_commit(self, app, setup, machine):
+        """一个事务内的转换在提交后作为一批发布"""
+        passenger_id, first_id, second_id = setup
+        with app.app_context():
+            rides = [add_ride(passenger_id) for _ in range(2)]
+            db.session.commit()
+
+            machine.transition(rides[0].id, ACCEPT, driver_id=first_id)
+            machine.transition(rides[1].id, ACCEPT, driver_id=second_id)
+            assert machine.published == []
+
+            db.session.commit()
+            assert len(machine.published) == 1
+            assert [event.ride_id for event in machine.published[0]] == [
+                rides[0].id,
+                rides[1].id,
+            ]
+
+    def test_rollback_discards_events(self, app, setup, machine):
+        """回滚的转换不发布，也不生效"""
+        passenger_id, driver_id, _ = setup
+        with app.app_context():
+            ride = add_ride(passenger_id)
+            db.session.commit()
+
+            machine.transition(ride.id, ACCEPT, driver_id=driver_id)
+            db.session.rollback()
+            db.session.commit()
+
+            assert machine.published == []
+            assert db.session.get(Ride, ride.id).status == REQUESTED
+
+    def test_failing_subscriber_does_not_block_others(self, app, setup, machine):
+        """订阅者出错不影响其他订阅者"""
+        passenger_id, driver_id, _ = setup
+
+        def broken(events):
+            raise RuntimeError("boom")
+
+        machine.unsubscribe(machine.published.append)
+        machine.subscribe(broken)
+        machine.subscribe(machine.published.append)
+        with app.app_context():
+            ride = add_ride(passenger_id)
+            db.session.commit()
+            machine.transition(ride.id, ACCEPT, driver_id=driver_id)
+            db.session.commit()
+
+        assert len(machine.published) == 1
+
+
+class TestBulkTransitions:
+    """测试批量转换和超时取消"""
+
+    def test_transition_many_in_chunks(self, app, setup, machine):
+        """超过分块大小的批量转换只转换满足条件的行程"""
+        passenger_id, driver_id, _ = setup
+        with app.app_context():
+            rides = [add_ride(passenger_id) for _ in range(7)]
+            db.session.commit()
+            ride_ids = [ride.id for ride in rides]
+            machine.transition(ride_ids[0], ACCEPT, driver_id=driver_id)
+
+            events = machine.transition_many(ride_ids + [999], EXPIRE)
+            db.session.commit()
+
+            assert sorted(event.ride_id for event in events) == ride_ids[1:]
+            assert db.session.get(Ride, ride_ids[0]).status == ACCEPTED
+            assert all(
+                db.session.get(Ride, ride_id).cancelled_at for ride_id in ride_ids[1:]
+            )
+
+    def test_cancel_guarded_by_passenger(self, app, setup, machine):
+        """乘客只能取消自己的行程"""
+        passenger_id, _, _ = setup
+        with app.app_context():
+            ride = add_ride(passenger_id)
+            db.session.commit()
+
+            assert (
+                machine.transition(ride.id, CANCEL, passenger_id=passenger_id + 100)
+                is None
+            )
+            assert (
+                machine.transition(ride.id, CANCEL, passenger_id=passenger_id).status
+                == CANCELLED
+            )
+
+    def test_expire_requests(self, app, setup, machine):
+        """只取消等待超时且无司机的行程"""
+        passenger_id, driver_id, _ = setup
+        now = datetime.utcnow()
+        with app.app_context():
+            stale = add_ride(passenger_id, requested_at=now - timedelta(minutes=20))
+            taken = add_ride(passenger_id, requested_at=now - timedelta(minutes=20))
+            fresh = add_ride(passenger_id, requested_at=now - timedelta(minutes=1))
+            db.session.commit()
+            machine.transition(taken.id, ACCEPT, driver_id=driver_id)
+            db.session.commit()
+
+            events = machine.expire_requests(600, now=now)
+
+            assert [event.ride_id for event in events] == [stale.id]
+            assert db.session.get(Ride, stale.id).status == CANCELLED
+            assert db.session.get(Ride, fresh.id).status == REQUESTED
+            assert machine.published[-1] == events
+
+    def test_expire_only_on_leader(self, app, setup, machine):
+        """只有派单leader进程执行超时取消"""
+        passenger_id, _, _ = setup
+        lock = LeaderLock(1)
+        with app.app_context():
+            stale = add_ride(
+                passenger_id, requested_at=datetime.utcnow() - timedelta(minutes=20)
+            )
+            db.session.commit()
+
+            assert machine.expire_if_leader(600, lock) == []
+            assert db.session.get(Ride, stale.id).status == REQUESTED
+
+            assert lock.acquire()
+            events = machine.expire_if_leader(600, lock)
+
+            assert [event.ride_id for event in events] == [stale.id]
+            lock.release()
+
+
+class TestRideEndpoints:
+    """测试接口通过状态机转换"""
+
+    @pytest.fixture
+    def client(self, app, monkeypatch):
+        index = DriverGridIndex()
+        manager = OfferManager(
+            source=index,
+            dispatcher=BatchDispatcher(source=index),
+            notifier=lambda *args: True,
+        )
+        monkeypatch.setattr("src.api.driver.offer_manager", manager)
+        app.register_blueprint(driver_bp, url_prefix="/api/driver")
+        app.register_blueprint(booking_bp, url_prefix="/api")
+        return app.test_client()
+
+    def test_start_and_complete(self, app, setup, client, auth_header):
+        """开始和完成行程，只有行程的司机可以操作"""
+        passenger_id, driver_id, other_id = setup
+        with app.app_context():
+            ride = add_ride(passenger_id)
+            db.session.commit()
+            ride_id = ride.id
+
+        assert (
+            client.post(
+                f"/api/driver/ride/{ride_id}/start", headers=auth_header(driver_id)
+            ).status_code
+            == 400
+        )
+        assert (
+            client.post(
+                f"/api/driver/ride/{ride_id}/accept", headers=auth_header(driver_id)
+            ).status_code
+            == 200
+        )
+        assert (
+            client.post(
+                f"/api/driver/ride/{ride_id}/start", headers=auth_header(other_id)
+            ).status_code
+            == 403
+        )
+        assert (
+            client.post(
+                "/api/driver/ride/999/start", headers=auth_header(driver_id)
+            ).status_code
+            == 404
+        )
+
+        response = client.post(
+            f"/api/driver/ride/{ride_id}/start", headers=auth_header(driver_id)
+        )
+        assert response.status_code == 200
+        assert response.get_json()["ride"]["status"] == IN_PROGRESS
+
+        complete = f"/api/driver/ride/{ride_id}/complete"
+        assert (
+            client.post(complete, json={}, headers=auth_header(driver_id)).status_code
+            == 400
+        )
+        assert (
+            client.post(
+                complete, json={"actual_fare": "x"}, headers=auth_header(driver_id)
+            ).status_code
+            == 400
+        )
+        response = client.post(
+            complete, json={"actual_fare": 28}, headers=auth_header(driver_id)
+        )
+        assert response.status_code == 200
+        assert response.get_json()["ride"]["status"] == COMPLETED
+
+        with app.app_context():
+            assert db.session.get(User, driver_id).is_available is True
+
+    def test_bulk_cancel_releases_driver(self, app, setup, client, auth_header):
+        """管理员批量取消，已接单行程的司机恢复可用"""
+        passenger_id, driver_id, _ = setup
+        with app.app_context():
+            accepted, waiting, started = (add_ride(passenger_id) for _ in range(3))
+            db.session.commit()
+            ride_ids = [accepted.id, waiting.id, started.id]
+        client.post(
+            f"/api/driver/ride/{ride_ids[0]}/accept", headers=auth_header(driver_id)
+        )
+
+        admin = auth_header(1, role="admin")
+        assert (
+            client.post(
+                "/api/driver/rides/transition",
+                json={"action": CANCEL, "ride_ids": [ride_ids[0]]},
+                headers=auth_header(driver_id),
+            ).status_code
+            == 403
+        )
+        assert (
+            client.post(
+                "/api/driver/rides/transition",
+                json={"action": START, "ride_ids": ride_ids},
+                headers=admin,
+            ).status_code
+            == 400
+        )
+
+        response = client.post(
+            "/api/driver/rides/transition",
+            json={"action": CANCEL, "ride_ids": ride_ids[:2] + [999]},
+            headers=admin,
+        )
+        assert response.status_code == 200
+        data = response.get_json()
+        assert sorted(data["transitioned"]) == sorted(ride_ids[:2])
+        assert data["skipped"] == [999]
+        assert data["released_drivers"] == [driver_id]
+
+        with app.app_context():
+            assert db.session.get(User, driver_id).is_available is True
+            assert db.session.get(Ride, ride_ids[2]).status == REQUESTED
+
+    def test_passenger_cancel_releases_driver(self, app, setup, client, auth_header):
+        """乘客取消自己的行程，已接单的司机恢复可用"""
+        passenger_id, driver_id, _ = setup
+        with app.app_context():
+            other = add_user(2, role="passenger")
+            accepted, waiting = add_ride(passenger_id), add_ride(passenger_id)
+            db.session.commit()
+            other_id, accepted_id, waiting_id = other.id, accepted.id, waiting.id
+        client.post(
+            f"/api/driver/ride/{accepted_id}/accept", headers=auth_header(driver_id)
+        )
+
+        cancel = f"/api/ride/{accepted_id}/cancel"
+        assert client.post(cancel).status_code == 401
+        assert client.post(cancel, headers=auth_header(driver_id)).status_code == 403
+        assert (
+            client.post(
+                cancel, headers=auth_header(other_id, role="passenger")
+            ).status_code
+            == 404
+        )
+        assert (
+            client.post(
+                "/api/ride/999/cancel",
+                headers=auth_header(passenger_id, role="passenger"),
+            ).status_code
+            == 404
+        )
+
+        response = client.post(
+            cancel, headers=auth_header(passenger_id, role="passenger")
+        )
+        assert response.status_code == 200
+        assert response.get_json()["status"] == CANCELLED
+        assert (
+            client.post(
+                cancel, headers=auth_header(passenger_id, role="passenger")
+            ).status_code
+            == 400
+        )
+
+        response = client.post(
+            f"/api/ride/{waiting_id}/cancel",
+            headers=auth_header(passenger_id, role="passenger"),
+        )
+        assert response.status_code == 200
+
+        with app.app_context():
+            assert db.session.get(User, driver_id).is_available is True
+            assert db.session.get(Ride, accepted_id).status == CANCELLED
+            assert db.session.get(Ride, waiting_id).status == CANCELLED
@@ -0,0 +1,276 @@
+"""
+行程状态等待单元测试 - 测试等待登记的唤醒、超时和长轮询接口
+"""
+import threading
+import time
+
+import pytest
+from src.api.ride_watch import ride_watch_bp
+from src.models.ride import Ride
+from src.models.user import User
+from src.services.database import db
+from src.services.ride_cache import RideDetailCache
+from src.services.ride_state import (
+    RideTransitionListener,
+    RideTransition,
+    ride_state_machine,
+    format_notification,
+    parse_notification,
+    ACCEPT,
+)
+from src.services.ride_watch import RideWatchRegistry
+
+
+def start_waiter(registry, ride_id, version, timeout, results):
+    thread = threading.Thread(
+        target=lambda: results.append(registry.wait(ride_id, version, timeout))
+    )
+    thread.start()
+    return thread
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+class TestRideWatchRegistry:
+    """测试等待登记"""
+
+    def test_notify_wakes_waiters(self):
+        """转换唤醒该行程的全部等待者，等待结束后不保留条件变量"""
+        registry = RideWatchRegistry()
+        results = []
+        threads = [start_waiter(registry, 7, 1, 5.0, results) for _ in range(50)]
+        wait_for(lambda: registry.waiting == 50)
+        assert len(registry) == 1
+
+        registry.notify(7, 2)
+        for thread in threads:
+            thread.join()
+
+        assert results == [2] * 50
+        assert len(registry) == 0
+        assert registry.get_stats()["woken"] == 50
+
+    def test_other_rides_not_woken(self):
+        """其他行程的转换不唤醒等待者"""
+        registry = RideWatchRegistry()
+        results = []
+        thread = start_waiter(registry, 7, 1, 0.2, results)
+        wait_for(lambda: registry.waiting == 1)
+
+        registry.notify(8, 5)
+        thread.join()
+
+        assert results == [None]
+        assert registry.get_stats()["timeouts"] == 1
+
+    def test_transition_before_wait_not_missed(self):
+        """检查状态之后、开始等待之前发生的转换立即返回"""
+        registry = RideWatchRegistry()
+        registry.notify(7, 3)
+
+        assert registry.wait(7, 2, timeout=5.0) == 3
+        assert registry.wait(7, 3, timeout=0.01) is None
+
+    def test_max_waiters(self):
+        """等待者已满时不再挂起"""
+        registry = RideWatchRegistry(max_waiters=1)
+        results = []
+        thread = start_waiter(registry, 7, 1, 5.0, results)
+        wait_for(lambda: registry.waiting == 1)
+
+        started = time.monotonic()
+        assert registry.wait(8, 1, timeout=5.0) is None
+        assert time.monotonic() - started < 1.0
+        assert registry.get_stats()["rejected"] == 1
+
+        registry.notify(7, 2)
+        thread.join()
+
+
+class TestRideTransitionListener:
+    """测试跨进程转换通知"""
+
+    def test_notification_round_trip(self):
+        """通知负载包含行程ID和版本号，格式错误的项被忽略"""
+        events = [
+            RideTransition(7, ACCEPT, "accepted", 2, 1, 3, {}, None),
+            RideTransition(8, ACCEPT, "accepted", 5, 1, 4, {}, None),
+        ]
+
+        assert parse_notification(format_notification(events)) == [(7, 2), (8, 5)]
+        assert parse_notification("7:2,x,9:") == [(7, 2)]
+
+    def test_dispatch_wakes_waiters_and_invalidates(self):
+        """其他进程的转换唤醒等待者并使缓存失效，重复通知不清除已是新版本的缓存"""
+        registry, cache = RideWatchRegistry(), RideDetailCache()
+        listener = RideTransitionListener()
+        listener.subscribe(registry.notify)
+        listener.subscribe(cache.invalidate)
+        cache.store(7, 1, b"v1")
+        results = []
+        thread = start_waiter(registry, 7, 1, 5.0, results)
+        wait_for(lambda: registry.waiting == 1)
+
+        listener.dispatch("7:2")
+        thread.join()
+
+        assert results == [2]
+        assert cache.get(7) is None
+        cache.store(7, 2, b"v2")
+        listener.dispatch("7:2")
+        assert cache.get(7).body == b"v2"
+        assert listener.stats["transitions"] == 2
+
+    def test_not_started_without_postgres(self, app):
+        """SQLite只跑一个进程，不启动监听"""
+        assert RideTransitionListener().start(app) is False
+
+
+class TestWaitRideEndpoint:
+    """测试长轮询接口"""
+
+    @pytest.fixture
+    def registry(self, monkeypatch):
+        registry = RideWatchRegistry()
+        cache = RideDetailCache()
+        monkeypatch.setattr("src.api.ride_watch.ride_watch_registry", registry)
+        monkeypatch.setattr("src.api.ride_watch.ride_detail_cache", cache)
+        ride_state_machine.subscribe(cache.on_transitions)
+        ride_state_machine.subscribe(registry.on_transitions)
+        yield registry
+        ride_state_machine.unsubscribe(registry.on_transitions)
+        ride_state_machine.unsubscribe(cache.on_transitions)
+
+    @pytest.fixture
+    def ride_client(self, app, registry):
+        app.register_blueprint(ride_watch_bp, url_prefix="/api")
+        return app.test_client()
+
+    @pytest.fixture
+    def ride_ids(self, app):
+        with app.app_context():
+            passenger = User(
+                email="p@example.com", username="p", password_hash="x", role="passenger"
+            )
+            driver = User(
+                email="d@example.com",
+                username="d",
+                password_hash="x",
+                role="driver",
+                is_available=True,
+            )
+            db.session.add_all([passenger, driver])
+            db.session.commit()
+            ride = Ride(
+                passenger_id=passenger.id,
+                pickup_address="A",
+                dropoff_address="B",
+                pickup_lat=40.7128,
+                pickup_lng=-74.0060,
+            )
+            db.session.add(ride)
+            db.session.commit()
+            return ride.id, passenger.id, driver.id
+
+    @pytest.fixture
+    def passenger_header(self, ride_ids, auth_header):
+        return auth_header(ride_ids[1], "passenger")
+
+    def test_returns_immediately_when_behind(
+        self, ride_client, ride_ids, passenger_header
+    ):
+        """客户端版本落后时不等待"""
+        ride_id, _, _ = ride_ids
+        response = ride_client.get(
+            f"/api/ride/{ride_id}/wait?version=0&timeout=5", headers=passenger_header
+        )
+
+        assert response.status_code == 200
+        assert response.get_json()["version"] == 1
+        assert "ETag" in response.headers
+
+    def test_timeout_not_modified(self, ride_client, ride_ids, passenger_header):
+        """没有转换时超时返回304"""
+        ride_id, _, _ = ride_ids
+        response = ride_client.get(
+            f"/api/ride/{ride_id}/wait?version=1&timeout=0.05", headers=passenger_header
+        )
+
+        assert response.status_code == 304
+
+    def test_transition_wakes_request(
+        self, app, ride_client, ride_ids, passenger_header, registry
+    ):
+        """挂起的请求在转换提交后返回新状态"""
+        ride_id, _, driver_id = ride_ids
+        responses = []
+        thread = threading.Thread(
+            target=lambda: responses.append(
+                ride_client.get(
+                    f"/api/ride/{ride_id}/wait?version=1&timeout=5",
+                    headers=passenger_header,
+                )
+            )
+        )
+        started = time.monotonic()
+        thread.start()
+        wait_for(lambda: registry.waiting == 1)
+
+        with app.app_context():
+            ride_state_machine.transition(ride_id, ACCEPT, driver_id=driver_id)
+            db.session.commit()
+        thread.join()
+
+        assert time.monotonic() - started < 2.0
+        assert responses[0].status_code == 200
+        data = responses[0].get_json()
+        assert data["status"] == "accepted"
+        assert data["version"] == 2
+
+    def test_invalid_parameters(self, ride_client, ride_ids, passenger_header):
+        """缺少或无效的版本号返回400，行程不存在返回404"""
+        ride_id, _, _ = ride_ids
+        assert (
+            ride_client.get(
+                f"/api/ride/{ride_id}/wait", headers=passenger_header
+            ).status_code
+            == 400
+        )
+        assert (
+            ride_client.get(
+                f"/api/ride/{ride_id}/wait?version=x", headers=passenger_header
+            ).status_code
+            == 400
+        )
+        assert (
+            ride_client.get(
+                "/api/ride/999/wait?version=1&timeout=0", headers=passenger_header
+            ).status_code
+            == 404
+        )
+
+    def test_requires_ride_access(self, ride_client, ride_ids, auth_header, registry):
+        """未登录返回401，不是行程的乘客、司机或管理员返回403且不挂起"""
+        ride_id, passenger_id, driver_id = ride_ids
+        url = f"/api/ride/{ride_id}/wait?version=1&timeout=5"
+
+        assert ride_client.get(url).status_code == 401
+        assert (
+            ride_client.get(
+                url, headers=auth_header(passenger_id + 100, "passenger")
+            ).status_code
+            == 403
+        )
+        assert ride_client.get(url, headers=auth_header(driver_id)).status_code == 403
+        assert registry.get_stats()["waits"] == 0
+        assert (
+            ride_client.get(
+                f"/api/ride/{ride_id}/wait?version=0", headers=auth_header(1, "admin")
+            ).status_code
+            == 200
+        )
@@ -0,0 +1,123 @@
+"""
+路由服务单元测试 - 测试路网加载、ALT最短路径和LocationService回退逻辑
+"""
+import numpy as np
+import pytest
+from src.services.routing import RoadGraph, RoutingEngine, set_routing_engine
+from src.services.location import LocationService
+
+
+def grid_graph(size=20, spacing_deg=0.002, seed=5):
+    """生成带随机速度的双向网格路网"""
+    rng = np.random.default_rng(seed)
+    rows, cols = np.divmod(np.arange(size * size), size)
+    lats = 40.70 + rows * spacing_deg
+    lngs = -74.00 + cols * spacing_deg
+
+    sources, targets = [], []
+    for node in range(size * size):
+        r, c = divmod(node, size)
+        if c + 1 < size:
+            sources += [node, node + 1]
+            targets += [node + 1, node]
+        if r + 1 < size:
+            sources += [node, node + size]
+            targets += [node + size, node]
+
+    lengths = np.full(len(sources), 200.0)
+    times = lengths / rng.uniform(3.0, 15.0, len(sources))
+    return RoadGraph.from_edges(lats, lngs, sources, targets, times, lengths)
+
+
+@pytest.fixture
+def engine():
+    """小型网格路网上的路由引擎"""
+    graph = grid_graph()
+    graph.build_landmarks(count=4)
+    return RoutingEngine(graph)
+
+
+class TestRoutingEngine:
+    """测试路由引擎"""
+
+    def test_alt_matches_dijkstra(self, engine):
+        """测试ALT查询结果与完整Dijkstra一致"""
+        rng = np.random.default_rng(1)
+        for source, target in rng.integers(0, engine.graph.node_count, size=(20, 2)):
+            expected = engine.graph.shortest_times_from(int(source))[target]
+            seconds, meters = engine.shortest_path(int(source), int(target))
+            assert seconds == pytest.approx(expected, rel=1e-5)
+            assert meters >= 0
+
+    def test_unreachable(self):
+        """测试不可达节点"""
+        graph = RoadGraph.from_edges(
+            [0.0, 0.0, 0.0], [0.0, 0.001, 0.002], [0], [1], [10.0], [100.0]
+        )
+        graph.build_landmarks(count=2)
+        engine = RoutingEngine(graph)
+
+        assert engine.shortest_path(0, 1) == (10.0, 100.0)
+        assert engine.shortest_path(1, 0) is None
+        assert engine.shortest_path(0, 2) is None
+
+    def test_requires_landmarks(self, tmp_path):
+        """测试缺少预计算地标的路网不能用于创建引擎"""
+        graph = RoadGraph.from_edges(
+            [0.0, 0.0], [0.0, 0.001], [0], [1], [10.0], [100.0]
+        )
+        with pytest.raises(ValueError):
+            RoutingEngine(graph)
+
+        path = tmp_path / "no_landmarks.npz"
+        graph.save(str(path))
+        with pytest.raises(ValueError):
+            RoutingEngine.load(str(path))
+
+    def test_route_snaps_coordinates(self, engine):
+        """测试坐标吸附到路网节点"""
+        route = engine.route(40.7001, -73.9999, 40.7181, -73.9621)
+
+        assert route["duration_minutes"] > 0
+        assert route["distance_km"] == pytest.approx(9 * 0.2 + 19 * 0.2, rel=1e-3)
+        # 离路网太远的坐标
+        assert engine.route(41.5, -74.0, 40.71, -73.99) is None
+
+    def test_save_and_load(self, engine, tmp_path):
+        """测试路网文件保存和加载"""
+        path = tmp_path / "graph.npz"
+        engine.graph.save(str(path))
+
+        loaded = RoutingEngine.load(str(path))
+
+        assert loaded.graph.node_count == engine.graph.node_count
+        assert np.array_equal(loaded.graph.landmarks, engine.graph.landmarks)
+        assert loaded.shortest_path(0, 399) == engine.shortest_path(0, 399)
+
+
+class TestEstimateRoute:
+    """测试LocationService路线估算"""
+
+    def test_uses_road_network(self, engine):
+        """测试路网可用时使用路网结果"""
+        set_routing_engine(engine)
+        try:
+            route = LocationService.estimate_route(40.70, -74.00, 40.71, -73.99)
+            assert route["source"] == "road_network"
+        finally:
+            set_routing_engine(None)
+
+    def test_falls_back_to_heuristic(self):
+        """测试未配置路网时回退到直线估算"""
+        set_routing_engine(None)
+
+        route = LocationService.estimate_route(40.7128, -74.0060, 40.7589, -73.9851)
+
+        distance = LocationService.calculate_distance(
+            40.7128, -74.0060, 40.7589, -73.9851
+        )
+        assert route["source"] == "heuristic"
+        assert route["distance_km"] == pytest.approx(distance)
+        assert route["duration_minutes"] == pytest.approx(
+            LocationService.estimate_travel_time(distance)
+        )
@@ -0,0 +1,138 @@
+"""
+城市模拟器单元测试 - 测试事件队列、城市地图和完整行程生命周期
+"""
+import numpy as np
+from src.simulator import CityMap, EventQueue, Simulation
+from src.simulator.simulation import COMPLETED, CANCELLED, REQUESTED
+
+
+class TestEventQueue:
+    """测试离散事件队列"""
+
+    def test_pops_in_time_then_insertion_order(self):
+        """测试按时间弹出，同一时刻按加入顺序"""
+        queue = EventQueue()
+        queue.schedule(5.0, "b")
+        queue.schedule(1.0, "a")
+        queue.schedule(5.0, "c", 1, 2)
+
+        assert [queue.pop()[1:] for _ in range(3)] == [
+            ("a", ()),
+            ("b", ()),
+            ("c", (1, 2)),
+        ]
+        assert queue.now == 5.0
+        assert queue() == 5.0
+
+    def test_past_events_run_now(self):
+        """测试早于当前时间的事件按当前时间处理"""
+        queue = EventQueue(start=10.0)
+        queue.schedule(3.0, "late")
+        queue.schedule_after(2.0, "later")
+
+        assert queue.pop()[0] == 10.0
+        assert queue.pop()[0] == 12.0
+        assert queue.peek_time() is None
+
+
+class TestCityMap:
+    """测试城市地图"""
+
+    def test_points_inside_city(self):
+        """测试生成的点都在城市范围内"""
+        city = CityMap(seed=1)
+        lats, lngs = city.demand_points(5000)
+
+        assert np.all(np.abs(lats - city.center_lat) <= city.span_deg)
+        assert np.all(np.abs(lngs - city.center_lng) <= city.span_deg)
+
+    def test_same_seed_same_city(self):
+        """测试相同种子生成相同的需求"""
+        first = CityMap(seed=7).demand_points(100)
+        second = CityMap(seed=7).demand_points(100)
+
+        assert np.array_equal(first[0], second[0])
+        assert np.array_equal(first[1], second[1])
+
+
+class TestSimulation:
+    """测试城市模拟"""
+
+    def test_full_lifecycle(self):
+        """测试完成的行程依次经过请求、接单、上车、完成"""
+        simulation = Simulation(drivers=200, duration_seconds=1200, seed=3)
+        report = simulation.run()
+
+        assert report["completed"] > 0
+        done = simulation.ride_status == COMPLETED
+        requested = simulation.request_times[done]
+        assert np.all(requested <= simulation.accepted_at[done])
+        assert np.all(simulation.accepted_at[done] <= simulation.picked_up_at[done])
+        assert np.all(simulation.picked_up_at[done] < simulation.completed_at[done])
+        assert report["offers"]["accepted"] == report["accepted"]
+
+    def test_driver_never_double_booked(self):
+        """测试同一司机的行程时间不重叠（前向派单的下一单在上一单完成后才上车）"""
+        simulation = Simulation(
+            drivers=50, duration_seconds=1800, requests_per_hour=400, seed=5
+        )
+        simulation.run()
+
+        for driver_id in range(len(simulation.fleet)):
+            rides = np.flatnonzero(simulation.ride_driver == driver_id)
+            trips = sorted(
+                (simulation.picked_up_at[ride], simulation.completed_at[ride])
+                for ride in rides
+                if not np.isnan(simulation.picked_up_at[ride])
+            )
+            for (_, end), (start, _) in zip(trips, trips[1:]):
+                assert not np.isnan(end) and end <= start
+
+    def test_deterministic(self):
+        """测试相同种子的两次模拟结果一致"""
+        first = Simulation(drivers=100, duration_seconds=600, seed=11).run()
+        second = Simulation(drivers=100, duration_seconds=600, seed=11).run()
+
+        for key in ("wall_seconds", "speedup", "events_per_second", "dispatch_ms"):
+            first.pop(key)
+            second.pop(key)
+        assert first == second
+
+    def test_no_accepting_drivers(self):
+        """测试司机都不接单时乘客等待超时后取消"""
+        simulation = Simulation(
+            drivers=20,
+            duration_seconds=900,
+            requests_per_hour=120,
+            accept_rate=0.0,
+            patience_seconds=120,
+            seed=2,
+        )
+        report = simulation.run()
+
+        assert report["accepted"] == 0
+        assert report["cancelled"] > 0
+        assert report["offers"]["declined"] + report["offers"]["timed_out"] > 0
+        assert set(np.unique(simulation.ride_status[: report["requests"]])) <= {
+            REQUESTED,
+            CANCELLED,
+        }
+
+    def test_forward_dispatch_toggle(self):
+        """测试关闭前向派单时没有预留的下一单"""
+        report = Simulation(
+            drivers=50,
+            duration_seconds=1800,
+            requests_per_hour=300,
+            forward_horizon_seconds=0,
+            seed=4,
+        ).run()
+
+        assert report["chained"] == 0
+        assert report["completed"] > 0
+
+    def test_faster_than_real_time(self):
+        """测试大规模司机时模拟快于实时"""
+        report = Simulation(drivers=20000, duration_seconds=120, seed=1).run()
+
+        assert report["speedup"] > 1
@@ -0,0 +1,106 @@
+"""
+空间索引单元测试 - 测试可用司机的网格索引
+"""
+import random
+import pytest
+from src.services.spatial_index import DriverGridIndex, haversine_km
+from src.services.location import LocationService
+
+
+def brute_force(drivers, lat, lng):
+    """线性扫描计算所有司机的距离"""
+    return sorted(
+        (
+            (driver_id, haversine_km(lat, lng, d_lat, d_lng))
+            for driver_id, (d_lat, d_lng) in drivers.items()
+        ),
+        key=lambda item: item[1],
+    )
+
+
+@pytest.fixture
+def fleet():
+    """生成随机司机位置"""
+    rng = random.Random(1)
+    return {
+        driver_id: (40.7 + rng.uniform(-0.1, 0.1), -74.0 + rng.uniform(-0.1, 0.1))
+        for driver_id in range(1, 2001)
+    }
+
+
+class TestDriverGridIndex:
+    """测试司机网格索引"""
+
+    def test_query_radius_matches_linear_scan(self, fleet):
+        """测试半径查询结果与线性扫描一致"""
+        index = DriverGridIndex()
+        index.bulk_load(
+            (driver_id, lat, lng) for driver_id, (lat, lng) in fleet.items()
+        )
+
+        expected = [
+            (d, dist) for d, dist in brute_force(fleet, 40.71, -74.01) if dist <= 2.0
+        ]
+        result = index.query_radius(40.71, -74.01, 2.0)
+
+        assert [d for d, _ in result] == [d for d, _ in expected]
+
+        limited = index.query_radius(40.71, -74.01, 2.0, limit=5)
+        assert [d for d, _ in limited] == [d for d, _ in expected[:5]]
+
+    def test_query_nearest_matches_linear_scan(self, fleet):
+        """测试Top-K查询结果与线性扫描一致"""
+        index = DriverGridIndex()
+        index.bulk_load(
+            (driver_id, lat, lng) for driver_id, (lat, lng) in fleet.items()
+        )
+
+        for lat, lng in [(40.71, -74.01), (40.6, -74.1), (41.0, -73.5)]:
+            expected = brute_force(fleet, lat, lng)[:7]
+            result = index.query_nearest(lat, lng, k=7)
+            assert [d for d, _ in result] == [d for d, _ in expected]
+
+    def test_incremental_updates(self):
+        """测试增量移动和移除司机"""
+        index = DriverGridIndex()
+        index.upsert(1, 40.7128, -74.0060, name="driver1", rating=4.8)
+        index.upsert(2, 40.7589, -73.9851)
+
+        assert len(index) == 2
+        assert [d for d, _ in index.query_radius(40.7128, -74.0060, 1.0)] == [1]
+
+        # 司机1移动到司机2附近
+        index.upsert(1, 40.7590, -73.9850)
+        assert index.query_radius(40.7128, -74.0060, 1.0) == []
+        assert index.get_info(1) == {"name": "driver1", "rating": 4.8}
+
+        assert index.remove(2) is True
+        assert index.remove(2) is False
+        assert 2 not in index
+        assert [d for d, _ in index.query_nearest(40.7589, -73.9851, k=5)] == [1]
+
+    def test_empty_index(self):
+        """测试空索引查询"""
+        index = DriverGridIndex()
+
+        assert index.query_radius(40.7, -74.0, 5.0) == []
+        assert index.query_nearest(40.7, -74.0, k=3) == []
+
+
+class TestFindNearbyDrivers:
+    """测试LocationService通过索引查找附近司机"""
+
+    def test_find_nearby_drivers_uses_index(self, monkeypatch):
+        """测试返回索引中的司机"""
+        index = DriverGridIndex()
+        index.upsert(7, 40.7130, -74.0062, name="driver7", rating=4.9)
+        index.upsert(8, 41.5, -74.0, name="far_away", rating=4.5)
+        monkeypatch.setattr("src.services.location.driver_index", index)
+
+        drivers = LocationService.find_nearby_drivers(40.7128, -74.0060, radius_km=5)
+
+        assert len(drivers) == 1
+        assert drivers[0]["driver_id"] == 7
+        assert drivers[0]["name"] == "driver7"
+        assert drivers[0]["rating"] == 4.9
+        assert drivers[0]["distance_km"] < 0.1
@@ -0,0 +1,98 @@
+"""
+动态加价单元测试 - 测试按网格的加价倍数计算和车费调整
+"""
+import pytest
+from src.services.heatmap import DemandHeatmap, demand_heatmap
+from src.services.payment import PaymentService
+from src.services.spatial_index import DriverGridIndex
+from src.services.surge import SurgeEngine, surge_engine
+
+
+NY_LAT, NY_LNG = 40.7128, -74.0060
+
+
+@pytest.fixture
+def clock_start():
+    return 1704110400.0
+
+
+def busy_heatmap(clock, requests=10, drivers=1):
+    """上车点网格有 requests 个请求、drivers 个可用司机的热力图"""
+    index = DriverGridIndex()
+    for driver_id in range(drivers):
+        index.upsert(driver_id, NY_LAT, NY_LNG)
+    heatmap = DemandHeatmap(source=index, clock=clock)
+    for _ in range(requests):
+        heatmap.record_request(NY_LAT, NY_LNG)
+    heatmap.sample_supply()
+    return heatmap
+
+
+class TestSurgeEngine:
+    """测试动态加价引擎"""
+
+    def test_multiplier_is_smoothed_towards_target(self, clock):
+        """测试倍数逐步逼近目标值"""
+        engine = SurgeEngine(
+            busy_heatmap(clock, requests=10, drivers=1), sensitivity=0.25, smoothing=0.3
+        )
+
+        # 需求/供给比 10/(1+1)=5，目标倍数 1+0.25*4=2.0
+        assert engine.tick() == 1
+        assert engine.multiplier(NY_LAT, NY_LNG) == 1.3
+        for _ in range(20):
+            engine.tick()
+        assert engine.multiplier(NY_LAT, NY_LNG) == pytest.approx(1.9)
+        # 其他网格不加价
+        assert engine.multiplier(51.5, -0.12) == 1.0
+
+    def test_no_surge_when_supply_covers_demand(self, clock):
+        """测试供给充足时不加价"""
+        engine = SurgeEngine(busy_heatmap(clock, requests=3, drivers=5))
+
+        assert engine.tick() == 0
+        assert engine.surging_cells() == {}
+
+    def test_tick_is_vectorized(self, clock):
+        """测试大量网格时一次计算很快"""
+        heatmap = DemandHeatmap(source=DriverGridIndex(), clock=clock)
+        for i in range(20000):
+            heatmap.counts.add_demand(f"cell{i}", count=i % 7)
+        engine = SurgeEngine(heatmap)
+
+        engine.tick()
+
+        assert len(engine.surging_cells()) > 0
+        assert engine.last_tick_ms < 500
+
+
+class TestSurgePricing:
+    """测试车费加价"""
+
+    def test_calculate_fare_with_multiplier(self):
+        """测试显式倍数和无上车点时的车费"""
+        assert PaymentService.calculate_fare(10.0, surge_multiplier=1.5) == 26.25
+        assert PaymentService.calculate_fare(10.0, pickup_lat=None) == 17.5
+
+    def test_estimate_fare_uses_pickup_surge(self):
+        """测试预估车费按上车点网格加价"""
+        demand_heatmap.counts.clear()
+        surge_engine.reset()
+        try:
+            cell = demand_heatmap.cell_of(NY_LAT, NY_LNG)
+            demand_heatmap.counts.add_demand(cell, count=20)
+            for _ in range(10):
+                surge_engine.tick()
+
+            multiplier = surge_engine.multiplier(NY_LAT, NY_LNG)
+            estimate = PaymentService.estimate_fare(NY_LAT, NY_LNG, 40.7589, -74.0567)
+
+            assert multiplier > 1.0
+            assert estimate["surge_multiplier"] == multiplier
+            assert estimate["estimated_fare"] == round(25.0 * multiplier, 2)
+            assert PaymentService.calculate_fare(
+                10.0, pickup_lat=NY_LAT, pickup_lng=NY_LNG
+            ) == pytest.approx(17.5 * multiplier)
+        finally:
+            demand_heatmap.counts.clear()
+            surge_engine.reset()
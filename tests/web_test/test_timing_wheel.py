@@ -0,0 +1,48 @@
+"""
+分层时间轮单元测试 - 测试定时器的到期、取消和跨层级联
+"""
+import random
+from src.services.timing_wheel import HierarchicalTimingWheel
+
+
+class TestHierarchicalTimingWheel:
+    """测试分层时间轮"""
+
+    def test_fires_at_deadline(self):
+        """测试定时器在到期刻度触发，不会提前"""
+        wheel = HierarchicalTimingWheel(tick_seconds=0.1, start=0.0)
+        wheel.schedule(1.0, "a")
+        wheel.schedule(0.25, "b")
+
+        assert wheel.advance(0.2) == []
+        assert wheel.advance(0.3) == ["b"]
+        assert wheel.advance(0.95) == []
+        assert wheel.advance(1.0) == ["a"]
+        assert len(wheel) == 0
+
+    def test_cancel(self):
+        """测试取消的定时器不触发"""
+        wheel = HierarchicalTimingWheel(tick_seconds=0.1, start=0.0)
+        handle = wheel.schedule(0.5, "a")
+
+        assert wheel.cancel(handle)
+        assert not wheel.cancel(handle)
+        assert wheel.advance(1.0) == []
+        assert len(wheel) == 0
+
+    def test_cascades_across_levels_and_overflow(self):
+        """测试超出低层范围的定时器经过级联和溢出列表后准时触发"""
+        wheel = HierarchicalTimingWheel(
+            tick_seconds=1.0, wheel_size=4, levels=2, start=0.0
+        )
+        rng = random.Random(5)
+        deadlines = {i: rng.randint(1, 100) for i in range(200)}
+        for i, deadline in deadlines.items():
+            wheel.schedule(deadline, i)
+
+        for now in range(1, 101):
+            expired = wheel.advance(now)
+            assert sorted(expired) == sorted(
+                i for i, d in deadlines.items() if d == now
+            )
+        assert len(wheel) == 0
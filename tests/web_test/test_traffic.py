@@ -0,0 +1,124 @@
+"""
+交通系数表单元测试 - 测试由历史行程学习交通系数和O(1)查询
+"""
+import datetime
+import pytest
+from src.services.database import db
+from src.services.location import LocationService
+from src.services.traffic import (
+    TrafficFactorBuilder,
+    TrafficFactorTable,
+    build_from_rides,
+    set_traffic_table,
+    hour_of_week,
+)
+from src.models.ride import Ride
+
+
+# 2024-01-01 是周一
+MONDAY_8AM = datetime.datetime(2024, 1, 1, 8, 0, 0)
+NY_LAT, NY_LNG = 40.7128, -74.0060
+
+
+@pytest.fixture
+def traffic_table():
+    """设置全局交通系数表，测试结束后恢复为不使用"""
+    builder = TrafficFactorBuilder()
+    for _ in range(5):
+        # 早高峰：10公里用时30分钟，20km/h
+        builder.add(NY_LAT, NY_LNG, MONDAY_8AM, 10.0, 0.5)
+    table = builder.build(min_samples=5)
+    set_traffic_table(table)
+    yield table
+    set_traffic_table(None)
+
+
+class TestTrafficFactorTable:
+    """测试交通系数表"""
+
+    def test_hour_of_week(self):
+        """测试周内小时"""
+        assert hour_of_week(MONDAY_8AM) == 8
+        assert hour_of_week(datetime.datetime(2024, 1, 7, 23, 30)) == 167
+
+    def test_builder_factors_and_fallback(self):
+        """测试按区域和小时聚合，样本不足时回退"""
+        builder = TrafficFactorBuilder()
+        for _ in range(5):
+            builder.add(NY_LAT, NY_LNG, MONDAY_8AM, 10.0, 0.5)
+        # 另一区域只有一个样本，回退到全局同一小时
+        builder.add(41.5, -73.0, MONDAY_8AM, 25.0, 0.5)
+        # 无效样本：时长太短、速度异常
+        assert builder.add(NY_LAT, NY_LNG, MONDAY_8AM, 1.0, 0.001) is False
+        assert builder.add(NY_LAT, NY_LNG, MONDAY_8AM, 500.0, 1.0) is False
+
+        table = builder.build(min_samples=5)
+
+        assert table.zone_count == 2
+        assert table.lookup(NY_LAT, NY_LNG, MONDAY_8AM) == pytest.approx(2.5)
+        # 全局：75公里用时3小时，25km/h
+        assert table.lookup(41.5, -73.0, MONDAY_8AM) == pytest.approx(2.0)
+        assert table.lookup(None, None, MONDAY_8AM) == pytest.approx(2.0)
+        # 没有样本的小时为1.0
+        assert (
+            table.lookup(NY_LAT, NY_LNG, MONDAY_8AM + datetime.timedelta(hours=5))
+            == 1.0
+        )
+
+    def test_save_and_load(self, tmp_path, traffic_table):
+        """测试保存和加载"""
+        path = str(tmp_path / "traffic.npz")
+        traffic_table.save(path)
+
+        loaded = TrafficFactorTable.load(path)
+
+        assert loaded.zone_count == traffic_table.zone_count
+        assert loaded.lookup(NY_LAT, NY_LNG, MONDAY_8AM) == pytest.approx(2.5)
+
+    def test_estimate_travel_time_uses_table(self, traffic_table):
+        """测试行驶时间估算按时间和区域查询交通系数"""
+        assert LocationService.estimate_travel_time(
+            100, lat=NY_LAT, lng=NY_LNG, when=MONDAY_8AM
+        ) == pytest.approx(300)
+        # 显式指定系数时不查表
+        assert LocationService.estimate_travel_time(100, traffic_factor=1.0) == 120
+
+    def test_build_from_rides(self, app):
+        """测试从已完成行程流式构建"""
+        with app.app_context():
+            db.session.add_all(
+                [
+                    Ride(
+                        passenger_id=1,
+                        pickup_address="a",
+                        dropoff_address="b",
+                        status="completed",
+                        pickup_lat=NY_LAT,
+                        pickup_lng=NY_LNG,
+                        dropoff_lat=NY_LAT + 0.09,
+                        dropoff_lng=NY_LNG,
+                        started_at=MONDAY_8AM,
+                        completed_at=MONDAY_8AM + datetime.timedelta(minutes=30),
+                    )
+                    for _ in range(5)
+                ]
+                + [
+                    Ride(
+                        passenger_id=1,
+                        pickup_address="a",
+                        dropoff_address="b",
+                        status="in_progress",
+                        pickup_lat=NY_LAT,
+                        pickup_lng=NY_LNG,
+                        started_at=MONDAY_8AM,
+                    )
+                ]
+            )
+            db.session.commit()
+
+            table = build_from_rides(
+                Ride.query.filter(Ride.status == "completed"), batch_size=2
+            )
+
+        # 约10公里用时30分钟
+        assert table.lookup(NY_LAT, NY_LNG, MONDAY_8AM) == pytest.approx(2.5, rel=0.01)
@@ -0,0 +1,195 @@
+"""
+行程轨迹单元测试 - 测试轨迹编码、流式简化和轨迹存储
+"""
+import datetime
+import pytest
+from src.services.database import db
+from src.services.trajectory import (
+    StreamingSimplifier,
+    TrackStore,
+    encode_track,
+    decode_track,
+    encode_polyline,
+)
+from src.models.ride import Ride
+from src.models.ride_track import RideTrack
+
+
+T0 = datetime.datetime(2024, 1, 1, 12, 0, 0)
+
+
+def straight_then_turn():
+    """向北行驶60秒后向东行驶60秒，每秒一个点"""
+    points = [(40.0 + i * 0.0001, -74.0, 1704110400 + i) for i in range(61)]
+    points += [(40.006, -74.0 + i * 0.0001, 1704110460 + i) for i in range(1, 61)]
+    return points
+
+
+class TestTrackEncoding:
+    """测试轨迹编码"""
+
+    def test_roundtrip(self):
+        """测试编码后解码还原（1e-5度精度）"""
+        points = [
+            (40.71281, -74.00601, 1704110400),
+            (40.71290, -74.00590, 1704110401),
+            (-33.8688, 151.2093, 1704110460),
+        ]
+
+        decoded = decode_track(encode_track(points))
+
+        assert len(decoded) == 3
+        for original, restored in zip(points, decoded):
+            assert restored[0] == pytest.approx(original[0], abs=1e-5)
+            assert restored[1] == pytest.approx(original[1], abs=1e-5)
+            assert restored[2] == original[2]
+
+    def test_delta_encoding_is_compact(self):
+        """测试相邻点差值编码后每个点占用少量字节"""
+        points = straight_then_turn()
+        data = encode_track(points)
+
+        assert len(data) < len(points) * 6
+
+    def test_polyline(self):
+        """测试Google Encoded Polyline编码"""
+        points = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+
+        assert encode_polyline(points) == "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+
+
+class TestStreamingSimplifier:
+    """测试流式轨迹简化"""
+
+    def test_keeps_corner_drops_collinear(self):
+        """测试直线上的点被丢弃，转弯点被保留"""
+        simplifier = StreamingSimplifier(tolerance_m=5.0)
+        for point in straight_then_turn():
+            simplifier.add(point)
+
+        points = simplifier.points()
+
+        assert simplifier.raw_count == 121
+        assert len(points) <= 5
+        assert points[0][:2] == (40.0, -74.0)
+        assert any(
+            p[0] == pytest.approx(40.006) and p[1] == pytest.approx(-74.0)
+            for p in points
+        )
+        assert points[-1][1] == pytest.approx(-73.994)
+
+    def test_drops_out_of_order_points(self):
+        """测试乱序的旧点被丢弃"""
+        simplifier = StreamingSimplifier()
+        simplifier.add((40.0, -74.0, 100))
+        simplifier.add((40.001, -74.0, 110))
+        simplifier.add((40.0005, -74.0, 105))
+
+        assert [p[2] for p in simplifier.points()] == [100, 110]
+
+
+class TestTrackStore:
+    """测试轨迹存储"""
+
+    def test_records_and_persists_track(self, app):
+        """测试行程中的上报被记录并在结束时保存"""
+        store = TrackStore(tolerance_m=5.0, save_every=1000)
+
+        with app.app_context():
+            ride = Ride(
+                passenger_id=1,
+                driver_id=7,
+                pickup_address="a",
+                dropoff_address="b",
+                status="in_progress",
+            )
+            db.session.add(ride)
+            db.session.commit()
+
+            # 未登记的司机不记录
+            assert store.add_ping(8, 40.0, -74.0, T0) is False
+
+            store.start(ride.id, 7)
+            for lat, lng, ts in straight_then_turn():
+                store.add_ping(7, lat, lng, datetime.datetime.utcfromtimestamp(ts))
+            live = store.points(ride.id)
+
+            store.finish(ride.id)
+            db.session.commit()
+
+            assert store.ride_for_driver(7) is None
+            assert store.points(ride.id) is None
+
+            track = db.session.get(RideTrack, ride.id)
+            assert track.raw_point_count == 121
+            assert track.point_count == len(live)
+            assert track.get_points()[-1] == pytest.approx(live[-1])
+
+    def test_track_endpoint(self, app, client, auth_header):
+        """测试获取行程轨迹接口"""
+        from src.api.booking import booking_bp
+
+        app.register_blueprint(booking_bp, url_prefix="/api/booking")
+
+        with app.app_context():
+            ride = Ride(
+                passenger_id=1,
+                driver_id=7,
+                pickup_address="a",
+                dropoff_address="b",
+                status="completed",
+            )
+            db.session.add(ride)
+            db.session.commit()
+            track = RideTrack(ride_id=ride.id)
+            track.set_points(
+                [(38.5, -120.2, 0), (40.7, -120.95, 10), (43.252, -126.453, 20)], 30
+            )
+            db.session.add(track)
+            db.session.commit()
+            ride_id = ride.id
+
+        response = client.get(
+            f"/api/booking/ride/{ride_id}/track", headers=auth_header(1, "passenger")
+        )
+        data = response.get_json()
+
+        assert response.status_code == 200
+        assert data["polyline"] == "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+        assert data["point_count"] == 3
+
+        assert (
+            client.get(
+                "/api/booking/ride/999/track", headers=auth_header(1, "passenger")
+            ).status_code
+            == 404
+        )
+
+    def test_track_endpoint_access(self, app, client, auth_header):
+        """测试只有行程的乘客、司机和管理员可以查看轨迹"""
+        from src.api.booking import booking_bp
+
+        app.register_blueprint(booking_bp, url_prefix="/api/booking")
+
+        with app.app_context():
+            ride = Ride(
+                passenger_id=1,
+                driver_id=7,
+                pickup_address="a",
+                dropoff_address="b",
+                status="completed",
+            )
+            db.session.add(ride)
+            db.session.commit()
+            ride_id = ride.id
+
+        def status(user_id, role):
+            return client.get(
+                f"/api/booking/ride/{ride_id}/track", headers=auth_header(user_id, role)
+            ).status_code
+
+        assert client.get(f"/api/booking/ride/{ride_id}/track").status_code == 401
+        assert status(2, "passenger") == 403
+        assert status(8, "driver") == 403
+        assert status(7, "driver") == 200
+        assert status(100, "admin") == 200